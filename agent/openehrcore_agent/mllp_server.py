@@ -153,6 +153,36 @@ class MLLPServer:
 
 
 # Utility functions
+#
+# O agente é distribuído sem o backend: estas funções seguem o mesmo princípio
+# do parser do backend (fhir_api/services/hl7_parser.py) em versão mínima,
+# localizando só os segmentos usados em vez de dividir a mensagem inteira.
+
+def _field_separator(message: str) -> str:
+    """Field separator declared in MSH-1 (default '|')."""
+    start = message.find('MSH')
+    return message[start + 3] if 0 <= start < len(message) - 3 else '|'
+
+
+def _first_segment(message: str, name: str) -> Optional[list]:
+    """Fields of the first segment `name` (index 0 = segment name), or None."""
+    separator = _field_separator(message)
+    prefix = name + separator
+    start = 0 if message.startswith(prefix) else -1
+    if start < 0:
+        for terminator in ('\r', '\n'):
+            position = message.find(terminator + prefix)
+            if position >= 0 and (start < 0 or position + 1 < start):
+                start = position + 1
+    if start < 0:
+        return None
+    end = len(message)
+    for terminator in ('\r', '\n'):
+        position = message.find(terminator, start)
+        if 0 <= position < end:
+            end = position
+    return message[start:end].split(separator)
+
 
 def parse_hl7_message(message: str) -> dict:
     """
@@ -162,41 +192,37 @@ def parse_hl7_message(message: str) -> dict:
         Dict with segment name as key and list of fields as value
     """
     segments = {}
+    separator = _field_separator(message)
     
-    for line in message.split('\r'):
-        if not line:
+    for line in message.replace('\n', '\r').split('\r'):
+        if not line.strip():
             continue
         
-        fields = line.split('|')
-        segment_name = fields[0]
-        
-        if segment_name not in segments:
-            segments[segment_name] = []
-        
-        segments[segment_name].append(fields)
+        fields = line.split(separator)
+        segments.setdefault(fields[0], []).append(fields)
     
     return segments
 
 
 def get_message_type(message: str) -> str:
     """Get HL7 message type (e.g., 'ADT^A01')."""
-    segments = parse_hl7_message(message)
+    msh = _first_segment(message, 'MSH')
     
-    if 'MSH' in segments and segments['MSH']:
-        msh = segments['MSH'][0]
-        if len(msh) > 9:
-            return msh[9]
+    # fields[1] é MSH-2 (MSH-1 é o próprio separador): MSH-9 fica em fields[8]
+    if msh and len(msh) > 8 and msh[8]:
+        component = msh[1][:1] or '^'
+        return '^'.join(msh[8].split(component))
     
     return 'UNKNOWN'
 
 
 def get_patient_id(message: str) -> Optional[str]:
     """Extract patient ID from HL7 message."""
-    segments = parse_hl7_message(message)
+    pid = _first_segment(message, 'PID')
     
-    if 'PID' in segments and segments['PID']:
-        pid = segments['PID'][0]
-        if len(pid) > 3:
-            return pid[3].split('^')[0] if pid[3] else None
+    if pid and len(pid) > 3 and pid[3]:
+        msh = _first_segment(message, 'MSH')
+        component = msh[1][:1] if msh and len(msh) > 1 and msh[1] else '^'
+        return pid[3].split(component)[0] or None
     
     return None
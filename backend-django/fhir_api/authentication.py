@@ -1,7 +1,13 @@
 
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
 import jwt
-from typing import Optional
+import requests
 
 from django.conf import settings
 from rest_framework import status
@@ -11,6 +17,206 @@ from rest_framework.exceptions import AuthenticationFailed
 
 logger = logging.getLogger(__name__)
 
+
+class JWKSKeyStore:
+    """
+    Cache process-wide das chaves públicas (JWKS) do Keycloak, indexado por `kid`.
+
+    - Atualização periódica em thread de background (fora do caminho crítico)
+    - `kid` desconhecido dispara um único refetch, limitado por rate limit
+    - Se o Keycloak estiver indisponível, continua servindo o último conjunto válido
+    """
+
+    _instance: Optional['JWKSKeyStore'] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(
+        self,
+        jwks_url: str,
+        refresh_interval: int = 300,
+        min_refetch_interval: int = 30,
+        timeout: int = 5,
+    ):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self._keys: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._refetch_lock = threading.Lock()
+        self._last_fetch_attempt = 0.0
+        self._last_success: Optional[float] = None
+        self._refresher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def get_instance(cls) -> 'JWKSKeyStore':
+        """Retorna o key store compartilhado pelo processo (lazy)."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    jwks_url = (
+                        f"{settings.KEYCLOAK_URL}/realms/{settings.KEYCLOAK_REALM}"
+                        f"/protocol/openid-connect/certs"
+                    )
+                    cls._instance = cls(
+                        jwks_url,
+                        refresh_interval=getattr(settings, 'KEYCLOAK_JWKS_REFRESH_INTERVAL', 300),
+                        min_refetch_interval=getattr(settings, 'KEYCLOAK_JWKS_MIN_REFETCH_INTERVAL', 30),
+                        timeout=getattr(settings, 'KEYCLOAK_JWKS_TIMEOUT', 5),
+                    )
+        return cls._instance
+
+    @classmethod
+    def reset_instance(cls) -> None:
+        """Descarta o key store compartilhado (para testes)."""
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.stop()
+            cls._instance = None
+
+    def refresh(self) -> bool:
+        """
+        Busca o JWKS no Keycloak e substitui o conjunto de chaves.
+
+        Returns:
+            bool: True se o conjunto foi atualizado. Em caso de falha o
+            conjunto anterior é mantido.
+        """
+        self._last_fetch_attempt = time.monotonic()
+        try:
+            response = requests.get(self.jwks_url, timeout=self.timeout)
+            response.raise_for_status()
+            jwk_set = jwt.PyJWKSet.from_dict(response.json())
+        except (requests.RequestException, ValueError, jwt.PyJWTError) as e:
+            logger.warning(f"JWKS refresh failed, keeping {len(self._keys)} cached keys: {e}")
+            return False
+
+        keys = {jwk.key_id: jwk.key for jwk in jwk_set.keys if jwk.key_id}
+        with self._lock:
+            self._keys = keys
+            self._last_success = time.monotonic()
+        logger.debug(f"JWKS refreshed: {len(keys)} keys")
+        return True
+
+    def get_signing_key(self, kid: Optional[str]) -> Any:
+        """
+        Retorna a chave pública para o `kid` informado.
+
+        Raises:
+            jwt.InvalidTokenError: Se o `kid` não existe no JWKS
+        """
+        self._ensure_refresher()
+
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        # kid desconhecido (rotação de chave ou cache vazio): um refetch, com rate limit
+        with self._refetch_lock:
+            key = self._keys.get(kid)
+            can_refetch = (
+                self._last_fetch_attempt == 0.0
+                or time.monotonic() - self._last_fetch_attempt >= self.min_refetch_interval
+            )
+            if key is None and can_refetch:
+                self.refresh()
+                key = self._keys.get(kid)
+
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key: kid={kid}")
+        return key
+
+    def get_signing_key_from_jwt(self, token: str) -> Any:
+        """Extrai o `kid` do header do token e retorna a chave correspondente."""
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get('kid'))
+
+    def _ensure_refresher(self) -> None:
+        """Inicia a thread de atualização em background, se ainda não iniciada."""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._stop.clear()
+            self._refresher = threading.Thread(
+                target=self._refresh_loop,
+                name='jwks-refresher',
+                daemon=True,
+            )
+            self._refresher.start()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def stop(self) -> None:
+        """Interrompe a thread de atualização."""
+        self._stop.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._keys),
+            "seconds_since_refresh": (
+                int(time.monotonic() - self._last_success) if self._last_success else None
+            ),
+            "refresher_alive": bool(self._refresher and self._refresher.is_alive()),
+        }
+
+
+class TokenClaimsCache:
+    """
+    Cache LRU de claims de tokens já validados, válido até o `exp` do token.
+
+    Requisições repetidas com o mesmo bearer token evitam a verificação RSA.
+    O token em si não é armazenado, apenas seu SHA-256.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[Dict[str, Any], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, exp = entry
+            if exp <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def set(self, token: str, claims: Dict[str, Any]) -> None:
+        exp = claims.get('exp')
+        if not exp:
+            return  # Sem exp não há limite seguro para cachear
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (claims, float(exp))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_claims_cache = TokenClaimsCache(
+    max_entries=getattr(settings, 'KEYCLOAK_TOKEN_CACHE_SIZE', 10000)
+)
+
+
 class KeycloakUser:
     """
     Classe wrapper para simular um usuário Django a partir do token Keycloak.
@@ -83,22 +289,23 @@ class KeycloakAuthentication(TokenAuthentication):
                 }
                 return (KeycloakUser(user_info), key)
 
-            # 1. Obter JWKS do Keycloak (cachear isso seria ideal em prod)
-            jwks_url = f"{settings.KEYCLOAK_URL}/realms/{settings.KEYCLOAK_REALM}/protocol/openid-connect/certs"
-            jwks_client = jwt.PyJWKClient(jwks_url)
-            
-            # 2. Obter a chave de assinatura
-            signing_key = jwks_client.get_signing_key_from_jwt(key)
-            
-            # 3. Decodificar e validar token
-            # audience pode ser opcional dependendo da config do Keycloak, aqui validamos se presente
-            token_info = jwt.decode(
-                key,
-                signing_key.key,
-                algorithms=["RS256"],
-                audience=settings.KEYCLOAK_CLIENT_ID,
-                options={"verify_aud": False} # Relaxar aud por enquanto para evitar erros se não configurado
-            )
+            # 1. Claims já validadas anteriormente (até o exp do token)
+            token_info = token_claims_cache.get(key)
+
+            if token_info is None:
+                # 2. Obter a chave de assinatura do JWKS em cache (indexado por kid)
+                signing_key = JWKSKeyStore.get_instance().get_signing_key_from_jwt(key)
+
+                # 3. Decodificar e validar token
+                # audience pode ser opcional dependendo da config do Keycloak, aqui validamos se presente
+                token_info = jwt.decode(
+                    key,
+                    signing_key,
+                    algorithms=["RS256"],
+                    audience=settings.KEYCLOAK_CLIENT_ID,
+                    options={"verify_aud": False} # Relaxar aud por enquanto para evitar erros se não configurado
+                )
+                token_claims_cache.set(key, token_info)
             
             # 4. Extrair informações do usuário
             user_info = {
@@ -106,7 +313,7 @@ class KeycloakAuthentication(TokenAuthentication):
                 'preferred_username': token_info.get('preferred_username'),
                 'email': token_info.get('email'),
                 'name': token_info.get('name'),
-                'roles': token_info.get('realm_access', {}).get('roles', []),
+                'roles': list(token_info.get('realm_access', {}).get('roles', [])),
                 'exp': token_info.get('exp'),
             }
             
@@ -0,0 +1,68 @@
+"""
+Management Command para sincronizar os contadores de analytics.
+
+Atualiza o analytics store (ANALYTICS_STORE) a partir do servidor FHIR pelo
+histórico de cada tipo (`_history?_since=`), cobrindo escritas e exclusões
+feitas fora do backend. Com --full reconstrói os contadores do zero.
+
+Uso: python manage.py analytics_sync [--full] [--once] [--interval 300]
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from fhir_api.services.analytics_service import AnalyticsService
+from fhir_api.services.analytics_store import TRACKED_RESOURCES
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza os contadores materializados de analytics com o servidor FHIR'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Reconstruir os contadores do zero (apenas na primeira execução)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Sincronizar uma vez e sair'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'ANALYTICS_SYNC_INTERVAL', 300) or 300,
+            help='Segundos entre sincronizações (padrão: ANALYTICS_SYNC_INTERVAL)'
+        )
+        parser.add_argument(
+            '--resource',
+            action='append',
+            choices=sorted(TRACKED_RESOURCES),
+            help='Tipo de recurso a sincronizar (padrão: todos)'
+        )
+
+    def handle(self, *args, **options):
+        service = AnalyticsService()
+        full = options['full']
+        self.stdout.write(self.style.SUCCESS('Analytics sync iniciado'))
+
+        while True:
+            try:
+                applied = service.sync(options['resource'], full=full)
+                for resource_type, count in applied.items():
+                    self.stdout.write(f'   {resource_type}: {count} recursos atualizados')
+            except Exception as e:
+                logger.error(f"Analytics sync failed: {e}")
+                self.stderr.write(self.style.ERROR(f'Falha no sync: {e}'))
+                if options['once']:
+                    raise
+            full = False
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
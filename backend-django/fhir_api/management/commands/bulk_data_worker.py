@@ -0,0 +1,57 @@
+"""
+Management Command para processar jobs de Bulk Data ($export/$import).
+
+Qualquer réplica pode rodar este worker: os jobs ficam no job store
+(BULK_JOB_STORE) e são assumidos via lease, inclusive jobs de workers que
+pararam de enviar heartbeat. Também remove jobs/arquivos expirados.
+
+Uso: python manage.py bulk_data_worker [--once] [--poll-interval 5]
+"""
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from fhir_api.services.bulk_data_service import BulkExportService, BulkImportService
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Processa jobs pendentes de Bulk Data ($export/$import) e expira arquivos antigos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Processar os jobs disponíveis e sair'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=5.0,
+            help='Segundos entre verificações quando não há jobs (padrão: 5)'
+        )
+
+    def handle(self, *args, **options):
+        services = (BulkExportService, BulkImportService)
+        self.stdout.write(self.style.SUCCESS('Bulk data worker iniciado'))
+
+        while True:
+            for service in services:
+                service.expire_jobs()
+
+            ran = 0
+            for service in services:
+                while True:
+                    job_id = service.run_next_pending()
+                    if not job_id:
+                        break
+                    ran += 1
+                    self.stdout.write(f'   {service.JOB_KIND} job {job_id} processado')
+
+            if options['once']:
+                self.stdout.write(self.style.SUCCESS(f'{ran} jobs processados'))
+                return
+            if not ran:
+                time.sleep(options['poll_interval'])
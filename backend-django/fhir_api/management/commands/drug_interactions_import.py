@@ -0,0 +1,95 @@
+"""
+Management Command para atualizar a tabela local de interações medicamentosas.
+
+Lê um dataset de interações por par de RxCUIs (CSV ou JSON, arquivo local ou
+URL para download) e grava a tabela em DRUG_INTERACTIONS_PATH, substituindo
+o arquivo atomicamente. Os workers carregam a nova versão na próxima
+checagem (DRUG_INTERACTIONS_CHECK_INTERVAL), sem reiniciar.
+
+Colunas padrão: rxcui1, rxcui2, drug1, drug2, severity, description, source.
+Linhas sem rxcui2 apenas declaram um medicamento coberto pelo dataset (sem
+interações conhecidas), para que ele não seja consultado no RxNav.
+
+Uso:
+    python manage.py drug_interactions_import interacoes.csv --release 2024-06
+    python manage.py drug_interactions_import https://exemplo.org/ddi.csv --release 2024-06 \\
+        --column rxcui1=object_rxcui --column rxcui2=precipitant_rxcui
+    python manage.py drug_interactions_import --info
+"""
+import os
+import tempfile
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fhir_api.services.drug_interactions import InteractionTable, read_interaction_file
+
+
+class Command(BaseCommand):
+    help = 'Atualiza a tabela local de interações medicamentosas (por par de RxCUIs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='Arquivo CSV/JSON ou URL do dataset')
+        parser.add_argument('--release', help='Versão do dataset (ex: 2024-06)')
+        parser.add_argument(
+            '--column',
+            action='append',
+            default=[],
+            metavar='CAMPO=COLUNA',
+            help='Coluna de origem de um campo (ex: rxcui1=object_rxcui)'
+        )
+        parser.add_argument('--encoding', default='utf-8', help='Encoding do arquivo (padrão: utf-8)')
+        parser.add_argument('--delimiter', help='Separador do CSV (padrão: detectado)')
+        parser.add_argument('--info', action='store_true', help='Mostrar a tabela instalada')
+
+    def handle(self, *args, **options):
+        path = getattr(settings, 'DRUG_INTERACTIONS_PATH', '')
+        if not path:
+            raise CommandError('DRUG_INTERACTIONS_PATH não configurado')
+
+        if options['info']:
+            if not os.path.exists(path):
+                self.stdout.write('Nenhuma tabela de interações instalada')
+                return
+            table = InteractionTable.load(path)
+            self.stdout.write(
+                f'{path}: versão {table.version}, {len(table)} pares, {len(table.drugs)} medicamentos'
+            )
+            return
+
+        if not options['source'] or not options['release']:
+            raise CommandError('Informe o dataset e --release')
+
+        columns = dict(item.split('=', 1) for item in options['column'])
+        source = options['source']
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                if source.startswith(('http://', 'https://')):
+                    source = self.download(source, directory)
+                rows = read_interaction_file(
+                    source, columns=columns, encoding=options['encoding'], delimiter=options['delimiter']
+                )
+                table = InteractionTable.from_rows(options['release'], rows)
+            except (OSError, ValueError, requests.RequestException) as e:
+                raise CommandError(str(e))
+
+        if not table.pairs:
+            raise CommandError('Nenhuma interação encontrada (verifique --column)')
+
+        table.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Interações {options['release']}: {len(table)} pares, {len(table.drugs)} medicamentos"
+        ))
+
+    def download(self, url, directory):
+        """Baixa o dataset para o diretório temporário, mantendo a extensão."""
+        name = os.path.basename(url.split('?', 1)[0]) or 'dataset.csv'
+        target = os.path.join(directory, name)
+        self.stdout.write(f'Baixando {url}...')
+        with requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(target, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        return target
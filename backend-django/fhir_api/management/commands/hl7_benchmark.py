@@ -0,0 +1,132 @@
+"""
+Management Command para medir o parser HL7 v2.
+
+Gera um lote ORU^R01 (FHS/BHS) com N mensagens de M resultados OBX e mede a
+vazão, em mensagens por segundo, do parsing anterior (todas as linhas e
+campos divididos na hora, componentes com split("^") a cada acesso) e do
+parser indexado (hl7_parser): só o parsing, roteamento (MSH-9 e PID-3, como
+o agente e views_agent) e leitura de todos os campos usados por
+parse_oru_to_fhir (MSH-9, PID-3, OBX-2/3/5/6, com decodificação de escapes).
+
+Uso: python manage.py hl7_benchmark [--messages 2000] [--obx 20] [--rounds 3]
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from fhir_api.services.hl7_parser import iter_messages, unescape
+
+TESTS = [
+    ('718-7', 'Hemoglobina', 'NM', 'g/dL', 12, 17),
+    ('789-8', 'Eritrócitos', 'NM', '10*6/uL', 4, 6),
+    ('6690-2', 'Leucócitos', 'NM', '10*3/uL', 4, 11),
+    ('2345-7', 'Glicose', 'NM', 'mg/dL', 70, 140),
+    ('2160-0', 'Creatinina', 'NM', 'mg/dL', 0.6, 1.3),
+    ('5778-6', 'Cor da urina', 'ST', '', 0, 0),
+]
+
+
+def oru_batch(messages, obx_count, rng):
+    """FHS/BHS batch of ORU^R01 messages."""
+    lines = ['FHS|^~\\&|LAB|HOSPITAL', 'BHS|^~\\&|LAB|HOSPITAL']
+    for i in range(messages):
+        lines.append(f'MSH|^~\\&|LAB|HOSPITAL|OPENEHR|CORE|20241213120000||ORU^R01^ORU_R01|{i}|P|2.5.1')
+        lines.append(f'PID|1||{100000 + i}^^^HOSP^MR~{i}^^^SUS||Silva^João {i}^Carlos||19850315|M')
+        lines.append(f'OBR|1|LAB{i}|LAB{i}|24356-8^Hemograma^LN|||20241213080000')
+        for j in range(obx_count):
+            code, name, value_type, unit, low, high = TESTS[j % len(TESTS)]
+            value = f'{rng.uniform(low, high):.1f}' if value_type == 'NM' else 'Amarelo \\T\\ límpido'
+            lines.append(f'OBX|{j + 1}|{value_type}|{code}^{name}^LN||{value}|{unit}^{unit}^UCUM|{low}-{high}|N|||F')
+    lines += [f'BTS|{messages}', 'FTS|1']
+    return '\r'.join(lines)
+
+
+def legacy_parse(text):
+    """Parsing anterior (HL7Message.from_string): linhas e campos divididos na hora."""
+    messages = []
+    for line in text.replace('\n', '\r').split('\r'):
+        if not line.strip():
+            continue
+        parts = line.split('|')
+        if parts[0] == 'MSH':
+            messages.append([])
+        if messages and parts[0] not in ('BTS', 'FTS'):
+            messages[-1].append((parts[0], parts[1:]))
+    return messages
+
+
+def legacy_read(segments):
+    message_type = next((f[7] for name, f in segments if name == 'MSH' and len(f) >= 8), '')
+    pid = next((f for name, f in segments if name == 'PID'), None)
+    values = [message_type, pid[2].split('^')[0] if pid and len(pid) > 2 else '']
+    for name, fields in segments:
+        if name == 'OBX' and len(fields) >= 5:
+            code = fields[2].split('^')
+            values += [fields[1], code[0], code[1] if len(code) > 1 else '', fields[4], fields[5].split('^')[0]]
+    return values
+
+
+def legacy_route(segments):
+    message_type = next((f[7] for name, f in segments if name == 'MSH' and len(f) >= 8), '')
+    pid = next((f for name, f in segments if name == 'PID'), None)
+    return message_type, pid[2].split('^')[0] if pid and len(pid) > 2 else ''
+
+
+def indexed_route(message):
+    pid = message.first('PID')
+    return message.message_type, pid.get(3, 1) if pid else ''
+
+
+def indexed_read(message):
+    pid = message.first('PID')
+    values = [message.message_type, pid.get(3, 1) if pid else '']
+    for obx in message.segments('OBX'):
+        if obx.field_count >= 5:
+            values += [obx.get(2), obx.get(3, 1), obx.get(3, 2), obx.get(5), obx.get(6, 1)]
+    return values
+
+
+def best_of(rounds, func):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+class Command(BaseCommand):
+    help = 'Mede a vazão (mensagens/s) do parser HL7 v2 em lotes ORU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Mensagens no lote')
+        parser.add_argument('--obx', type=int, default=20, help='Segmentos OBX por mensagem')
+        parser.add_argument('--rounds', type=int, default=3, help='Repetições (melhor tempo)')
+        parser.add_argument('--seed', type=int, default=42, help='Semente do gerador')
+
+    def handle(self, *args, **options):
+        messages = options['messages']
+        text = oru_batch(messages, options['obx'], random.Random(options['seed']))
+        rounds = options['rounds']
+
+        # Mesmo resultado nos dois parsers antes de medir (o anterior não decodificava escapes)
+        legacy = [[unescape(v) for v in legacy_read(m)] for m in legacy_parse(text)]
+        indexed = [indexed_read(m) for m in iter_messages(text)]
+        if legacy != indexed:
+            self.stderr.write(self.style.ERROR('Os parsers divergem no lote gerado'))
+
+        results = [
+            ('anterior, parsing', best_of(rounds, lambda: legacy_parse(text))),
+            ('anterior, roteamento', best_of(rounds, lambda: [legacy_route(m) for m in legacy_parse(text)])),
+            ('anterior, todos os campos', best_of(rounds, lambda: [legacy_read(m) for m in legacy_parse(text)])),
+            ('índice, parsing', best_of(rounds, lambda: list(iter_messages(text)))),
+            ('índice, roteamento', best_of(rounds, lambda: [indexed_route(m) for m in iter_messages(text)])),
+            ('índice, todos os campos', best_of(rounds, lambda: [indexed_read(m) for m in iter_messages(text)])),
+        ]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Lote ORU: {messages} mensagens, {options["obx"]} OBX cada, {len(text) / 1024 / 1024:.1f} MB'
+        ))
+        for name, seconds in results:
+            self.stdout.write(f'   {name:<28} {messages / seconds:>10,.0f} msg/s  ({seconds * 1000:.0f} ms)')
@@ -0,0 +1,141 @@
+"""
+Management Command para medir a busca de terminologias.
+
+Gera tabelas sintéticas do tamanho das tabelas completas (CID-10 ~14 mil
+códigos, TUSS ~6 mil, CBO ~2,6 mil) a partir do vocabulário das tabelas
+embarcadas e compara a varredura linear antiga com o TerminologyIndex e
+com a release importada no store SQLite: tempo de construção, memória e
+latência (p50/p95) de consultas de autocomplete (prefixos de palavras,
+códigos, substrings).
+
+Uso: python manage.py terminology_benchmark [--queries 500] [--seed 42]
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from fhir_api.services.cbo_service import CBO_SAUDE
+from fhir_api.services.terminology_index import TerminologyIndex, fold
+from fhir_api.services.terminology_store import TerminologySpec, TerminologyStore
+from fhir_api.services.terminology_service import ICD10_CODES, TUSS_CODES, normalize_icd10
+
+# (nome, tabela embarcada, tamanho completo, campos, gerador de códigos)
+TABLES = [
+    ('CID-10', ICD10_CODES, 14000, ('description', 'category'),
+     lambda i: f"{chr(65 + i % 26)}{i // 26 % 100:02d}.{i // 2600}"),
+    ('TUSS', TUSS_CODES, 6000, ('description', 'category'),
+     lambda i: f"{10101012 + i * 7:08d}"),
+    ('CBO', CBO_SAUDE, 2600, ('nome', 'descricao'),
+     lambda i: f"{2000 + i // 10:04d}-{i % 10:02d}"),
+]
+
+
+def synthetic_table(base, size, fields, make_code, rng):
+    """Table with `size` entries whose texts mix the embedded vocabulary."""
+    samples = list(base.values())
+    words = {field: [w for entry in samples for w in str(entry.get(field, '')).split()] for field in fields}
+    table = {}
+    for i in range(size):
+        entry = dict(rng.choice(samples))
+        for field in fields:
+            entry[field] = ' '.join(rng.choice(words[field]) for _ in range(rng.randint(2, 8)))
+        table[make_code(i)] = entry
+    return table
+
+
+def linear_search(table, fields, term, max_results):
+    """A varredura anterior: substring em código e campos, na ordem da tabela."""
+    term_lower = term.lower()
+    results = []
+    for code, entry in table.items():
+        if term_lower in code.lower() or any(term_lower in str(entry.get(f, '')).lower() for f in fields):
+            results.append(code)
+            if len(results) >= max_results:
+                break
+    return results
+
+
+def sample_queries(table, fields, count, rng):
+    """Autocomplete-style queries: word prefixes, two words, codes, misses."""
+    codes = list(table)
+    texts = [fold(str(entry.get(fields[0], ''))).split() for entry in table.values()]
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        words = rng.choice(texts) or ['x']
+        if kind < 0.4:
+            word = rng.choice(words)
+            queries.append(word[:rng.randint(2, max(2, len(word)))])
+        elif kind < 0.6:
+            queries.append(' '.join(w[:4] for w in words[:2]))
+        elif kind < 0.85:
+            code = rng.choice(codes)
+            queries.append(code[:rng.randint(1, len(code))])
+        else:
+            queries.append('zzq' + rng.choice(words))
+    return queries
+
+
+def timed(func, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+class Command(BaseCommand):
+    help = 'Compara a busca linear de terminologias com o índice em memória e o store SQLite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=500, help='Consultas por tabela')
+        parser.add_argument('--max-results', type=int, default=20, help='Resultados por consulta')
+        parser.add_argument('--seed', type=int, default=42, help='Semente do gerador')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        max_results = options['max_results']
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = TerminologyStore(os.path.join(directory, 'terminology.sqlite3'))
+            for name, base, size, fields, make_code in TABLES:
+                table = synthetic_table(base, size, fields, make_code, rng)
+                queries = sample_queries(table, fields, options['queries'], rng)
+                self.benchmark(store, name, table, fields, queries, max_results)
+
+    def benchmark(self, store, name, table, fields, queries, max_results):
+        normalize = normalize_icd10 if name == 'CID-10' else str.strip
+
+        start = time.perf_counter()
+        index = TerminologyIndex(table, fields, normalize_code=normalize)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # Memória medida numa segunda construção (tracemalloc distorce o tempo)
+        tracemalloc.start()
+        measured = TerminologyIndex(table, fields, normalize_code=normalize)
+        memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+        tracemalloc.stop()
+        del measured
+
+        spec = TerminologySpec(name.lower(), fields, normalize_code=normalize)
+        start = time.perf_counter()
+        store.import_release(spec, 'benchmark', table.items())
+        import_ms = (time.perf_counter() - start) * 1000
+        sqlite_table = store.table(spec)
+
+        linear = timed(lambda q: linear_search(table, fields, q, max_results), queries)
+        indexed = timed(lambda q: index.search(q, max_results), queries)
+        stored = timed(lambda q: sqlite_table.search(q, max_results), queries)
+
+        self.stdout.write(self.style.SUCCESS(f'{name}: {len(table)} códigos, {len(queries)} consultas'))
+        self.stdout.write(f'   índice: construção {build_ms:.0f} ms, {memory_mb:.1f} MB')
+        self.stdout.write(f'   linear: p50 {linear[0]:.3f} ms, p95 {linear[1]:.3f} ms')
+        self.stdout.write(f'   índice: p50 {indexed[0]:.3f} ms, p95 {indexed[1]:.3f} ms')
+        self.stdout.write(f'   sqlite: import {import_ms:.0f} ms, p50 {stored[0]:.3f} ms, p95 {stored[1]:.3f} ms')
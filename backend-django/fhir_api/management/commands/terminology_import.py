@@ -0,0 +1,96 @@
+"""
+Management Command para importar terminologias completas.
+
+Importa uma release oficial (CSV ou JSON) de CID-10, TUSS, CBO ou do mapa
+CID-10 -> SNOMED CT para o store SQLite (TERMINOLOGY_DB_PATH). A release é
+ativada ao final e os workers passam a usá-la na próxima consulta, sem
+reiniciar.
+
+Uso:
+    python manage.py terminology_import icd10 CID10.csv --release 2024 \\
+        --code-column SUBCAT --column description=DESCRICAO --encoding latin-1
+    python manage.py terminology_import cbo CBO2002.csv --release 2002 \\
+        --code-column CODIGO --column nome=TITULO --encoding latin-1
+    python manage.py terminology_import --list
+    python manage.py terminology_import icd10 --activate 2023
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+# Registram os sistemas em TERMINOLOGY_SPECS
+import fhir_api.services.cbo_service  # noqa: F401
+import fhir_api.services.terminology_service  # noqa: F401
+from fhir_api.services.terminology_store import (
+    TERMINOLOGY_SPECS,
+    get_terminology_store,
+    read_release_file,
+)
+
+
+class Command(BaseCommand):
+    help = 'Importa uma release de terminologia (CSV/JSON) para o store compartilhado'
+
+    def add_arguments(self, parser):
+        parser.add_argument('system', nargs='?', choices=sorted(TERMINOLOGY_SPECS), help='Sistema')
+        parser.add_argument('file', nargs='?', help='Arquivo CSV ou JSON da release')
+        parser.add_argument('--release', help='Versão da release (ex: 2024)')
+        parser.add_argument('--code-column', default='code', help='Coluna do código (padrão: code)')
+        parser.add_argument(
+            '--column',
+            action='append',
+            default=[],
+            metavar='CAMPO=COLUNA',
+            help='Coluna de origem de um campo (ex: description=DESCRICAO)'
+        )
+        parser.add_argument('--encoding', default='utf-8', help='Encoding do arquivo (padrão: utf-8)')
+        parser.add_argument('--delimiter', help='Separador do CSV (padrão: detectado)')
+        parser.add_argument('--no-activate', action='store_true', help='Importar sem ativar')
+        parser.add_argument('--activate', metavar='RELEASE', help='Ativar uma release já importada')
+        parser.add_argument('--keep', type=int, default=2, help='Releases mantidas por sistema (padrão: 2)')
+        parser.add_argument('--list', action='store_true', help='Listar as releases importadas')
+
+    def handle(self, *args, **options):
+        store = get_terminology_store()
+        if not store.path:
+            raise CommandError('TERMINOLOGY_DB_PATH não configurado')
+
+        if options['list']:
+            for release in store.releases(options['system']):
+                marker = '*' if release['active'] else ' '
+                self.stdout.write(
+                    f"{marker} {release['system']:<14} {release['version']:<12} "
+                    f"{release['size']:>8} códigos  {release['loaded_at']}"
+                )
+            return
+
+        if not options['system']:
+            raise CommandError('Informe o sistema')
+
+        try:
+            if options['activate']:
+                store.activate(options['system'], options['activate'], keep=options['keep'])
+                self.stdout.write(self.style.SUCCESS(f"{options['system']} {options['activate']} ativada"))
+                return
+
+            if not options['file'] or not options['release']:
+                raise CommandError('Informe o arquivo e --release')
+
+            columns = dict(item.split('=', 1) for item in options['column'])
+            spec = TERMINOLOGY_SPECS[options['system']]
+            rows = read_release_file(
+                options['file'],
+                spec,
+                code_column=options['code_column'],
+                columns=columns,
+                encoding=options['encoding'],
+                delimiter=options['delimiter'],
+            )
+            count = store.import_release(
+                spec, options['release'], rows, activate=not options['no_activate'], keep=options['keep']
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['system']} {options['release']}: {count} códigos importados"
+            + ('' if options['no_activate'] else ' e ativados')
+        ))
@@ -3,155 +3,570 @@ Prometheus Metrics Endpoint
 Sprint 28: DevOps Improvement
 
 Provides /metrics endpoint for Prometheus scraping.
+
+Metrics:
+- Counters, gauges and fixed-bucket histograms (cumulative `_bucket`,
+  `_sum`, `_count` series, so `histogram_quantile()` works on the scrape)
+- Latency histograms per endpoint (MetricsMiddleware), per FHIR operation
+  (fhir_operation) and per upstream HAPI call (FHIRTransport)
+
+Storage:
+Observations are O(1) and take no lock: every thread writes to its own
+shard of slots (a shard id is leased per thread and recycled when the
+thread exits), so there is a single writer per value. The scrape sums the
+shards. With METRICS_MULTIPROC_DIR set, each process keeps its values in a
+memory-mapped file in that directory and /metrics aggregates the files of
+all gunicorn workers; without it values live in process memory.
+
+Multi-process deployments should empty the directory before starting
+gunicorn and call mark_process_dead(worker.pid) from the `child_exit` hook.
 """
 
-import time
+import bisect
 import functools
+import glob
+import itertools
+import json
 import logging
-from typing import Dict, Any, Callable
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 from django.http import HttpResponse
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
-# Metrics storage (in production, use prometheus_client library)
-_metrics: Dict[str, Any] = {
-    'requests_total': 0,
-    'requests_by_method': {},
-    'requests_by_status': {},
-    'requests_by_endpoint': {},
-    'request_duration_seconds': [],
-    'active_requests': 0,
-    'fhir_operations': {},
-    'cache_hits': 0,
-    'cache_misses': 0,
-    'db_queries': 0,
-    'errors_total': 0,
-}
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+# =============================================================================
+# Value stores
+# =============================================================================
+
+class _ValueStore:
+    """Slots in process memory (single process)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._values: List[float] = []
+
+    def slot(self, key: str) -> int:
+        idx = self._index.get(key)
+        if idx is None:
+            with self._lock:
+                idx = self._index.get(key)
+                if idx is None:
+                    idx = len(self._values)
+                    self._values.append(0.0)
+                    self._index[key] = idx
+        return idx
+
+    def add(self, idx: int, amount: float) -> None:
+        self._values[idx] += amount
+
+    def set(self, idx: int, value: float) -> None:
+        self._values[idx] = value
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        values = self._values
+        for key, idx in list(self._index.items()):
+            yield key, values[idx]
+
+
+class _MmapValueStore:
+    """
+    Slots in a memory-mapped file owned by one process.
+
+    Layout: an 8-byte header with the bytes used, then entries of
+    [uint32 key length][key, padded to 8 bytes][float64 value]. An entry is
+    written before the header is advanced, so readers in other processes
+    only ever parse complete entries.
+    """
+
+    INITIAL_SIZE = 1 << 20
+    HEADER = 8
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._file = open(path, 'a+b')
+        self._capacity = max(os.fstat(self._file.fileno()).st_size, self.INITIAL_SIZE)
+        self._file.truncate(self._capacity)
+        self._m = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from('q', self._m, 0)[0] or self.HEADER
+        for key, offset, _ in _parse_entries(self._m, self._used):
+            self._index[key] = offset
+
+    def slot(self, key: str) -> int:
+        offset = self._index.get(key)
+        if offset is None:
+            with self._lock:
+                offset = self._index.get(key)
+                if offset is None:
+                    offset = self._append(key)
+                    self._index[key] = offset
+        return offset
+
+    def _append(self, key: str) -> int:
+        encoded = key.encode('utf-8')
+        value_offset = self._used + _padded(4 + len(encoded))
+        end = value_offset + 8
+        if end > self._capacity:
+            while end > self._capacity:
+                self._capacity *= 2
+            self._file.truncate(self._capacity)
+            # Threads still holding the old mapping write to the same pages
+            self._m = mmap.mmap(self._file.fileno(), self._capacity)
+        m = self._m
+        struct.pack_into(f'I{len(encoded)}s', m, self._used, len(encoded), encoded)
+        struct.pack_into('d', m, value_offset, 0.0)
+        self._used = end
+        struct.pack_into('q', m, 0, end)
+        return value_offset
+
+    def add(self, offset: int, amount: float) -> None:
+        m = self._m
+        struct.pack_into('d', m, offset, struct.unpack_from('d', m, offset)[0] + amount)
+
+    def set(self, offset: int, value: float) -> None:
+        struct.pack_into('d', self._m, offset, value)
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        for key, _, value in _parse_entries(self._m, self._used):
+            yield key, value
+
+
+def _padded(size: int) -> int:
+    return size + (-size % 8)
+
+
+def _parse_entries(data, used: int) -> Iterator[Tuple[str, int, float]]:
+    pos = _MmapValueStore.HEADER
+    while pos < used:
+        length = struct.unpack_from('I', data, pos)[0]
+        key = bytes(data[pos + 4:pos + 4 + length]).decode('utf-8')
+        value_offset = pos + _padded(4 + length)
+        yield key, value_offset, struct.unpack_from('d', data, value_offset)[0]
+        pos = value_offset + 8
+
+
+def _read_file(path: str) -> Iterator[Tuple[str, float]]:
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return
+    if len(data) < _MmapValueStore.HEADER:
+        return
+    used = min(struct.unpack_from('q', data, 0)[0], len(data))
+    for key, _, value in _parse_entries(data, used):
+        yield key, value
+
+
+def _multiproc_dir() -> str:
+    return getattr(settings, 'METRICS_MULTIPROC_DIR', '') or os.environ.get('PROMETHEUS_MULTIPROC_DIR', '')
+
+
+# Counter/histogram values and gauge values are kept apart so a dead
+# worker's gauges can be dropped while its counters keep counting.
+_stores: Dict[str, Any] = {}
+_stores_lock = threading.Lock()
+_generation = 0
+
+
+def _store(kind: str):
+    store = _stores.get(kind)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(kind)
+            if store is None:
+                directory = _multiproc_dir()
+                if directory:
+                    store = _MmapValueStore(os.path.join(directory, f'{kind}_{os.getpid()}.db'))
+                else:
+                    store = _ValueStore()
+                _stores[kind] = store
+    return store
+
+
+def _reset_stores() -> None:
+    """Start fresh stores (after fork, in tests)."""
+    global _generation
+    _stores.clear()
+    _generation += 1
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_stores)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the gauges of a dead worker (gunicorn child_exit hook)."""
+    directory = _multiproc_dir()
+    if directory:
+        try:
+            os.remove(os.path.join(directory, f'gauge_{pid}.db'))
+        except FileNotFoundError:
+            pass
+
+
+# =============================================================================
+# Per-thread shards
+# =============================================================================
+
+_shard_ids = itertools.count()
+_free_shards: List[int] = []
+_local = threading.local()
+
+
+class _ShardLease:
+    """Shard id owned by one thread; returned to the pool when the thread exits."""
+
+    def __init__(self):
+        try:
+            self.id = _free_shards.pop()
+        except IndexError:
+            self.id = next(_shard_ids)
+
+    def __del__(self, _free=_free_shards):
+        _free.append(self.id)
+
+
+def _thread_slots() -> Tuple[int, Dict[Any, Tuple[int, ...]]]:
+    if getattr(_local, 'generation', None) != _generation:
+        if not hasattr(_local, 'lease'):
+            _local.lease = _ShardLease()
+        _local.slots = {}
+        _local.generation = _generation
+    return _local.lease.id, _local.slots
+
+
+def _sample_key(sample: str, labels: Sequence[Tuple[str, str]], shard: int) -> str:
+    return json.dumps([sample, list(labels), shard])
+
+
+# =============================================================================
+# Metric types
+# =============================================================================
+
+_registry: Dict[str, '_Metric'] = {}
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    type = 'untyped'
+    store_kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        with _registry_lock:
+            _registry[name] = self
+
+    def _slot_samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...]]]:
+        """(sample name, extra labels) of the slots of one label set."""
+        return [(self.name, ())]
+
+    def _slots(self, labels: Dict[str, Any]) -> Tuple[int, ...]:
+        labelvalues = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        shard, cache = _thread_slots()
+        slots = cache.get((self.name, labelvalues))
+        if slots is None:
+            store = _store(self.store_kind)
+            base = tuple(zip(self.labelnames, labelvalues))
+            slots = cache[(self.name, labelvalues)] = tuple(
+                store.slot(_sample_key(sample, base + extra, shard))
+                for sample, extra in self._slot_samples()
+            )
+        return slots
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        _store(self.store_kind).add(self._slots(labels)[0], amount)
+
+
+class Gauge(_Metric):
+    """Gauge summed across threads and live processes (inc/dec)."""
+    type = 'gauge'
+    store_kind = 'gauge'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        _store(self.store_kind).add(self._slots(labels)[0], amount)
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        """Set this thread's contribution (use from a single thread)."""
+        _store(self.store_kind).set(self._slots(labels)[0], value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        buckets = tuple(sorted(float(b) for b in buckets))
+        if buckets[-1] != float('inf'):
+            buckets += (float('inf'),)
+        self.buckets = buckets
+        super().__init__(name, documentation, labelnames)
+
+    def _slot_samples(self):
+        samples = [(f'{self.name}_bucket', (('le', _format_le(b)),)) for b in self.buckets]
+        samples.append((f'{self.name}_sum', ()))
+        return samples
+
+    def observe(self, value: float, **labels) -> None:
+        store = _store(self.store_kind)
+        slots = self._slots(labels)
+        store.add(slots[bisect.bisect_left(self.buckets, value)], 1)
+        store.add(slots[-1], value)
+
+    def time(self, **labels):
+        """Context manager observing the elapsed time of the block."""
+        return _Timer(self, labels)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """
+        Estimate the q-quantile from the aggregated buckets (like PromQL
+        histogram_quantile), over all series matching the given labels.
+        """
+        counts = [0.0] * len(self.buckets)
+        index = {_format_le(b): i for i, b in enumerate(self.buckets)}
+        for (sample, sample_labels), value in collect().items():
+            if sample != f'{self.name}_bucket':
+                continue
+            label_map = dict(sample_labels)
+            if all(label_map.get(k) == str(v) for k, v in labels.items()):
+                counts[index[label_map['le']]] += value
+        return histogram_quantile(q, self.buckets, counts)
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _format_le(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def histogram_quantile(q: float, buckets: Sequence[float], counts: Sequence[float]) -> Optional[float]:
+    """Linear interpolation within the bucket holding rank q (non-cumulative counts)."""
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    cumulative = 0.0
+    for i, count in enumerate(counts):
+        if cumulative + count >= rank and count > 0:
+            upper = buckets[i]
+            lower = buckets[i - 1] if i > 0 else 0.0
+            if upper == float('inf'):
+                return lower
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-2] if len(buckets) > 1 else None
+
+
+# =============================================================================
+# Collection / exposition
+# =============================================================================
+
+def collect() -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """Sum every sample over threads (and worker processes)."""
+    totals: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+    directory = _multiproc_dir()
+    if directory:
+        _store('counter'), _store('gauge')  # make sure this worker's files exist
+        entries = itertools.chain.from_iterable(
+            _read_file(path) for path in sorted(glob.glob(os.path.join(directory, '*.db')))
+        )
+    else:
+        entries = itertools.chain(_store('counter').items(), _store('gauge').items())
+
+    for key, value in entries:
+        sample, labels, _ = json.loads(key)
+        totals[(sample, tuple(tuple(pair) for pair in labels))] += value
+    return totals
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    pairs = (
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def format_prometheus_metrics() -> str:
+    """Format metrics in Prometheus exposition format."""
+    totals = collect()
+    by_sample: Dict[str, List[Tuple[Tuple[Tuple[str, str], ...], float]]] = defaultdict(list)
+    for (sample, labels), value in totals.items():
+        by_sample[sample].append((labels, value))
+
+    lines = []
+    for metric in list(_registry.values()):
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        if isinstance(metric, Histogram):
+            lines.extend(_format_histogram(metric, by_sample))
+        else:
+            samples = by_sample.get(metric.name) or ([((), 0.0)] if not metric.labelnames else [])
+            for labels, value in sorted(samples):
+                lines.append(f'{metric.name}{_format_labels(labels)} {_format_value(value)}')
+        lines.append('')
+
+    return '\n'.join(lines)
+
+
+def _format_histogram(metric: Histogram, by_sample) -> List[str]:
+    series: Dict[Tuple[Tuple[str, str], ...], List[float]] = defaultdict(lambda: [0.0] * len(metric.buckets))
+    index = {_format_le(b): i for i, b in enumerate(metric.buckets)}
+    for labels, value in by_sample.get(f'{metric.name}_bucket', []):
+        le = dict(labels)['le']
+        series[tuple(pair for pair in labels if pair[0] != 'le')][index[le]] += value
+    sums = {labels: value for labels, value in by_sample.get(f'{metric.name}_sum', [])}
+
+    lines = []
+    for labels in sorted(series):
+        cumulative = 0.0
+        for bound, count in zip(metric.buckets, series[labels]):
+            cumulative += count
+            bucket_labels = labels + (('le', _format_le(bound)),)
+            lines.append(f'{metric.name}_bucket{_format_labels(bucket_labels)} {_format_value(cumulative)}')
+        lines.append(f'{metric.name}_sum{_format_labels(labels)} {_format_value(sums.get(labels, 0.0))}')
+        lines.append(f'{metric.name}_count{_format_labels(labels)} {_format_value(cumulative)}')
+    return lines
+
+
+# =============================================================================
+# Application metrics
+# =============================================================================
+
+REQUESTS_TOTAL = Counter('openehrcore_requests_total', 'Total number of HTTP requests')
+REQUESTS_BY_METHOD = Counter('openehrcore_requests_by_method', 'Requests by HTTP method', ['method'])
+REQUESTS_BY_STATUS = Counter('openehrcore_requests_by_status', 'Requests by HTTP status', ['status'])
+ACTIVE_REQUESTS = Gauge('openehrcore_active_requests', 'Current number of active requests')
+ERRORS_TOTAL = Counter('openehrcore_errors_total', 'Total number of errors')
+CACHE_HITS = Counter('openehrcore_cache_hits_total', 'Total cache hits')
+CACHE_MISSES = Counter('openehrcore_cache_misses_total', 'Total cache misses')
+REQUEST_DURATION = Histogram(
+    'openehrcore_request_duration_seconds', 'Request duration in seconds', ['method', 'endpoint'],
+)
+FHIR_OPERATIONS = Counter('openehrcore_fhir_operations', 'FHIR operations by type', ['operation', 'resource'])
+FHIR_OPERATION_DURATION = Histogram(
+    'openehrcore_fhir_operation_duration_seconds', 'FHIRService operation duration in seconds',
+    ['operation', 'resource'],
+)
+FHIR_UPSTREAM_DURATION = Histogram(
+    'openehrcore_fhir_upstream_duration_seconds', 'HAPI FHIR HTTP call duration in seconds',
+    ['method', 'resource', 'status'],
+)
+
+
+def _get_or_create(cls, name: str, labelnames: Sequence[str] = ()) -> _Metric:
+    metric = _registry.get(name)
+    if metric is None:
+        metric = cls(name, name, labelnames)
+    return metric
 
 
 def increment_counter(name: str, labels: Dict[str, str] = None) -> None:
     """Increment a counter metric."""
-    if labels:
-        key = f"{name}_{labels}"
-        _metrics.setdefault(name, {})
-        _metrics[name][str(labels)] = _metrics[name].get(str(labels), 0) + 1
-    else:
-        _metrics[name] = _metrics.get(name, 0) + 1
+    labels = labels or {}
+    if not name.startswith('openehrcore_'):
+        name = f'openehrcore_{name}'
+    _get_or_create(Counter, name, sorted(labels)).inc(**labels)
 
 
-def observe_duration(name: str, duration: float) -> None:
+def observe_duration(name: str, duration: float, labels: Dict[str, str] = None) -> None:
     """Record a duration observation."""
-    _metrics.setdefault(f'{name}_seconds', [])
-    _metrics[f'{name}_seconds'].append(duration)
-    # Keep only last 1000 observations
-    if len(_metrics[f'{name}_seconds']) > 1000:
-        _metrics[f'{name}_seconds'] = _metrics[f'{name}_seconds'][-1000:]
+    labels = labels or {}
+    name = f'openehrcore_{name}_seconds'
+    _get_or_create(Histogram, name, sorted(labels)).observe(duration, **labels)
 
 
 def set_gauge(name: str, value: float) -> None:
     """Set a gauge metric value."""
-    _metrics[name] = value
+    if not name.startswith('openehrcore_'):
+        name = f'openehrcore_{name}'
+    _get_or_create(Gauge, name).set(value)
+
+
+def _record_request(request, status_code: Optional[int], duration: float) -> None:
+    match = getattr(request, 'resolver_match', None)
+    endpoint = match.route if match is not None and match.route else 'unmatched'
+    REQUESTS_TOTAL.inc()
+    REQUESTS_BY_METHOD.inc(method=request.method)
+    REQUEST_DURATION.observe(duration, method=request.method, endpoint=endpoint)
+    if status_code is not None:
+        REQUESTS_BY_STATUS.inc(status=status_code)
 
 
 def track_request(func: Callable) -> Callable:
     """Decorator to track request metrics."""
     @functools.wraps(func)
     def wrapper(request, *args, **kwargs):
-        _metrics['active_requests'] = _metrics.get('active_requests', 0) + 1
-        start_time = time.time()
-        
+        ACTIVE_REQUESTS.inc()
+        start_time = time.perf_counter()
+        status_code = None
         try:
             response = func(request, *args, **kwargs)
             status_code = response.status_code
-        except Exception as e:
-            _metrics['errors_total'] = _metrics.get('errors_total', 0) + 1
+            return response
+        except Exception:
+            ERRORS_TOTAL.inc()
             raise
         finally:
-            duration = time.time() - start_time
-            _metrics['active_requests'] = max(0, _metrics.get('active_requests', 1) - 1)
-            
-            # Record metrics
-            increment_counter('requests_total')
-            increment_counter('requests_by_method', {'method': request.method})
-            observe_duration('request_duration', duration)
-            
-            if 'status_code' in dir():
-                increment_counter('requests_by_status', {'status': str(status_code)})
-        
-        return response
+            ACTIVE_REQUESTS.dec()
+            _record_request(request, status_code, time.perf_counter() - start_time)
     return wrapper
 
 
-def format_prometheus_metrics() -> str:
-    """Format metrics in Prometheus exposition format."""
-    lines = []
-    
-    # Help and type declarations
-    lines.append('# HELP openehrcore_requests_total Total number of HTTP requests')
-    lines.append('# TYPE openehrcore_requests_total counter')
-    lines.append(f'openehrcore_requests_total {_metrics.get("requests_total", 0)}')
-    
-    lines.append('')
-    lines.append('# HELP openehrcore_active_requests Current number of active requests')
-    lines.append('# TYPE openehrcore_active_requests gauge')
-    lines.append(f'openehrcore_active_requests {_metrics.get("active_requests", 0)}')
-    
-    lines.append('')
-    lines.append('# HELP openehrcore_errors_total Total number of errors')
-    lines.append('# TYPE openehrcore_errors_total counter')
-    lines.append(f'openehrcore_errors_total {_metrics.get("errors_total", 0)}')
-    
-    lines.append('')
-    lines.append('# HELP openehrcore_cache_hits_total Total cache hits')
-    lines.append('# TYPE openehrcore_cache_hits_total counter')
-    lines.append(f'openehrcore_cache_hits_total {_metrics.get("cache_hits", 0)}')
-    
-    lines.append('')
-    lines.append('# HELP openehrcore_cache_misses_total Total cache misses')
-    lines.append('# TYPE openehrcore_cache_misses_total counter')
-    lines.append(f'openehrcore_cache_misses_total {_metrics.get("cache_misses", 0)}')
-    
-    # Request duration histogram (simplified)
-    durations = _metrics.get('request_duration_seconds', [])
-    if durations:
-        avg_duration = sum(durations) / len(durations)
-        max_duration = max(durations)
-        lines.append('')
-        lines.append('# HELP openehrcore_request_duration_seconds Request duration in seconds')
-        lines.append('# TYPE openehrcore_request_duration_seconds summary')
-        lines.append(f'openehrcore_request_duration_seconds_avg {avg_duration:.6f}')
-        lines.append(f'openehrcore_request_duration_seconds_max {max_duration:.6f}')
-        lines.append(f'openehrcore_request_duration_seconds_count {len(durations)}')
-    
-    # Requests by method
-    methods = _metrics.get('requests_by_method', {})
-    if methods:
-        lines.append('')
-        lines.append('# HELP openehrcore_requests_by_method Requests by HTTP method')
-        lines.append('# TYPE openehrcore_requests_by_method counter')
-        for method_labels, count in methods.items():
-            lines.append(f'openehrcore_requests_by_method{{{method_labels.replace("'", '"')}}} {count}')
-    
-    # Requests by status
-    statuses = _metrics.get('requests_by_status', {})
-    if statuses:
-        lines.append('')
-        lines.append('# HELP openehrcore_requests_by_status Requests by HTTP status')
-        lines.append('# TYPE openehrcore_requests_by_status counter')
-        for status_labels, count in statuses.items():
-            lines.append(f'openehrcore_requests_by_status{{{status_labels.replace("'", '"')}}} {count}')
-    
-    # FHIR operations
-    fhir_ops = _metrics.get('fhir_operations', {})
-    if fhir_ops:
-        lines.append('')
-        lines.append('# HELP openehrcore_fhir_operations FHIR operations by type')
-        lines.append('# TYPE openehrcore_fhir_operations counter')
-        for op_labels, count in fhir_ops.items():
-            lines.append(f'openehrcore_fhir_operations{{{op_labels}}} {count}')
-    
-    return '\n'.join(lines) + '\n'
+class MetricsMiddleware:
+    """
+    Records request count, status and latency histogram per endpoint.
+
+    The endpoint label is the matched URL route (e.g. `api/v1/patients/<str:id>/`),
+    not the raw path, to keep the number of series bounded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.track = track_request(get_response)
+
+    def __call__(self, request):
+        if request.path.rstrip('/').endswith('/metrics'):
+            return self.get_response(request)
+        return self.track(request)
 
 
 def metrics_view(request):
@@ -170,33 +585,62 @@ def metrics_view(request):
 
 
 # Utility functions for tracking specific operations
-def track_fhir_operation(operation: str, resource_type: str) -> None:
-    """Track a FHIR operation."""
-    key = f'operation="{operation}",resource="{resource_type}"'
-    _metrics.setdefault('fhir_operations', {})
-    _metrics['fhir_operations'][key] = _metrics['fhir_operations'].get(key, 0) + 1
+def track_fhir_operation(operation: str, resource_type: str, duration: Optional[float] = None) -> None:
+    """Track a FHIR operation (and its duration, when known)."""
+    FHIR_OPERATIONS.inc(operation=operation, resource=resource_type)
+    if duration is not None:
+        FHIR_OPERATION_DURATION.observe(duration, operation=operation, resource=resource_type)
+
+
+def fhir_operation(operation: str, resource_type: Optional[str] = None) -> Callable:
+    """
+    Decorator timing a FHIRService operation.
+
+    The resource label is `resource_type`, or the method's first argument.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            resource = resource_type or (args[0] if args else kwargs.get('resource_type', ''))
+            start_time = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                track_fhir_operation(operation, resource, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+def track_upstream_call(method: str, resource_type: str, status: str, duration: float) -> None:
+    """Track one HTTP call to the HAPI FHIR server."""
+    FHIR_UPSTREAM_DURATION.observe(duration, method=method, resource=resource_type, status=status)
 
 
 def track_cache_hit() -> None:
     """Track a cache hit."""
-    _metrics['cache_hits'] = _metrics.get('cache_hits', 0) + 1
+    CACHE_HITS.inc()
 
 
 def track_cache_miss() -> None:
     """Track a cache miss."""
-    _metrics['cache_misses'] = _metrics.get('cache_misses', 0) + 1
+    CACHE_MISSES.inc()
 
 
 def get_metrics_summary() -> Dict[str, Any]:
     """Get a summary of current metrics (for health check)."""
-    durations = _metrics.get('request_duration_seconds', [])
+    totals = collect()
+
+    def total(sample: str) -> float:
+        return sum(value for (name, _), value in totals.items() if name == sample)
+
+    requests = total(f'{REQUEST_DURATION.name}_bucket')
+    hits, misses = total(CACHE_HITS.name), total(CACHE_MISSES.name)
     return {
-        'requests_total': _metrics.get('requests_total', 0),
-        'errors_total': _metrics.get('errors_total', 0),
-        'active_requests': _metrics.get('active_requests', 0),
-        'avg_response_time': sum(durations) / len(durations) if durations else 0,
-        'cache_hit_rate': (
-            _metrics.get('cache_hits', 0) / 
-            max(1, _metrics.get('cache_hits', 0) + _metrics.get('cache_misses', 0))
-        )
+        'requests_total': int(total(REQUESTS_TOTAL.name)),
+        'errors_total': int(total(ERRORS_TOTAL.name)),
+        'active_requests': int(total(ACTIVE_REQUESTS.name)),
+        'avg_response_time': total(f'{REQUEST_DURATION.name}_sum') / requests if requests else 0,
+        'p95_response_time': REQUEST_DURATION.quantile(0.95) or 0,
+        'p99_response_time': REQUEST_DURATION.quantile(0.99) or 0,
+        'cache_hit_rate': hits / max(1, hits + misses),
     }
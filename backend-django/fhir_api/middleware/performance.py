@@ -3,18 +3,33 @@ Sprint 25: Performance Monitoring Middleware
 
 Middleware for:
 - Request timing
+- Upstream FHIR call tracing (Server-Timing)
 - Query counting
 - Rate limiting
 - Performance headers
+- Conditional GET (ETag / Last-Modified)
 """
 
+import hashlib
+import json
+import math
+import random
 import time
 import logging
+from typing import Any, Optional, Tuple
 from django.conf import settings
 from django.http import JsonResponse
 from django.db import connection, reset_queries
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+from .rate_limit import get_rate_limiter
+from ..services.cache_service import cache_service
+from ..tracing import current_trace, end_trace, start_trace
 
 logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger('fhir_api.tracing')
 
 
 class PerformanceMiddleware:
@@ -25,56 +40,105 @@ class PerformanceMiddleware:
     - X-Request-Time: Total request time in ms
     - X-Query-Count: Number of database queries
     - X-Cache-Status: Cache hit/miss status
+    - Server-Timing: time spent in FHIR server calls (per resource/method)
+    
+    Requests that called the FHIR server get one structured log line;
+    slow requests (REQUEST_TRACE_SLOW_MS) are sampled
+    (REQUEST_TRACE_SAMPLE_RATE) into a WARNING listing every call.
     """
     
     def __init__(self, get_response):
         self.get_response = get_response
+        self.slow_ms = getattr(settings, 'REQUEST_TRACE_SLOW_MS', 1000)
+        self.sample_rate = getattr(settings, 'REQUEST_TRACE_SAMPLE_RATE', 1.0)
+        self.repeat_threshold = getattr(settings, 'REQUEST_TRACE_REPEAT_THRESHOLD', 5)
     
     def __call__(self, request):
         # Start timing
         start_time = time.time()
+        token = start_trace()
         
         # Reset query log if in debug mode
         if settings.DEBUG:
             reset_queries()
         
-        # Process request
-        response = self.get_response(request)
-        
-        # Calculate elapsed time
-        elapsed_ms = (time.time() - start_time) * 1000
-        
-        # Add performance headers
-        response['X-Request-Time'] = f"{elapsed_ms:.2f}ms"
-        
-        if settings.DEBUG:
-            query_count = len(connection.queries)
-            response['X-Query-Count'] = str(query_count)
+        try:
+            # Process request
+            response = self.get_response(request)
             
-            if query_count > 10:
+            # Calculate elapsed time
+            elapsed_ms = (time.time() - start_time) * 1000
+            
+            # Add performance headers
+            response['X-Request-Time'] = f"{elapsed_ms:.2f}ms"
+            
+            if settings.DEBUG:
+                query_count = len(connection.queries)
+                response['X-Query-Count'] = str(query_count)
+                
+                if query_count > 10:
+                    logger.warning(
+                        f"High query count ({query_count}) for {request.method} {request.path}"
+                    )
+            
+            self._report_trace(request, response, elapsed_ms)
+            
+            # Log slow requests
+            if elapsed_ms > 1000:  # > 1 second
                 logger.warning(
-                    f"High query count ({query_count}) for {request.method} {request.path}"
+                    f"Slow request: {request.method} {request.path} took {elapsed_ms:.2f}ms"
                 )
+            
+            return response
+        finally:
+            end_trace(token)
+    
+    def _report_trace(self, request, response, elapsed_ms: float) -> None:
+        """Server-Timing header, structured log line and sampled slow trace."""
+        trace = current_trace()
+        if trace is None:
+            return
+        calls = trace.finish()
         
-        # Log slow requests
-        if elapsed_ms > 1000:  # > 1 second
-            logger.warning(
-                f"Slow request: {request.method} {request.path} took {elapsed_ms:.2f}ms"
-            )
+        timing = trace.server_timing()
+        response['Server-Timing'] = f'{timing}, total;dur={elapsed_ms:.1f}'
+        if not calls:
+            return
         
-        return response
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(elapsed_ms, 1),
+            **trace.summary(),
+        }
+        trace_logger.info(json.dumps(record), extra={'trace': record})
+        
+        if elapsed_ms >= self.slow_ms and random.random() < self.sample_rate:
+            record["repeated"] = trace.repeated(self.repeat_threshold)
+            record["calls"] = [
+                {
+                    "method": c.method,
+                    "resource": c.resource,
+                    "path": c.path,
+                    "status": c.status,
+                    "bytes": c.bytes,
+                    "duration_ms": round(c.duration * 1000, 1),
+                    "cache_hit": c.cache_hit,
+                }
+                for c in calls
+            ]
+            trace_logger.warning(f"Slow request trace: {json.dumps(record)}", extra={'trace': record})
 
 
 class RateLimitMiddleware:
     """
     Simple rate limiting middleware.
     
-    Limits requests per IP address within a time window.
+    Limits requests per IP address within a time window, using the shared
+    rate limit engine (Redis-backed across workers when configured).
     """
     
-    # In-memory store (use Redis in production)
-    _requests = {}
-    
     def __init__(self, get_response):
         self.get_response = get_response
         self.limit = getattr(settings, 'RATE_LIMIT_REQUESTS', 100)
@@ -89,11 +153,12 @@ class RateLimitMiddleware:
         ip = self._get_client_ip(request)
         
         # Check rate limit
-        if not self._check_rate_limit(ip):
+        status = get_rate_limiter().check(f"ip:{ip}", self.limit, self.window)
+        if not status.allowed:
             return JsonResponse(
                 {
                     "error": "Rate limit exceeded",
-                    "retry_after": self.window
+                    "retry_after": math.ceil(status.retry_after)
                 },
                 status=429
             )
@@ -101,10 +166,9 @@ class RateLimitMiddleware:
         response = self.get_response(request)
         
         # Add rate limit headers
-        remaining = self.limit - self._get_request_count(ip)
         response['X-RateLimit-Limit'] = str(self.limit)
-        response['X-RateLimit-Remaining'] = str(max(0, remaining))
-        response['X-RateLimit-Reset'] = str(int(time.time()) + self.window)
+        response['X-RateLimit-Remaining'] = str(status.remaining)
+        response['X-RateLimit-Reset'] = str(math.ceil(time.time() + status.reset_after))
         
         return response
     
@@ -113,30 +177,6 @@ class RateLimitMiddleware:
         if x_forwarded_for:
             return x_forwarded_for.split(',')[0]
         return request.META.get('REMOTE_ADDR', 'unknown')
-    
-    def _check_rate_limit(self, ip: str) -> bool:
-        current_time = time.time()
-        
-        # Initialize or clean up old entries
-        if ip not in self._requests:
-            self._requests[ip] = []
-        
-        # Remove old requests outside the window
-        self._requests[ip] = [
-            t for t in self._requests[ip]
-            if current_time - t < self.window
-        ]
-        
-        # Check if under limit
-        if len(self._requests[ip]) >= self.limit:
-            return False
-        
-        # Record this request
-        self._requests[ip].append(current_time)
-        return True
-    
-    def _get_request_count(self, ip: str) -> int:
-        return len(self._requests.get(ip, []))
 
 
 class CompressionMiddleware:
@@ -195,31 +235,163 @@ class CacheControlMiddleware:
 
 class ETaggerMiddleware:
     """
-    Adds ETag headers for conditional requests.
+    Conditional GET (ETag / Last-Modified) for API reads.
+    
+    Validators come from the FHIR data when possible: the ETag is weak and
+    built from `meta.versionId` (a resource, or every entry of a Bundle /
+    list) and Last-Modified from `meta.lastUpdated`, so no body is hashed.
+    Other bodies up to ETAG_MAX_BODY_BYTES get a content hash; larger and
+    streaming responses (exports) get no ETag.
+    
+    Validators taken from `meta.versionId` are stored per URL and credential
+    (Authorization header / session cookie) for ETAG_VALIDATOR_TTL seconds
+    and dropped on every FHIR write (FHIRService.clear_cache). A request
+    whose If-None-Match / If-Modified-Since matches them gets its 304 before
+    the view runs, without any call to the FHIR server. Hashed bodies may
+    come from data changed outside FHIRService, so those requests always
+    run the view and the 304 is decided on the fresh body. Without Redis
+    the stored validators are per worker.
     """
     
+    EXEMPT_PATHS = ['/health', '/metrics', '/static/', '/admin/']
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        self.ttl = getattr(settings, 'ETAG_VALIDATOR_TTL', 300)
+        self.max_body = getattr(settings, 'ETAG_MAX_BODY_BYTES', 1024 * 1024)
     
     def __call__(self, request):
+        if request.method not in ('GET', 'HEAD') or any(p in request.path for p in self.EXEMPT_PATHS):
+            return self.get_response(request)
+        
+        key = self._validator_key(request)
+        conditional = 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+        if conditional:
+            not_modified = self._check_stored(request, key)
+            if not_modified is not None:
+                return not_modified
+        
         response = self.get_response(request)
         
-        # Only for successful GET requests
-        if request.method != 'GET' or response.status_code != 200:
+        # Only for successful, fully rendered responses
+        if response.status_code != 200 or response.streaming:
             return response
         
-        # Generate ETag from content
-        if hasattr(response, 'content'):
-            import hashlib
-            content_hash = hashlib.md5(response.content).hexdigest()
-            etag = f'"{content_hash}"'
-            
+        etag, last_modified, versioned = self._validators(response)
+        if etag is None and last_modified is None:
+            return response
+        
+        if etag and not response.has_header('ETag'):
             response['ETag'] = etag
-            
-            # Check If-None-Match
-            if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
-            if if_none_match == etag:
-                response.status_code = 304
-                response.content = b''
+        if last_modified and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+        
+        # Só validadores de versão FHIR são invalidados em toda escrita; os
+        # demais não podem dispensar a view
+        if versioned:
+            try:
+                cache_service.set_validator(
+                    key, {'etag': etag, 'last_modified': last_modified, 'versioned': True}, self.ttl
+                )
+            except Exception as e:
+                logger.warning(f"Could not store validators for {request.path}: {e}")
         
+        if conditional:
+            return get_conditional_response(
+                request, etag=etag, last_modified=last_modified, response=response
+            )
         return response
+    
+    @staticmethod
+    def _validator_key(request) -> str:
+        """Hash of URL and credentials: a 304 is only given to whoever received the body."""
+        credentials = request.META.get('HTTP_AUTHORIZATION', '')
+        session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+        raw = f"{request.get_full_path()}\0{credentials}\0{session}"
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+    
+    def _check_stored(self, request, key: str):
+        """304 from the stored validators, or None to run the view."""
+        try:
+            validator = cache_service.get_validator(key)
+        except Exception as e:
+            logger.warning(f"Could not read validators for {request.path}: {e}")
+            return None
+        if not validator or not validator.get('versioned'):
+            return None
+        
+        etag, last_modified = validator.get('etag'), validator.get('last_modified')
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None or response.status_code != 304:
+            return None
+        if etag:
+            response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+    
+    def _validators(self, response) -> Tuple[Optional[str], Optional[int], bool]:
+        """(ETag, Last-Modified timestamp, taken from meta.versionId) of a rendered response."""
+        etag = response.get('ETag')
+        last_modified = None
+        versioned = False
+        
+        data = getattr(response, 'data', None)
+        if data is not None:
+            versions = fhir_version_validators(data)
+            if versions is not None:
+                version_etag, last_modified = versions
+                versioned = etag is None
+                etag = etag or version_etag
+        
+        if etag is None and len(response.content) <= self.max_body:
+            etag = f'"{hashlib.blake2b(response.content, digest_size=16).hexdigest()}"'
+        return etag, last_modified, versioned
+
+
+def fhir_version_validators(data: Any) -> Optional[Tuple[str, Optional[int]]]:
+    """
+    Weak ETag and Last-Modified timestamp from FHIR `meta`.
+    
+    `data` is a resource, a Bundle or a list of resources; returns None
+    unless every resource carries `meta.versionId`.
+    """
+    if isinstance(data, dict) and data.get('resourceType') == 'Bundle':
+        resources = [entry.get('resource') for entry in data.get('entry') or []]
+    elif isinstance(data, dict) and data.get('resourceType'):
+        resources = [data]
+    elif isinstance(data, list) and data:
+        resources = data
+    else:
+        return None
+    
+    versions = []
+    updated = []
+    for resource in resources:
+        if not isinstance(resource, dict):
+            return None
+        meta = resource.get('meta') or {}
+        version_id = meta.get('versionId')
+        if not version_id:
+            return None
+        versions.append(f"{resource.get('resourceType')}/{resource.get('id')}/_history/{version_id}")
+        if meta.get('lastUpdated'):
+            updated.append(meta['lastUpdated'])
+    
+    if isinstance(data, dict) and data.get('resourceType') != 'Bundle':
+        etag = f'W/"{version_id}"'
+    else:
+        # The set of entries (and the total) identifies the page
+        total = data.get('total', '') if isinstance(data, dict) else len(data)
+        digest = hashlib.blake2b(f"{total}|{'|'.join(versions)}".encode(), digest_size=16).hexdigest()
+        etag = f'W/"{digest}"'
+    
+    # Last-Modified only when every resource has a parseable lastUpdated
+    try:
+        parsed = [parse_datetime(value) for value in updated]
+    except (TypeError, ValueError):
+        parsed = []
+    last_modified = None
+    if parsed and len(parsed) == len(resources) and all(p and p.tzinfo for p in parsed):
+        last_modified = int(max(p.timestamp() for p in parsed))
+    return etag, last_modified
@@ -4,19 +4,32 @@ Rate Limiting Middleware for HealthStack
 Implements request rate limiting to prevent API abuse.
 Supports different limits for different endpoint types.
 
+All rate limiters in the project share one engine (RateLimiter) using
+GCRA, the sliding-window equivalent of a token bucket that stores a single
+timestamp per client:
+- RedisRateLimitStore: one atomic Lua call per request, shared by every
+  gunicorn worker/pod (RATE_LIMIT_BACKEND=redis)
+- LocalRateLimitStore: lock-free in-process fallback
+
 ISO 27001 / OWASP Security Best Practice
 """
 
+import math
 import time
 import logging
-from collections import defaultdict
 from threading import Lock
-from typing import Dict, Optional, Tuple
+from typing import Dict, NamedTuple, Optional, Tuple
 from django.http import JsonResponse
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
 
 class RateLimitConfig:
     """Rate limit configuration for different endpoint types."""
@@ -33,6 +46,9 @@ class RateLimitConfig:
         'agent': 120,            # 120 requests/minute for agent communication
     }
     
+    # Window the limits above apply to (seconds)
+    WINDOW = 60
+    
     # Endpoint patterns to category mapping
     PATTERNS = {
         '/auth/': 'auth',
@@ -46,87 +62,142 @@ class RateLimitConfig:
         '/webhook': 'webhook',
         '/agent/': 'agent',
     }
+    
+    @classmethod
+    def limit_for(cls, category: str) -> int:
+        return cls.LIMITS.get(category, cls.LIMITS['default'])
 
 
-class TokenBucket:
-    """Token bucket algorithm for rate limiting."""
+class RateLimitStatus(NamedTuple):
+    """Outcome of a rate limit check (times in seconds)."""
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float
+    reset_after: float
+
+
+class LocalRateLimitStore:
+    """
+    In-process GCRA store: one float (theoretical arrival time) per key.
+    
+    There is no lock: a check is a dict read plus a dict write, each atomic
+    under the GIL, so two racing requests for the same key can at worst
+    both be admitted. Keys whose arrival time has passed hold no state and
+    are pruned as the table grows, so memory is bounded by the clients
+    active within one window.
+    """
     
-    def __init__(self, rate: int, capacity: int):
-        self.rate = rate  # tokens per minute
-        self.capacity = capacity
-        self.tokens = capacity
-        self.last_update = time.time()
-        self.lock = Lock()
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._prune_at = max_keys
+        self._tat: Dict[str, float] = {}
     
-    def consume(self, tokens: int = 1) -> bool:
-        """Try to consume tokens. Returns True if successful."""
-        with self.lock:
-            now = time.time()
-            elapsed = now - self.last_update
-            
-            # Add tokens based on elapsed time
-            self.tokens = min(
-                self.capacity,
-                self.tokens + (elapsed * self.rate / 60)
-            )
-            self.last_update = now
-            
-            if self.tokens >= tokens:
-                self.tokens -= tokens
-                return True
-            return False
+    def check(self, key: str, limit: int, window: float, cost: int = 1) -> RateLimitStatus:
+        now = time.monotonic()
+        interval = window / limit
+        tat = max(self._tat.get(key, now), now)
+        new_tat = tat + interval * cost
+        allow_at = new_tat - window
+        
+        if allow_at > now:
+            return RateLimitStatus(False, limit, 0, allow_at - now, tat - now)
+        
+        self._tat[key] = new_tat
+        if len(self._tat) > self._prune_at:
+            self._prune(now)
+        remaining = int((now - allow_at) / interval + 1e-9)
+        return RateLimitStatus(True, limit, remaining, 0.0, new_tat - now)
+    
+    def _prune(self, now: float) -> None:
+        for key, tat in list(self._tat.items()):
+            if tat <= now:
+                self._tat.pop(key, None)
+        # Amortize: with many active clients do not rescan on every request
+        self._prune_at = max(self.max_keys, 2 * len(self._tat))
+    
+    def clear(self) -> None:
+        self._tat.clear()
+
+
+class RedisRateLimitStore:
+    """
+    GCRA store in Redis, shared by all workers.
+    
+    Keys:
+        ratelimit:{key}  theoretical arrival time (ms), with PX expiry
+    """
+    
+    # KEYS[1] = key; ARGV[1] = emission interval (ms), ARGV[2] = limit,
+    # ARGV[3] = cost. Uses the Redis clock so workers need not agree on time.
+    # Returns {allowed, remaining, retry_after_ms, reset_after_ms}.
+    _GCRA_SCRIPT = """
+    local t = redis.call('time')
+    local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+    local interval = tonumber(ARGV[1])
+    local window = interval * tonumber(ARGV[2])
+    local tat = tonumber(redis.call('get', KEYS[1])) or now
+    if tat < now then tat = now end
+    local new_tat = tat + interval * tonumber(ARGV[3])
+    local allow_at = new_tat - window
+    if allow_at > now then
+        return {0, 0, math.ceil(allow_at - now), math.ceil(tat - now)}
+    end
+    redis.call('set', KEYS[1], tostring(new_tat), 'px', math.ceil(new_tat - now))
+    return {1, math.floor((now - allow_at) / interval + 1e-9), 0, math.ceil(new_tat - now)}
+    """
+    
+    def __init__(self, url: Optional[str] = None, prefix: str = "ratelimit"):
+        self.url = url or getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.from_url(
+            self.url,
+            socket_timeout=getattr(settings, 'RATE_LIMIT_REDIS_TIMEOUT', 0.5),
+        )
+        self.prefix = prefix
+        self._gcra = self.client.register_script(self._GCRA_SCRIPT)
     
-    def get_wait_time(self) -> float:
-        """Get time to wait until next token available."""
-        if self.tokens >= 1:
-            return 0
-        return ((1 - self.tokens) / self.rate) * 60
+    def check(self, key: str, limit: int, window: float, cost: int = 1) -> RateLimitStatus:
+        allowed, remaining, retry_ms, reset_ms = self._gcra(
+            keys=[f"{self.prefix}:{key}"],
+            args=[window * 1000.0 / limit, limit, cost],
+        )
+        return RateLimitStatus(bool(allowed), limit, int(remaining), retry_ms / 1000.0, reset_ms / 1000.0)
 
 
 class RateLimiter:
-    """Rate limiter using token bucket algorithm per client."""
+    """
+    Rate limit engine shared by the middlewares and the @rate_limit decorator.
+    
+    Checks go to the configured store; if Redis fails the request is
+    checked against the local store instead, so an outage degrades to
+    per-process limits rather than blocking or admitting everything.
+    """
+    
+    def __init__(self, store=None):
+        self.store = store or LocalRateLimitStore()
+        self.fallback = self.store if isinstance(self.store, LocalRateLimitStore) else LocalRateLimitStore()
     
-    def __init__(self):
-        self.buckets: Dict[str, Dict[str, TokenBucket]] = defaultdict(dict)
-        self.lock = Lock()
+    def check(self, key: str, limit: int, window: float = RateLimitConfig.WINDOW, cost: int = 1) -> RateLimitStatus:
+        """Consume `cost` from `key`, allowing `limit` requests per `window` seconds."""
+        if self.store is not self.fallback:
+            try:
+                return self.store.check(key, limit, window, cost)
+            except Exception as e:
+                logger.error(f"Rate limit store error, using local limiter: {e}")
+        return self.fallback.check(key, limit, window, cost)
     
-    def get_bucket(self, client_id: str, category: str) -> TokenBucket:
-        """Get or create a token bucket for a client/category combo."""
-        with self.lock:
-            if category not in self.buckets[client_id]:
-                rate = RateLimitConfig.LIMITS.get(category, RateLimitConfig.LIMITS['default'])
-                self.buckets[client_id][category] = TokenBucket(rate=rate, capacity=rate)
-            return self.buckets[client_id][category]
+    def check_category(self, client_id: str, category: str) -> RateLimitStatus:
+        """Check a client against the RateLimitConfig limit of a category."""
+        return self.check(f"middleware:{client_id}:{category}", RateLimitConfig.limit_for(category))
     
     def is_allowed(self, client_id: str, category: str) -> Tuple[bool, float]:
         """Check if request is allowed. Returns (allowed, retry_after)."""
-        bucket = self.get_bucket(client_id, category)
-        if bucket.consume():
-            return True, 0
-        return False, bucket.get_wait_time()
-    
-    def cleanup_old_buckets(self, max_age: int = 3600):
-        """Remove buckets that haven't been used in max_age seconds."""
-        with self.lock:
-            now = time.time()
-            expired_clients = []
-            
-            for client_id, categories in self.buckets.items():
-                all_expired = True
-                for bucket in categories.values():
-                    if now - bucket.last_update < max_age:
-                        all_expired = False
-                        break
-                
-                if all_expired:
-                    expired_clients.append(client_id)
-            
-            for client_id in expired_clients:
-                del self.buckets[client_id]
+        status = self.check_category(client_id, category)
+        return status.allowed, status.retry_after
 
 
-# Global rate limiter instance
-_rate_limiter = RateLimiter()
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = Lock()
 
 
 class RateLimitMiddleware:
@@ -136,7 +207,7 @@ class RateLimitMiddleware:
     Features:
     - Per-client rate limiting using IP or user ID
     - Different limits for different endpoint types
-    - Token bucket algorithm for smooth rate limiting
+    - GCRA (sliding window) shared across workers via Redis
     - Retry-After header in 429 responses
     """
     
@@ -159,16 +230,16 @@ class RateLimitMiddleware:
         category = self._get_category(request.path)
         
         # Check rate limit
-        allowed, retry_after = _rate_limiter.is_allowed(client_id, category)
+        status = get_rate_limiter().check_category(client_id, category)
         
-        if not allowed:
+        if not status.allowed:
             logger.warning(
                 f"Rate limit exceeded for client {client_id} on category {category}",
                 extra={
                     'client_id': client_id,
                     'category': category,
                     'path': request.path,
-                    'retry_after': retry_after
+                    'retry_after': status.retry_after
                 }
             )
             
@@ -176,19 +247,18 @@ class RateLimitMiddleware:
                 {
                     'error': 'rate_limit_exceeded',
                     'message': 'Too many requests. Please try again later.',
-                    'retry_after': round(retry_after, 1)
+                    'retry_after': round(status.retry_after, 1)
                 },
                 status=429,
-                headers={'Retry-After': str(int(retry_after) + 1)}
+                headers={'Retry-After': str(int(status.retry_after) + 1)}
             )
         
         # Add rate limit headers to response
         response = self.get_response(request)
         
-        bucket = _rate_limiter.get_bucket(client_id, category)
-        response['X-RateLimit-Limit'] = str(RateLimitConfig.LIMITS.get(category, 60))
-        response['X-RateLimit-Remaining'] = str(int(bucket.tokens))
-        response['X-RateLimit-Reset'] = str(int(time.time()) + 60)
+        response['X-RateLimit-Limit'] = str(status.limit)
+        response['X-RateLimit-Remaining'] = str(status.remaining)
+        response['X-RateLimit-Reset'] = str(math.ceil(time.time() + status.reset_after))
         
         return response
     
@@ -227,5 +297,26 @@ class RateLimitMiddleware:
 
 
 def get_rate_limiter() -> RateLimiter:
-    """Get the global rate limiter instance."""
+    """Return the global rate limiter (RATE_LIMIT_BACKEND: memory | redis)."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                backend = getattr(settings, 'RATE_LIMIT_BACKEND', 'memory')
+                store = None
+                if backend == 'redis' and REDIS_AVAILABLE:
+                    try:
+                        store = RedisRateLimitStore()
+                        store.client.ping()
+                    except Exception as e:
+                        logger.warning(f"Redis rate limit store unavailable ({e}), using local limiter")
+                        store = None
+                _rate_limiter = RateLimiter(store)
+                logger.info(f"Rate limit store: {type(_rate_limiter.store).__name__}")
     return _rate_limiter
+
+
+def set_rate_limiter(limiter: Optional[RateLimiter]) -> None:
+    """Replace the global rate limiter (tests)."""
+    global _rate_limiter
+    _rate_limiter = limiter
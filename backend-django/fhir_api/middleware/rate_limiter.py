@@ -3,28 +3,27 @@ Rate Limiter Middleware - Proteção contra DDoS e abuso
 Implementa throttling configurável por endpoint e usuário
 """
 
+import math
 import time
 import logging
-from collections import defaultdict
-from threading import Lock
 from functools import wraps
 from django.conf import settings
 from django.http import JsonResponse
 from rest_framework import status
 
+from .rate_limit import get_rate_limiter
+
 logger = logging.getLogger(__name__)
 
 
 class RateLimiter:
     """
-    Rate limiter em memória com sliding window.
-    Para produção, considerar Redis para distribuído.
+    Rate limiter com sliding window (GCRA).
+    A contagem usa o engine compartilhado de rate_limit (Redis entre
+    workers quando configurado); aqui ficam os limites e a categorização.
     """
     
     def __init__(self):
-        self.requests = defaultdict(list)
-        self.lock = Lock()
-        
         # Configurações padrão (requests por minuto)
         self.limits = {
             'default': 60,           # 60 req/min para usuários autenticados
@@ -65,63 +64,49 @@ class RateLimiter:
             return 'export'
         return 'default'
     
-    def is_rate_limited(self, request):
+    def is_rate_limited(self, request, category=None, limit=None):
         """
         Verifica se o request deve ser limitado.
         Retorna (is_limited, retry_after_seconds, limit_info)
         """
         client_id = self.get_client_id(request)
-        category = self.get_limit_category(request.path)
+        category = category or self.get_limit_category(request.path)
         
         # Usar limite anônimo se não autenticado
         if client_id.startswith('ip:') and category == 'default':
             category = 'anonymous'
         
-        limit = self.limits.get(category, self.limits['default'])
+        if limit is None:
+            limit = self.limits.get(category, self.limits['default'])
         window = 60  # 1 minuto
         
-        key = f"{client_id}:{category}"
-        now = time.time()
+        # Prefixo próprio: as mesmas categorias do RateLimitMiddleware (rate_limit)
+        # têm outros limites e não podem consumir a mesma chave no engine
+        result = get_rate_limiter().check(f"decorator:{client_id}:{category}", limit, window)
+        reset = math.ceil(time.time() + result.reset_after)
         
-        with self.lock:
-            # Limpar requests antigos
-            self.requests[key] = [
-                ts for ts in self.requests[key]
-                if now - ts < window
-            ]
-            
-            current_count = len(self.requests[key])
-            
-            if current_count >= limit:
-                # Calcular tempo até próximo slot
-                oldest = min(self.requests[key]) if self.requests[key] else now
-                retry_after = int(window - (now - oldest)) + 1
-                
-                logger.warning(
-                    f"Rate limit exceeded for {client_id} on {category}",
-                    extra={
-                        'client_id': client_id,
-                        'category': category,
-                        'limit': limit,
-                        'current': current_count,
-                        'path': request.path
-                    }
-                )
-                
-                return True, retry_after, {
+        if not result.allowed:
+            logger.warning(
+                f"Rate limit exceeded for {client_id} on {category}",
+                extra={
+                    'client_id': client_id,
+                    'category': category,
                     'limit': limit,
-                    'remaining': 0,
-                    'reset': int(oldest + window)
+                    'path': request.path
                 }
+            )
             
-            # Registrar request
-            self.requests[key].append(now)
-            
-            return False, 0, {
+            return True, math.ceil(result.retry_after), {
                 'limit': limit,
-                'remaining': limit - current_count - 1,
-                'reset': int(now + window)
+                'remaining': 0,
+                'reset': reset
             }
+        
+        return False, 0, {
+            'limit': limit,
+            'remaining': result.remaining,
+            'reset': reset
+        }
 
 
 # Instância global
@@ -183,27 +168,18 @@ def rate_limit(category='default', limit=None):
     def decorator(view_func):
         @wraps(view_func)
         def wrapper(request, *args, **kwargs):
-            # Override temporário do limite se especificado
-            original_limit = None
-            if limit is not None:
-                original_limit = rate_limiter.limits.get(category)
-                rate_limiter.limits[category] = limit
+            is_limited, retry_after, limit_info = rate_limiter.is_rate_limited(
+                request, category=category, limit=limit
+            )
+            
+            if is_limited:
+                return JsonResponse({
+                    'error': 'Rate limit exceeded',
+                    'message': 'Limite de requisições atingido.',
+                    'retry_after': retry_after
+                }, status=status.HTTP_429_TOO_MANY_REQUESTS)
             
-            try:
-                is_limited, retry_after, limit_info = rate_limiter.is_rate_limited(request)
-                
-                if is_limited:
-                    return JsonResponse({
-                        'error': 'Rate limit exceeded',
-                        'message': 'Limite de requisições atingido.',
-                        'retry_after': retry_after
-                    }, status=status.HTTP_429_TOO_MANY_REQUESTS)
-                
-                return view_func(request, *args, **kwargs)
-            finally:
-                # Restaurar limite original
-                if original_limit is not None:
-                    rate_limiter.limits[category] = original_limit
+            return view_func(request, *args, **kwargs)
         
         return wrapper
     return decorator
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fhir_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkDataJob',
+            fields=[
+                ('job_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('export', 'Export'), ('import', 'Import')], max_length=10)),
+                ('status', models.CharField(max_length=20)),
+                ('data', models.JSONField(default=dict)),
+                ('lease_owner', models.CharField(blank=True, default='', max_length=200)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'fhir_bulk_data_job',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['kind', 'status', 'created_at'], name='fhir_bulk_d_kind_e90851_idx')],
+            },
+        ),
+    ]
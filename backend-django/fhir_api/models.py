@@ -11,10 +11,14 @@ from .models_task import Task
 from .models_goal import Goal, GoalTarget
 from .models_media import Media
 
+# Bulk Data ($export/$import) job store
+from .models_bulk_data import BulkDataJob
+
 __all__ = [
     'MedicationAdministration',
     'Task',
     'Goal',
     'GoalTarget',
     'Media',
+    'BulkDataJob',
 ]
@@ -0,0 +1,51 @@
+"""
+Bulk Data Job Models
+
+Estado durável dos jobs de $export/$import (FHIR Bulk Data), compartilhado
+entre workers do gunicorn e pods do Kubernetes. O worker que executa um job
+mantém um lease (lease_owner/lease_expires_at) renovado por heartbeat;
+jobs com lease vencido podem ser assumidos por outro worker.
+"""
+
+from django.db import models
+
+
+class BulkDataJob(models.Model):
+    """
+    Job de Bulk Data ($export ou $import).
+
+    O estado completo do job (ExportJob/ImportJob.to_dict()) fica em `data`;
+    status, lease e expiração ficam em colunas próprias para consultas e
+    claims atômicos.
+    """
+
+    KIND_CHOICES = [
+        ('export', 'Export'),
+        ('import', 'Import'),
+    ]
+
+    job_id = models.CharField(max_length=64, primary_key=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20)
+    data = models.JSONField(default=dict)
+
+    # Lease do worker que está executando o job
+    lease_owner = models.CharField(max_length=200, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    # Quando os arquivos de saída e o registro podem ser removidos
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'fhir_bulk_data_job'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['kind', 'status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"BulkDataJob {self.kind}/{self.job_id} ({self.status})"
@@ -18,6 +18,9 @@ import logging
 import requests
 from django.conf import settings
 
+from .drug_interactions import get_interaction_source, severity_rank
+from .terminology_service import TerminologyService
+
 logger = logging.getLogger(__name__)
 
 # Ollama configuration
@@ -278,6 +281,19 @@ Resumo clínico:"""
                 "recommendations": []
             }
         
+        # Tabela local de interações (RxCUIs): resposta determinística, sem chamar o modelo
+        table = get_interaction_source().get()
+        if table is not None:
+            found, unknown = table.check(medication_codes)
+            if not unknown:
+                return self._interaction_report(found, unknown)
+            # Medicamentos fora da tabela: a mesma checagem do TerminologyService
+            # (tabela + RxNav só para os desconhecidos); sem interações, segue para o modelo
+            merged = TerminologyService.check_multi_drug_interactions(medication_codes)
+            if merged:
+                source = "local" if len(merged) == len(found) else "local+rxnav"
+                return self._interaction_report(merged, unknown, source=source)
+        
         if self.check_ollama_health():
             prompt = f"""Você é um farmacêutico clínico. Analise possíveis interações medicamentosas entre:
 
@@ -316,3 +332,29 @@ Análise JSON:"""
                 "Revisar com farmacêutico clínico se > 5 medicações"
             ]
         }
+
+    def _interaction_report(self, found, unknown, source="local"):
+        """Resultado de check_medication_interactions a partir da tabela local (e do RxNav)."""
+        if not found:
+            return {
+                "has_interactions": False,
+                "severity": "none",
+                "interactions": [],
+                "recommendations": [],
+                "source": source
+            }
+        
+        worst = min(found, key=lambda i: severity_rank(i["severity"]))
+        recommendations = ["Revisar a prescrição com farmacêutico clínico"]
+        if unknown:
+            recommendations.append(f"Medicamentos fora da base de interações: {', '.join(sorted(unknown))}")
+        return {
+            "has_interactions": True,
+            "severity": worst["severity"].lower(),
+            "interactions": [
+                f"{i['drug1'] or i['drug1_rxcui']} + {i['drug2'] or i['drug2_rxcui']}: {i['description']}"
+                for i in found
+            ],
+            "recommendations": recommendations,
+            "source": source
+        }
@@ -1,35 +1,210 @@
 
+import contextvars
 import logging
+import threading
 from collections import Counter
-from datetime import datetime, date
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
 
+from django.conf import settings
+from django.utils import timezone
+
+from .analytics_store import (
+    AGE_BANDS,
+    OPD_CLASS_CODES,
+    TRACKED_RESOURCES,
+    AnalyticsStore,
+    age_band,
+    fact_update,
+    get_analytics_store,
+    history_update,
+    resource_facts,
+)
+from .cache_service import CacheService, cache_service
 from .fhir_core import FHIRService
 
 logger = logging.getLogger(__name__)
 
+
+def years_before(day: date, years: int) -> date:
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:  # 29/02 em ano não bissexto
+        return day.replace(year=day.year - years, day=28)
+
+
+def last_days(today: date, days: int = 7) -> List[str]:
+    return [(today - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+
+
+class AnalyticsQueryPlanner:
+    """
+    Calcula os contadores do analytics no próprio servidor FHIR, sem baixar
+    recursos inteiros (usado enquanto o analytics store não está pronto).
+
+    - Totais e buckets de valores conhecidos (gênero, faixa etária, status
+      do atendimento, atendimentos por dia, OPD) viram consultas
+      `_summary=count`, todas executadas em paralelo: contagens exatas.
+      Atendimentos por dia contam pela data de início (period.start), como
+      o store: `date=lt` casa pelo início do período, então o dia d é
+      count(lt d+1) - count(lt d); `date=ge&date=lt` contaria também os
+      atendimentos que só atravessam o dia.
+    - Buckets abertos (códigos de condição, tipos de atendimento,
+      categorias cirúrgicas) não têm agregação no FHIR: são calculados
+      sobre os recursos mais recentes baixados só com os elementos usados
+      (`_elements`), até PROJECTION_LIMITS.
+    """
+
+    GENDERS = ("male", "female", "other", "unknown")
+    ENCOUNTER_STATUSES = (
+        "planned", "arrived", "triaged", "in-progress", "onleave",
+        "finished", "cancelled", "entered-in-error", "unknown",
+    )
+    # Contadores calculados por projeção (amostra) e tamanho da amostra
+    PROJECTED = {
+        "Condition": ("condition",),
+        "Encounter": ("type",),
+        "ServiceRequest": ("operations",),
+    }
+    PROJECTION_LIMITS = {"Condition": 1000, "Encounter": 500, "ServiceRequest": 100}
+
+    _executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, 'ANALYTICS_QUERY_WORKERS', 8),
+        thread_name_prefix='analytics-query',
+    )
+
+    def __init__(self, fhir: FHIRService, fetch: Callable[..., List[Dict[str, Any]]]):
+        self.fhir = fhir
+        self.fetch = fetch
+
+    def count_queries(
+        self, resource_type: str, name: str, today: date
+    ) -> Dict[str, List[Tuple[Dict[str, Any], int]]]:
+        """Consultas de contagem de um contador: {chave do bucket: [(params, peso)]}, somadas."""
+        if name == "total":
+            return {"": [({}, 1)]}
+        if resource_type == "Patient" and name == "gender":
+            queries = {gender: [({"gender": gender}, 1)] for gender in self.GENDERS}
+            queries["unknown"].append(({"gender:missing": "true"}, 1))
+            return queries
+        if resource_type == "Patient" and name == "age":
+            queries = {}
+            lower = 0
+            for band, upper in AGE_BANDS:
+                # idade >= lower  <=>  nascido até hoje - lower anos
+                params = {"birthdate": [f"le{years_before(today, lower).isoformat()}"]}
+                if upper is not None:
+                    params["birthdate"].append(f"gt{years_before(today, upper + 1).isoformat()}")
+                    lower = upper + 1
+                queries[band] = [(params, 1)]
+            return queries
+        if resource_type == "Encounter" and name == "status":
+            return {status: [({"status": status}, 1)] for status in self.ENCOUNTER_STATUSES}
+        if resource_type == "Encounter" and name == "day":
+            # Início no dia d  <=>  início antes de d+1 e não antes de d
+            return {
+                day: [
+                    ({"date": f"lt{(date.fromisoformat(day) + timedelta(days=1)).isoformat()}"}, 1),
+                    ({"date": f"lt{day}"}, -1),
+                ]
+                for day in last_days(today)
+            }
+        if resource_type == "Encounter" and name == "opd":
+            return {"": [({"class": ",".join(OPD_CLASS_CODES)}, 1)]}
+        return {}
+
+    def counters(self, wanted: Dict[str, Tuple[str, ...]]) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """Contadores por tipo de recurso, no formato do analytics store."""
+        today = date.today()
+        tasks = []
+        for resource_type, names in wanted.items():
+            projected = [n for n in names if n in self.PROJECTED.get(resource_type, ())]
+            if projected:
+                tasks.append((resource_type, None, None, projected, 1))
+            for name in names:
+                if name in projected:
+                    continue
+                for key, queries in self.count_queries(resource_type, name, today).items():
+                    for params, weight in queries:
+                        tasks.append((resource_type, name, key, params, weight))
+
+        # Mantém as chamadas no trace da requisição (Server-Timing)
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, self._run, task) for task in tasks
+        ]
+
+        result: Dict[str, Dict[str, Dict[str, int]]] = {resource_type: {} for resource_type in wanted}
+        for (resource_type, name, key, _, weight), future in zip(tasks, futures):
+            counters = result[resource_type]
+            if name is None:
+                for counter, buckets in future.result().items():
+                    counters[counter] = buckets
+                continue
+            value = future.result()
+            buckets = counters.setdefault(name, {})
+            buckets[key] = buckets.get(key, 0) + weight * value
+        for counters in result.values():
+            for name, buckets in counters.items():
+                # Diferenças de contagens feitas em paralelo com escritas podem ficar negativas
+                counters[name] = {key: count for key, count in buckets.items() if count > 0 or key == ""}
+        return result
+
+    def _run(self, task: Tuple) -> Any:
+        """Uma contagem (params) ou uma projeção (nomes dos contadores)."""
+        resource_type, name, _key, arg, _weight = task
+        if name is not None:
+            return self.fhir.get_total_count(resource_type, arg)
+
+        limit = self.PROJECTION_LIMITS.get(resource_type, 500)
+        totals = Counter()
+        for resource in self.fetch(resource_type, limit=limit, elements=TRACKED_RESOURCES[resource_type][1]):
+            totals.update(resource_facts(resource_type, resource))
+        grouped = AnalyticsStore._group(dict(totals))
+        return {counter: grouped.get(counter, {}) for counter in arg}
+
+
 class AnalyticsService:
     """
     Serviço responsável por agregar dados do servidor FHIR
     para gerar indicadores gerenciais e clínicos.
+
+    Os indicadores de população, condições, atendimentos e KPIs são lidos
+    dos contadores materializados (analytics_store), que cobrem toda a base.
+    Enquanto o primeiro sync não terminou, são calculados no servidor FHIR
+    pelo AnalyticsQueryPlanner (contagens `_summary=count` e projeções).
     """
 
+    # Sync dos contadores: tamanho de página, idade máxima antes de um
+    # catch-up em background (0 = só via `manage.py analytics_sync`)
+    SYNC_PAGE_SIZE = getattr(settings, 'ANALYTICS_SYNC_PAGE_SIZE', 500)
+    SYNC_INTERVAL = getattr(settings, 'ANALYTICS_SYNC_INTERVAL', 300)
+    SYNC_LOCK_TIMEOUT = 600
+    _sync_guard = threading.Lock()
+    _sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analytics-sync')
+
     def __init__(self):
         self.fhir = FHIRService()
         # Reutiliza a sessão e URL do FHIRService
         self.session = self.fhir.session
         self.base_url = self.fhir.base_url
         self.timeout = self.fhir.timeout
+        self.planner = AnalyticsQueryPlanner(self.fhir, self._fetch_all_resources)
 
-    def _fetch_all_resources(self, resource_type: str, limit: int = 500) -> List[Dict[str, Any]]:
+    def _fetch_all_resources(
+        self, resource_type: str, limit: int = 500, elements: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
         """
-        Busca recursos do FHIR (limite configurável para evitar timeout em demo).
-        Em produção, usaria paginação iterativa.
+        Busca os `limit` recursos mais recentes do FHIR (amostra).
+        Com `elements`, o servidor devolve só esses elementos (_elements).
         """
+        params = {"_count": limit, "_sort": "-_lastUpdated"}
+        if elements:
+            params["_elements"] = elements
         try:
             response = self.session.get(
                 f"{self.base_url}/{resource_type}",
-                params={"_count": limit, "_sort": "-_lastUpdated"},
+                params=params,
                 timeout=self.timeout
             )
             response.raise_for_status()
@@ -46,51 +221,175 @@ class AnalyticsService:
             logger.error(f"Analytics: Falha ao buscar {resource_type}: {e}")
             return []
 
+    # =========================================================================
+    # Materialised counters (analytics_store)
+    # =========================================================================
+
+    def sync(self, resource_types: Optional[Iterable[str]] = None, full: bool = False) -> Dict[str, int]:
+        """
+        Atualiza os contadores materializados a partir do servidor FHIR.
+
+        Na primeira vez (ou com full=True) busca todos os recursos do tipo por
+        `_lastUpdated`, página a página, só com os elementos usados pelos
+        contadores; o cursor é salvo a cada página, então um sync interrompido
+        continua de onde parou. Depois disso o catch-up lê o histórico do tipo
+        a partir do cursor (`Type/_history?_since=`), que ao contrário da busca
+        também traz as exclusões. Não há rebuild periódico: `--full` no
+        `manage.py analytics_sync` fica para recuperar um store perdido.
+
+        Returns:
+            Dict tipo de recurso -> recursos cuja contribuição mudou
+        """
+        store = get_analytics_store()
+        applied = {}
+        for resource_type in resource_types or TRACKED_RESOURCES:
+            applied[resource_type] = self._sync_resource(store, resource_type, full)
+        return applied
+
+    def _sync_resource(self, store: AnalyticsStore, resource_type: str, full: bool) -> int:
+        if full:
+            store.reset(resource_type)
+        state = store.get_state(resource_type)
+        started = timezone.now().isoformat()
+
+        if state.get("synced_at") and state.get("cursor"):
+            applied = self._sync_history(store, resource_type, state["cursor"])
+        else:
+            params = {
+                "_sort": "_lastUpdated",
+                "_count": self.SYNC_PAGE_SIZE,
+                "_elements": TRACKED_RESOURCES[resource_type][1],
+            }
+            if state.get("cursor"):
+                # Build interrompido: ge reaplica os recursos do instante do cursor (no-op)
+                params["_lastUpdated"] = f"ge{state['cursor']}"
+
+            applied = 0
+            for bundle in self.fhir.iter_pages(resource_type, params):
+                resources = [entry["resource"] for entry in bundle.get("entry", []) if "resource" in entry]
+                updates = [u for u in (fact_update(resource_type, r) for r in resources) if u]
+                applied += store.apply_many(resource_type, updates)
+                cursor = next(
+                    (r["meta"]["lastUpdated"] for r in reversed(resources)
+                     if (r.get("meta") or {}).get("lastUpdated")),
+                    None,
+                )
+                if cursor:
+                    store.set_state(resource_type, cursor=cursor)
+
+        store.set_state(resource_type, synced_at=started)
+        logger.info(f"Analytics sync {resource_type}: {applied} resources updated")
+        return applied
+
+    def _sync_history(self, store: AnalyticsStore, resource_type: str, since: str) -> int:
+        """
+        Catch-up pelo histórico do tipo a partir do cursor (inclusive).
+
+        O histórico vem do mais novo para o mais antigo e pode trazer várias
+        versões do mesmo recurso (inclusive a exclusão seguida de recriação):
+        só a versão mais nova de cada recurso é aplicada, ao final, junto com
+        o novo cursor. Um catch-up interrompido recomeça do cursor anterior.
+        """
+        params = {"_since": since, "_count": self.SYNC_PAGE_SIZE}
+        latest = {}
+        cursor = since
+        for bundle in self.fhir.iter_pages(f"{resource_type}/_history", params):
+            for entry in bundle.get("entry", []):
+                update = history_update(resource_type, entry)
+                if update is None:
+                    continue
+                latest.setdefault(update[0], update)
+                updated = (
+                    ((entry.get("resource") or {}).get("meta") or {}).get("lastUpdated")
+                    or (entry.get("response") or {}).get("lastModified")
+                )
+                if updated and updated > cursor:
+                    cursor = updated
+
+        applied = store.apply_many(resource_type, latest.values())
+        store.set_state(resource_type, cursor=cursor)
+        return applied
+
+    @classmethod
+    def _schedule_sync(cls) -> None:
+        """Agenda um sync em background (um por processo; um por vez entre workers)."""
+        if cls.SYNC_INTERVAL <= 0 or not cls._sync_guard.acquire(blocking=False):
+            return
+
+        def run():
+            lock_name = f"{CacheService.PREFIX_LOCK}:analytics-sync"
+            token = cache_service.backend.acquire_lock(lock_name, cls.SYNC_LOCK_TIMEOUT * 1000)
+            try:
+                if token:
+                    cls().sync()
+            except Exception as e:
+                logger.error(f"Analytics: background sync failed: {e}")
+            finally:
+                if token:
+                    cache_service.backend.release_lock(lock_name, token)
+                cls._sync_guard.release()
+
+        cls._sync_executor.submit(run)
+
+    def _materialized(self, resource_type: str) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        Contadores do store, ou None enquanto o primeiro sync do tipo não
+        terminou. Contadores mais velhos que SYNC_INTERVAL disparam um sync
+        em background e continuam sendo servidos.
+        """
+        try:
+            store = get_analytics_store()
+            synced_at = store.get_state(resource_type).get("synced_at")
+            if not synced_at:
+                self._schedule_sync()
+                return None
+            age = (timezone.now() - datetime.fromisoformat(synced_at)).total_seconds()
+            if age > self.SYNC_INTERVAL:
+                self._schedule_sync()
+            return store.counters(resource_type)
+        except Exception as e:
+            logger.error(f"Analytics: store indisponível para {resource_type}: {e}")
+            return None
+
+    def _counters(self, wanted: Dict[str, Tuple[str, ...]]) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """
+        Contadores por tipo de recurso ({tipo: nomes dos contadores usados}):
+        materializados quando disponíveis; os tipos ainda sem sync são
+        resolvidos pelo planner numa única rodada de consultas paralelas.
+        """
+        result = {}
+        planned = {}
+        for resource_type, names in wanted.items():
+            counters = self._materialized(resource_type)
+            if counters is None:
+                planned[resource_type] = names
+            else:
+                result[resource_type] = counters
+        if planned:
+            result.update(self.planner.counters(planned))
+        return result
+
+    @staticmethod
+    def _total(counters: Dict[str, Dict[str, int]], name: str = "total") -> int:
+        return counters.get(name, {}).get("", 0)
+
     def get_population_demographics(self) -> Dict[str, Any]:
         """
         Gera métricas de pirâmide etária e gênero.
         """
-        patients = self._fetch_all_resources("Patient", limit=1000)
-        
-        gender_dist = Counter()
-        age_groups = {
-            "0-12": 0,
-            "13-18": 0,
-            "19-30": 0,
-            "31-50": 0,
-            "51-70": 0,
-            "71+": 0
-        }
-        
-        today = date.today()
-        
-        for p in patients:
-            # Gênero
-            g = p.get("gender", "unknown")
-            gender_dist[g] += 1
-            
-            # Idade
-            birth_date_str = p.get("birthDate")
-            if birth_date_str:
-                try:
-                    # Tenta parsing simples YYYY-MM-DD
-                    bd = datetime.strptime(birth_date_str[:10], "%Y-%m-%d").date()
-                    age = today.year - bd.year - ((today.month, today.day) < (bd.month, bd.day))
-                    
-                    if age <= 12: age_groups["0-12"] += 1
-                    elif age <= 18: age_groups["13-18"] += 1
-                    elif age <= 30: age_groups["19-30"] += 1
-                    elif age <= 50: age_groups["31-50"] += 1
-                    elif age <= 70: age_groups["51-70"] += 1
-                    else: age_groups["71+"] += 1
-                except (ValueError, AttributeError, TypeError) as e:
-                    # Invalid birthDate format or missing field
-                    logger.debug(f"Invalid birthDate in patient demographics: {e}")
-                    pass
+        counters = self._counters({"Patient": ("total", "gender", "age")})["Patient"]
+
+        age_groups = {band: 0 for band, _ in AGE_BANDS}
+        if "age" in counters:
+            age_groups.update(counters["age"])
+        else:
+            today = date.today()
+            for birth_date, count in counters.get("birth_date", {}).items():
+                age_groups[age_band(date.fromisoformat(birth_date), today)] += count
 
         return {
-            "total_patients": len(patients),
-            "gender_distribution": dict(gender_dist),
+            "total_patients": self._total(counters),
+            "gender_distribution": counters.get("gender", {}),
             "age_distribution": age_groups
         }
 
@@ -98,22 +397,13 @@ class AnalyticsService:
         """
         Gera métricas de condições mais frequentes.
         """
-        conditions = self._fetch_all_resources("Condition", limit=1000)
-        
-        condition_counter = Counter()
-        
-        for c in conditions:
-            code_entry = {}
-            if c.get("code") and c.get("code").get("coding"):
-                code_entry = c["code"]["coding"][0]
-            
-            display = code_entry.get("display") or code_entry.get("code") or "Desconhecido"
-            condition_counter[display] += 1
-            
+        counters = self._counters({"Condition": ("total", "condition")})["Condition"]
+        condition_counter = Counter(counters.get("condition", {}))
+
         top_5 = [{"name": k, "value": v} for k, v in condition_counter.most_common(5)]
-        
+
         return {
-            "total_conditions": len(conditions),
+            "total_conditions": self._total(counters),
             "top_conditions": top_5
         }
 
@@ -122,31 +412,14 @@ class AnalyticsService:
         Gera métricas de operação (ex: Atendimentos e Agendamentos).
         OBS: Usaremos Appointment se disponível, ou Encounter como proxy.
         """
-        # Para simplificar, vamos analisar Encounters (Atendimentos Realizados)
-        encounters = self._fetch_all_resources("Encounter", limit=500)
-        
-        # Agrupar por status
-        status_dist = Counter()
-        type_dist = Counter()
-        
-        dates_counter = Counter() # Atendimentos por dia (últimos 7 dias seria ideal)
-        
-        for e in encounters:
-            status_dist[e.get("status", "unknown")] += 1
-            
-            # Tipo
-            types = e.get("type", [])
-            t = "N/A"
-            if types and len(types) > 0 and types[0].get("coding"):
-                coding = types[0]["coding"]
-                if len(coding) > 0:
-                    t = coding[0].get("code", "N/A")
-            
-            type_dist[t] += 1
-                
+        # Encounters (Atendimentos Realizados): status, tipo e atendimentos por dia
+        counters = self._counters({"Encounter": ("status", "type", "day")})["Encounter"]
+
+        days = counters.get("day", {})
         return {
-            "status_distribution": dict(status_dist),
-            "type_distribution": dict(type_dist)
+            "status_distribution": counters.get("status", {}),
+            "type_distribution": counters.get("type", {}),
+            "daily_encounters": {day: days.get(day, 0) for day in last_days(date.today())}
         }
 
     def get_kpi_summary(self) -> Dict[str, Any]:
@@ -154,69 +427,34 @@ class AnalyticsService:
         Gera os KPIs específicos do 'Medical Template'.
         Puxa dados reais do FHIR.
         """
-        print("=== DEBUG: get_kpi_summary NOVO CODIGO v3 ===")  # Debug
-        
+        counters = self._counters({
+            "Patient": ("total",),
+            # Encounters com class AMB/EMER/HH (ou in-progress/finished sem class)
+            "Encounter": ("opd",),
+            # ServiceRequest com categoria cirúrgica, mais as ordens (intent=order) ativas/concluídas
+            "ServiceRequest": ("operations",),
+        })
+
         # 1. New Patients (Total Pacientes)
-        total_patients = len(self._fetch_all_resources("Patient", limit=1000))
-        print(f"DEBUG: total_patients = {total_patients}")
-        
+        total_patients = self._total(counters["Patient"])
+
         # 2. OPD Patients (Outpatient Department - Ambulatorial)
-        # Use Encounters with class = 'AMB' (ambulatory) or type = outpatient
-        encounters = self._fetch_all_resources("Encounter", limit=500)
-        print(f"DEBUG: encounters fetched = {len(encounters)}")
-        
-        # Filter for ambulatory encounters (class.code = 'AMB' or status = 'in-progress', 'finished')
-        opd_count = 0
-        for enc in encounters:
-            enc_class = enc.get("class", {})
-            if isinstance(enc_class, dict):
-                class_code = enc_class.get("code", "")
-                if class_code in ["AMB", "EMER", "HH"]:  # Ambulatory, Emergency, Home Health
-                    opd_count += 1
-            elif enc.get("status") in ["in-progress", "finished"]:
-                opd_count += 1
-                
-        print(f"DEBUG: opd_count = {opd_count}")
-        
+        opd_count = self._total(counters["Encounter"], "opd")
+
         # 3. Operations (Cirurgias)
-        # Use ServiceRequest with category = 387713003 (Surgical procedure) or intent = order
-        service_requests = self._fetch_all_resources("ServiceRequest", limit=100)
-        print(f"DEBUG: service_requests fetched = {len(service_requests)}")
-        
-        # Filter for surgical procedures
-        surgeries_count = 0
-        for sr in service_requests:
-            # Check category for surgical codes
-            categories = sr.get("category", [])
-            for cat in categories:
-                codings = cat.get("coding", [])
-                for coding in codings:
-                    code = coding.get("code", "")
-                    display = coding.get("display", "").lower()
-                    if "surgery" in display or "surgical" in display or "cirurgia" in display:
-                        surgeries_count += 1
-                        break
-                else:
-                    continue
-                break
-            
-            # Also count if intent is 'order' and status is active
-            if sr.get("intent") == "order" and sr.get("status") in ["active", "completed"]:
-                surgeries_count += 1
-                
-        print(f"DEBUG: surgeries_count = {surgeries_count}")
-        
+        surgeries_count = self._total(counters["ServiceRequest"], "operations")
+
         # 4. Visitors
         # Estimate based on patient count
         visitors_count = int(total_patients * 2.5)
-        
+
         result = {
             "new_patients": total_patients,
             "opd_patients": opd_count,
             "todays_operations": surgeries_count,
             "visitors": visitors_count
         }
-        print(f"DEBUG: returning = {result}")
+        logger.debug(f"Analytics KPIs: {result}")
         return result
 
     def get_hospital_survey_data(self) -> Dict[str, Any]:
@@ -0,0 +1,396 @@
+"""
+Analytics Store
+
+Materialised counters behind the analytics dashboards (AnalyticsService),
+so a dashboard read costs a handful of hash reads instead of downloading
+resources from HAPI.
+
+Each tracked resource contributes a small set of facts (``counter:key`` ->
+weight, e.g. ``gender:female`` -> 1). The store keeps the facts last
+applied per resource together with its versionId, so applying a resource
+again moves its contribution from the old facts to the new ones:
+- writes made through FHIRService are applied as they happen (response hook)
+- AnalyticsService.sync() builds the counters with a `_lastUpdated` search
+  and then catches up from `Type/_history?_since=` (writes and deletes made
+  elsewhere, bundle transactions); replays are no-ops
+- older versions never overwrite newer ones
+
+Backends:
+- InMemoryAnalyticsStore: process-local (tests, local dev)
+- RedisAnalyticsStore: shared by every worker (ANALYTICS_STORE=redis)
+"""
+
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+Facts = Dict[str, int]
+# (resource id, facts or None to remove, versionId)
+FactUpdate = Tuple[str, Optional[Facts], Optional[int]]
+
+
+# =============================================================================
+# Facts per resource type
+# =============================================================================
+
+AGE_BANDS: List[Tuple[str, Optional[int]]] = [
+    ("0-12", 12),
+    ("13-18", 18),
+    ("19-30", 30),
+    ("31-50", 50),
+    ("51-70", 70),
+    ("71+", None),
+]
+
+OPD_CLASS_CODES = ("AMB", "EMER", "HH")  # Ambulatorial, Emergência, Home Health
+SURGICAL_TERMS = ("surgery", "surgical", "cirurgia")
+
+
+def _fact(counter: str, key: Any = "") -> str:
+    # Separadores do encoding do Redis não podem aparecer na chave
+    return f"{counter}:{str(key).replace(chr(9), ' ').replace(chr(10), ' ')}"
+
+
+def _first_coding(concept: Any) -> Dict[str, Any]:
+    if isinstance(concept, dict) and concept.get("coding"):
+        return concept["coding"][0] or {}
+    return {}
+
+
+def age_band(birth_date: date, today: date) -> str:
+    age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+    for band, upper in AGE_BANDS:
+        if upper is None or age <= upper:
+            return band
+    return AGE_BANDS[-1][0]
+
+
+def patient_facts(patient: Dict[str, Any]) -> Facts:
+    facts = {_fact("total"): 1, _fact("gender", patient.get("gender", "unknown")): 1}
+    birth_date = patient.get("birthDate")
+    if birth_date:
+        try:
+            # Idade muda com o tempo: guarda a data, a faixa etária é calculada na leitura
+            parsed = datetime.strptime(birth_date[:10], "%Y-%m-%d").date()
+            facts[_fact("birth_date", parsed.isoformat())] = 1
+        except (ValueError, TypeError):
+            logger.debug(f"Invalid birthDate in patient {patient.get('id')}: {birth_date}")
+    return facts
+
+
+def condition_facts(condition: Dict[str, Any]) -> Facts:
+    coding = _first_coding(condition.get("code"))
+    display = coding.get("display") or coding.get("code") or "Desconhecido"
+    return {_fact("total"): 1, _fact("condition", display): 1}
+
+
+def encounter_facts(encounter: Dict[str, Any]) -> Facts:
+    facts = {_fact("total"): 1, _fact("status", encounter.get("status", "unknown")): 1}
+
+    types = encounter.get("type") or []
+    coding = _first_coding(types[0]) if types else {}
+    facts[_fact("type", coding.get("code", "N/A"))] = 1
+
+    start = (encounter.get("period") or {}).get("start")
+    if start:
+        facts[_fact("day", start[:10])] = 1
+
+    enc_class = encounter.get("class", {})
+    if isinstance(enc_class, dict):
+        is_opd = enc_class.get("code", "") in OPD_CLASS_CODES
+    else:
+        is_opd = encounter.get("status") in ("in-progress", "finished")
+    if is_opd:
+        facts[_fact("opd")] = 1
+    return facts
+
+
+def service_request_facts(service_request: Dict[str, Any]) -> Facts:
+    operations = 0
+    for category in service_request.get("category", []):
+        if any(
+            term in (coding.get("display") or "").lower()
+            for coding in category.get("coding", [])
+            for term in SURGICAL_TERMS
+        ):
+            operations += 1
+            break
+    if service_request.get("intent") == "order" and service_request.get("status") in ("active", "completed"):
+        operations += 1
+
+    facts = {_fact("total"): 1}
+    if operations:
+        facts[_fact("operations")] = operations
+    return facts
+
+
+# Tipos de recurso materializados, com os elementos que os fatos usam
+TRACKED_RESOURCES = {
+    "Patient": (patient_facts, "gender,birthDate"),
+    "Condition": (condition_facts, "code"),
+    "Encounter": (encounter_facts, "status,type,class,period"),
+    "ServiceRequest": (service_request_facts, "category,intent,status"),
+}
+
+
+def resource_facts(resource_type: str, resource: Dict[str, Any]) -> Optional[Facts]:
+    """Facts of a resource, or None if its type is not tracked."""
+    tracked = TRACKED_RESOURCES.get(resource_type)
+    return tracked[0](resource) if tracked else None
+
+
+def resource_version(resource: Dict[str, Any]) -> Optional[int]:
+    version_id = (resource.get("meta") or {}).get("versionId")
+    try:
+        return int(version_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def fact_update(resource_type: str, resource: Dict[str, Any]) -> Optional[FactUpdate]:
+    """(id, facts, version) to apply for a resource as returned by the server."""
+    if resource.get("resourceType") != resource_type or not resource.get("id"):
+        return None
+    facts = resource_facts(resource_type, resource)
+    if facts is None:
+        return None
+    return resource["id"], facts, resource_version(resource)
+
+
+def history_update(resource_type: str, entry: Dict[str, Any]) -> Optional[FactUpdate]:
+    """(id, facts, version) to apply for an entry of a `_history` Bundle (DELETE removes)."""
+    request = entry.get("request") or {}
+    if request.get("method") == "DELETE":
+        # Patient/7 ou Patient/7/_history/3
+        parts = (request.get("url") or "").split("?")[0].strip("/").split("/")
+        if len(parts) < 2 or parts[0] != resource_type or not parts[1]:
+            return None
+        version = parts[3] if len(parts) > 3 and parts[2] == "_history" else None
+        return parts[1], None, resource_version({"meta": {"versionId": version}})
+    resource = entry.get("resource")
+    return fact_update(resource_type, resource) if resource else None
+
+
+# =============================================================================
+# Stores
+# =============================================================================
+
+class AnalyticsStore:
+    """Abstract analytics store interface."""
+
+    def apply_many(self, resource_type: str, updates: Iterable[FactUpdate]) -> int:
+        """
+        Apply resource facts (None removes the resource). An update with a
+        versionId lower than the stored one is ignored. Returns the number
+        of resources whose contribution changed.
+        """
+        raise NotImplementedError
+
+    def apply(self, resource_type: str, resource_id: str, facts: Optional[Facts],
+              version: Optional[int] = None) -> bool:
+        return self.apply_many(resource_type, [(resource_id, facts, version)]) > 0
+
+    def counters(self, resource_type: str) -> Dict[str, Dict[str, int]]:
+        """Counters of a resource type: {counter: {key: count}}."""
+        raise NotImplementedError
+
+    def get_state(self, resource_type: str) -> Dict[str, str]:
+        """Sync state of a resource type (cursor, synced_at)."""
+        raise NotImplementedError
+
+    def set_state(self, resource_type: str, **state: str) -> None:
+        raise NotImplementedError
+
+    def reset(self, resource_type: str) -> None:
+        """Drop every counter, fact and sync state of a resource type."""
+        raise NotImplementedError
+
+    def is_ready(self, resource_type: str) -> bool:
+        """True once a full sync of the resource type has completed."""
+        return bool(self.get_state(resource_type).get("synced_at"))
+
+    @staticmethod
+    def _group(fields: Dict[str, int]) -> Dict[str, Dict[str, int]]:
+        grouped: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for field, count in fields.items():
+            counter, _, key = field.partition(":")
+            if count > 0:
+                grouped[counter][key] = count
+        return dict(grouped)
+
+
+class InMemoryAnalyticsStore(AnalyticsStore):
+    """Process-local analytics store (not shared between workers)."""
+
+    def __init__(self):
+        self._facts: Dict[str, Dict[str, Tuple[Optional[int], Facts]]] = defaultdict(dict)
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._state: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def apply_many(self, resource_type, updates):
+        changed = 0
+        with self._lock:
+            facts_by_id = self._facts[resource_type]
+            counters = self._counters[resource_type]
+            for resource_id, facts, version in updates:
+                old = facts_by_id.get(resource_id)
+                if old is not None:
+                    old_version, old_facts = old
+                    if facts is not None and version is not None and old_version is not None and version < old_version:
+                        continue
+                    if (version, facts) == old:
+                        continue
+                    for field, weight in old_facts.items():
+                        counters[field] -= weight
+                        if counters[field] <= 0:
+                            del counters[field]
+                elif facts is None:
+                    continue
+                if facts is None:
+                    del facts_by_id[resource_id]
+                else:
+                    for field, weight in facts.items():
+                        counters[field] += weight
+                    facts_by_id[resource_id] = (version, dict(facts))
+                changed += 1
+        return changed
+
+    def counters(self, resource_type):
+        with self._lock:
+            return self._group(dict(self._counters[resource_type]))
+
+    def get_state(self, resource_type):
+        with self._lock:
+            return dict(self._state[resource_type])
+
+    def set_state(self, resource_type, **state):
+        with self._lock:
+            self._state[resource_type].update(state)
+
+    def reset(self, resource_type):
+        with self._lock:
+            self._facts.pop(resource_type, None)
+            self._counters.pop(resource_type, None)
+            self._state.pop(resource_type, None)
+
+
+class RedisAnalyticsStore(AnalyticsStore):
+    """
+    Analytics store backed by Redis.
+
+    Keys:
+        analytics:{type}:facts     hash id -> "version\\nfield\\tweight..."
+        analytics:{type}:counters  hash field -> count
+        analytics:{type}:state     hash (cursor, synced_at)
+    """
+
+    # KEYS[1] = facts, KEYS[2] = counters; ARGV[1] = id, ARGV[2] = encoded
+    # facts ('' removes), ARGV[3] = version ('' unknown). Returns 1 if changed.
+    _APPLY_SCRIPT = """
+    local old = redis.call('hget', KEYS[1], ARGV[1])
+    if old == ARGV[2] or (not old and ARGV[2] == '') then return 0 end
+    if old then
+        local old_version = tonumber(string.match(old, '^(%d+)\\n'))
+        if ARGV[2] ~= '' and ARGV[3] ~= '' and old_version and tonumber(ARGV[3]) < old_version then
+            return 0
+        end
+        for field, weight in string.gmatch(old, '\\n([^\\t\\n]*)\\t(%-?%d+)') do
+            if redis.call('hincrby', KEYS[2], field, -tonumber(weight)) <= 0 then
+                redis.call('hdel', KEYS[2], field)
+            end
+        end
+    end
+    if ARGV[2] == '' then
+        redis.call('hdel', KEYS[1], ARGV[1])
+        return 1
+    end
+    for field, weight in string.gmatch(ARGV[2], '\\n([^\\t\\n]*)\\t(%-?%d+)') do
+        redis.call('hincrby', KEYS[2], field, weight)
+    end
+    redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+    return 1
+    """
+
+    def __init__(self, url: Optional[str] = None, prefix: str = "analytics"):
+        self.url = url or getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.from_url(self.url, decode_responses=True)
+        self.prefix = prefix
+        self._apply = self.client.register_script(self._APPLY_SCRIPT)
+
+    def _key(self, resource_type: str, name: str) -> str:
+        return f"{self.prefix}:{resource_type}:{name}"
+
+    @staticmethod
+    def _encode(facts: Optional[Facts], version: Optional[int]) -> str:
+        if facts is None:
+            return ""
+        header = "" if version is None else str(version)
+        return header + "".join(f"\n{field}\t{int(weight)}" for field, weight in sorted(facts.items()))
+
+    def apply_many(self, resource_type, updates):
+        keys = [self._key(resource_type, "facts"), self._key(resource_type, "counters")]
+        pipe = self.client.pipeline(transaction=False)
+        queued = 0
+        for resource_id, facts, version in updates:
+            self._apply(keys=keys, args=[resource_id, self._encode(facts, version), "" if version is None else version],
+                        client=pipe)
+            queued += 1
+        return sum(int(r) for r in pipe.execute()) if queued else 0
+
+    def counters(self, resource_type):
+        fields = self.client.hgetall(self._key(resource_type, "counters"))
+        return self._group({field: int(count) for field, count in fields.items()})
+
+    def get_state(self, resource_type):
+        return self.client.hgetall(self._key(resource_type, "state"))
+
+    def set_state(self, resource_type, **state):
+        self.client.hset(self._key(resource_type, "state"), mapping=state)
+
+    def reset(self, resource_type):
+        self.client.delete(*(self._key(resource_type, name) for name in ("facts", "counters", "state")))
+
+
+_analytics_store: Optional[AnalyticsStore] = None
+_analytics_store_lock = threading.Lock()
+
+
+def get_analytics_store() -> AnalyticsStore:
+    """Return the configured analytics store (ANALYTICS_STORE: memory | redis)."""
+    global _analytics_store
+    if _analytics_store is None:
+        with _analytics_store_lock:
+            if _analytics_store is None:
+                backend = getattr(settings, 'ANALYTICS_STORE', 'memory')
+                store = None
+                if backend == 'redis' and REDIS_AVAILABLE:
+                    try:
+                        store = RedisAnalyticsStore()
+                        store.client.ping()
+                    except Exception as e:
+                        logger.warning(f"Redis analytics store unavailable ({e}), using in-memory store")
+                        store = None
+                _analytics_store = store or InMemoryAnalyticsStore()
+                logger.info(f"Analytics store: {type(_analytics_store).__name__}")
+    return _analytics_store
+
+
+def set_analytics_store(store: Optional[AnalyticsStore]) -> None:
+    """Replace the analytics store (tests)."""
+    global _analytics_store
+    with _analytics_store_lock:
+        _analytics_store = store
@@ -3,25 +3,37 @@ Sprint 22: FHIR Bulk Data Export Service
 
 Implements the FHIR Bulk Data Access (Flat FHIR) specification:
 - $export operation at Patient, Group, and System levels
-- NDJSON (Newline Delimited JSON) format
-- Async processing with job status tracking
-- $import operation for bulk data loading
+- NDJSON (Newline Delimited JSON) format, optionally gzip-compressed and
+  split into size-capped files
+- Async processing with job status tracking in a durable job store
+  (database or Redis) shared by all workers, with lease-based claiming
+- $import operation for bulk data loading (streaming, batched, resumable)
 
 Reference: https://hl7.org/fhir/uv/bulkdata/
 """
 
+import gzip
+import io
 import json
 import logging
 import os
+import shutil
+import time
 import uuid
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from enum import Enum
 from dataclasses import dataclass, field, asdict
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from urllib3.exceptions import ConnectTimeoutError
 
 from .fhir_core import FHIRService, FHIRServiceException
+from .job_store import WORKER_ID, LeaseKeeper, get_job_store
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +41,17 @@ logger = logging.getLogger(__name__)
 EXPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'exports')
 os.makedirs(EXPORT_DIR, exist_ok=True)
 
+# Directory for import spool files and checkpoints (outside the package, see BULK_IMPORT_DIR)
+IMPORT_DIR = getattr(settings, 'BULK_IMPORT_DIR', os.path.join(settings.BASE_DIR, 'imports'))
+
+# How long job records and their files are kept after the job ends
+JOB_RETENTION = timedelta(hours=getattr(settings, 'BULK_JOB_RETENTION_HOURS', 24))
+JOB_LEASE_SECONDS = getattr(settings, 'BULK_JOB_LEASE_SECONDS', 60)
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
 
 class ExportStatus(Enum):
     """Status of an export job."""
@@ -63,6 +86,14 @@ class ExportJob:
     completed_time: Optional[datetime] = None
     progress: int = 0
     total_resources: int = 0
+    # Output settings
+    compress: bool = False
+    max_file_bytes: Optional[int] = None  # Uncompressed bytes per file (None = unlimited)
+    # Per-type progress
+    resource_counts: Dict[str, int] = field(default_factory=dict)
+    types_completed: int = 0
+    errors: List[Dict[str, str]] = field(default_factory=list)
+    expires_time: Optional[datetime] = None
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization."""
@@ -80,11 +111,265 @@ class ExportJob:
             "error_message": self.error_message,
             "completed_time": self.completed_time.isoformat() if self.completed_time else None,
             "progress": self.progress,
-            "total_resources": self.total_resources
+            "total_resources": self.total_resources,
+            "compress": self.compress,
+            "max_file_bytes": self.max_file_bytes,
+            "resource_counts": self.resource_counts,
+            "types_completed": self.types_completed,
+            "errors": self.errors,
+            "expires_time": self.expires_time.isoformat() if self.expires_time else None
         }
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ExportJob':
+        """Rebuild a job from to_dict() output (job store)."""
+        return cls(
+            job_id=data["job_id"],
+            status=ExportStatus(data["status"]),
+            level=ExportLevel(data["level"]),
+            request_time=datetime.fromisoformat(data["request_time"]),
+            resource_types=data["resource_types"],
+            patient_ids=data.get("patient_ids"),
+            group_id=data.get("group_id"),
+            since=_parse_datetime(data.get("since")),
+            type_filter=data.get("type_filter"),
+            output_files=data.get("output_files", []),
+            error_message=data.get("error_message"),
+            completed_time=_parse_datetime(data.get("completed_time")),
+            progress=data.get("progress", 0),
+            total_resources=data.get("total_resources", 0),
+            compress=data.get("compress", False),
+            max_file_bytes=data.get("max_file_bytes"),
+            resource_counts=data.get("resource_counts", {}),
+            types_completed=data.get("types_completed", 0),
+            errors=data.get("errors", []),
+            expires_time=_parse_datetime(data.get("expires_time")),
+        )
+
+
+class NDJSONFileWriter:
+    """
+    Incremental NDJSON writer for one resource type.
+
+    Resources are written as they arrive; when `max_file_bytes` (measured on
+    the uncompressed NDJSON) would be exceeded the current file is closed and
+    a new part is started: Patient.ndjson, Patient.2.ndjson, ...
+    """
+
+    def __init__(self, job_dir: str, resource_type: str,
+                 compress: bool = False, max_file_bytes: Optional[int] = None):
+        self.job_dir = job_dir
+        self.resource_type = resource_type
+        self.compress = compress
+        self.max_file_bytes = max_file_bytes
+        self.parts: List[Dict[str, Any]] = []
+        self._file = None
+        self._part_bytes = 0
+
+    def _part_name(self, part: int) -> str:
+        name = self.resource_type if part == 1 else f"{self.resource_type}.{part}"
+        return f"{name}.ndjson.gz" if self.compress else f"{name}.ndjson"
+
+    def _open_part(self) -> None:
+        file_name = self._part_name(len(self.parts) + 1)
+        file_path = os.path.join(self.job_dir, file_name)
+        if self.compress:
+            self._file = gzip.open(file_path, 'wb', compresslevel=6)
+        else:
+            self._file = open(file_path, 'wb')
+        self._part_bytes = 0
+        self.parts.append({"file_name": file_name, "file_path": file_path, "count": 0, "bytes": 0})
+
+    def write(self, resource: Dict[str, Any]) -> None:
+        line = (json.dumps(resource, ensure_ascii=False) + '\n').encode('utf-8')
+        if self._file is None or (
+            self.max_file_bytes and self._part_bytes
+            and self._part_bytes + len(line) > self.max_file_bytes
+        ):
+            self.close()
+            self._open_part()
+        self._file.write(line)
+        self._part_bytes += len(line)
+        part = self.parts[-1]
+        part["count"] += 1
+        part["bytes"] = self._part_bytes
+
+    @property
+    def count(self) -> int:
+        return sum(p["count"] for p in self.parts)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self) -> None:
+        """Close and remove every part written so far."""
+        self.close()
+        for part in self.parts:
+            try:
+                os.remove(part["file_path"])
+            except OSError:
+                pass
+        self.parts = []
+
+
+class _JobStoreMixin:
+    """
+    Job persistence shared by the export and import services.
+
+    Job state lives in the job store so any worker can answer status polls;
+    `_jobs` only holds the live objects of jobs this process is running.
+    """
+
+    JOB_KIND = ""
+    JOB_CLASS: Any = None
+    EXPIRE_INTERVAL = 300  # Seconds between opportunistic expiry sweeps
+    _last_expire = 0.0
+    # Jobs of this process whose lease another worker took over: they stop
+    # without writing anything, the new owner's state is the valid one
+    _lost: set = set()
+
+    @classmethod
+    def _store(cls):
+        return get_job_store()
+
+    @classmethod
+    def _persist(cls, job) -> bool:
+        """
+        Save job state; adopt a cancellation made by another worker.
+
+        Returns False if the state was not written: the job was cancelled,
+        or its lease was lost (then the job stops without further writes).
+        """
+        with cls._lock:
+            if job.job_id in cls._lost:
+                return False
+            data = job.to_dict()
+        if cls._store().save(cls.JOB_KIND, data, WORKER_ID):
+            return True
+        stored = cls._store().load(cls.JOB_KIND, job.job_id)
+        with cls._lock:
+            if not stored or stored["status"] != ExportStatus.CANCELLED.value:
+                cls._lost.add(job.job_id)
+            if job.status in (ExportStatus.PENDING, ExportStatus.IN_PROGRESS):
+                job.status = ExportStatus.CANCELLED
+        return False
+
+    @classmethod
+    def get_job(cls, job_id: str):
+        """Get a job by ID."""
+        with cls._lock:
+            job = cls._jobs.get(job_id)
+        if job:
+            return job
+        data = cls._store().load(cls.JOB_KIND, job_id)
+        return cls.JOB_CLASS.from_dict(data) if data else None
+
+    @classmethod
+    def is_running(cls, job_id: str) -> bool:
+        """Whether a worker holds an unexpired lease on the job."""
+        return cls._store().lease_held(cls.JOB_KIND, job_id)
+
+    @classmethod
+    def _claim(cls, job_id: str, claimed: bool = False):
+        """
+        Take the lease on a job and register it as running in this process.
+
+        Returns the live job, or None if another worker holds it.
+        """
+        if not claimed and not cls._store().claim(cls.JOB_KIND, job_id, WORKER_ID, JOB_LEASE_SECONDS):
+            logger.info(f"{cls.JOB_KIND} job {job_id} is claimed by another worker")
+            return None
+        data = cls._store().load(cls.JOB_KIND, job_id)
+        if not data:
+            cls._store().release(cls.JOB_KIND, job_id, WORKER_ID)
+            return None
+        job = cls.JOB_CLASS.from_dict(data)
+        with cls._lock:
+            cls._jobs[job_id] = job
+        return job
+
+    @classmethod
+    def _lease(cls, job) -> LeaseKeeper:
+        def cancelled():
+            with cls._lock:
+                if job.status in (ExportStatus.PENDING, ExportStatus.IN_PROGRESS):
+                    job.status = ExportStatus.CANCELLED
+
+        def lost():
+            # O loop de processamento para como num cancelamento, mas nada é persistido
+            with cls._lock:
+                cls._lost.add(job.job_id)
+            cancelled()
+
+        return LeaseKeeper(cls._store(), cls.JOB_KIND, job.job_id, JOB_LEASE_SECONDS,
+                           on_cancel=cancelled, on_lost=lost)
 
-class BulkExportService:
+    @classmethod
+    def _finish(cls, job) -> None:
+        """Persist the final state (unless the lease was lost) and drop the live object."""
+        if job.expires_time is None:
+            job.expires_time = timezone.now() + JOB_RETENTION
+        cls._persist(job)
+        with cls._lock:
+            cls._jobs.pop(job.job_id, None)
+            cls._lost.discard(job.job_id)
+
+    @classmethod
+    def run_next_pending(cls, user: Optional[Any] = None) -> Optional[str]:
+        """
+        Claim and run (synchronously) the oldest pending job, or an
+        in-progress job whose worker stopped heartbeating.
+
+        Returns the job id, or None if there was nothing to run.
+        """
+        job_id = cls._store().claim_next(cls.JOB_KIND, WORKER_ID, JOB_LEASE_SECONDS)
+        if job_id:
+            cls._run_claimed_job(job_id, user)
+        return job_id
+
+    @classmethod
+    def _run_claimed_job(cls, job_id: str, user: Optional[Any] = None) -> None:
+        raise NotImplementedError
+
+    @classmethod
+    def _job_files(cls, data: Dict[str, Any]) -> List[str]:
+        """Files (or directories) to remove when a job expires."""
+        raise NotImplementedError
+
+    @classmethod
+    def expire_jobs(cls) -> int:
+        """Delete jobs past their expiry time along with their files."""
+        removed = 0
+        for data in cls._store().expired(cls.JOB_KIND):
+            for path in cls._job_files(data):
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    elif os.path.exists(path):
+                        os.remove(path)
+                except OSError as e:
+                    logger.error(f"Error deleting {path}: {e}")
+            if cls._store().delete(cls.JOB_KIND, data["job_id"]):
+                removed += 1
+        if removed:
+            logger.info(f"Expired {removed} {cls.JOB_KIND} jobs")
+        return removed
+
+    @classmethod
+    def _maybe_expire_jobs(cls) -> None:
+        now = time.monotonic()
+        if now - cls._last_expire < cls.EXPIRE_INTERVAL:
+            return
+        cls._last_expire = now
+        try:
+            cls.expire_jobs()
+        except Exception as e:
+            logger.warning(f"Error expiring {cls.JOB_KIND} jobs: {e}")
+
+
+class BulkExportService(_JobStoreMixin):
     """
     Service for FHIR Bulk Data Export operations.
     
@@ -92,10 +377,21 @@ class BulkExportService:
     large amounts of data in NDJSON format.
     """
     
-    # In-memory job storage (in production, use Redis or database)
+    JOB_KIND = "export"
+    JOB_CLASS = ExportJob
+
+    # Live objects of jobs running in this process (state is in the job store)
     _jobs: Dict[str, ExportJob] = {}
     _lock = threading.Lock()
     _executor = ThreadPoolExecutor(max_workers=3)
+
+    # Worker budget shared by all jobs for per-type exports
+    EXPORT_WORKERS = getattr(settings, 'BULK_EXPORT_WORKERS', 4)
+    _type_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="bulk-export")
+
+    EXPORT_PAGE_SIZE = getattr(settings, 'BULK_EXPORT_PAGE_SIZE', 1000)
+    EXPORT_MAX_FILE_BYTES = getattr(settings, 'BULK_EXPORT_MAX_FILE_BYTES', 0)
+    EXPORT_GZIP = getattr(settings, 'BULK_EXPORT_GZIP', False)
     
     # Supported resource types for export
     SUPPORTED_RESOURCE_TYPES = [
@@ -127,7 +423,9 @@ class BulkExportService:
         group_id: Optional[str] = None,
         since: Optional[datetime] = None,
         type_filter: Optional[str] = None,
-        user: Optional[Any] = None
+        user: Optional[Any] = None,
+        compress: Optional[bool] = None,
+        max_file_bytes: Optional[int] = None
     ) -> ExportJob:
         """
         Create a new bulk export job.
@@ -140,6 +438,8 @@ class BulkExportService:
             since: Only export resources updated since this time
             type_filter: Additional filter expression
             user: Requesting user (for audit)
+            compress: Write gzip-compressed NDJSON (.ndjson.gz)
+            max_file_bytes: Split output files above this size (0/None = no split)
             
         Returns:
             The created ExportJob
@@ -168,140 +468,204 @@ class BulkExportService:
             patient_ids=patient_ids,
             group_id=group_id,
             since=since,
-            type_filter=type_filter
+            type_filter=type_filter,
+            compress=cls.EXPORT_GZIP if compress is None else bool(compress),
+            max_file_bytes=int(max_file_bytes or cls.EXPORT_MAX_FILE_BYTES) or None
         )
         
-        with cls._lock:
-            cls._jobs[job.job_id] = job
+        cls._persist(job)
         
         logger.info(f"Created export job {job.job_id} at level {level.value}")
         
         # Start async processing
         cls._executor.submit(cls._process_export_job, job.job_id, user)
+        cls._maybe_expire_jobs()
         
         return job
     
-    @classmethod
-    def get_job(cls, job_id: str) -> Optional[ExportJob]:
-        """Get an export job by ID."""
-        with cls._lock:
-            return cls._jobs.get(job_id)
-    
     @classmethod
     def cancel_job(cls, job_id: str) -> bool:
-        """Cancel an export job."""
+        """Cancel an export job (the running worker observes it on its next heartbeat)."""
+        if not cls._store().cancel(cls.JOB_KIND, job_id):
+            return False
         with cls._lock:
             job = cls._jobs.get(job_id)
-            if job and job.status in [ExportStatus.PENDING, ExportStatus.IN_PROGRESS]:
+            if job:
                 job.status = ExportStatus.CANCELLED
-                logger.info(f"Cancelled export job {job_id}")
-                return True
-            return False
+        logger.info(f"Cancelled export job {job_id}")
+        return True
     
     @classmethod
     def delete_job(cls, job_id: str) -> bool:
         """Delete an export job and its files."""
-        with cls._lock:
-            job = cls._jobs.get(job_id)
-            if not job:
-                return False
-            
-            # Delete output files
-            for output in job.output_files:
-                file_path = output.get("file_path")
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        logger.error(f"Error deleting file {file_path}: {e}")
-            
-            del cls._jobs[job_id]
-            logger.info(f"Deleted export job {job_id}")
-            return True
+        job = cls.get_job(job_id)
+        if not job:
+            return False
+        
+        # Delete output files
+        for output in job.output_files:
+            file_path = output.get("file_path")
+            if file_path and os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                except Exception as e:
+                    logger.error(f"Error deleting file {file_path}: {e}")
+        
+        cls._store().delete(cls.JOB_KIND, job_id)
+        logger.info(f"Deleted export job {job_id}")
+        return True
     
     @classmethod
     def list_jobs(cls, status: Optional[ExportStatus] = None) -> List[ExportJob]:
         """List all export jobs, optionally filtered by status."""
-        with cls._lock:
-            jobs = list(cls._jobs.values())
-            if status:
-                jobs = [j for j in jobs if j.status == status]
-            return sorted(jobs, key=lambda j: j.request_time, reverse=True)
+        jobs = cls._store().list(cls.JOB_KIND, status.value if status else None)
+        return [ExportJob.from_dict(data) for data in jobs]
+
+    @classmethod
+    def _job_files(cls, data: Dict[str, Any]) -> List[str]:
+        return [os.path.join(EXPORT_DIR, data["job_id"])]
+
+    @classmethod
+    def _run_claimed_job(cls, job_id: str, user: Optional[Any] = None) -> None:
+        cls._process_export_job(job_id, user, claimed=True)
     
     @classmethod
-    def _process_export_job(cls, job_id: str, user: Optional[Any] = None):
-        """Background task to process an export job."""
-        job = cls.get_job(job_id)
+    def _search_params(cls, job: ExportJob, resource_type: str) -> Dict[str, str]:
+        """Build the first-page search parameters for a resource type."""
+        params = {"_count": str(cls.EXPORT_PAGE_SIZE)}  # Page size; next links are followed
+        
+        if job.since:
+            params["_lastUpdated"] = f"ge{job.since.isoformat()}"
+        
+        if job.level == ExportLevel.PATIENT and job.patient_ids:
+            if resource_type == "Patient":
+                params["_id"] = ",".join(job.patient_ids)
+            else:
+                params["patient"] = ",".join(job.patient_ids)
+        
+        return params
+    
+    @classmethod
+    def _export_resource_type(
+        cls,
+        job: ExportJob,
+        fhir_service: FHIRService,
+        resource_type: str,
+        job_dir: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Page through one resource type, streaming it to NDJSON part files.
+        
+        Returns:
+            The written parts (file_name, file_path, count, bytes)
+        """
+        writer = NDJSONFileWriter(job_dir, resource_type, job.compress, job.max_file_bytes)
+        params = cls._search_params(job, resource_type)
+        try:
+            for resource in fhir_service.iter_resources(resource_type, params):
+                if job.status != ExportStatus.IN_PROGRESS:  # Cancelled or failed
+                    writer.discard()
+                    return []
+                writer.write(resource)
+                if writer.count % cls.EXPORT_PAGE_SIZE == 0:
+                    with cls._lock:
+                        job.resource_counts[resource_type] = writer.count
+                    cls._persist(job)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+        return writer.parts
+    
+    @classmethod
+    def _process_export_job(cls, job_id: str, user: Optional[Any] = None, claimed: bool = False):
+        """Background task to process an export job (any worker holding the lease)."""
+        job = cls._claim(job_id, claimed)
         if not job:
             return
         
+        try:
+            with cls._lease(job):
+                cls._execute_export_job(job, user)
+        finally:
+            cls._finish(job)
+    
+    @classmethod
+    def _execute_export_job(cls, job: ExportJob, user: Optional[Any] = None):
+        job_id = job.job_id
         try:
             with cls._lock:
+                if job.status == ExportStatus.CANCELLED:
+                    return
                 job.status = ExportStatus.IN_PROGRESS
+                job.progress = 0
+                job.total_resources = 0
+                job.types_completed = 0
+                job.resource_counts = {}
+                job.errors = []
+            cls._persist(job)
             
-            logger.info(f"Processing export job {job_id}")
+            logger.info(f"Processing export job {job_id} on {WORKER_ID}")
             
             fhir_service = FHIRService(user)
             job_dir = os.path.join(EXPORT_DIR, job_id)
             os.makedirs(job_dir, exist_ok=True)
             
-            total_resources = 0
+            futures = {
+                cls._type_executor.submit(
+                    cls._export_resource_type, job, fhir_service, resource_type, job_dir
+                ): resource_type
+                for resource_type in job.resource_types
+            }
+            parts_by_type: Dict[str, List[Dict[str, Any]]] = {}
             
-            for i, resource_type in enumerate(job.resource_types):
-                # Check if cancelled
-                if job.status == ExportStatus.CANCELLED:
-                    return
-                
-                # Update progress
-                job.progress = int((i / len(job.resource_types)) * 100)
-                
-                # Build search parameters
-                params = {"_count": "1000"}  # Max per request
-                
-                if job.since:
-                    params["_lastUpdated"] = f"ge{job.since.isoformat()}"
-                
-                if job.level == ExportLevel.PATIENT and job.patient_ids:
-                    if resource_type == "Patient":
-                        params["_id"] = ",".join(job.patient_ids)
-                    else:
-                        params["patient"] = ",".join(job.patient_ids)
-                
-                # Fetch resources
+            for future in as_completed(futures):
+                resource_type = futures[future]
                 try:
-                    resources = fhir_service.search_resources(resource_type, params)
+                    parts = future.result()
                 except FHIRServiceException as e:
-                    logger.warning(f"Error fetching {resource_type}: {e}")
-                    resources = []
-                
-                if not resources:
-                    continue
-                
-                # Write to NDJSON file
-                file_name = f"{resource_type}.ndjson"
-                file_path = os.path.join(job_dir, file_name)
+                    logger.warning(f"Error exporting {resource_type}: {e}")
+                    parts = []
+                    with cls._lock:
+                        job.errors.append({"type": resource_type, "error": str(e)})
                 
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    for resource in resources:
-                        f.write(json.dumps(resource, ensure_ascii=False) + '\n')
-                        total_resources += 1
-                
-                job.output_files.append({
+                parts_by_type[resource_type] = parts
+                count = sum(p["count"] for p in parts)
+                with cls._lock:
+                    job.resource_counts[resource_type] = count
+                    job.total_resources += count
+                    job.types_completed += 1
+                    job.progress = min(99, int(job.types_completed / len(job.resource_types) * 100))
+                cls._persist(job)
+            
+            if job.status == ExportStatus.CANCELLED:
+                return
+            
+            # Keep the manifest in the requested type order
+            output_files = [
+                {
                     "type": resource_type,
-                    "url": f"/api/v1/export/files/{job_id}/{file_name}",
-                    "file_path": file_path,
-                    "count": len(resources)
-                })
-                
-                job.total_resources = total_resources
+                    "url": f"/api/v1/export/files/{job_id}/{part['file_name']}",
+                    "file_path": part["file_path"],
+                    "count": part["count"],
+                    "bytes": part["bytes"],
+                }
+                for resource_type in job.resource_types
+                for part in parts_by_type.get(resource_type, [])
+                if part["count"]
+            ]
             
-            # Mark as completed
+            # Mark as completed (unless cancelled meanwhile)
             with cls._lock:
+                if job.status == ExportStatus.CANCELLED:
+                    return
+                job.output_files = output_files
                 job.status = ExportStatus.COMPLETED
                 job.completed_time = datetime.now()
                 job.progress = 100
             
-            logger.info(f"Export job {job_id} completed with {total_resources} resources")
+            logger.info(f"Export job {job_id} completed with {job.total_resources} resources "
+                        f"in {len(output_files)} files")
             
         except Exception as e:
             logger.error(f"Export job {job_id} failed: {e}")
@@ -316,6 +680,9 @@ class BulkExportService:
         if not job or job.status != ExportStatus.COMPLETED:
             return None
         
+        if os.path.basename(file_name) != file_name:
+            return None
+        
         file_path = os.path.join(EXPORT_DIR, job_id, file_name)
         if os.path.exists(file_path):
             return file_path
@@ -335,6 +702,19 @@ class ImportJob:
     progress: int = 0
     total_resources: int = 0
     errors: List[Dict[str, str]] = field(default_factory=list)
+    # Pipeline settings
+    chunk_size: int = 200
+    concurrency: int = 4
+    bundle_type: str = "batch"
+    # Chunk progress
+    chunks_completed: int = 0
+    chunks_failed: int = 0
+    failed_resources: int = 0
+    # Checkpoint: file index -> number of leading lines already committed
+    checkpoint: Dict[str, int] = field(default_factory=dict)
+    expires_time: Optional[datetime] = None
+    # Submitting user, for Provenance when the job runs on another worker
+    submitted_by: Optional[str] = None
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization."""
@@ -348,26 +728,90 @@ class ImportJob:
             "completed_time": self.completed_time.isoformat() if self.completed_time else None,
             "progress": self.progress,
             "total_resources": self.total_resources,
-            "errors": self.errors
+            "errors": self.errors,
+            "chunk_size": self.chunk_size,
+            "concurrency": self.concurrency,
+            "bundle_type": self.bundle_type,
+            "chunks_completed": self.chunks_completed,
+            "chunks_failed": self.chunks_failed,
+            "failed_resources": self.failed_resources,
+            "checkpoint": self.checkpoint,
+            "expires_time": self.expires_time.isoformat() if self.expires_time else None,
+            "submitted_by": self.submitted_by,
         }
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ImportJob':
+        """Rebuild a job from to_dict() output (job store, checkpoint files)."""
+        completed = data.get("completed_time")
+        return cls(
+            job_id=data["job_id"],
+            status=ExportStatus(data["status"]),
+            request_time=datetime.fromisoformat(data["request_time"]),
+            input_files=data.get("input_files", []),
+            imported_resources=data.get("imported_resources", {}),
+            error_message=data.get("error_message"),
+            completed_time=datetime.fromisoformat(completed) if completed else None,
+            progress=data.get("progress", 0),
+            total_resources=data.get("total_resources", 0),
+            errors=data.get("errors", []),
+            chunk_size=data.get("chunk_size", 200),
+            concurrency=data.get("concurrency", 4),
+            bundle_type=data.get("bundle_type", "batch"),
+            chunks_completed=data.get("chunks_completed", 0),
+            chunks_failed=data.get("chunks_failed", 0),
+            failed_resources=data.get("failed_resources", 0),
+            checkpoint=data.get("checkpoint", {}),
+            expires_time=_parse_datetime(data.get("expires_time")),
+            submitted_by=data.get("submitted_by"),
+        )
+
+
+@dataclass
+class ImportChunk:
+    """A group of NDJSON lines submitted as one batch/transaction Bundle."""
+    file_index: int
+    resource_type: str
+    start_line: int  # Line numbers are 0-based, end_line exclusive
+    end_line: int
+    entries: List[Dict[str, Any]] = field(default_factory=list)
+    line_numbers: List[int] = field(default_factory=list)
+    bytes_read: int = 0
+
 
-class BulkImportService:
+class BulkImportService(_JobStoreMixin):
     """
     Service for FHIR Bulk Data Import operations.
     
-    Processes NDJSON files to import resources into the FHIR server.
+    Streams NDJSON files line by line, groups resources into FHIR batch (or
+    transaction) Bundles of `chunk_size` entries and submits them with
+    bounded concurrency. After every committed chunk a checkpoint is written
+    to `IMPORT_DIR/{job_id}/checkpoint.json`, so a crashed job can be resumed
+    with `resume_job()` without re-importing committed lines.
     """
     
+    JOB_KIND = "import"
+    JOB_CLASS = ImportJob
+
+    # Live objects of jobs running in this process (state is in the job store)
     _jobs: Dict[str, ImportJob] = {}
     _lock = threading.Lock()
     _executor = ThreadPoolExecutor(max_workers=2)
+
+    DEFAULT_CHUNK_SIZE = getattr(settings, 'BULK_IMPORT_CHUNK_SIZE', 200)
+    DEFAULT_CONCURRENCY = getattr(settings, 'BULK_IMPORT_CONCURRENCY', 4)
+    DEFAULT_BUNDLE_TYPE = getattr(settings, 'BULK_IMPORT_BUNDLE_TYPE', 'batch')
+    CHUNK_RETRIES = 2
+    MAX_RECORDED_ERRORS = 1000
     
     @classmethod
     def create_import_job(
         cls,
         ndjson_files: List[Dict[str, Any]],
-        user: Optional[Any] = None
+        user: Optional[Any] = None,
+        chunk_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        bundle_type: Optional[str] = None
     ) -> ImportJob:
         """
         Create a new bulk import job.
@@ -375,120 +819,370 @@ class BulkImportService:
         Args:
             ndjson_files: List of dicts with 'resource_type' and 'content' or 'file_path'
             user: Requesting user
+            chunk_size: Resources per batch/transaction Bundle
+            concurrency: Bundles submitted in parallel
+            bundle_type: 'batch' (default) or 'transaction'
             
         Returns:
             The created ImportJob
         """
+        bundle_type = bundle_type or cls.DEFAULT_BUNDLE_TYPE
+        if bundle_type not in ("batch", "transaction"):
+            raise ValueError(f"Unsupported bundle type: {bundle_type}")
+
         job = ImportJob(
             job_id=str(uuid.uuid4()),
             status=ExportStatus.PENDING,
             request_time=datetime.now(),
-            input_files=ndjson_files
+            input_files=ndjson_files,
+            chunk_size=max(1, int(chunk_size or cls.DEFAULT_CHUNK_SIZE)),
+            concurrency=max(1, int(concurrency or cls.DEFAULT_CONCURRENCY)),
+            bundle_type=bundle_type,
+            submitted_by=str(user) if user else None
         )
         
-        with cls._lock:
-            cls._jobs[job.job_id] = job
+        cls._persist(job)
         
         logger.info(f"Created import job {job.job_id}")
         
         # Start async processing
         cls._executor.submit(cls._process_import_job, job.job_id, user)
+        cls._maybe_expire_jobs()
         
         return job
-    
+
     @classmethod
-    def get_job(cls, job_id: str) -> Optional[ImportJob]:
-        """Get an import job by ID."""
+    def resume_job(cls, job_id: str, user: Optional[Any] = None) -> Optional[ImportJob]:
+        """
+        Resume an interrupted import job from its last checkpoint.
+
+        The checkpoint comes from the job store, falling back to the
+        on-disk checkpoint.json. Lines already committed are skipped.
+
+        Returns:
+            The resumed ImportJob, or None if no checkpoint exists
+        """
+        data = cls._store().load(cls.JOB_KIND, job_id)
+        if data is None:
+            checkpoint_path = cls._checkpoint_path(job_id)
+            if not os.path.exists(checkpoint_path):
+                return None
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        job = ImportJob.from_dict(data)
+
+        if job.status == ExportStatus.COMPLETED:
+            return job
+
+        job.status = ExportStatus.PENDING
+        job.error_message = None
+        job.expires_time = None
+        cls._persist(job)
+
+        logger.info(f"Resuming import job {job_id} from checkpoint {job.checkpoint}")
+        cls._executor.submit(cls._process_import_job, job.job_id, user)
+        return job
+
+    # ------------------------------------------------------------------
+    # Pipeline
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _job_dir(job_id: str) -> str:
+        return os.path.join(IMPORT_DIR, job_id)
+
+    @classmethod
+    def _checkpoint_path(cls, job_id: str) -> str:
+        return os.path.join(cls._job_dir(job_id), 'checkpoint.json')
+
+    @classmethod
+    def _save_checkpoint(cls, job: ImportJob) -> None:
+        """
+        Persist job state, then atomically write checkpoint.json (temp file
+        + rename). A job whose lease was lost writes neither.
+        """
         with cls._lock:
-            return cls._jobs.get(job_id)
-    
+            data = job.to_dict()
+        if not cls._persist(job) and job.job_id in cls._lost:
+            return
+        path = cls._checkpoint_path(job.job_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
     @classmethod
-    def _process_import_job(cls, job_id: str, user: Optional[Any] = None):
-        """Background task to process an import job."""
-        job = cls.get_job(job_id)
+    def _job_files(cls, data: Dict[str, Any]) -> List[str]:
+        return [cls._job_dir(data["job_id"])]
+
+    @classmethod
+    def _run_claimed_job(cls, job_id: str, user: Optional[Any] = None) -> None:
+        cls._process_import_job(job_id, user, claimed=True)
+
+    @classmethod
+    def _spool_inline_content(cls, job: ImportJob) -> None:
+        """
+        Write inline NDJSON content to the job directory so the job can be
+        resumed after a crash and the request payload is not kept in memory.
+        """
+        job_dir = cls._job_dir(job.job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        for i, file_info in enumerate(job.input_files):
+            content = file_info.get("content")
+            if content and not file_info.get("file_path"):
+                spool_path = os.path.join(job_dir, f"input_{i}.ndjson")
+                with open(spool_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                job.input_files[i] = {
+                    "resource_type": file_info.get("resource_type", "Unknown"),
+                    "file_path": spool_path,
+                }
+
+    @staticmethod
+    def _input_size(file_info: Dict[str, Any]) -> int:
+        file_path = file_info.get("file_path")
+        if file_path and os.path.exists(file_path):
+            return os.path.getsize(file_path)
+        return len((file_info.get("content") or "").encode('utf-8'))
+
+    @staticmethod
+    def _iter_lines(file_info: Dict[str, Any]):
+        """Yield NDJSON lines one at a time without loading the file."""
+        file_path = file_info.get("file_path")
+        if file_path and os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                yield from f
+        elif file_info.get("content"):
+            yield from io.StringIO(file_info["content"])
+
+    @classmethod
+    def _iter_chunks(cls, job: ImportJob, file_index: int, file_info: Dict[str, Any]):
+        """
+        Parse a file into ImportChunks, skipping lines already committed.
+        Malformed lines are recorded as errors and never sent.
+        """
+        resource_type = file_info.get("resource_type", "Unknown")
+        skip = job.checkpoint.get(str(file_index), 0)
+        chunk = None
+
+        for line_no, line in enumerate(cls._iter_lines(file_info)):
+            if line_no < skip:
+                continue
+            if chunk is None:
+                chunk = ImportChunk(file_index, resource_type, line_no, line_no)
+            chunk.end_line = line_no + 1
+            chunk.bytes_read += len(line.encode('utf-8'))
+
+            line = line.strip()
+            if line:
+                try:
+                    resource = json.loads(line)
+                except json.JSONDecodeError as e:
+                    cls._record_error(job, resource_type, f"JSON parse error: {str(e)}", line, line_no)
+                else:
+                    chunk.entries.append(cls._bundle_entry(resource, resource_type))
+                    chunk.line_numbers.append(line_no)
+
+            if len(chunk.entries) >= job.chunk_size:
+                yield chunk
+                chunk = None
+
+        if chunk is not None:
+            yield chunk
+
+    @staticmethod
+    def _bundle_entry(resource: Dict[str, Any], default_type: str) -> Dict[str, Any]:
+        """PUT (upsert) when the resource has an id, POST otherwise."""
+        resource_type = resource.get("resourceType") or default_type
+        if resource.get("id"):
+            request = {"method": "PUT", "url": f"{resource_type}/{resource['id']}"}
+        else:
+            request = {"method": "POST", "url": resource_type}
+        return {"resource": resource, "request": request}
+
+    @classmethod
+    def _record_error(cls, job: ImportJob, resource_type: str, error: str,
+                      line: str = "", line_no: Optional[int] = None) -> None:
+        with cls._lock:
+            job.failed_resources += 1
+            if len(job.errors) < cls.MAX_RECORDED_ERRORS:
+                job.errors.append({
+                    "resource_type": resource_type,
+                    "error": error,
+                    "line": line[:100],
+                    "line_number": line_no,
+                })
+
+    @staticmethod
+    def _can_resend(chunk: ImportChunk, error: FHIRServiceException) -> bool:
+        """
+        Whether resending the chunk cannot create resources twice.
+
+        Only when the connection failed before the request was sent, or on a
+        5xx for a chunk of PUTs (idempotent upserts). A read timeout or a 5xx
+        on POSTs may follow a partial commit; 4xx rejections are never resent.
+        """
+        cause = error.__cause__
+        if isinstance(cause, requests.ConnectTimeout):
+            return True
+        if isinstance(cause, requests.ConnectionError):
+            # Conexão recusada/DNS: urllib3 embrulha NewConnectionError em MaxRetryError
+            reason = getattr(cause.args[0], "reason", None) if cause.args else None
+            return isinstance(reason, ConnectTimeoutError)
+        if error.status_code is not None and error.status_code >= 500:
+            return all(entry["request"]["method"] == "PUT" for entry in chunk.entries)
+        return False
+
+    @classmethod
+    def _submit_chunk(cls, job: ImportJob, fhir_service: FHIRService, chunk: ImportChunk) -> Dict[str, Any]:
+        """Send one chunk as a Bundle, retrying failures that are safe to resend."""
+        bundle = {"resourceType": "Bundle", "type": job.bundle_type, "entry": chunk.entries}
+        attempt = 0
+        while True:
+            try:
+                return fhir_service.execute_bundle(bundle)
+            except FHIRServiceException as e:
+                attempt += 1
+                if attempt > cls.CHUNK_RETRIES or not cls._can_resend(chunk, e):
+                    raise
+                time.sleep(0.5 * attempt)
+
+    @classmethod
+    def _apply_chunk_result(cls, job: ImportJob, chunk: ImportChunk,
+                            response_bundle: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        """Update per-resource and per-chunk counters from a chunk response."""
+        if error is not None:
+            with cls._lock:
+                job.chunks_failed += 1
+            for entry, line_no in zip(chunk.entries, chunk.line_numbers):
+                cls._record_error(job, entry["resource"].get("resourceType", chunk.resource_type),
+                                  error, entry["request"]["url"], line_no)
+            return
+
+        response_entries = (response_bundle or {}).get("entry", [])
+        for i, entry in enumerate(chunk.entries):
+            resource_type = entry["resource"].get("resourceType", chunk.resource_type)
+            status_line = ""
+            if i < len(response_entries):
+                status_line = response_entries[i].get("response", {}).get("status", "")
+            if status_line[:1] == "2":
+                with cls._lock:
+                    job.imported_resources[resource_type] = job.imported_resources.get(resource_type, 0) + 1
+                    job.total_resources += 1
+            else:
+                outcome = response_entries[i].get("response", {}).get("outcome") if i < len(response_entries) else None
+                detail = status_line or "no response entry"
+                if outcome:
+                    issues = outcome.get("issue", [])
+                    if issues:
+                        detail = f"{detail}: {issues[0].get('diagnostics', '')}"
+                cls._record_error(job, resource_type, detail, entry["request"]["url"], chunk.line_numbers[i])
+        with cls._lock:
+            job.chunks_completed += 1
+
+    @classmethod
+    def _process_import_job(cls, job_id: str, user: Optional[Any] = None, claimed: bool = False):
+        """Background task to process an import job (any worker holding the lease)."""
+        job = cls._claim(job_id, claimed)
         if not job:
             return
         
+        try:
+            with cls._lease(job):
+                cls._execute_import_job(job, user)
+        finally:
+            cls._finish(job)
+
+    @classmethod
+    def _execute_import_job(cls, job: ImportJob, user: Optional[Any] = None):
+        job_id = job.job_id
         try:
             with cls._lock:
+                if job.status == ExportStatus.CANCELLED:
+                    return
                 job.status = ExportStatus.IN_PROGRESS
             
-            logger.info(f"Processing import job {job_id}")
-            
-            fhir_service = FHIRService(user)
-            total_imported = 0
-            
-            for i, file_info in enumerate(job.input_files):
-                resource_type = file_info.get("resource_type", "Unknown")
-                content = file_info.get("content", "")
-                file_path = file_info.get("file_path")
-                
-                # Update progress
-                job.progress = int((i / len(job.input_files)) * 100)
-                
-                # Read content from file if path provided
-                if file_path and os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                
-                if not content:
-                    continue
-                
-                # Parse NDJSON and import each resource
-                lines = content.strip().split('\n')
-                imported_count = 0
-                
-                for line in lines:
-                    if not line.strip():
-                        continue
-                    
-                    try:
-                        resource = json.loads(line)
-                        
-                        # Create or update resource
-                        if "id" in resource:
-                            # Update existing
-                            fhir_service.update_resource(
-                                resource_type,
-                                resource["id"],
-                                resource
-                            )
-                        else:
-                            # Create new
-                            fhir_service.create_resource(resource_type, resource)
-                        
-                        imported_count += 1
-                        total_imported += 1
-                        
-                    except json.JSONDecodeError as e:
-                        job.errors.append({
-                            "resource_type": resource_type,
-                            "error": f"JSON parse error: {str(e)}",
-                            "line": line[:100]
-                        })
-                    except Exception as e:
-                        job.errors.append({
-                            "resource_type": resource_type,
-                            "error": str(e),
-                            "line": line[:100]
-                        })
-                
-                job.imported_resources[resource_type] = imported_count
-                job.total_resources = total_imported
+            logger.info(
+                f"Processing import job {job_id} on {WORKER_ID} "
+                f"({job.bundle_type}, chunk_size={job.chunk_size}, concurrency={job.concurrency})"
+            )
+
+            cls._spool_inline_content(job)
+            cls._save_checkpoint(job)
+
+            # Sem usuário (bulk_data_worker), a Provenance usa quem submeteu o job
+            fhir_service = FHIRService(user or job.submitted_by)
+            total_bytes = sum(cls._input_size(f) for f in job.input_files) or 1
+            bytes_done = 0
+
+            with ThreadPoolExecutor(max_workers=job.concurrency,
+                                    thread_name_prefix=f"import-{job_id[:8]}") as pool:
+                for file_index, file_info in enumerate(job.input_files):
+                    # Chunks may finish out of order; the checkpoint only
+                    # advances over a contiguous prefix of committed chunks.
+                    committed_until = job.checkpoint.get(str(file_index), 0)
+                    finished: Dict[int, int] = {}  # start_line -> end_line
+                    in_flight: Dict[Any, ImportChunk] = {}
+
+                    def drain(block_until: int) -> None:
+                        nonlocal committed_until, bytes_done
+                        while len(in_flight) > block_until:
+                            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                            for future in done:
+                                chunk = in_flight.pop(future)
+                                try:
+                                    cls._apply_chunk_result(job, chunk, future.result(), None)
+                                except FHIRServiceException as e:
+                                    cls._apply_chunk_result(job, chunk, None, str(e))
+                                finished[chunk.start_line] = chunk.end_line
+                                bytes_done += chunk.bytes_read
+
+                            while committed_until in finished:
+                                committed_until = finished.pop(committed_until)
+                            with cls._lock:
+                                job.checkpoint[str(file_index)] = committed_until
+                                job.progress = min(99, int(bytes_done / total_bytes * 100))
+                            cls._save_checkpoint(job)
+
+                    for chunk in cls._iter_chunks(job, file_index, file_info):
+                        if job.status == ExportStatus.CANCELLED:
+                            break
+                        if not chunk.entries:
+                            finished[chunk.start_line] = chunk.end_line
+                            continue
+                        in_flight[pool.submit(cls._submit_chunk, job, fhir_service, chunk)] = chunk
+                        # Bound memory: at most `concurrency` chunks parsed ahead
+                        drain(block_until=job.concurrency)
+                    drain(block_until=0)
+
+                    if job.status == ExportStatus.CANCELLED:
+                        cls._save_checkpoint(job)
+                        return
             
-            # Mark as completed
+            # Mark as completed (unless cancelled meanwhile)
             with cls._lock:
+                if job.status == ExportStatus.CANCELLED:
+                    return
                 job.status = ExportStatus.COMPLETED
                 job.completed_time = datetime.now()
                 job.progress = 100
+                job.expires_time = timezone.now() + JOB_RETENTION
+            cls._save_checkpoint(job)
             
-            logger.info(f"Import job {job_id} completed: {total_imported} resources imported")
+            logger.info(
+                f"Import job {job_id} completed: {job.total_resources} resources imported, "
+                f"{job.failed_resources} failed, {job.chunks_completed} chunks"
+            )
             
         except Exception as e:
             logger.error(f"Import job {job_id} failed: {e}")
             with cls._lock:
                 job.status = ExportStatus.FAILED
                 job.error_message = str(e)
+            try:
+                cls._save_checkpoint(job)
+            except OSError:
+                pass
 
 
 # SMART on FHIR OAuth2 Scopes
@@ -9,13 +9,25 @@ Uses Redis for distributed caching with support for:
 - Rate limiting
 """
 
+import fnmatch
+import heapq
 import json
 import hashlib
 import logging
+import math
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import timedelta
-from typing import Any, Dict, List, Optional, Callable, TypeVar
+from typing import Any, Dict, Iterable, List, Optional, Callable, TypeVar, Union
 from functools import wraps
 from django.conf import settings
+from django.db import connections
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +39,12 @@ except ImportError:
     REDIS_AVAILABLE = False
     logger.warning("Redis not available, using in-memory cache fallback")
 
+# orjson is optional: faster (de)serialization when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 T = TypeVar('T')
 
@@ -51,67 +69,442 @@ class CacheBackend:
     
     def incr(self, key: str) -> int:
         raise NotImplementedError
+    
+    def set_tagged(self, key: str, value: str, ttl: Optional[int], tags: List[str]) -> bool:
+        """Set a key and register it as a member of each tag."""
+        raise NotImplementedError
+    
+    def invalidate_tags(self, tags: List[str], keys: List[str] = ()) -> int:
+        """Delete every member of the given tags (plus extra keys) in one call."""
+        raise NotImplementedError
+    
+    def get_many(self, keys: List[str]) -> List[Optional[Union[str, bytes]]]:
+        """Values for the keys, in order (None for misses)."""
+        return [self.get(key) for key in keys]
+    
+    def set_many(self, mapping: Dict[str, Union[str, bytes]], ttl: Optional[int] = None) -> bool:
+        return all([self.set(key, value, ttl) for key, value in mapping.items()])
+    
+    def acquire_lock(self, name: str, ttl_ms: int) -> Optional[str]:
+        """
+        Cross-worker lock; returns a token or None if someone else holds it.
+        
+        Backends local to the process need no lock (SingleFlight already
+        coalesces within the process).
+        """
+        return "local"
+    
+    def release_lock(self, name: str, token: str) -> None:
+        pass
 
 
-class InMemoryCache(CacheBackend):
-    """In-memory cache fallback when Redis is not available."""
+class SingleFlight:
+    """
+    Per-key request coalescing within the process.
     
-    _cache: Dict[str, tuple] = {}  # key -> (value, expiry_time)
+    Concurrent calls of do() with the same key run the function once; the
+    other callers wait for (and share) its result or exception.
+    """
+    
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
     
     def __init__(self):
-        import time
-        self._time = time
+        self._lock = threading.Lock()
+        self._calls: Dict[str, 'SingleFlight._Call'] = {}
     
-    def _cleanup(self):
-        """Remove expired entries."""
-        now = self._time.time()
-        expired = [k for k, (_, exp) in self._cache.items() if exp and exp < now]
-        for k in expired:
-            del self._cache[k]
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
     
+    def do(self, key: str, func: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class LRUTTLCache:
+    """
+    Bounded in-process LRU cache with per-entry TTL.
+
+    Entries are evicted least-recently-used first once either the entry
+    count or the approximate byte budget is exceeded. Each entry may carry
+    a tag (e.g. the FHIR resource type) so related entries can be
+    invalidated together without scanning the whole cache.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None, default_ttl: int = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # key -> (value, expiry_time, size_bytes, tag)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _estimate_size(value: Any) -> int:
+        try:
+            return len(json.dumps(value, default=str))
+        except (TypeError, ValueError):
+            return 0
+
+    def _remove(self, key: str) -> None:
+        _, _, size, tag = self._data.pop(key)
+        self._bytes -= size
+        if tag is not None:
+            members = self._tags.get(tag)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._tags[tag]
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expiry, _, _ = entry
+            if expiry <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None,
+            size: Optional[int] = None, tag: Optional[str] = None) -> None:
+        if size is None:
+            size = self._estimate_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # Never cache a single entry larger than the whole budget
+
+        expiry = time.monotonic() + (ttl or self.default_ttl)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expiry, size, tag)
+            self._bytes += size
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                return True
+            return False
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Remove every entry stored with the given tag."""
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            self._tags.clear()
+            self._bytes = 0
+            return count
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0.0,
+            }
+
+
+class InMemoryCache(CacheBackend):
+    """
+    In-memory cache fallback when Redis is not available.
+
+    get/set are O(1) amortised:
+    - expiry is driven by a min-heap of (expiry, key) with lazy deletion,
+      so reads never scan the cache;
+    - entries are bounded by count and approximate bytes, evicting the
+      least recently used first;
+    - keys are indexed by every ':'-delimited prefix, so the usual
+      ``prefix:*`` invalidations touch only the matching keys.
+    """
+
+    PREFIX_SEPARATOR = ":"
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries or getattr(settings, 'LOCAL_CACHE_MAX_ENTRIES', 100_000)
+        self.max_bytes = max_bytes or getattr(settings, 'LOCAL_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+        # key -> (value, expiry_time or None, size_bytes, tags)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._expiry_heap: List[tuple] = []
+        self._prefixes: Dict[str, set] = {}
+        self._tags: Dict[str, set] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def _key_prefixes(cls, key: str):
+        """Every ':'-terminated prefix of the key ("a:b:c" -> "a:", "a:b:")."""
+        index = key.find(cls.PREFIX_SEPARATOR)
+        while index != -1:
+            yield key[:index + 1]
+            index = key.find(cls.PREFIX_SEPARATOR, index + 1)
+
+    @staticmethod
+    def _unindex(index: Dict[str, set], names, key: str) -> None:
+        for name in names:
+            members = index.get(name)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del index[name]
+
+    def _remove(self, key: str) -> None:
+        _, _, size, tags = self._cache.pop(key)
+        self._bytes -= size
+        self._unindex(self._prefixes, self._key_prefixes(key), key)
+        self._unindex(self._tags, tags, key)
+
+    def _expire(self, now: float) -> None:
+        """Pop expired keys off the heap (stale heap items are skipped)."""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expiry, key = heapq.heappop(heap)
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] == expiry:
+                self._remove(key)
+                self.expirations += 1
+        # Overwritten keys leave stale heap items behind; rebuild when they dominate
+        if len(heap) > 2 * len(self._cache) + 1024:
+            self._expiry_heap = [
+                (entry[1], key) for key, entry in self._cache.items() if entry[1] is not None
+            ]
+            heapq.heapify(self._expiry_heap)
+
     def get(self, key: str) -> Optional[str]:
-        self._cleanup()
-        if key in self._cache:
-            value, expiry = self._cache[key]
-            if expiry is None or expiry > self._time.time():
-                return value
-            del self._cache[key]
-        return None
-    
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expiry = entry[1]
+            if expiry is not None and expiry <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
+
     def set(self, key: str, value: str, ttl: Optional[int] = None) -> bool:
-        expiry = self._time.time() + ttl if ttl else None
-        self._cache[key] = (value, expiry)
+        return self.set_tagged(key, value, ttl, ())
+
+    def set_tagged(self, key: str, value: str, ttl: Optional[int], tags: List[str]) -> bool:
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return False
+        tags = tuple(tags)
+        with self._lock:
+            now = time.monotonic()
+            expiry = now + ttl if ttl else None
+            if key in self._cache:
+                self._remove(key)
+            self._cache[key] = (value, expiry, size, tags)
+            self._bytes += size
+            for prefix in self._key_prefixes(key):
+                self._prefixes.setdefault(prefix, set()).add(key)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            if expiry is not None:
+                heapq.heappush(self._expiry_heap, (expiry, key))
+
+            self._expire(now)
+            while len(self._cache) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._cache)))
+                self.evictions += 1
         return True
-    
+
     def delete(self, key: str) -> bool:
-        if key in self._cache:
-            del self._cache[key]
-            return True
-        return False
-    
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+                return True
+            return False
+
     def exists(self, key: str) -> bool:
         return self.get(key) is not None
-    
+
+    def _pattern_candidates(self, pattern: str):
+        """Keys that may match the glob: the longest indexed literal prefix, else all."""
+        literal = pattern
+        for index, char in enumerate(pattern):
+            if char in "*?[":
+                literal = pattern[:index]
+                break
+        cut = literal.rfind(self.PREFIX_SEPARATOR)
+        if cut == -1:
+            return list(self._cache)
+        return [k for k in self._prefixes.get(literal[:cut + 1], ()) if k.startswith(literal)]
+
     def clear_pattern(self, pattern: str) -> int:
-        import fnmatch
-        keys = [k for k in self._cache.keys() if fnmatch.fnmatch(k, pattern)]
-        for k in keys:
-            del self._cache[k]
-        return len(keys)
-    
+        with self._lock:
+            candidates = self._pattern_candidates(pattern)
+            if pattern.endswith("*") and not any(c in pattern[:-1] for c in "*?["):
+                keys = candidates  # "literal*": every candidate already matches
+            else:
+                keys = [k for k in candidates if fnmatch.fnmatchcase(k, pattern)]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        with self._lock:
+            return [self.get(key) for key in keys]
+
+    def set_many(self, mapping: Dict[str, str], ttl: Optional[int] = None) -> bool:
+        with self._lock:
+            return all([self.set(key, value, ttl) for key, value in mapping.items()])
+
+    def invalidate_tags(self, tags: List[str], keys: List[str] = ()) -> int:
+        with self._lock:
+            members = set(keys)
+            for tag in tags:
+                members.update(self._tags.get(tag, ()))
+            removed = 0
+            for key in members:
+                if key in self._cache:
+                    self._remove(key)
+                    removed += 1
+            return removed
+
     def incr(self, key: str) -> int:
-        value = self.get(key)
-        new_value = int(value or 0) + 1
-        self.set(key, str(new_value), ttl=60)
-        return new_value
+        with self._lock:
+            value = self.get(key)
+            new_value = int(value or 0) + 1
+            self.set(key, str(new_value), ttl=60)
+            return new_value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._expiry_heap.clear()
+            self._prefixes.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "in-memory",
+                "total_keys": len(self._cache),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
 
 
 class RedisCache(CacheBackend):
-    """Redis-based cache backend."""
+    """
+    Redis-based cache backend.
+    
+    Tagged keys are also added to a Redis set per tag, so invalidating a
+    tag costs O(members) instead of a SCAN over the whole keyspace.
+    """
+    
+    # KEYS[1] = key, KEYS[2..] = tag sets; ARGV = value, ttl (0 = no expiry).
+    # A tag set lives as long as its longest-lived member.
+    SET_TAGGED_SCRIPT = """
+    local ttl = tonumber(ARGV[2])
+    if ttl > 0 then
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+    else
+        redis.call('SET', KEYS[1], ARGV[1])
+    end
+    for i = 2, #KEYS do
+        local current = redis.call('TTL', KEYS[i])
+        redis.call('SADD', KEYS[i], KEYS[1])
+        if ttl == 0 then
+            redis.call('PERSIST', KEYS[i])
+        elseif current == -2 or (current >= 0 and current < ttl) then
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+    end
+    return 1
+    """
+    
+    # KEYS = tag sets; ARGV = extra keys. Returns the number of keys removed.
+    INVALIDATE_TAGS_SCRIPT = """
+    local removed = 0
+    for i = 1, #KEYS do
+        local members = redis.call('SMEMBERS', KEYS[i])
+        for j = 1, #members, 500 do
+            removed = removed + redis.call('UNLINK', unpack(members, j, math.min(j + 499, #members)))
+        end
+        redis.call('UNLINK', KEYS[i])
+    end
+    for i = 1, #ARGV do
+        removed = removed + redis.call('UNLINK', ARGV[i])
+    end
+    return removed
+    """
     
     def __init__(self, url: str = None, **kwargs):
         self.url = url or getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0')
-        self.client = redis.from_url(self.url, decode_responses=True, **kwargs)
+        # Binary-safe: compressed values are stored as bytes
+        self.client = redis.from_url(self.url, decode_responses=False, **kwargs)
+        self._set_tagged = self.client.register_script(self.SET_TAGGED_SCRIPT)
+        self._invalidate_tags = self.client.register_script(self.INVALIDATE_TAGS_SCRIPT)
+        self._release_lock = self.client.register_script(self.RELEASE_LOCK_SCRIPT)
         logger.info(f"Redis cache connected: {self.url}")
     
     def get(self, key: str) -> Optional[str]:
@@ -162,6 +555,67 @@ class RedisCache(CacheBackend):
             logger.error(f"Redis INCR error: {e}")
             return 0
     
+    def set_tagged(self, key: str, value: str, ttl: Optional[int], tags: List[str]) -> bool:
+        try:
+            return bool(self._set_tagged(keys=[key, *tags], args=[value, int(ttl or 0)]))
+        except redis.RedisError as e:
+            logger.error(f"Redis SET_TAGGED error: {e}")
+            return False
+    
+    def invalidate_tags(self, tags: List[str], keys: List[str] = ()) -> int:
+        if not tags and not keys:
+            return 0
+        try:
+            return int(self._invalidate_tags(keys=list(tags), args=list(keys)))
+        except redis.RedisError as e:
+            logger.error(f"Redis INVALIDATE_TAGS error: {e}")
+            return 0
+    
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        try:
+            return self.client.mget(keys)
+        except redis.RedisError as e:
+            logger.error(f"Redis MGET error: {e}")
+            return [None] * len(keys)
+    
+    def set_many(self, mapping: Dict[str, Union[str, bytes]], ttl: Optional[int] = None) -> bool:
+        if not mapping:
+            return True
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ttl or None)
+            return all(pipe.execute())
+        except redis.RedisError as e:
+            logger.error(f"Redis pipeline SET error: {e}")
+            return False
+    
+    # KEYS[1] = lock; ARGV[1] = token. Only the owner may release.
+    RELEASE_LOCK_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+    
+    def acquire_lock(self, name: str, ttl_ms: int) -> Optional[str]:
+        token = uuid.uuid4().hex
+        try:
+            if self.client.set(name, token, nx=True, px=ttl_ms):
+                return token
+            return None
+        except redis.RedisError as e:
+            logger.error(f"Redis LOCK error: {e}")
+            return "unlocked"  # Redis down: do not block callers on the lock
+    
+    def release_lock(self, name: str, token: str) -> None:
+        try:
+            self._release_lock(keys=[name], args=[token])
+        except redis.RedisError as e:
+            logger.error(f"Redis UNLOCK error: {e}")
+    
     def pipeline(self):
         """Get a pipeline for batch operations."""
         return self.client.pipeline()
@@ -176,6 +630,21 @@ class CacheService:
     - Query result caching
     - Cache key generation
     - TTL management
+    
+    Search results and patient data are stored with tags (per resource
+    type, per patient), so invalidation deletes the tag's members instead
+    of pattern-scanning the keyspace. Invalidations issued inside
+    ``invalidation_batch()`` are coalesced into a single backend call.
+    
+    Values are JSON; when CACHE_COMPRESSION is on, payloads of at least
+    CACHE_COMPRESS_MIN_BYTES are stored zlib-compressed behind a version
+    byte (plain JSON never starts with it, so both formats can coexist).
+    
+    fetch() protects hot keys from stampedes: misses are computed once per
+    key (SingleFlight in-process, a Redis lock across workers), entries have
+    a soft TTL after which they are served stale while one background
+    refresh runs, and hot entries are refreshed early with a probability
+    that grows near expiry (XFetch).
     """
     
     # Default TTL values (in seconds)
@@ -190,8 +659,28 @@ class CacheService:
     PREFIX_PATIENT = "fhir:patient"
     PREFIX_TERMINOLOGY = "term"
     PREFIX_RATE_LIMIT = "rate"
+    PREFIX_TAG = "fhir:tag"
+    PREFIX_VALIDATOR = "http:validator"
+    TAG_ALL_SEARCHES = f"{PREFIX_TAG}:search"
+    TAG_VALIDATORS = f"{PREFIX_TAG}:validators"
+    
+    # Leading byte of encoded values (JSON text never starts with it)
+    ENCODING_ZLIB_JSON = b"\x01"
     
     _instance: Optional['CacheService'] = None
+    _batch = threading.local()
+    
+    # Stampede protection
+    PREFIX_LOCK = "lock"
+    STALE_TTL = getattr(settings, 'CACHE_STALE_TTL', 60)
+    LOCK_TIMEOUT = getattr(settings, 'CACHE_LOCK_TIMEOUT', 10)
+    EARLY_REFRESH_BETA = getattr(settings, 'CACHE_EARLY_REFRESH_BETA', 1.0)
+    LOCK_POLL_INTERVAL = 0.05
+    _single_flight = SingleFlight()
+    _refresh_executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, 'CACHE_REFRESH_WORKERS', 4),
+        thread_name_prefix='cache-refresh',
+    )
     
     def __new__(cls):
         if cls._instance is None:
@@ -212,6 +701,8 @@ class CacheService:
         else:
             self.backend = InMemoryCache()
         
+        self.compress = getattr(settings, 'CACHE_COMPRESSION', True)
+        self.compress_min_bytes = getattr(settings, 'CACHE_COMPRESS_MIN_BYTES', 512)
         self._initialized = True
     
     @staticmethod
@@ -220,6 +711,212 @@ class CacheService:
         key_data = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True)
         return hashlib.md5(key_data.encode()).hexdigest()[:16]
     
+    # =========================================================================
+    # Encoding
+    # =========================================================================
+    
+    def encode(self, value: Any) -> Union[str, bytes]:
+        """Serialize a value for the backend (compressed when large enough)."""
+        if orjson is not None:
+            data = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            data = json.dumps(value, separators=(",", ":")).encode()
+        if self.compress and len(data) >= self.compress_min_bytes:
+            return self.ENCODING_ZLIB_JSON + zlib.compress(data, 6)
+        return data.decode()
+    
+    def decode(self, raw: Optional[Union[str, bytes]]) -> Any:
+        """Inverse of encode(); also reads plain JSON written by older versions."""
+        if raw is None:
+            return None
+        if isinstance(raw, bytes) and raw[:1] == self.ENCODING_ZLIB_JSON:
+            raw = zlib.decompress(raw[1:])
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+    
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Cached values for the keys present (one MGET on Redis)."""
+        keys = list(keys)
+        found = {}
+        for key, raw in zip(keys, self.backend.get_many(keys)):
+            if raw:
+                found[key] = self.decode(raw)
+        return found
+    
+    def set_many(self, mapping: Dict[str, Any], ttl: int = None) -> bool:
+        """Cache several values (one pipeline on Redis)."""
+        return self.backend.set_many(
+            {key: self.encode(value) for key, value in mapping.items()},
+            ttl or self.TTL_MEDIUM,
+        )
+    
+    # =========================================================================
+    # Stampede protection (single-flight, stale-while-revalidate)
+    # =========================================================================
+    
+    @staticmethod
+    def make_entry(value: Any, ttl: int, compute_seconds: float = 0.0) -> Dict[str, Any]:
+        """Envelope stored by fetch(): value, soft expiry and recompute cost."""
+        return {"_swr": 1, "v": value, "soft": time.time() + ttl, "delta": compute_seconds}
+    
+    @staticmethod
+    def is_entry(data: Any) -> bool:
+        return isinstance(data, dict) and data.get("_swr") == 1
+    
+    def needs_refresh(self, entry: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """True once past the soft TTL, or early with XFetch probability."""
+        now = time.time() if now is None else now
+        early = entry["delta"] * self.EARLY_REFRESH_BETA * -math.log(1.0 - random.random())
+        return now + early >= entry["soft"]
+    
+    def _load_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self.decode(self.backend.get(key))
+        return data if self.is_entry(data) else None
+    
+    def _store_entry(self, key: str, entry: Dict[str, Any], ttl: int, tags: List[str] = ()) -> None:
+        if tags:
+            self.backend.set_tagged(key, self.encode(entry), ttl, list(tags))
+        else:
+            self.backend.set(key, self.encode(entry), ttl)
+    
+    def fetch(
+        self,
+        key: str,
+        compute: Callable[[], T],
+        ttl: int = None,
+        stale_ttl: int = None,
+        tags: List[str] = (),
+        load: Callable[[str], Optional[Dict[str, Any]]] = None,
+        store: Callable[[str, Dict[str, Any], int], None] = None,
+        negative_ttl: int = None,
+    ) -> T:
+        """
+        Get a value from the cache or compute it, protecting against stampedes.
+        
+        - Fresh entry: returned as is (occasionally refreshed early in the
+          background as it nears its soft TTL).
+        - Stale entry (past ttl, within ttl + stale_ttl): returned as is
+          while a single background refresh runs.
+        - Miss: computed once per key; concurrent callers in this process
+          wait for it, other workers wait on the Redis lock and then read
+          the stored value.
+        
+        ``load``/``store`` let callers keep entries elsewhere (e.g. a local
+        LRU); ``compute`` results of None are not cached, and empty results
+        ([], {}) use ``negative_ttl`` when given. Exceptions raised by
+        ``compute`` are not cached either.
+        """
+        ttl = ttl or self.TTL_MEDIUM
+        stale_ttl = self.STALE_TTL if stale_ttl is None else stale_ttl
+        load = load or self._load_entry
+        store = store or (lambda k, entry, hard_ttl: self._store_entry(k, entry, hard_ttl, tags))
+        
+        entry = load(key)
+        if entry is not None:
+            if self.needs_refresh(entry):
+                self._refresh_async(key, compute, ttl, stale_ttl, load, store, negative_ttl)
+            return entry["v"]
+        
+        return self._single_flight.do(
+            key, lambda: self._compute(key, compute, ttl, stale_ttl, load, store, True, negative_ttl)
+        )
+    
+    def _compute(self, key, compute, ttl, stale_ttl, load, store, wait_for_peer, negative_ttl=None):
+        lock_name = f"{self.PREFIX_LOCK}:{key}"
+        token = self.backend.acquire_lock(lock_name, int(self.LOCK_TIMEOUT * 1000))
+        if token is None:
+            if not wait_for_peer:
+                return None  # Another worker is already refreshing
+            # Another worker is computing: wait for its result
+            deadline = time.monotonic() + self.LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(self.LOCK_POLL_INTERVAL)
+                entry = load(key)
+                if entry is not None:
+                    return entry["v"]
+            logger.warning(f"Cache lock wait timed out for {key}, computing locally")
+        
+        try:
+            started = time.monotonic()
+            value = compute()
+            if value is not None:
+                if negative_ttl and not value:
+                    ttl = negative_ttl
+                store(key, self.make_entry(value, ttl, time.monotonic() - started), ttl + stale_ttl)
+            return value
+        finally:
+            if token is not None:
+                self.backend.release_lock(lock_name, token)
+    
+    def _refresh_async(self, key, compute, ttl, stale_ttl, load, store, negative_ttl=None) -> None:
+        """Schedule one background refresh per key."""
+        if self._single_flight.in_flight(key):
+            return
+        
+        def refresh():
+            try:
+                self._single_flight.do(
+                    key, lambda: self._compute(key, compute, ttl, stale_ttl, load, store, False, negative_ttl)
+                )
+            except Exception as e:
+                logger.warning(f"Background cache refresh failed for {key}: {e}")
+            finally:
+                connections.close_all()
+        
+        self._refresh_executor.submit(refresh)
+    
+    # =========================================================================
+    # Tags / Invalidation
+    # =========================================================================
+    
+    @classmethod
+    def search_tag(cls, resource_type: str) -> str:
+        return f"{cls.PREFIX_TAG}:search:{resource_type}"
+    
+    @classmethod
+    def search_tags(cls, resource_type: str) -> List[str]:
+        """Tags carried by every cached search of a resource type."""
+        return [cls.search_tag(resource_type), cls.TAG_ALL_SEARCHES]
+    
+    @classmethod
+    def patient_tag(cls, patient_id: str) -> str:
+        return f"{cls.PREFIX_TAG}:patient:{patient_id}"
+    
+    def invalidate_tags(self, tags: List[str], keys: List[str] = ()) -> int:
+        """
+        Delete all members of the tags plus the given keys.
+        
+        Inside invalidation_batch() the work is deferred and 0 is returned.
+        """
+        pending = getattr(self._batch, "pending", None)
+        if pending is not None:
+            pending[0].update(tags)
+            pending[1].update(keys)
+            return 0
+        return self.backend.invalidate_tags(list(tags), list(keys))
+    
+    @contextmanager
+    def invalidation_batch(self):
+        """
+        Coalesce the invalidations of a bulk write (current thread).
+        
+        Usage:
+            with cache_service.invalidation_batch():
+                for resource in resources:
+                    save(resource)
+                    cache_service.invalidate_resource(...)
+        """
+        if getattr(self._batch, "pending", None) is not None:
+            yield  # Nested: the outermost batch flushes
+            return
+        pending = (set(), set())
+        self._batch.pending = pending
+        try:
+            yield
+        finally:
+            self._batch.pending = None
+            if pending[0] or pending[1]:
+                self.backend.invalidate_tags(sorted(pending[0]), sorted(pending[1]))
+    
     # =========================================================================
     # Resource Caching
     # =========================================================================
@@ -230,7 +927,7 @@ class CacheService:
         data = self.backend.get(key)
         if data:
             logger.debug(f"Cache HIT: {key}")
-            return json.loads(data)
+            return self.decode(data)
         logger.debug(f"Cache MISS: {key}")
         return None
     
@@ -238,14 +935,25 @@ class CacheService:
         """Cache a FHIR resource."""
         key = f"{self.PREFIX_RESOURCE}:{resource_type}:{resource_id}"
         ttl = ttl or self.TTL_MEDIUM
-        return self.backend.set(key, json.dumps(resource), ttl)
+        return self.backend.set(key, self.encode(resource), ttl)
+    
+    def get_resources(self, resource_type: str, resource_ids: Iterable[str]) -> Dict[str, Dict]:
+        """Get several cached resources of a type: {id: resource} for the hits."""
+        keys = {f"{self.PREFIX_RESOURCE}:{resource_type}:{rid}": rid for rid in resource_ids}
+        return {keys[key]: value for key, value in self.get_many(list(keys)).items()}
+    
+    def set_resources(self, resource_type: str, resources: Iterable[Dict], ttl: int = None) -> bool:
+        """Cache several resources of a type (keyed by their ``id``)."""
+        return self.set_many(
+            {f"{self.PREFIX_RESOURCE}:{resource_type}:{r['id']}": r for r in resources if r.get("id")},
+            ttl,
+        )
     
     def invalidate_resource(self, resource_type: str, resource_id: str) -> bool:
         """Invalidate a cached resource."""
         key = f"{self.PREFIX_RESOURCE}:{resource_type}:{resource_id}"
         # Also invalidate related search results
-        self.invalidate_search(resource_type)
-        return self.backend.delete(key)
+        return self.invalidate_tags([self.search_tag(resource_type)], [key]) > 0
     
     # =========================================================================
     # Search Result Caching
@@ -258,7 +966,7 @@ class CacheService:
         data = self.backend.get(key)
         if data:
             logger.debug(f"Search cache HIT: {resource_type}")
-            return json.loads(data)
+            return self.decode(data)
         return None
     
     def set_search(self, resource_type: str, params: Dict, results: List, ttl: int = None) -> bool:
@@ -266,12 +974,15 @@ class CacheService:
         params_hash = self.generate_key(**params)
         key = f"{self.PREFIX_SEARCH}:{resource_type}:{params_hash}"
         ttl = ttl or self.TTL_SHORT
-        return self.backend.set(key, json.dumps(results), ttl)
+        return self.backend.set_tagged(key, self.encode(results), ttl, self.search_tags(resource_type))
     
     def invalidate_search(self, resource_type: str) -> int:
         """Invalidate all cached searches for a resource type."""
-        pattern = f"{self.PREFIX_SEARCH}:{resource_type}:*"
-        return self.backend.clear_pattern(pattern)
+        return self.invalidate_tags([self.search_tag(resource_type)])
+    
+    def invalidate_all_searches(self) -> int:
+        """Invalidate every cached search."""
+        return self.invalidate_tags([self.TAG_ALL_SEARCHES])
     
     # =========================================================================
     # Patient-Centric Caching
@@ -281,21 +992,39 @@ class CacheService:
         """Get cached patient-related data."""
         key = f"{self.PREFIX_PATIENT}:{patient_id}:{data_type}"
         data = self.backend.get(key)
-        return json.loads(data) if data else None
+        return self.decode(data) if data else None
     
     def set_patient_data(self, patient_id: str, data_type: str, data: Any, ttl: int = None) -> bool:
         """Cache patient-related data."""
         key = f"{self.PREFIX_PATIENT}:{patient_id}:{data_type}"
         ttl = ttl or self.TTL_MEDIUM
-        return self.backend.set(key, json.dumps(data), ttl)
+        return self.backend.set_tagged(key, self.encode(data), ttl, [self.patient_tag(patient_id)])
     
     def invalidate_patient(self, patient_id: str) -> int:
-        """Invalidate all cached data for a patient."""
-        pattern = f"{self.PREFIX_PATIENT}:{patient_id}:*"
-        count = self.backend.clear_pattern(pattern)
-        # Also invalidate patient resource
-        self.invalidate_resource("Patient", patient_id)
-        return count
+        """Invalidate all cached data for a patient (and the Patient resource)."""
+        return self.invalidate_tags(
+            [self.patient_tag(patient_id), self.search_tag("Patient")],
+            [f"{self.PREFIX_RESOURCE}:Patient:{patient_id}"],
+        )
+    
+    # =========================================================================
+    # Conditional Request Validators
+    # =========================================================================
+    
+    def get_validator(self, key_id: str) -> Optional[Dict]:
+        """Get the ETag/Last-Modified last served for a request key."""
+        data = self.backend.get(f"{self.PREFIX_VALIDATOR}:{key_id}")
+        return self.decode(data) if data else None
+    
+    def set_validator(self, key_id: str, validator: Dict, ttl: int = None) -> bool:
+        """Store the validators of a response; every FHIR write drops them."""
+        key = f"{self.PREFIX_VALIDATOR}:{key_id}"
+        ttl = ttl or self.TTL_MEDIUM
+        return self.backend.set_tagged(key, self.encode(validator), ttl, [self.TAG_VALIDATORS])
+    
+    def invalidate_validators(self) -> int:
+        """Invalidate every stored response validator."""
+        return self.invalidate_tags([self.TAG_VALIDATORS])
     
     # =========================================================================
     # Terminology Caching
@@ -305,13 +1034,13 @@ class CacheService:
         """Get cached terminology lookup."""
         key = f"{self.PREFIX_TERMINOLOGY}:{system}:{code}"
         data = self.backend.get(key)
-        return json.loads(data) if data else None
+        return self.decode(data) if data else None
     
     def set_terminology(self, system: str, code: str, data: Dict, ttl: int = None) -> bool:
         """Cache terminology lookup result."""
         key = f"{self.PREFIX_TERMINOLOGY}:{system}:{code}"
         ttl = ttl or self.TTL_VERY_LONG  # Terminology is stable
-        return self.backend.set(key, json.dumps(data), ttl)
+        return self.backend.set(key, self.encode(data), ttl)
     
     # =========================================================================
     # Rate Limiting
@@ -337,7 +1066,7 @@ class CacheService:
     # Cache Decorator
     # =========================================================================
     
-    def cached(self, ttl: int = None, key_prefix: str = "cache"):
+    def cached(self, ttl: int = None, key_prefix: str = "cache", batch: bool = False, stale_ttl: int = None):
         """
         Decorator to cache function results.
         
@@ -345,25 +1074,45 @@ class CacheService:
             @cache_service.cached(ttl=300, key_prefix="my_func")
             def my_expensive_function(arg1, arg2):
                 ...
+        
+        Lookups go through fetch(): one computation per key at a time and
+        results served stale for ``stale_ttl`` seconds while refreshing.
+        
+        With batch=True the function takes a list of ids as first argument
+        and returns {id: result}; cached ids are fetched in one multi-get
+        and the function is only called with the missing ones:
+            @cache_service.cached(ttl=300, key_prefix="beds", batch=True)
+            def load_locations(location_ids):
+                ...
         """
         def decorator(func: Callable[..., T]) -> Callable[..., T]:
+            def make_key(*args, **kwargs) -> str:
+                return f"{key_prefix}:{func.__name__}:{self.generate_key(*args, **kwargs)}"
+            
             @wraps(func)
             def wrapper(*args, **kwargs) -> T:
-                cache_key = f"{key_prefix}:{func.__name__}:{self.generate_key(*args, **kwargs)}"
-                
-                # Try to get from cache
-                cached = self.backend.get(cache_key)
-                if cached:
-                    return json.loads(cached)
-                
-                # Execute function
-                result = func(*args, **kwargs)
+                return self.fetch(
+                    make_key(*args, **kwargs),
+                    lambda: func(*args, **kwargs),
+                    ttl=ttl or self.TTL_MEDIUM,
+                    stale_ttl=stale_ttl,
+                )
+            
+            @wraps(func)
+            def batch_wrapper(ids, *args, **kwargs) -> Dict[Any, Any]:
+                keys = {item: make_key(item, *args, **kwargs) for item in ids}
+                found = self.get_many(list(keys.values()))
+                results = {item: found[key] for item, key in keys.items() if key in found}
                 
-                # Store in cache
-                self.backend.set(cache_key, json.dumps(result), ttl or self.TTL_MEDIUM)
+                missing = [item for item in keys if item not in results]
+                if missing:
+                    fresh = func(missing, *args, **kwargs) or {}
+                    self.set_many({keys[item]: value for item, value in fresh.items() if item in keys}, ttl)
+                    results.update(fresh)
                 
-                return result
-            return wrapper
+                return {item: results[item] for item in keys if item in results}
+            
+            return batch_wrapper if batch else wrapper
         return decorator
     
     # =========================================================================
@@ -391,10 +1140,7 @@ class CacheService:
             except Exception as e:
                 return {"backend": "redis", "connected": False, "error": str(e)}
         else:
-            return {
-                "backend": "in-memory",
-                "total_keys": len(self.backend._cache)
-            }
+            return self.backend.get_stats()
 
 
 # Singleton instance
@@ -407,6 +1153,6 @@ def get_cache() -> CacheService:
     return cache_service
 
 
-def cached(ttl: int = None, key_prefix: str = "cache"):
+def cached(ttl: int = None, key_prefix: str = "cache", batch: bool = False, stale_ttl: int = None):
     """Decorator shortcut for caching."""
-    return cache_service.cached(ttl, key_prefix)
+    return cache_service.cached(ttl, key_prefix, batch, stale_ttl)
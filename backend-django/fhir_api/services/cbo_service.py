@@ -7,6 +7,8 @@ from typing import Dict, List, Optional
 from dataclasses import dataclass
 from enum import Enum
 
+from .terminology_store import TerminologySource, TerminologySpec
+
 
 class GrupoCBO(Enum):
     """Grandes grupos CBO relacionados à saúde"""
@@ -203,6 +205,26 @@ class OcupacaoCBO:
     descricao: str
 
 
+def normalizar_codigo_cbo(codigo: str) -> str:
+    """Código CBO no formato 'NNNN-NN'."""
+    return codigo.replace('.', '-').strip()
+
+
+def _preparar_cbo(codigo: str, dados: Dict) -> tuple:
+    """Linha importada: '225125' -> '2251-25' e família a partir do código."""
+    digitos = ''.join(c for c in codigo if c.isdigit())
+    if len(digitos) == 6:
+        codigo = f'{digitos[:4]}-{digitos[4:]}'
+    dados['familia'] = dados.get('familia') or codigo[:4]
+    return codigo, dados
+
+
+CBO_SPEC = TerminologySpec(
+    'cbo', ('nome', 'descricao'), facets=('familia',),
+    normalize_code=normalizar_codigo_cbo, prepare=_preparar_cbo
+)
+
+
 class CBOService:
     """
     Serviço de consulta CBO - Classificação Brasileira de Ocupações
@@ -220,6 +242,8 @@ class CBOService:
     def __init__(self):
         self.ocupacoes = CBO_SAUDE
         self.familias = FAMILIAS_CBO
+        # Release importada ativa ou CBO_SAUDE (índice construído no primeiro uso)
+        self._tabela = TerminologySource(CBO_SPEC, self.ocupacoes)
     
     def buscar_por_codigo(self, codigo: str) -> Optional[OcupacaoCBO]:
         """
@@ -231,19 +255,8 @@ class CBOService:
         Returns:
             OcupacaoCBO ou None
         """
-        # Normalizar código
-        codigo = codigo.replace('.', '-').strip()
-        
-        if codigo in self.ocupacoes:
-            ocp = self.ocupacoes[codigo]
-            return OcupacaoCBO(
-                codigo=codigo,
-                nome=ocp['nome'],
-                familia=ocp['familia'],
-                familia_nome=self.familias.get(ocp['familia'], ''),
-                descricao=ocp['descricao']
-            )
-        return None
+        encontrado = self._tabela.get().get(codigo)
+        return self._ocupacao(*encontrado) if encontrado else None
     
     def buscar_por_nome(self, termo: str, limite: int = 20) -> List[OcupacaoCBO]:
         """
@@ -256,23 +269,10 @@ class CBOService:
         Returns:
             Lista de ocupações
         """
-        termo_lower = termo.lower()
-        resultados = []
-        
-        for codigo, dados in self.ocupacoes.items():
-            if (termo_lower in dados['nome'].lower() or 
-                termo_lower in dados['descricao'].lower()):
-                resultados.append(OcupacaoCBO(
-                    codigo=codigo,
-                    nome=dados['nome'],
-                    familia=dados['familia'],
-                    familia_nome=self.familias.get(dados['familia'], ''),
-                    descricao=dados['descricao']
-                ))
-                if len(resultados) >= limite:
-                    break
-        
-        return resultados
+        return [
+            self._ocupacao(codigo, dados)
+            for codigo, dados in self._tabela.get().search(termo, limite)
+        ]
     
     def listar_por_familia(self, familia: str) -> List[OcupacaoCBO]:
         """
@@ -284,19 +284,19 @@ class CBOService:
         Returns:
             Lista de ocupações
         """
-        resultados = []
-        
-        for codigo, dados in self.ocupacoes.items():
-            if dados['familia'] == familia:
-                resultados.append(OcupacaoCBO(
-                    codigo=codigo,
-                    nome=dados['nome'],
-                    familia=dados['familia'],
-                    familia_nome=self.familias.get(dados['familia'], ''),
-                    descricao=dados['descricao']
-                ))
-        
-        return resultados
+        return [
+            self._ocupacao(codigo, dados)
+            for codigo, dados in self._tabela.get().facet('familia', familia)
+        ]
+    
+    def _ocupacao(self, codigo: str, dados: Dict) -> OcupacaoCBO:
+        return OcupacaoCBO(
+            codigo=codigo,
+            nome=dados['nome'],
+            familia=dados['familia'],
+            familia_nome=self.familias.get(dados['familia'], ''),
+            descricao=dados.get('descricao', '')
+        )
     
     def listar_familias(self) -> Dict[str, str]:
         """Lista todas as famílias CBO de saúde"""
@@ -312,8 +312,7 @@ class CBOService:
         Returns:
             True se válido
         """
-        codigo = codigo.replace('.', '-').strip()
-        return codigo in self.ocupacoes
+        return self._tabela.get().get(codigo) is not None
     
     def gerar_coding_fhir(self, codigo: str) -> Optional[Dict]:
         """
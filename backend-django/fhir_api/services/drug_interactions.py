@@ -0,0 +1,258 @@
+"""
+Drug interaction table
+
+Local table of drug-drug interactions indexed by unordered RXCUI pair,
+loaded once per worker from the file written by the
+drug_interactions_import command (DRUG_INTERACTIONS_PATH). Checking a
+prescription with N drugs is N(N-1)/2 dictionary lookups, with no network
+call; only drugs the dataset does not cover are sent to RxNav.
+
+File format (JSON):
+    {"version": "2024-06",
+     "drugs": {"11289": "warfarin", ...},
+     "pairs": [["11289", "1191", "high", "description", "source"], ...]}
+
+The file is replaced atomically on import and reloaded by every worker on
+the next check after its mtime changes, without restart.
+"""
+
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from itertools import combinations
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+Pair = Tuple[str, str]
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+
+# Colunas de um registro de interação (nomes padrão das colunas do dataset)
+INTERACTION_FIELDS = ("rxcui1", "rxcui2", "drug1", "drug2", "severity", "description", "source")
+
+# Ordem de gravidade (maior primeiro); valores desconhecidos ficam no fim
+SEVERITY_ORDER = {"contraindicated": 0, "high": 1, "major": 1, "moderate": 2, "low": 3, "minor": 3}
+
+
+def pair_key(rxcui1: str, rxcui2: str) -> Pair:
+    """Key of an unordered RXCUI pair."""
+    return (rxcui1, rxcui2) if rxcui1 <= rxcui2 else (rxcui2, rxcui1)
+
+
+def severity_rank(severity: str) -> int:
+    return SEVERITY_ORDER.get((severity or "").lower(), len(SEVERITY_ORDER))
+
+
+class InteractionTable:
+    """
+    Interactions by unordered RXCUI pair.
+
+    Args:
+        version: dataset release
+        drugs: {rxcui: name} of every drug the dataset covers (with or
+            without interactions)
+        pairs: {pair_key: [(severity, description, source), ...]}
+    """
+
+    def __init__(
+        self,
+        version: str,
+        drugs: Mapping[str, str],
+        pairs: Mapping[Pair, List[Tuple[str, str, str]]],
+    ):
+        self.version = version
+        self.drugs = dict(drugs)
+        self.pairs = dict(pairs)
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def knows(self, rxcui: str) -> bool:
+        return rxcui in self.drugs
+
+    def check(self, rxcuis: Iterable[str]) -> Tuple[List[Dict[str, Any]], Set[str]]:
+        """
+        Pairwise check of a drug list.
+
+        Returns:
+            (interactions in the TerminologyService format, RXCUIs not
+            covered by the dataset)
+        """
+        rxcuis = sorted({str(rxcui) for rxcui in rxcuis})
+        unknown = {rxcui for rxcui in rxcuis if rxcui not in self.drugs}
+        interactions = []
+        for rxcui1, rxcui2 in combinations(rxcuis, 2):
+            for severity, description, source in self.pairs.get((rxcui1, rxcui2), ()):
+                interactions.append({
+                    "drug1": self.drugs.get(rxcui1, ""),
+                    "drug1_rxcui": rxcui1,
+                    "drug2": self.drugs.get(rxcui2, ""),
+                    "drug2_rxcui": rxcui2,
+                    "severity": severity,
+                    "description": description,
+                    "source": source,
+                })
+        return interactions, unknown
+
+    # =========================================================================
+    # Arquivo
+    # =========================================================================
+
+    @classmethod
+    def from_rows(cls, version: str, rows: Iterable[Mapping[str, str]]) -> "InteractionTable":
+        """
+        Build from dataset rows (INTERACTION_FIELDS). A row without rxcui2
+        only declares a drug as covered.
+        """
+        drugs: Dict[str, str] = {}
+        pairs: Dict[Pair, List[Tuple[str, str, str]]] = {}
+        for row in rows:
+            rxcui1, rxcui2 = row.get("rxcui1", ""), row.get("rxcui2", "")
+            if not rxcui1:
+                continue
+            drugs[rxcui1] = drugs.get(rxcui1) or row.get("drug1", "")
+            if not rxcui2 or rxcui2 == rxcui1:
+                continue
+            drugs[rxcui2] = drugs.get(rxcui2) or row.get("drug2", "")
+            record = (row.get("severity") or "N/A", row.get("description", ""), row.get("source", ""))
+            records = pairs.setdefault(pair_key(rxcui1, rxcui2), [])
+            if record not in records:
+                records.append(record)
+        return cls(version, drugs, pairs)
+
+    @classmethod
+    def load(cls, path: str) -> "InteractionTable":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        pairs: Dict[Pair, List[Tuple[str, str, str]]] = {}
+        for rxcui1, rxcui2, severity, description, source in data["pairs"]:
+            pairs.setdefault(pair_key(rxcui1, rxcui2), []).append((severity, description, source))
+        return cls(data.get("version", ""), data["drugs"], pairs)
+
+    def save(self, path: str) -> None:
+        """Write the table, replacing the file atomically."""
+        data = {
+            "version": self.version,
+            "drugs": self.drugs,
+            "pairs": [[*pair, *record] for pair, records in self.pairs.items() for record in records],
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def read_interaction_file(
+    path: str,
+    columns: Optional[Mapping[str, str]] = None,
+    encoding: str = "utf-8",
+    delimiter: Optional[str] = None,
+) -> Iterator[Dict[str, str]]:
+    """
+    Interaction rows of a CSV or JSON (list of objects) dataset.
+
+    `columns` maps INTERACTION_FIELDS to source columns when the names
+    differ (e.g. {"rxcui1": "object_rxcui"}).
+    """
+    columns = dict(columns or {})
+
+    def record(row: Mapping[str, Any]) -> Dict[str, str]:
+        return {name: str(row.get(columns.get(name, name)) or "").strip() for name in INTERACTION_FIELDS}
+
+    if path.lower().endswith(".json"):
+        with open(path, encoding=encoding) as f:
+            for row in json.load(f):
+                yield record(row)
+        return
+
+    with open(path, encoding=encoding, newline="") as f:
+        if delimiter is None:
+            sample = f.readline()
+            f.seek(0)
+            delimiter = max(",;\t|", key=sample.count)
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield record(row)
+
+
+class InteractionSource:
+    """
+    Table loaded from `path` on first use, reloaded when the file changes
+    (checked at most every `check_interval` seconds). None while no
+    dataset was imported.
+    """
+
+    def __init__(self, path: str, check_interval: float = 60):
+        self.path = path
+        self.check_interval = check_interval
+        self._table: Optional[InteractionTable] = None
+        self._mtime: Optional[float] = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[InteractionTable]:
+        if not self.path or time.monotonic() - self._checked < self.check_interval:
+            return self._table
+        with self._lock:
+            if time.monotonic() - self._checked >= self.check_interval:
+                self._reload()
+                self._checked = time.monotonic()
+        return self._table
+
+    def _reload(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            self._table, self._mtime = None, None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            self._table = InteractionTable.load(self.path)
+            self._mtime = mtime
+            logger.info(
+                "Drug interactions %s loaded: %d pairs, %d drugs",
+                self._table.version, len(self._table), len(self._table.drugs)
+            )
+        except (OSError, ValueError, KeyError) as e:
+            # Mantém a tabela anterior
+            logger.error(f"Error loading drug interactions from {self.path}: {e}")
+
+
+# =============================================================================
+# Source selection
+# =============================================================================
+
+_interaction_source: Optional[InteractionSource] = None
+_interaction_source_lock = threading.Lock()
+
+
+def get_interaction_source() -> InteractionSource:
+    """Return the interaction source (DRUG_INTERACTIONS_PATH; empty disables it)."""
+    global _interaction_source
+    if _interaction_source is None:
+        with _interaction_source_lock:
+            if _interaction_source is None:
+                _interaction_source = InteractionSource(
+                    getattr(settings, 'DRUG_INTERACTIONS_PATH', ''),
+                    getattr(settings, 'DRUG_INTERACTIONS_CHECK_INTERVAL', 60),
+                )
+    return _interaction_source
+
+
+def set_interaction_source(source: Optional[InteractionSource]) -> None:
+    """Replace the interaction source (tests)."""
+    global _interaction_source
+    with _interaction_source_lock:
+        _interaction_source = source
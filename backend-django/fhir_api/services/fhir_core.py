@@ -9,11 +9,18 @@ Princípio: O HAPI FHIR é a autoridade absoluta dos dados clínicos.
 """
 
 import requests
+import contextvars
+import copy
 import logging
 import json
+import hashlib
+import queue
 import threading
-from typing import Dict, Any, Optional, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Iterator, Tuple
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit
 from django.conf import settings
 
 from fhirclient.models.patient import Patient
@@ -41,6 +48,11 @@ from fhirclient.models.money import Money
 from fhirclient.models.provenance import Provenance
 from fhirclient.models.provenance import ProvenanceAgent
 
+from .analytics_store import TRACKED_RESOURCES, fact_update, get_analytics_store
+from .cache_service import CacheService, LRUTTLCache, RedisCache, cache_service
+from ..metrics import fhir_operation, track_cache_hit, track_cache_miss
+from ..tracing import record_cache_hit
+from .fhir_transport import FHIRTransport
 
 
 logger = logging.getLogger(__name__)
@@ -48,7 +60,11 @@ logger = logging.getLogger(__name__)
 
 class FHIRServiceException(Exception):
     """Exceção customizada para erros de integração FHIR."""
-    pass
+
+    def __init__(self, message: str = "", status_code: Optional[int] = None):
+        super().__init__(message)
+        # Status HTTP da resposta, quando o servidor chegou a responder
+        self.status_code = status_code
 
 
 class CircuitBreakerOpen(FHIRServiceException):
@@ -65,14 +81,46 @@ class FHIRService:
     - Validação de dados antes de enviar
     - Tratamento de erros padronizado
     - Logging de todas as operações
-    - Cache para buscas frequentes (TTL 5 minutos)
+    - Cache LRU/TTL limitado para buscas e leituras (TTL 5 minutos),
+      opcionalmente compartilhado entre workers via Redis, com proteção
+      contra stampede (single-flight, stale-while-revalidate)
     - Circuit Breaker para resiliência
     """
     
-    # Cache class-level para buscas (shared entre instâncias)
-    _cache: Dict[str, tuple] = {}
+    # Cache class-level para buscas e leituras (shared entre instâncias)
     _cache_ttl_seconds = 300  # 5 minutos
+    _cache = LRUTTLCache(
+        max_entries=getattr(settings, 'FHIR_CACHE_MAX_ENTRIES', 2048),
+        max_bytes=getattr(settings, 'FHIR_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+        default_ttl=_cache_ttl_seconds,
+    )
     
+    # Limite de segurança para buscas que seguem a paginação (search_resources sem _count)
+    SEARCH_MAX_ITEMS = getattr(settings, 'FHIR_SEARCH_MAX_ITEMS', 10000)
+
+    _WRITE_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+
+    # CapabilityStatement (/metadata) em cache, usado para detectar operações suportadas
+    _capabilities: Optional[Dict[str, Any]] = None
+    _capabilities_fetched_at = 0.0
+    CAPABILITIES_TTL = 3600
+
+    # Export do paciente: buscas do compartimento executadas em paralelo quando
+    # o servidor não anuncia Patient/$everything
+    PATIENT_EXPORT_SEARCHES: List[Tuple[str, str]] = [
+        ("Encounter", "subject"),
+        ("Observation", "patient"),
+        ("Condition", "subject"),
+        ("AllergyIntolerance", "patient"),
+        ("MedicationRequest", "subject"),
+        ("Appointment", "actor"),
+    ]
+    EXPORT_QUEUE_PAGES = 8  # Páginas em trânsito entre workers e o consumidor (backpressure)
+    _export_executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, 'FHIR_EXPORT_WORKERS', 6),
+        thread_name_prefix='fhir-export',
+    )
+
     # Circuit Breaker state (shared entre instâncias)
     _circuit_open = False
     _circuit_open_until: Optional[datetime] = None
@@ -86,11 +134,10 @@ class FHIRService:
     def __init__(self, user: Optional[Any] = None):
         self.base_url = settings.FHIR_SERVER_URL
         self.timeout = settings.FHIR_SERVER_TIMEOUT
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/fhir+json',
-            'Accept': 'application/fhir+json',
-        })
+        # Sessão HTTP compartilhada pelo processo (pool keep-alive)
+        transport = FHIRTransport.get_instance()
+        transport.add_response_hook(FHIRService._on_write)
+        self.session = transport.session
         self.user = user # Contexto do usuário para auditoria (Provenance)
     
     @classmethod
@@ -170,28 +217,81 @@ class FHIRService:
         sorted_params = sorted((params or {}).items())
         return f"{resource_type}:{str(sorted_params)}"
     
+    @staticmethod
+    def _cache_resource_type(cache_key: str) -> str:
+        return cache_key.split(":", 1)[0]
+
     @classmethod
-    def _is_cache_valid(cls, cache_key: str) -> bool:
-        """Verifica se o cache ainda é válido (não expirou)."""
-        if cache_key not in cls._cache:
-            return False
-        cached_time, _ = cls._cache[cache_key]
-        return (datetime.now() - cached_time).total_seconds() < cls._cache_ttl_seconds
-    
-    @classmethod
-    def _get_from_cache(cls, cache_key: str) -> Optional[List[Dict[str, Any]]]:
-        """Retorna dados do cache se válido."""
-        if cls._is_cache_valid(cache_key):
-            _, data = cls._cache[cache_key]
-            logger.debug(f"Cache HIT: {cache_key}")
-            return data
+    def _shared_cache(cls) -> Optional[CacheService]:
+        """Retorna o CacheService quando ele está em Redis (compartilhado entre workers)."""
+        if isinstance(cache_service.backend, RedisCache):
+            return cache_service
         return None
-    
+
+    @classmethod
+    def _shared_cache_key(cls, cache_key: str) -> str:
+        resource_type, rest = cache_key.split(":", 1)
+        digest = hashlib.md5(rest.encode()).hexdigest()[:16]
+        return f"{CacheService.PREFIX_SEARCH}:{resource_type}:{digest}"
+
+    @classmethod
+    def _load_entry(cls, cache_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Lê o envelope (valor + TTL "soft") do cache.
+
+        Com Redis habilitado o cache é compartilhado entre workers (e a
+        invalidação vale para todos); caso contrário usa o LRU local.
+        """
+        shared = cls._shared_cache()
+        if shared is not None:
+            entry = shared.decode(shared.backend.get(cls._shared_cache_key(cache_key)))
+        else:
+            entry = cls._cache.get(cache_key)
+        return entry if CacheService.is_entry(entry) else None
+
     @classmethod
-    def _set_cache(cls, cache_key: str, data: List[Dict[str, Any]]) -> None:
-        """Armazena dados no cache."""
-        cls._cache[cache_key] = (datetime.now(), data)
+    def _store_entry(cls, cache_key: str, entry: Dict[str, Any], ttl: int) -> None:
+        shared = cls._shared_cache()
+        resource_type = cls._cache_resource_type(cache_key)
+        if shared is not None:
+            shared.backend.set_tagged(
+                cls._shared_cache_key(cache_key), shared.encode(entry), ttl,
+                CacheService.search_tags(resource_type),
+            )
+        else:
+            cls._cache.set(cache_key, entry, ttl=ttl, tag=resource_type)
         logger.debug(f"Cache SET: {cache_key}")
+
+    @classmethod
+    def _cached_fetch(cls, cache_key: str, compute) -> Optional[Any]:
+        """
+        Lê do cache ou executa `compute` uma única vez por chave: requisições
+        concorrentes esperam a mesma busca (no processo e, com Redis, entre
+        workers); entradas vencidas são servidas enquanto uma atualização
+        roda em background, evitando rajadas contra o HAPI.
+        """
+        missed = []
+
+        def compute_on_miss():
+            missed.append(True)
+            return compute()
+
+        started = time.perf_counter()
+        result = cache_service.fetch(
+            cls._shared_cache_key(cache_key),
+            compute_on_miss,
+            ttl=cls._cache_ttl_seconds,
+            load=lambda _key: cls._load_entry(cache_key),
+            store=lambda _key, entry, ttl: cls._store_entry(cache_key, entry, ttl),
+        )
+        if missed:
+            track_cache_miss()
+        else:
+            track_cache_hit()
+            record_cache_hit(cls._cache_resource_type(cache_key), time.perf_counter() - started)
+        # O valor é o mesmo objeto guardado no LRU local (e entregue às requisições
+        # que esperaram a mesma busca): cada chamador recebe sua própria cópia
+        return copy.deepcopy(result)
     
     @classmethod
     def clear_cache(cls, resource_type: Optional[str] = None) -> int:
@@ -201,18 +301,84 @@ class FHIRService:
         Returns:
             int: Número de entradas removidas
         """
+        shared = cls._shared_cache()
+        # Respostas já servidas podem conter o recurso alterado: os validadores
+        # de requisição condicional (ETaggerMiddleware) deixam de valer
+        cache_service.invalidate_validators()
         if resource_type:
-            keys_to_remove = [k for k in cls._cache if k.startswith(f"{resource_type}:")]
-            for key in keys_to_remove:
-                del cls._cache[key]
-            logger.info(f"Cache cleared for {resource_type}: {len(keys_to_remove)} entries removed")
-            return len(keys_to_remove)
+            count = cls._cache.invalidate_tag(resource_type)
+            if shared is not None:
+                count += shared.invalidate_search(resource_type)
+            logger.info(f"Cache cleared for {resource_type}: {count} entries removed")
+            return count
         else:
-            count = len(cls._cache)
-            cls._cache.clear()
+            count = cls._cache.clear()
+            if shared is not None:
+                count += shared.invalidate_all_searches()
             logger.info(f"Cache fully cleared: {count} entries removed")
             return count
 
+    @classmethod
+    def _on_write(cls, response: requests.Response, *args, **kwargs) -> requests.Response:
+        """
+        Hook de resposta da sessão: toda escrita bem-sucedida (POST/PUT/PATCH/DELETE)
+        invalida o cache do tipo de recurso afetado. Escritas na base
+        (Bundle transaction/batch) limpam o cache inteiro.
+
+        Escritas de recursos acompanhados pelo analytics também atualizam os
+        contadores materializados (o recurso vem no corpo da resposta; DELETE
+        remove a contribuição). Escritas sem corpo (Bundle, Prefer:
+        return=minimal) ficam para o catch-up do AnalyticsService.sync, que lê
+        o histórico do tipo (`_history?_since=`) e por isso vê também as exclusões.
+        """
+        request = response.request
+        if request is None or request.method not in cls._WRITE_METHODS or response.status_code >= 400:
+            return response
+
+        resource_type, resource_id = cls._request_path(request)
+        cls.clear_cache(resource_type or None)
+        if resource_type in TRACKED_RESOURCES and not kwargs.get('stream'):
+            cls._record_analytics_write(request.method, resource_type, resource_id, response)
+        return response
+
+    @staticmethod
+    def _record_analytics_write(
+        method: str, resource_type: str, resource_id: Optional[str], response: requests.Response
+    ) -> None:
+        try:
+            store = get_analytics_store()
+            if method == 'DELETE':
+                if resource_id:
+                    store.apply(resource_type, resource_id, None)
+            else:
+                update = fact_update(resource_type, response.json())
+                if update:
+                    store.apply(resource_type, *update)
+        except Exception as e:
+            logger.warning(f"Analytics store not updated for {method} {resource_type}: {e}")
+
+    @staticmethod
+    def _request_path(request: requests.PreparedRequest) -> Tuple[str, Optional[str]]:
+        """(tipo de recurso, id) de uma requisição ao servidor FHIR."""
+        base_path = urlsplit(settings.FHIR_SERVER_URL).path.rstrip('/')
+        path = urlsplit(request.url).path
+        if base_path and path.startswith(base_path):
+            path = path[len(base_path):]
+        parts = path.strip('/').split('/')
+        return parts[0], (parts[1] if len(parts) > 1 and not parts[1].startswith('$') else None)
+
+    @classmethod
+    def get_transport_stats(cls) -> Dict[str, Any]:
+        """Retorna métricas de utilização do pool HTTP compartilhado."""
+        return FHIRTransport.get_instance().get_stats()
+
+    @classmethod
+    def get_cache_stats(cls) -> Dict[str, Any]:
+        """Retorna estatísticas do cache local (entradas, bytes, hits/misses)."""
+        stats = cls._cache.get_stats()
+        stats["shared"] = cls._shared_cache() is not None
+        return stats
+
     def health_check(self) -> bool:
         """
         Verifica se o servidor FHIR está respondendo.
@@ -254,6 +420,7 @@ class FHIRService:
             logger.error(f"FHIR Server health check failed: {str(e)}")
             raise FHIRServiceException(f"FHIR Server error: {str(e)}")
 
+    @fhir_operation('create')
     def create_resource(self, resource_type: str, resource_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Cria qualquer recurso FHIR genericamente.
@@ -311,6 +478,7 @@ class FHIRService:
             logger.error(f"Error creating {resource_type}: {str(e)}", exc_info=True)
             raise FHIRServiceException(f"Error creating {resource_type}: {str(e)}")
 
+    @fhir_operation('update')
     def update_resource(self, resource_type: str, resource_id: str, resource_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Atualiza qualquer recurso FHIR genericamente.
@@ -346,53 +514,155 @@ class FHIRService:
             logger.error(f"Error updating {resource_type}/{resource_id}: {str(e)}")
             raise FHIRServiceException(f"Error updating {resource_type}: {str(e)}")
 
-    def search_resources(self, resource_type: str, params: Dict[str, Any] = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+    def _next_page_url(self, bundle: Dict[str, Any]) -> Optional[str]:
+        """
+        Retorna a URL da próxima página (link rel=next) do Bundle.
+
+        O HAPI monta o link com o host que ele próprio enxerga; reescrevemos
+        scheme/host para o FHIR_SERVER_URL configurado (ex: nome do container).
+        """
+        for link in bundle.get('link', []):
+            if link.get('relation') == 'next' and link.get('url'):
+                next_url = urlsplit(link['url'])
+                base = urlsplit(self.base_url)
+                return urlunsplit((base.scheme, base.netloc, next_url.path, next_url.query, ''))
+        return None
+
+    def iter_pages(
+        self,
+        resource_type: str,
+        params: Optional[Dict[str, Any]] = None,
+        max_pages: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Itera sobre as páginas (Bundles searchset) de uma busca, seguindo link[rel=next].
+
+        Apenas uma página é mantida em memória por vez.
+
+        Args:
+            resource_type: Tipo do recurso (Ex: 'Observation')
+            params: Parâmetros de busca da primeira página
+            max_pages: Número máximo de páginas a buscar (None = todas)
+
+        Raises:
+            CircuitBreakerOpen: Se circuit breaker está aberto
+            FHIRServiceException: Se alguma página falhar
+        """
+        url = f"{self.base_url}/{resource_type}"
+        page_params = params
+        pages = 0
+
+        while url and (max_pages is None or pages < max_pages):
+            self._check_circuit()
+            try:
+                response = self.session.get(url, params=page_params, timeout=self.timeout)
+                response.raise_for_status()
+                bundle = response.json()
+            except requests.RequestException as e:
+                self._record_failure()
+                logger.error(f"Error searching {resource_type} (page {pages + 1}): {str(e)}")
+                raise FHIRServiceException(f"Failed to search {resource_type}: {str(e)}")
+            except ValueError as e:
+                self._record_failure()
+                logger.error(f"Invalid JSON searching {resource_type}: {str(e)}")
+                raise FHIRServiceException(f"Invalid JSON response from FHIR server: {str(e)}")
+
+            self._record_success()
+            pages += 1
+            yield bundle
+
+            url = self._next_page_url(bundle)
+            page_params = None  # O link next já carrega todos os parâmetros
+
+    def iter_resources(
+        self,
+        resource_type: str,
+        params: Optional[Dict[str, Any]] = None,
+        max_items: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        include_included: bool = False,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Itera lazily sobre todos os recursos de uma busca, página a página.
+
+        Só os resultados (search.mode = match) são retornados e contados em
+        max_items; recursos de _include/_revinclude e OperationOutcome ficam de fora.
+        Com include_included, os recursos incluídos (search.mode = include) também
+        são retornados e contados: operações como Patient/$everything marcam assim
+        Practitioner, Organization, Medication etc. que fazem parte do resultado.
+
+        Uso:
+            for obs in fhir.iter_resources("Observation", {"patient": "Patient/1"}):
+                ...
+
+        Args:
+            resource_type: Tipo do recurso
+            params: Parâmetros de busca
+            max_items: Número máximo de recursos a retornar (None = sem limite)
+            max_pages: Número máximo de páginas a buscar (None = sem limite)
+            include_included: Retorna também as entradas com search.mode = include
+        """
+        if max_items is not None and max_items <= 0:
+            return
+        modes = (None, 'match', 'include') if include_included else (None, 'match')
+        count = 0
+        for bundle in self.iter_pages(resource_type, params, max_pages=max_pages):
+            for entry in bundle.get('entry', []):
+                # Entradas de _include (mode=include) e OperationOutcome (mode=outcome)
+                # não são resultados da busca; sem search.mode a entrada é mantida
+                mode = entry.get('search', {}).get('mode')
+                if 'resource' not in entry or mode not in modes:
+                    continue
+                yield entry['resource']
+                count += 1
+                if max_items is not None and count >= max_items:
+                    return
+
+    @fhir_operation('search')
+    def search_resources(
+        self,
+        resource_type: str,
+        params: Dict[str, Any] = None,
+        use_cache: bool = True,
+        search_params: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
         """
         Busca genérica de recursos FHIR com suporte a cache.
+
+        Sem `_count` nos parâmetros, segue a paginação do servidor até
+        SEARCH_MAX_ITEMS recursos. Com `_count`, retorna apenas a primeira
+        página (o chamador pediu um limite explícito). Para resultados
+        grandes prefira `iter_resources`.
         
         Args:
             resource_type: Tipo do recurso (Ex: 'RelatedPerson')
             params: Dicionário de parâmetros de busca
             use_cache: Se True, usa cache (padrão). Se False, força busca no servidor.
+            search_params: Alias de `params` (compatibilidade)
             
         Returns:
             Lista de recursos encontrados
+
+        Raises:
+            FHIRServiceException: Se a busca falhar
         """
-        # Verificar cache primeiro
-        if use_cache:
-            cache_key = self._get_cache_key(resource_type, params)
-            cached_data = self._get_from_cache(cache_key)
-            if cached_data is not None:
-                return cached_data
-        
-        try:
-            response = self.session.get(
-                f"{self.base_url}/{resource_type}",
-                params=params,
-                timeout=self.timeout
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Search failed for {resource_type}: {response.status_code}")
-                return []
-                
-            bundle = response.json()
-            results = []
-            if 'entry' in bundle:
-                for entry in bundle['entry']:
-                    if 'resource' in entry:
-                        results.append(entry['resource'])
-            
-            # Armazenar no cache
-            if use_cache:
-                cache_key = self._get_cache_key(resource_type, params)
-                self._set_cache(cache_key, results)
-            
+        if params is None:
+            params = search_params
+
+        def fetch():
+            if params and '_count' in params:
+                return list(self.iter_resources(resource_type, params, max_pages=1))
+            results = list(self.iter_resources(resource_type, params, max_items=self.SEARCH_MAX_ITEMS))
+            if len(results) >= self.SEARCH_MAX_ITEMS:
+                logger.warning(
+                    f"Search {resource_type} truncated at {self.SEARCH_MAX_ITEMS} resources; "
+                    f"use iter_resources() for full result sets"
+                )
             return results
-            
-        except Exception as e:
-            logger.error(f"Error searching {resource_type}: {e}")
-            return []
+
+        if not use_cache:
+            return fetch()
+        return self._cached_fetch(self._get_cache_key(resource_type, params), fetch)
     
     def search_resources_no_cache(self, resource_type: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
@@ -400,17 +670,65 @@ class FHIRService:
         """
         return self.search_resources(resource_type, params, use_cache=False)
 
-    def get_resource(self, resource_type: str, resource_id: str) -> Optional[Dict[str, Any]]:
+    @fhir_operation('bundle', resource_type='Bundle')
+    def execute_bundle(self, bundle: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Envia um Bundle do tipo batch ou transaction para a base do servidor FHIR.
+
+        Args:
+            bundle: Bundle FHIR (type = batch | transaction)
+
+        Returns:
+            Bundle de resposta (batch-response / transaction-response)
+
+        Raises:
+            CircuitBreakerOpen: Se circuit breaker está aberto
+            FHIRServiceException: Se o servidor rejeitar o Bundle ou não responder
+        """
+        self._check_circuit()
+
+        try:
+            response = self.session.post(self.base_url, json=bundle, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._record_failure()
+            logger.error(f"Error executing {bundle.get('type')} Bundle: {str(e)}")
+            raise FHIRServiceException(f"Failed to execute Bundle: {str(e)}") from e
+
+        if response.status_code >= 500:
+            self._record_failure()
+        if response.status_code not in [200, 201]:
+            logger.error(f"{bundle.get('type')} Bundle rejected: {response.status_code} - {response.text[:500]}")
+            raise FHIRServiceException(f"Bundle rejected: {response.status_code}", status_code=response.status_code)
+
+        self._record_success()
+        try:
+            return response.json()
+        except ValueError as e:
+            logger.error(f"Invalid {bundle.get('type')} Bundle response: {str(e)}")
+            raise FHIRServiceException(f"Invalid Bundle response: {str(e)}", status_code=response.status_code) from e
+
+    @fhir_operation('read')
+    def get_resource(self, resource_type: str, resource_id: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
         """
         Recupera um único recurso FHIR pelo ID.
         
         Args:
             resource_type: Tipo do recurso (Ex: 'Practitioner', 'Patient')
             resource_id: ID do recurso no FHIR
+            use_cache: Se True, usa cache (padrão)
         
         Returns:
             Dict com o recurso completo, ou None se não encontrado
         """
+        if use_cache:
+            return self._cached_fetch(
+                f"{resource_type}:read:{resource_id}",
+                lambda: self._read_resource(resource_type, resource_id),
+            )
+        return self._read_resource(resource_type, resource_id)
+
+    def _read_resource(self, resource_type: str, resource_id: str) -> Optional[Dict[str, Any]]:
+        """Lê o recurso direto do servidor FHIR (sem cache)."""
         try:
             response = self.session.get(
                 f"{self.base_url}/{resource_type}/{resource_id}",
@@ -954,46 +1272,6 @@ class FHIRService:
             logger.error(f"Error creating Observation: {str(e)}")
             raise FHIRServiceException(f"Failed to create Observation: {str(e)}")
 
-    def get_observations_by_patient_id(self, patient_id: str) -> List[Dict[str, Any]]:
-        """
-        Recupera todas as observações de um paciente.
-        
-        Args:
-            patient_id: ID do paciente
-            
-        Returns:
-            Lista de recursos Observation
-        """
-        try:
-            # Busca por observações onde subject = Patient/{id}
-            # Ordenado por data decrescente (_sort=-date)
-            response = self.session.get(
-                f"{self.base_url}/Observation",
-                params={
-                    "subject": f"Patient/{patient_id}",
-                    "_sort": "-date"
-                },
-                timeout=self.timeout
-            )
-            
-            response.raise_for_status()
-            
-            bundle = response.json()
-            
-            # Extrair recursos do Bundle
-            observations = []
-            if "entry" in bundle:
-                for entry in bundle["entry"]:
-                    if "resource" in entry:
-                        observations.append(entry["resource"])
-            
-            logger.info(f"Retrieved {len(observations)} observations for Patient {patient_id}")
-            return observations
-            
-        except requests.RequestException as e:
-            logger.error(f"Error retrieving observations for Patient {patient_id}: {str(e)}")
-            raise FHIRServiceException(f"Failed to retrieve observations: {str(e)}")
-
     def create_condition_resource(
         self,
         patient_id: str,
@@ -1082,18 +1360,7 @@ class FHIRService:
             raise FHIRServiceException(f"Failed to create Condition: {str(e)}")
 
     def get_conditions_by_patient_id(self, patient_id: str) -> List[Dict[str, Any]]:
-        try:
-            response = self.session.get(
-                f"{self.base_url}/Condition",
-                params={"subject": f"Patient/{patient_id}"},
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            bundle = response.json()
-            return [entry["resource"] for entry in bundle.get("entry", []) if "resource" in entry]
-        except Exception as e:
-            logger.error(f"Error getting conditions: {str(e)}")
-            raise FHIRServiceException(f"Failed to get conditions: {str(e)}")
+        return self.search_resources("Condition", {"subject": f"Patient/{patient_id}"})
 
     def create_allergy_resource(
         self,
@@ -1391,20 +1658,6 @@ class FHIRService:
             logger.error(f"Error creating ClinicalImpression: {str(e)}")
             raise FHIRServiceException(f"Failed to create ClinicalImpression: {str(e)}")
 
-    def get_allergies_by_patient_id(self, patient_id: str) -> List[Dict[str, Any]]:
-        try:
-            response = self.session.get(
-                f"{self.base_url}/AllergyIntolerance",
-                params={"patient": f"Patient/{patient_id}"},
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            bundle = response.json()
-            return [entry["resource"] for entry in bundle.get("entry", []) if "resource" in entry]
-        except Exception as e:
-            logger.error(f"Error getting allergies: {str(e)}")
-            raise FHIRServiceException(f"Failed to get allergies: {str(e)}")
-
     def create_appointment_resource(
         self,
         patient_id: str,
@@ -1448,37 +1701,6 @@ class FHIRService:
             logger.error(f"Error creating Appointment: {str(e)}")
             raise FHIRServiceException(f"Failed to create Appointment: {str(e)}")
 
-    def get_appointments_by_patient_id(self, patient_id: str) -> List[Dict[str, Any]]:
-        try:
-            response = self.session.get(
-                f"{self.base_url}/Appointment",
-                params={
-                    "actor": f"Patient/{patient_id}",
-                    "_sort": "date"
-                },
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            bundle = response.json()
-            return [entry["resource"] for entry in bundle.get("entry", []) if "resource" in entry]
-        except Exception as e:
-            logger.error(f"Error getting appointments: {str(e)}")
-            raise FHIRServiceException(f"Failed to get appointments: {str(e)}")
-
-    def get_encounters_by_patient_id(self, patient_id: str) -> List[Dict[str, Any]]:
-        try:
-            response = self.session.get(
-                f"{self.base_url}/Encounter",
-                params={"subject": f"Patient/{patient_id}", "_sort": "-date"},
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            bundle = response.json()
-            return [entry["resource"] for entry in bundle.get("entry", []) if "resource" in entry]
-        except Exception as e:
-            logger.error(f"Error getting encounters: {str(e)}")
-            raise FHIRServiceException(f"Failed to get encounters: {str(e)}")
-
     def create_schedule_resource(
         self,
         practitioner_id: str,
@@ -1560,24 +1782,12 @@ class FHIRService:
             raise FHIRServiceException(f"Failed to create Slot: {str(e)}")
 
     def search_slots(self, start: str = None, end: str = None, status: str = "free") -> List[Dict[str, Any]]:
-        try:
-            params = {"status": status}
-            if start:
-                params["start"] = f"ge{start}"
-            if end:
-                params["start"] = [f"ge{start}", f"lt{end}"] # HAPI FHIR supports multiple params with same name for range
-
-            response = self.session.get(
-                f"{self.base_url}/Slot",
-                params=params,
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            bundle = response.json()
-            return [entry["resource"] for entry in bundle.get("entry", []) if "resource" in entry]
-        except Exception as e:
-            logger.error(f"Error searching Slots: {str(e)}")
-            raise FHIRServiceException(f"Failed to search Slots: {str(e)}")
+        params = {"status": status}
+        if start:
+            params["start"] = f"ge{start}"
+        if end:
+            params["start"] = [f"ge{start}", f"lt{end}"] # HAPI FHIR supports multiple params with same name for range
+        return self.search_resources("Slot", params)
 
     def create_questionnaire(
         self,
@@ -1935,7 +2145,7 @@ class FHIRService:
         """
         Retorna a contagem total de recursos usando _summary=count.
         """
-        params = search_params or {}
+        params = dict(search_params or {})
         params['_summary'] = 'count'
         try:
             response = self.session.get(
@@ -1949,28 +2159,6 @@ class FHIRService:
             logger.error(f"Error counting {resource_type}: {str(e)}")
             return 0
 
-    def search_resources(self, resource_type: str, search_params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-        """
-        Busca recursos no servidor FHIR usando parâmetros de consulta.
-        """
-        try:
-            response = self.session.get(
-                f"{self.base_url}/{resource_type}",
-                params=search_params,
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            bundle = response.json()
-            
-            # Extrair os recursos do Bundle
-            if 'entry' in bundle:
-                return [entry['resource'] for entry in bundle['entry']]
-            return []
-            
-        except requests.RequestException as e:
-            logger.error(f"Error searching {resource_type}: {str(e)}")
-            raise FHIRServiceException(f"Failed to search {resource_type}: {str(e)}")
-
     def get_observations_by_patient_id(self, patient_id: str, category: Optional[str] = None) -> List[Dict[str, Any]]:
         params = {"patient": f"Patient/{patient_id}"}
         if category:
@@ -2034,64 +2222,240 @@ class FHIRService:
             # Auditoria não deve bloquear a operação principal, mas deve ser logada
             logger.error(f"Failed to create Provenance for {target_reference}: {str(e)}")
 
+    def get_capabilities(self, refresh: bool = False) -> Dict[str, Any]:
+        """
+        Retorna o CapabilityStatement do servidor (/metadata), em cache por CAPABILITIES_TTL.
+        Em caso de falha retorna {} (nenhuma capacidade opcional é assumida).
+        """
+        cls = type(self)
+        if (
+            not refresh
+            and cls._capabilities is not None
+            and time.monotonic() - cls._capabilities_fetched_at < cls.CAPABILITIES_TTL
+        ):
+            return cls._capabilities
+
+        try:
+            response = self.session.get(
+                f"{self.base_url}/metadata",
+                params={"_summary": "true"},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            capabilities = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Could not fetch CapabilityStatement: {str(e)}")
+            return cls._capabilities or {}
+
+        cls._capabilities = capabilities
+        cls._capabilities_fetched_at = time.monotonic()
+        return capabilities
+
+    def supports_operation(self, operation: str, resource_type: Optional[str] = None) -> bool:
+        """
+        Verifica se o servidor anuncia a operação (ex: 'everything' em Patient).
+        """
+        operation = operation.lstrip('$')
+        for rest in self.get_capabilities().get('rest', []):
+            candidates = list(rest.get('operation', []))
+            for resource in rest.get('resource', []):
+                if resource_type is None or resource.get('type') == resource_type:
+                    candidates.extend(resource.get('operation', []))
+            for op in candidates:
+                if op.get('name') == operation or op.get('definition', '').endswith(f"-{operation}"):
+                    return True
+        return False
+
+    def _fan_out_searches(self, searches: List[Tuple[str, Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+        """
+        Executa várias buscas em paralelo no pool de export e produz os recursos
+        à medida que as páginas chegam. A fila limitada aplica backpressure aos
+        workers, então no máximo EXPORT_QUEUE_PAGES páginas ficam em memória.
+        """
+        pages: queue.Queue = queue.Queue(maxsize=self.EXPORT_QUEUE_PAGES)
+        stop = threading.Event()
+        done_marker = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker(resource_type: str, params: Dict[str, Any]) -> None:
+            if stop.is_set():
+                return
+            try:
+                for bundle in self.iter_pages(resource_type, params):
+                    if stop.is_set():
+                        return
+                    resources = [e['resource'] for e in bundle.get('entry', []) if 'resource' in e]
+                    if resources and not put(resources):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done_marker)
+
+        for resource_type, params in searches:
+            # Mantém as chamadas no trace da requisição (Server-Timing)
+            self._export_executor.submit(contextvars.copy_context().run, worker, resource_type, params)
+
+        pending = len(searches)
+        try:
+            while pending:
+                item = pages.get()
+                if item is done_marker:
+                    pending -= 1
+                elif isinstance(item, Exception):
+                    raise FHIRServiceException(f"Failed to export data: {str(item)}")
+                else:
+                    yield from item
+        finally:
+            # Consumidor terminou (ou desistiu): libera workers bloqueados na fila
+            stop.set()
+
+    def iter_patient_everything(self, patient_id: str, include_patient: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Itera sobre todos os recursos do compartimento do paciente.
+
+        Usa a operação nativa Patient/$everything quando o servidor a anuncia;
+        caso contrário, executa as buscas de PATIENT_EXPORT_SEARCHES em paralelo.
+        """
+        if include_patient:
+            yield self.get_patient_by_id(patient_id)
+
+        if self.supports_operation('everything', 'Patient'):
+            logger.info(f"Exporting Patient {patient_id} via native $everything")
+            # $everything marca como include os recursos referenciados (Practitioner, Medication...)
+            for resource in self.iter_resources(f"Patient/{patient_id}/$everything", include_included=True):
+                if resource.get('resourceType') == 'Patient' and resource.get('id') == patient_id:
+                    continue  # Já emitido acima
+                yield resource
+        else:
+            logger.info(f"Exporting Patient {patient_id} via parallel compartment searches")
+            searches = [
+                (resource_type, {param: f"Patient/{patient_id}"})
+                for resource_type, param in self.PATIENT_EXPORT_SEARCHES
+            ]
+            yield from self._fan_out_searches(searches)
+
+    def stream_patient_export(self, patient_id: str, output_format: str = "bundle") -> Iterator[str]:
+        """
+        Exporta os dados do paciente como fluxo de texto, sem acumular listas.
+
+        O Patient e o primeiro recurso do compartimento são lidos antes de
+        retornar o gerador, então um paciente inexistente ou um servidor fora
+        do ar falham imediatamente (antes de iniciar a resposta HTTP). Uma falha
+        no meio do fluxo não pode mais virar erro HTTP: o fluxo termina com um
+        OperationOutcome (última entrada do Bundle ou última linha do NDJSON),
+        para que o cliente detecte o export truncado.
+
+        A auditoria (Provenance) é registrada antes do primeiro chunk, já que os
+        dados começam a sair a partir dele, mesmo que o cliente aborte o download.
+
+        Args:
+            patient_id: ID do paciente
+            output_format: "bundle" (Bundle collection JSON) ou "ndjson"
+
+        Raises:
+            FHIRServiceException: Se o paciente não existe ou o servidor falhar
+        """
+        if output_format not in ("bundle", "ndjson"):
+            raise FHIRServiceException(f"Unsupported export format: {output_format}")
+
+        patient = self.get_patient_by_id(patient_id)
+        logger.info(f"Starting Data Export for Patient {patient_id} ({output_format})...")
+
+        compartment = self.iter_patient_everything(patient_id, include_patient=False)
+        first = next(compartment, None)
+
+        def iter_export_resources() -> Iterator[Dict[str, Any]]:
+            yield patient
+            if first is not None:
+                yield first
+                yield from compartment
+
+        def generate() -> Iterator[str]:
+            self._audit_export(patient_id)
+            count = 0
+            resources = iter_export_resources()
+            if output_format == "ndjson":
+                try:
+                    for resource in resources:
+                        count += 1
+                        yield json.dumps(resource) + "\n"
+                except FHIRServiceException as e:
+                    logger.error(f"Export stream for Patient {patient_id} failed after {count} resources: {e}")
+                    yield json.dumps(self._export_failure_outcome(e)) + "\n"
+            else:
+                header = {
+                    "resourceType": "Bundle",
+                    "type": "collection",
+                    "timestamp": datetime.utcnow().isoformat() + "Z",
+                }
+                yield json.dumps(header)[:-1] + ', "entry": ['
+                try:
+                    for resource in resources:
+                        yield ("," if count else "") + json.dumps({"resource": resource})
+                        count += 1
+                except FHIRServiceException as e:
+                    logger.error(f"Export stream for Patient {patient_id} failed after {count} resources: {e}")
+                    yield ("," if count else "") + json.dumps({"resource": self._export_failure_outcome(e)})
+                yield "]}"
+
+            logger.info(f"Export stream finished with {count} resources.")
+
+        return generate()
+
+    @staticmethod
+    def _export_failure_outcome(error: Exception) -> Dict[str, Any]:
+        """OperationOutcome que marca um export interrompido no meio do fluxo."""
+        return {
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "fatal",
+                "code": "incomplete",
+                "diagnostics": f"Export truncated: {error}",
+            }],
+        }
+
+    def _audit_export(self, patient_id: str) -> None:
+        if self.user:
+            self.create_provenance_resource(
+                target_reference=f"Patient/{patient_id}",
+                activity="EXPORT",
+                agent_name=str(self.user)
+            )
+
+    @fhir_operation('export', resource_type='Patient')
     def export_patient_data(self, patient_id: str) -> Dict[str, Any]:
         """
         Gera um Bundle contendo todos os dados clínicos do paciente.
-        Simula a operação $everything.
+        Usa Patient/$everything quando disponível, senão buscas paralelas.
+        Para pacientes com histórico longo prefira `stream_patient_export`.
         """
         try:
             logger.info(f"Starting Data Export for Patient {patient_id}...")
-            
-            # 1. Patient
-            patient = self.get_patient_by_id(patient_id)
-            
-            # 2. Encounters
-            encounters = self.get_encounters_by_patient_id(patient_id)
-            
-            # 3. Observations
-            observations = self.get_observations_by_patient_id(patient_id)
-            
-            # 4. Conditions
-            conditions = self.get_conditions_by_patient_id(patient_id)
-            
-            # 5. Allergies
-            allergies = self.get_allergies_by_patient_id(patient_id)
-            
-            # 6. Medications
-            medications = self.get_medications_by_patient_id(patient_id)
-
-            # 7. Appointments (Extra)
-            appointments = self.get_appointments_by_patient_id(patient_id)
 
-            # Montar Bundle
             bundle = {
                 "resourceType": "Bundle",
                 "type": "collection",
                 "timestamp": datetime.utcnow().isoformat() + "Z",
-                "entry": []
+                "entry": [
+                    {"resource": resource}
+                    for resource in self.iter_patient_everything(patient_id)
+                ]
             }
-            
-            def add_entry(resource):
-                bundle["entry"].append({"resource": resource})
-                
-            add_entry(patient)
-            for enc in encounters: add_entry(enc)
-            for obs in observations: add_entry(obs)
-            for cond in conditions: add_entry(cond)
-            for alg in allergies: add_entry(alg)
-            for med in medications: add_entry(med)
-            for app in appointments: add_entry(app)
-            
+
             logger.info(f"Export Bundle created with {len(bundle['entry'])} resources.")
-            
+
             # Audit Export action
-            if self.user:
-                self.create_provenance_resource(
-                    target_reference=f"Patient/{patient_id}",
-                    activity="EXPORT",
-                    agent_name=str(self.user)
-                )
-                
+            self._audit_export(patient_id)
+
             return bundle
             
         except Exception as e:
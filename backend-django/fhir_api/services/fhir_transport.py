@@ -0,0 +1,222 @@
+"""
+FHIR HTTP Transport - Sessão HTTP compartilhada com o HAPI FHIR Server.
+
+Todas as instâncias de FHIRService (e os demais serviços que falam com o
+HAPI) reutilizam o mesmo pool de conexões keep-alive do processo, evitando
+um novo handshake TCP/TLS a cada requisição da API.
+
+Recursos:
+- Pool de conexões configurável (FHIR_POOL_CONNECTIONS / FHIR_POOL_MAXSIZE)
+- Timeout padrão (connect, read) aplicado quando a chamada não informa um
+- Compressão gzip opcional do corpo das requisições (FHIR_GZIP_REQUESTS);
+  respostas gzip são negociadas e descomprimidas pelo requests
+- Métricas de utilização do pool (em uso, total, erros, conexões abertas)
+- Histograma de latência por chamada ao HAPI (método, tipo de recurso, status)
+- Registro de cada chamada no trace da requisição em andamento (Server-Timing)
+
+O contexto do usuário (Provenance) continua por instância de FHIRService.
+"""
+
+import gzip
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from ..metrics import track_upstream_call
+from ..tracing import record_upstream_call
+
+logger = logging.getLogger(__name__)
+
+
+def _resource_type(url: str) -> str:
+    """Tipo de recurso (ou operação de sistema) da URL, relativo ao FHIR_SERVER_URL."""
+    base_path = urlsplit(getattr(settings, 'FHIR_SERVER_URL', '')).path.rstrip('/')
+    path = urlsplit(url).path
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    return path.strip('/').split('/')[0] or 'system'
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter com timeout padrão, compressão gzip opcional e contadores de uso.
+    """
+
+    def __init__(
+        self,
+        default_timeout: Any = None,
+        compress_requests: bool = False,
+        compress_min_bytes: int = 1024,
+        **kwargs
+    ):
+        self.default_timeout = default_timeout
+        self.compress_requests = compress_requests
+        self.compress_min_bytes = compress_min_bytes
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.bytes_compressed_saved = 0
+        super().__init__(**kwargs)
+
+    def _compress(self, request: requests.PreparedRequest) -> None:
+        body = request.body
+        if not body or 'Content-Encoding' in request.headers:
+            return
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if not isinstance(body, bytes) or len(body) < self.compress_min_bytes:
+            return
+        compressed = gzip.compress(body, compresslevel=5)
+        request.body = compressed
+        request.headers['Content-Encoding'] = 'gzip'
+        request.headers['Content-Length'] = str(len(compressed))
+        with self._stats_lock:
+            self.bytes_compressed_saved += len(body) - len(compressed)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.default_timeout
+        if self.compress_requests:
+            self._compress(request)
+
+        with self._stats_lock:
+            self.in_flight += 1
+            self.requests_total += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        response = None
+        started = time.perf_counter()
+        try:
+            response = super().send(request, timeout=timeout, **kwargs)
+            return response
+        except requests.RequestException:
+            with self._stats_lock:
+                self.errors_total += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+            duration = time.perf_counter() - started
+            resource_type = _resource_type(request.url)
+            status_code = response.status_code if response is not None else None
+            track_upstream_call(
+                request.method, resource_type,
+                f"{status_code // 100}xx" if status_code else 'error', duration,
+            )
+            record_upstream_call(
+                resource_type, request.method, status_code, duration, request.url,
+                raw=response.raw if response is not None else None,
+            )
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        pools = []
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+            })
+        with self._stats_lock:
+            return {
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "requests_total": self.requests_total,
+                "errors_total": self.errors_total,
+                "bytes_compressed_saved": self.bytes_compressed_saved,
+                "pool_maxsize": self._pool_maxsize,
+                "pools": pools,
+            }
+
+
+class FHIRTransport:
+    """
+    Transporte HTTP process-wide para o HAPI FHIR Server.
+
+    Uso:
+        session = FHIRTransport.get_instance().session
+        session.get(f"{base_url}/Patient", params=..., timeout=...)
+    """
+
+    _instance: Optional['FHIRTransport'] = None
+    _instance_lock = threading.Lock()
+
+    DEFAULT_HEADERS = {
+        'Content-Type': 'application/fhir+json',
+        'Accept': 'application/fhir+json',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    }
+
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 50,
+        max_retries: int = 0,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        compress_requests: bool = False,
+        compress_min_bytes: int = 1024,
+    ):
+        self.adapter = PooledHTTPAdapter(
+            default_timeout=(connect_timeout, read_timeout),
+            compress_requests=compress_requests,
+            compress_min_bytes=compress_min_bytes,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries,
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.headers.update(self.DEFAULT_HEADERS)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    @classmethod
+    def get_instance(cls) -> 'FHIRTransport':
+        """Retorna o transporte compartilhado do processo (lazy)."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(
+                        pool_connections=getattr(settings, 'FHIR_POOL_CONNECTIONS', 10),
+                        pool_maxsize=getattr(settings, 'FHIR_POOL_MAXSIZE', 50),
+                        max_retries=getattr(settings, 'FHIR_POOL_MAX_RETRIES', 0),
+                        connect_timeout=getattr(settings, 'FHIR_CONNECT_TIMEOUT', 5),
+                        read_timeout=getattr(settings, 'FHIR_SERVER_TIMEOUT', 30),
+                        compress_requests=getattr(settings, 'FHIR_GZIP_REQUESTS', False),
+                    )
+                    logger.info("FHIR transport pool created")
+        return cls._instance
+
+    @classmethod
+    def reset_instance(cls) -> None:
+        """Fecha e descarta o transporte compartilhado (para testes / pós-fork)."""
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.session.close()
+            cls._instance = None
+
+    def add_response_hook(self, hook) -> None:
+        """Registra um hook de resposta uma única vez na sessão compartilhada."""
+        hooks = self.session.hooks['response']
+        if hook not in hooks:
+            hooks.append(hook)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.adapter.get_pool_stats()
+
+
+def get_fhir_session() -> requests.Session:
+    """Atalho para a sessão HTTP compartilhada com o HAPI FHIR."""
+    return FHIRTransport.get_instance().session
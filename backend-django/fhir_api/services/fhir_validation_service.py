@@ -17,6 +17,8 @@ from dataclasses import dataclass
 from functools import lru_cache
 from django.conf import settings
 
+from .fhir_transport import get_fhir_session
+
 logger = logging.getLogger(__name__)
 
 
@@ -100,14 +102,10 @@ class FHIRValidationService:
                 params["profile"] = profile
             
             # Call HAPI $validate
-            response = requests.post(
+            response = get_fhir_session().post(
                 url,
                 json=resource,
                 params=params,
-                headers={
-                    "Content-Type": "application/fhir+json",
-                    "Accept": "application/fhir+json"
-                },
                 timeout=10
             )
             
@@ -241,7 +239,7 @@ class FHIRValidationService:
         """
         try:
             url = f"{cls.FHIR_BASE_URL}/{reference}"
-            response = requests.head(url, timeout=5)
+            response = get_fhir_session().head(url, timeout=5)
             
             if response.status_code == 200:
                 return True, None
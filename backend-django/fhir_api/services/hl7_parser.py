@@ -0,0 +1,264 @@
+"""
+HL7 v2.x parsing core
+
+Parser behind HL7Message.from_string (standard library only, no Django
+imports). A message is parsed once, doing only the work the caller needs:
+- segments split in one pass, with a segment-name index (first PID, all
+  OBX) instead of scanning the segment list on every lookup
+- the fields of a segment split on its first field access and kept; fields
+  use HL7 numbering (PID-3 is field 3, MSH-1 the field separator)
+- repetitions, components and subcomponents cut out of the field, and
+  escape sequences (\\F\\, \\S\\, \\T\\, \\R\\, \\E\\, \\Xhh\\, \\.br\\) decoded, only
+  for the value actually returned
+
+Encoding characters are read from MSH-1/MSH-2 (or the BHS/FHS batch
+header), so messages using separators other than |^~\\& are handled.
+`iter_messages` splits an FHS/BHS batch into messages in the same pass.
+
+The per-segment split is done by str.split: in CPython it is several
+times faster than recording field offsets with a Python loop over
+str.find (see hl7_benchmark).
+"""
+
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+# Segmentos cujo campo 1 é o próprio separador de campo
+HEADER_SEGMENTS = ("MSH", "BHS", "FHS")
+BATCH_SEGMENTS = ("FHS", "BHS", "BTS", "FTS")
+
+
+class HL7Encoding(NamedTuple):
+    """Delimiters declared in MSH-1/MSH-2."""
+    field: str = "|"
+    component: str = "^"
+    repetition: str = "~"
+    escape: str = "\\"
+    subcomponent: str = "&"
+
+    @classmethod
+    def from_header(cls, segment: str) -> "HL7Encoding":
+        """Encoding declared by a MSH/BHS/FHS segment (defaults otherwise)."""
+        if segment[:3] not in HEADER_SEGMENTS or len(segment) < 4:
+            return DEFAULT_ENCODING
+        field = segment[3]
+        declared = segment[4:8].split(field, 1)[0]
+        defaults = DEFAULT_ENCODING[1:]
+        return cls(field, *(declared[i] if i < len(declared) else defaults[i] for i in range(4)))
+
+
+DEFAULT_ENCODING = HL7Encoding()
+
+
+def unescape(value: str, encoding: HL7Encoding = DEFAULT_ENCODING) -> str:
+    """Decode HL7 escape sequences (formatting sequences other than .br are dropped)."""
+    escape = encoding.escape
+    if escape not in value:
+        return value
+    replacements = {
+        "F": encoding.field,
+        "S": encoding.component,
+        "T": encoding.subcomponent,
+        "R": encoding.repetition,
+        "E": escape,
+        ".br": "\n",
+    }
+    parts = value.split(escape)
+    # Partes ímpares ficam entre dois caracteres de escape
+    out = [parts[0]]
+    for i in range(1, len(parts), 2):
+        if i + 1 >= len(parts):
+            # Escape sem fechamento: mantém literal
+            out.append(escape + parts[i])
+            break
+        sequence = parts[i]
+        if sequence in replacements:
+            out.append(replacements[sequence])
+        elif sequence[:1] == "X" and len(sequence) > 1:
+            try:
+                out.append(bytes.fromhex(sequence[1:]).decode("latin-1"))
+            except ValueError:
+                out.append(escape + sequence + escape)
+        elif sequence[:1] not in ("H", "N", "Z", "C", "M") and not sequence.startswith("."):
+            out.append(escape + sequence + escape)
+        out.append(parts[i + 1])
+    return "".join(out)
+
+
+def _nth(value: str, separator: str, n: int) -> str:
+    """n-th (1-based) `separator`-delimited piece of value ('' if absent)."""
+    if separator not in value:
+        return value if n == 1 else ""
+    parts = value.split(separator, n)
+    return parts[n - 1] if len(parts) >= n else ""
+
+
+def extract(
+    value: str,
+    encoding: HL7Encoding = DEFAULT_ENCODING,
+    component: Optional[int] = None,
+    subcomponent: Optional[int] = None,
+    repetition: int = 1,
+) -> str:
+    """Decoded repetition/component/subcomponent of a raw field value."""
+    value = _nth(value, encoding.repetition, repetition)
+    if component is not None:
+        value = _nth(value, encoding.component, component)
+        if subcomponent is not None:
+            value = _nth(value, encoding.subcomponent, subcomponent)
+    return unescape(value, encoding)
+
+
+def _segment_lines(text: str) -> List[str]:
+    """Non-blank segments; terminators may be \\r, \\n or \\r\\n."""
+    if "\n" in text:
+        text = text.replace("\r\n", "\r").replace("\n", "\r")
+    return [line for line in text.split("\r") if line and not line.isspace()]
+
+
+class SegmentView:
+    """
+    Read-only view of one segment of a ParsedMessage.
+
+    `fields` gives the raw field list of HL7Segment (without the segment
+    name); get/raw/components use HL7 field numbers.
+    """
+
+    __slots__ = ("message", "index")
+
+    def __init__(self, message: "ParsedMessage", index: int):
+        self.message = message
+        self.index = index
+
+    def __repr__(self) -> str:
+        return f"SegmentView({self.to_string()!r})"
+
+    @property
+    def name(self) -> str:
+        return self.message.names[self.index]
+
+    @property
+    def field_count(self) -> int:
+        return len(self.message.split(self.index)) - 1
+
+    def raw(self, n: int) -> str:
+        """Field n as in the message (escape sequences and separators kept)."""
+        fields = self.message.split(self.index)
+        return fields[n] if 0 < n < len(fields) else ""
+
+    def get(
+        self,
+        n: int,
+        component: Optional[int] = None,
+        subcomponent: Optional[int] = None,
+        repetition: int = 1,
+    ) -> str:
+        """Decoded field n, or one of its components/subcomponents (1-based)."""
+        message, index = self.message, self.index
+        fields = message._fields[index] or message.split(index)
+        value = fields[n] if 0 < n < len(fields) else ""
+        if n <= 2 and message.names[index] in HEADER_SEGMENTS:
+            return value
+        # Caminho rápido de extract(): sem repetições, componentes simples, sem escapes
+        repetition_sep, component_sep, escape = message._separators
+        if repetition != 1 or repetition_sep in value:
+            value = _nth(value, repetition_sep, repetition)
+        if component is not None:
+            value = _nth(value, component_sep, component)
+            if subcomponent is not None:
+                value = _nth(value, message.encoding.subcomponent, subcomponent)
+        return unescape(value, message.encoding) if escape in value else value
+
+    def repetitions(self, n: int) -> List[str]:
+        """Raw repetitions of field n."""
+        raw = self.raw(n)
+        return raw.split(self.message.encoding.repetition) if raw else []
+
+    def components(self, n: int, repetition: int = 1) -> List[str]:
+        """Decoded components of one repetition of field n."""
+        encoding = self.message.encoding
+        value = _nth(self.raw(n), encoding.repetition, repetition)
+        return [unescape(c, encoding) for c in value.split(encoding.component)] if value else []
+
+    @property
+    def fields(self) -> List[str]:
+        fields = self.message.split(self.index)
+        return fields[2:] if self.name in HEADER_SEGMENTS else fields[1:]
+
+    def to_string(self) -> str:
+        return self.message.lines[self.index]
+
+
+class ParsedMessage:
+    """
+    Segments of one HL7 message, indexed by name, with fields split on demand.
+
+    Args:
+        text: message text; segments may end with \\r, \\n or \\r\\n
+    """
+
+    def __init__(self, text: str = "", lines: Optional[List[str]] = None):
+        self.lines = _segment_lines(text) if lines is None else lines
+        self.encoding = HL7Encoding.from_header(self.lines[0]) if self.lines else DEFAULT_ENCODING
+        self._separators = (self.encoding.repetition, self.encoding.component, self.encoding.escape)
+        self.names = [line[:3] for line in self.lines]
+        self.index: Dict[str, List[int]] = {}
+        for i, name in enumerate(self.names):
+            indexes = self.index.get(name)
+            if indexes is None:
+                self.index[name] = [i]
+            else:
+                indexes.append(i)
+        self._fields: List[Optional[List[str]]] = [None] * len(self.lines)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def split(self, i: int) -> List[str]:
+        """Fields of segment i by HL7 number (0 = segment name), split on first use."""
+        fields = self._fields[i]
+        if fields is None:
+            separator = self.encoding.field
+            fields = self.lines[i].split(separator)
+            if self.names[i] in HEADER_SEGMENTS:
+                # MSH-1 é o próprio separador: MSH-2 passa a ser o campo 2
+                fields.insert(1, separator)
+            self._fields[i] = fields
+        return fields
+
+    # =========================================================================
+    # Segments
+    # =========================================================================
+
+    def segment(self, i: int) -> SegmentView:
+        return SegmentView(self, i)
+
+    def segments(self, name: Optional[str] = None) -> List[SegmentView]:
+        """All segments, or those with `name`, in message order."""
+        indexes = range(len(self.lines)) if name is None else self.index.get(name, ())
+        return [SegmentView(self, i) for i in indexes]
+
+    def first(self, name: str) -> Optional[SegmentView]:
+        indexes = self.index.get(name)
+        return SegmentView(self, indexes[0]) if indexes else None
+
+    @property
+    def message_type(self) -> str:
+        """MSH-9 with components joined by ^ (e.g. ORU^R01), whatever the declared separator."""
+        msh = self.first("MSH")
+        if msh is None:
+            return ""
+        return "^".join(msh.raw(9).split(self.encoding.component))
+
+
+def iter_messages(text: str) -> Iterator[ParsedMessage]:
+    """Messages of a single message or an FHS/BHS batch (batch segments skipped)."""
+    lines = _segment_lines(text)
+    start = None
+    for i, line in enumerate(lines):
+        name = line[:3]
+        if name == "MSH" or name in BATCH_SEGMENTS:
+            if start is not None:
+                yield ParsedMessage(lines=lines[start:i])
+            start = i if name == "MSH" else None
+    if start is not None:
+        yield ParsedMessage(lines=lines[start:])
@@ -17,6 +17,8 @@ from datetime import datetime
 from dataclasses import dataclass, field
 from enum import Enum
 
+from .hl7_parser import DEFAULT_ENCODING, HEADER_SEGMENTS, ParsedMessage, extract
+
 logger = logging.getLogger(__name__)
 
 
@@ -62,13 +64,42 @@ class HL7Segment:
         """Parse segment from HL7 string."""
         parts = segment_str.split('|')
         return cls(name=parts[0], fields=parts[1:] if len(parts) > 1 else [])
+    
+    @property
+    def field_count(self) -> int:
+        return len(self.fields) + (1 if self.name in HEADER_SEGMENTS else 0)
+    
+    def get(
+        self,
+        n: int,
+        component: Optional[int] = None,
+        subcomponent: Optional[int] = None,
+        repetition: int = 1
+    ) -> str:
+        """Decoded field n (HL7 numbering), or one of its components (same API as SegmentView)."""
+        if self.name in HEADER_SEGMENTS:
+            # MSH-1 é o separador; MSH-2 (caracteres de codificação) não é decodificado
+            if n == 1:
+                return DEFAULT_ENCODING.field
+            if n == 2:
+                return self.fields[0] if self.fields else ""
+            n -= 1
+        value = self.fields[n - 1] if 0 < n <= len(self.fields) else ""
+        return extract(value, DEFAULT_ENCODING, component, subcomponent, repetition)
 
 
 @dataclass
 class HL7Message:
-    """HL7 v2.x message representation."""
+    """
+    HL7 v2.x message representation.
+    
+    Messages built by HL7Service hold HL7Segment objects; messages parsed
+    with from_string hold read-only SegmentView objects over the original
+    text (fields decoded on access, segments looked up by name in O(1)).
+    """
     message_type: str
     segments: List[HL7Segment] = field(default_factory=list)
+    parsed: Optional[ParsedMessage] = field(default=None, repr=False, compare=False)
     
     def to_string(self) -> str:
         """Convert message to HL7 string format."""
@@ -77,22 +108,13 @@ class HL7Message:
     @classmethod
     def from_string(cls, message_str: str) -> 'HL7Message':
         """Parse HL7 message from string."""
-        lines = message_str.replace('\n', '\r').split('\r')
-        lines = [l for l in lines if l.strip()]
-        
-        segments = [HL7Segment.from_string(line) for line in lines]
-        
-        # Extract message type from MSH
-        message_type = ""
-        for seg in segments:
-            if seg.name == "MSH" and len(seg.fields) >= 8:
-                message_type = seg.fields[7]  # MSH-9
-                break
-        
-        return cls(message_type=message_type, segments=segments)
+        parsed = ParsedMessage(message_str)
+        return cls(message_type=parsed.message_type, segments=parsed.segments(), parsed=parsed)
     
     def get_segment(self, name: str) -> Optional[HL7Segment]:
         """Get first segment by name."""
+        if self.parsed is not None:
+            return self.parsed.first(name)
         for seg in self.segments:
             if seg.name == name:
                 return seg
@@ -100,6 +122,8 @@ class HL7Message:
     
     def get_segments(self, name: str) -> List[HL7Segment]:
         """Get all segments by name."""
+        if self.parsed is not None:
+            return self.parsed.segments(name)
         return [seg for seg in self.segments if seg.name == name]
 
 
@@ -316,36 +340,34 @@ class HL7Service:
         
         # Parse PID
         pid = message.get_segment("PID")
-        if pid and len(pid.fields) >= 5:
-            name_parts = pid.fields[4].split("^") if len(pid.fields) > 4 else ["", ""]
+        if pid and pid.field_count >= 5:
+            given = pid.get(5, 2)
             
             patient = {
                 "resourceType": "Patient",
-                "id": pid.fields[2].split("^")[0] if len(pid.fields) > 2 else "",
+                "id": pid.get(3, 1),
                 "name": [{
-                    "family": name_parts[0] if name_parts else "",
-                    "given": [name_parts[1]] if len(name_parts) > 1 else []
+                    "family": pid.get(5, 1),
+                    "given": [given] if given else []
                 }],
-                "gender": {"M": "male", "F": "female", "O": "other"}.get(
-                    pid.fields[7] if len(pid.fields) > 7 else "", "unknown"
-                ),
-                "birthDate": cls._parse_hl7_date(pid.fields[6]) if len(pid.fields) > 6 else None
+                "gender": {"M": "male", "F": "female", "O": "other"}.get(pid.get(8), "unknown"),
+                "birthDate": cls._parse_hl7_date(pid.get(7))
             }
             
             result["patient"] = patient
         
         # Parse PV1 for encounter
         pv1 = message.get_segment("PV1")
-        if pv1 and len(pv1.fields) >= 2:
+        if pv1 and pv1.field_count >= 2:
             encounter_class = {
                 "I": {"code": "IMP", "display": "Inpatient"},
                 "O": {"code": "AMB", "display": "Ambulatory"},
                 "E": {"code": "EMER", "display": "Emergency"}
-            }.get(pv1.fields[1], {"code": "AMB", "display": "Ambulatory"})
+            }.get(pv1.get(2), {"code": "AMB", "display": "Ambulatory"})
             
             encounter = {
                 "resourceType": "Encounter",
-                "id": pv1.fields[18] if len(pv1.fields) > 18 else "",
+                "id": pv1.get(19),
                 "class": encounter_class,
                 "status": "in-progress",
                 "subject": {"reference": f"Patient/{result.get('patient', {}).get('id', '')}"}
@@ -422,26 +444,21 @@ class HL7Service:
         
         # Get patient ID from PID
         pid = message.get_segment("PID")
-        patient_id = ""
-        if pid and len(pid.fields) > 2:
-            patient_id = pid.fields[2].split("^")[0]
+        patient_id = pid.get(3, 1) if pid else ""
         
         # Parse OBX segments
         obx_segments = message.get_segments("OBX")
         
         for obx in obx_segments:
-            if len(obx.fields) < 5:
+            if obx.field_count < 5:
                 continue
             
-            set_id = obx.fields[0]
-            value_type = obx.fields[1]
-            observation_id = obx.fields[2].split("^")
-            
-            obs_code = observation_id[0] if observation_id else ""
-            obs_display = observation_id[1] if len(observation_id) > 1 else ""
+            value_type = obx.get(2)
+            obs_code = obx.get(3, 1)
+            obs_display = obx.get(3, 2)
             
-            value = obx.fields[4] if len(obx.fields) > 4 else ""
-            units = obx.fields[5] if len(obx.fields) > 5 else ""
+            value = obx.get(5)
+            units = obx.get(6, 1)
             
             observation = {
                 "resourceType": "Observation",
@@ -462,7 +479,7 @@ class HL7Service:
                 try:
                     observation["valueQuantity"] = {
                         "value": float(value),
-                        "unit": units.split("^")[0] if units else ""
+                        "unit": units
                     }
                 except ValueError:
                     observation["valueString"] = value
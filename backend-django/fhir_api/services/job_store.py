@@ -0,0 +1,512 @@
+"""
+Bulk Data Job Store
+
+Durable storage for $export/$import job state so that any gunicorn worker
+(or pod) can answer status polls and pick up pending work.
+
+Backends:
+- DatabaseJobStore: Django ORM (BulkDataJob model), the default
+- RedisJobStore: Redis keys with PX leases (BULK_JOB_STORE=redis)
+- InMemoryJobStore: single-process fallback (tests, local dev)
+
+Leases:
+A worker must `claim()` a job before running it. The claim succeeds if the
+job is pending, or in progress with an expired lease (its worker died).
+The running worker renews the lease with `heartbeat()`, which also returns
+the stored status so cancellations made on other workers are observed.
+Saves are fenced on the lease: while a worker holds an unexpired lease,
+writes from any other worker (one that missed its heartbeats) are refused.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+# Identifies this process as a lease holder
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+PENDING = "pending"
+IN_PROGRESS = "in-progress"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (PENDING, IN_PROGRESS)
+
+
+def _expires_at(data: Dict[str, Any]) -> Optional[datetime]:
+    value = data.get("expires_time")
+    if not value:
+        return None
+    expires = datetime.fromisoformat(value)
+    if timezone.is_naive(expires):
+        expires = timezone.make_aware(expires)
+    return expires
+
+
+class JobStore:
+    """Abstract job store interface. Jobs are stored as to_dict() payloads."""
+
+    def save(self, kind: str, data: Dict[str, Any], worker_id: Optional[str] = None) -> bool:
+        """
+        Insert or update a job.
+
+        A write with status in-progress never overwrites a cancelled job, and
+        a job leased (unexpired) by a worker other than `worker_id` is not
+        overwritten at all; returns False in those cases.
+        """
+        raise NotImplementedError
+
+    def load(self, kind: str, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete(self, kind: str, job_id: str) -> bool:
+        raise NotImplementedError
+
+    def list(self, kind: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List jobs, newest first."""
+        raise NotImplementedError
+
+    def cancel(self, kind: str, job_id: str) -> bool:
+        """Mark a pending/in-progress job as cancelled."""
+        raise NotImplementedError
+
+    def claim(self, kind: str, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        raise NotImplementedError
+
+    def claim_next(self, kind: str, worker_id: str, lease_seconds: int) -> Optional[str]:
+        """Claim the oldest claimable job; returns its id."""
+        raise NotImplementedError
+
+    def heartbeat(self, kind: str, job_id: str, worker_id: str, lease_seconds: int) -> Optional[str]:
+        """Renew the lease. Returns the stored status, or None if the lease was lost."""
+        raise NotImplementedError
+
+    def lease_held(self, kind: str, job_id: str) -> bool:
+        """Whether some worker holds an unexpired lease on the job."""
+        raise NotImplementedError
+
+    def release(self, kind: str, job_id: str, worker_id: str) -> None:
+        raise NotImplementedError
+
+    def expired(self, kind: str) -> List[Dict[str, Any]]:
+        """Jobs whose expires_time has passed."""
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    """Process-local job store (not shared between workers)."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, kind: str, job_id: str) -> str:
+        return f"{kind}:{job_id}"
+
+    def save(self, kind, data, worker_id=None):
+        key = self._key(kind, data["job_id"])
+        with self._lock:
+            record = self._jobs.get(key)
+            if record is None:
+                self._jobs[key] = {"data": data, "lease_owner": None, "lease_expires": 0.0,
+                                   "created": time.time()}
+                return True
+            if record["data"]["status"] == CANCELLED and data["status"] == IN_PROGRESS:
+                return False
+            if record["lease_owner"] not in (None, worker_id) and record["lease_expires"] >= time.time():
+                return False
+            record["data"] = data
+            return True
+
+    def load(self, kind, job_id):
+        with self._lock:
+            record = self._jobs.get(self._key(kind, job_id))
+            return dict(record["data"]) if record else None
+
+    def delete(self, kind, job_id):
+        with self._lock:
+            return self._jobs.pop(self._key(kind, job_id), None) is not None
+
+    def list(self, kind, status=None):
+        prefix = f"{kind}:"
+        with self._lock:
+            records = [r for k, r in self._jobs.items() if k.startswith(prefix)]
+        records.sort(key=lambda r: r["created"], reverse=True)
+        return [dict(r["data"]) for r in records if status is None or r["data"]["status"] == status]
+
+    def cancel(self, kind, job_id):
+        with self._lock:
+            record = self._jobs.get(self._key(kind, job_id))
+            if not record or record["data"]["status"] not in ACTIVE_STATUSES:
+                return False
+            record["data"] = {**record["data"], "status": CANCELLED}
+            return True
+
+    def _claimable(self, record, now):
+        status = record["data"]["status"]
+        if status not in ACTIVE_STATUSES:
+            return False
+        return record["lease_owner"] is None or record["lease_expires"] < now
+
+    def claim(self, kind, job_id, worker_id, lease_seconds):
+        now = time.time()
+        with self._lock:
+            record = self._jobs.get(self._key(kind, job_id))
+            if not record or not self._claimable(record, now):
+                return False
+            record["lease_owner"] = worker_id
+            record["lease_expires"] = now + lease_seconds
+            return True
+
+    def claim_next(self, kind, worker_id, lease_seconds):
+        for data in reversed(self.list(kind)):
+            if self.claim(kind, data["job_id"], worker_id, lease_seconds):
+                return data["job_id"]
+        return None
+
+    def heartbeat(self, kind, job_id, worker_id, lease_seconds):
+        with self._lock:
+            record = self._jobs.get(self._key(kind, job_id))
+            if not record or record["lease_owner"] != worker_id:
+                return None
+            record["lease_expires"] = time.time() + lease_seconds
+            return record["data"]["status"]
+
+    def lease_held(self, kind, job_id):
+        with self._lock:
+            record = self._jobs.get(self._key(kind, job_id))
+            return bool(record and record["lease_owner"] is not None and record["lease_expires"] >= time.time())
+
+    def release(self, kind, job_id, worker_id):
+        with self._lock:
+            record = self._jobs.get(self._key(kind, job_id))
+            if record and record["lease_owner"] == worker_id:
+                record["lease_owner"] = None
+                record["lease_expires"] = 0.0
+
+    def expired(self, kind):
+        now = timezone.now()
+        return [d for d in self.list(kind) if (_expires_at(d) or now) < now]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._jobs.clear()
+
+
+class DatabaseJobStore(JobStore):
+    """
+    Job store backed by the BulkDataJob model.
+
+    Claims are a single conditional UPDATE, so only one worker wins.
+    """
+
+    @property
+    def model(self):
+        from ..models_bulk_data import BulkDataJob
+        return BulkDataJob
+
+    def save(self, kind, data, worker_id=None):
+        from django.db.models import Q
+        job_id = data["job_id"]
+        fields = {"status": data["status"], "data": data, "expires_at": _expires_at(data)}
+        updates = self.model.objects.filter(pk=job_id, kind=kind).filter(
+            Q(lease_owner='') | Q(lease_owner=worker_id or '')
+            | Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=timezone.now())
+        )
+        if data["status"] == IN_PROGRESS:
+            updates = updates.exclude(status=CANCELLED)
+        if updates.update(**fields, updated_at=timezone.now()):
+            return True
+        _, created = self.model.objects.get_or_create(pk=job_id, defaults={"kind": kind, **fields})
+        return created
+
+    def load(self, kind, job_id):
+        row = self.model.objects.filter(pk=job_id, kind=kind).values_list("data", flat=True).first()
+        return row
+
+    def delete(self, kind, job_id):
+        deleted, _ = self.model.objects.filter(pk=job_id, kind=kind).delete()
+        return deleted > 0
+
+    def list(self, kind, status=None):
+        rows = self.model.objects.filter(kind=kind)
+        if status:
+            rows = rows.filter(status=status)
+        return list(rows.order_by("-created_at").values_list("data", flat=True))
+
+    def cancel(self, kind, job_id):
+        rows = self.model.objects.filter(pk=job_id, kind=kind, status__in=ACTIVE_STATUSES)
+        job = rows.values_list("data", flat=True).first()
+        if job is None:
+            return False
+        return rows.update(status=CANCELLED, data={**job, "status": CANCELLED},
+                           updated_at=timezone.now()) > 0
+
+    def _claimable(self, kind):
+        from django.db.models import Q
+        now = timezone.now()
+        return self.model.objects.filter(kind=kind, status__in=ACTIVE_STATUSES).filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+        )
+
+    def claim(self, kind, job_id, worker_id, lease_seconds):
+        now = timezone.now()
+        return self._claimable(kind).filter(pk=job_id).update(
+            lease_owner=worker_id,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            heartbeat_at=now,
+        ) > 0
+
+    def claim_next(self, kind, worker_id, lease_seconds):
+        candidates = self._claimable(kind).order_by("created_at").values_list("pk", flat=True)[:10]
+        for job_id in candidates:
+            if self.claim(kind, job_id, worker_id, lease_seconds):
+                return job_id
+        return None
+
+    def heartbeat(self, kind, job_id, worker_id, lease_seconds):
+        now = timezone.now()
+        rows = self.model.objects.filter(pk=job_id, kind=kind, lease_owner=worker_id)
+        if not rows.update(lease_expires_at=now + timedelta(seconds=lease_seconds), heartbeat_at=now):
+            return None
+        return rows.values_list("status", flat=True).first()
+
+    def lease_held(self, kind, job_id):
+        return self.model.objects.filter(pk=job_id, kind=kind, lease_expires_at__gte=timezone.now()).exists()
+
+    def release(self, kind, job_id, worker_id):
+        self.model.objects.filter(pk=job_id, kind=kind, lease_owner=worker_id).update(
+            lease_owner='', lease_expires_at=None
+        )
+
+    def expired(self, kind):
+        return list(self.model.objects.filter(kind=kind, expires_at__lt=timezone.now())
+                    .values_list("data", flat=True))
+
+
+class RedisJobStore(JobStore):
+    """
+    Job store backed by Redis.
+
+    Keys:
+        bulkjob:{kind}:{id}        job payload (JSON)
+        bulkjob:{kind}:{id}:lease  lease owner, with PX expiry
+        bulkjob:{kind}:index       sorted set of job ids by creation time
+    """
+
+    # Saves with status in-progress must not resurrect a cancelled job, and
+    # only the lease holder (if any) may write
+    _SAVE_SCRIPT = """
+    local old = redis.call('get', KEYS[1])
+    if old and ARGV[2] == 'in-progress' and cjson.decode(old)['status'] == 'cancelled' then
+        return 0
+    end
+    local owner = redis.call('get', KEYS[3])
+    if owner and owner ~= ARGV[5] then
+        return 0
+    end
+    redis.call('set', KEYS[1], ARGV[1])
+    redis.call('zadd', KEYS[2], 'NX', ARGV[3], ARGV[4])
+    return 1
+    """
+
+    _CANCEL_SCRIPT = """
+    local old = redis.call('get', KEYS[1])
+    if not old then return 0 end
+    local job = cjson.decode(old)
+    if job['status'] ~= 'pending' and job['status'] ~= 'in-progress' then return 0 end
+    job['status'] = 'cancelled'
+    redis.call('set', KEYS[1], cjson.encode(job))
+    return 1
+    """
+
+    _RENEW_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    _RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: Optional[str] = None, prefix: str = "bulkjob"):
+        self.url = url or getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.from_url(self.url, decode_responses=True)
+        self.prefix = prefix
+        self._save = self.client.register_script(self._SAVE_SCRIPT)
+        self._cancel = self.client.register_script(self._CANCEL_SCRIPT)
+        self._renew = self.client.register_script(self._RENEW_SCRIPT)
+        self._release = self.client.register_script(self._RELEASE_SCRIPT)
+
+    def _job_key(self, kind, job_id):
+        return f"{self.prefix}:{kind}:{job_id}"
+
+    def _lease_key(self, kind, job_id):
+        return f"{self.prefix}:{kind}:{job_id}:lease"
+
+    def _index_key(self, kind):
+        return f"{self.prefix}:{kind}:index"
+
+    def save(self, kind, data, worker_id=None):
+        job_id = data["job_id"]
+        return bool(self._save(
+            keys=[self._job_key(kind, job_id), self._index_key(kind), self._lease_key(kind, job_id)],
+            args=[json.dumps(data), data["status"], time.time(), job_id, worker_id or ""],
+        ))
+
+    def load(self, kind, job_id):
+        raw = self.client.get(self._job_key(kind, job_id))
+        return json.loads(raw) if raw else None
+
+    def delete(self, kind, job_id):
+        pipe = self.client.pipeline()
+        pipe.delete(self._job_key(kind, job_id), self._lease_key(kind, job_id))
+        pipe.zrem(self._index_key(kind), job_id)
+        deleted, _ = pipe.execute()
+        return deleted > 0
+
+    def _load_many(self, kind, job_ids):
+        if not job_ids:
+            return []
+        raws = self.client.mget([self._job_key(kind, j) for j in job_ids])
+        return [json.loads(raw) for raw in raws if raw]
+
+    def list(self, kind, status=None):
+        jobs = self._load_many(kind, self.client.zrevrange(self._index_key(kind), 0, -1))
+        return [j for j in jobs if status is None or j["status"] == status]
+
+    def cancel(self, kind, job_id):
+        return bool(self._cancel(keys=[self._job_key(kind, job_id)]))
+
+    def claim(self, kind, job_id, worker_id, lease_seconds):
+        job = self.load(kind, job_id)
+        if not job or job["status"] not in ACTIVE_STATUSES:
+            return False
+        return bool(self.client.set(self._lease_key(kind, job_id), worker_id,
+                                    nx=True, px=int(lease_seconds * 1000)))
+
+    def claim_next(self, kind, worker_id, lease_seconds):
+        for job in self._load_many(kind, self.client.zrange(self._index_key(kind), 0, -1)):
+            if job["status"] in ACTIVE_STATUSES and self.claim(kind, job["job_id"], worker_id, lease_seconds):
+                return job["job_id"]
+        return None
+
+    def heartbeat(self, kind, job_id, worker_id, lease_seconds):
+        if not self._renew(keys=[self._lease_key(kind, job_id)],
+                           args=[worker_id, int(lease_seconds * 1000)]):
+            return None
+        job = self.load(kind, job_id)
+        return job["status"] if job else None
+
+    def lease_held(self, kind, job_id):
+        # A chave do lease expira sozinha (PX)
+        return bool(self.client.exists(self._lease_key(kind, job_id)))
+
+    def release(self, kind, job_id, worker_id):
+        self._release(keys=[self._lease_key(kind, job_id)], args=[worker_id])
+
+    def expired(self, kind):
+        now = timezone.now()
+        return [j for j in self.list(kind) if (_expires_at(j) or now) < now]
+
+
+class LeaseKeeper:
+    """
+    Background heartbeat for a claimed job.
+
+    Renews the lease every lease_seconds/3 and calls `on_cancel` when the
+    stored status becomes cancelled, or `on_lost` if another worker took
+    the lease over.
+    """
+
+    def __init__(self, store: JobStore, kind: str, job_id: str, lease_seconds: int,
+                 on_cancel=None, on_lost=None, worker_id: str = WORKER_ID):
+        self.store = store
+        self.kind = kind
+        self.job_id = job_id
+        self.lease_seconds = lease_seconds
+        self.on_cancel = on_cancel
+        self.on_lost = on_lost
+        self.worker_id = worker_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{job_id[:8]}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(max(1.0, self.lease_seconds / 3)):
+            try:
+                status = self.store.heartbeat(self.kind, self.job_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Heartbeat for {self.kind} job {self.job_id} failed: {e}")
+                continue
+            if status is None:
+                logger.warning(f"Lost lease on {self.kind} job {self.job_id}")
+                if self.on_lost:
+                    self.on_lost()
+                return
+            if status == CANCELLED and self.on_cancel:
+                self.on_cancel()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.store.release(self.kind, self.job_id, self.worker_id)
+        return False
+
+
+_job_store: Optional[JobStore] = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """Return the configured job store (BULK_JOB_STORE: database | redis | memory)."""
+    global _job_store
+    if _job_store is None:
+        with _job_store_lock:
+            if _job_store is None:
+                backend = getattr(settings, 'BULK_JOB_STORE', 'database')
+                if backend == 'redis' and REDIS_AVAILABLE:
+                    try:
+                        store = RedisJobStore()
+                        store.client.ping()
+                        _job_store = store
+                    except Exception as e:
+                        logger.warning(f"Redis job store unavailable ({e}), using database")
+                        _job_store = DatabaseJobStore()
+                elif backend == 'memory':
+                    _job_store = InMemoryJobStore()
+                else:
+                    _job_store = DatabaseJobStore()
+                logger.info(f"Bulk data job store: {type(_job_store).__name__}")
+    return _job_store
+
+
+def set_job_store(store: Optional[JobStore]) -> None:
+    """Replace the job store (tests)."""
+    global _job_store
+    with _job_store_lock:
+        _job_store = store
@@ -9,8 +9,20 @@ from typing import Dict, List, Optional
 from dataclasses import dataclass
 from enum import Enum
 
+from .drug_interactions import RXNORM_SYSTEM, severity_rank
+from .terminology_service import TerminologyService
+
 logger = logging.getLogger(__name__)
 
+# Gravidade das interações (RxNav / tabela local) -> tipo e recomendação
+TIPOS_INTERACAO = {0: 'contraindicada', 1: 'grave', 2: 'moderada', 3: 'leve'}
+RECOMENDACOES_INTERACAO = {
+    'contraindicada': 'Não utilizar em conjunto; substituir um dos medicamentos',
+    'grave': 'Evitar uso concomitante ou monitorar o paciente de perto',
+    'moderada': 'Avaliar risco-benefício e monitorar o paciente',
+    'leve': 'Orientar o paciente e monitorar se necessário',
+}
+
 
 class StatusDispensacao(Enum):
     """Status da dispensação"""
@@ -437,15 +449,26 @@ class PharmacyIntegrationService:
         """
         # Extrair códigos dos medicamentos
         codigos = []
+        rxcuis = []
         for mr in medication_requests:
             medication = mr.get('medicationCodeableConcept', {})
-            coding = medication.get('coding', [{}])[0]
-            codigos.append(coding.get('code'))
+            codings = medication.get('coding') or [{}]
+            codigos.append(codings[0].get('code'))
+            rxcuis.extend(c['code'] for c in codings if c.get('system') == RXNORM_SYSTEM and c.get('code'))
         
-        # Em produção, consultar base de interações (DrugBank, FDA, etc.)
-        # Simulação de algumas interações conhecidas
+        # Códigos RxNorm: tabela local de interações (RxNav só para os fora do dataset)
         interacoes = []
+        for interacao in TerminologyService.check_multi_drug_interactions(rxcuis):
+            tipo = TIPOS_INTERACAO.get(severity_rank(interacao['severity']), 'indeterminada')
+            interacoes.append({
+                'tipo': tipo,
+                'medicamento_1': interacao['drug1'] or interacao['drug1_rxcui'],
+                'medicamento_2': interacao['drug2'] or interacao['drug2_rxcui'],
+                'descricao': interacao['description'],
+                'recomendacao': RECOMENDACOES_INTERACAO.get(tipo, 'Revisar com farmacêutico clínico'),
+            })
         
+        # Códigos locais: simulação de algumas interações conhecidas
         # Exemplo: verificar combinações perigosas
         if 'WARFARINA' in str(codigos) and 'AAS' in str(codigos):
             interacoes.append({
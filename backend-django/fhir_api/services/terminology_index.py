@@ -0,0 +1,275 @@
+"""
+Terminology search index
+
+In-memory index over the code tables embedded in ICD10Service,
+TUSSService and CBOService (used while no full release was imported into
+the terminology store), built once per table on first use instead of
+scanning every code with substring checks on each autocomplete keystroke:
+- codes: normalised code -> entry, plus the sorted codes for prefix
+  lookups (bisect)
+- words: accent-folded tokens -> postings, with a sorted vocabulary so
+  every query word (in particular the one still being typed) is a prefix
+  range lookup
+- trigrams of the folded text, for matches inside words and codes
+
+Results are ranked: exact code, code prefix, query words found in the
+primary field (whole words before prefixes, shorter texts first), words
+found in secondary fields, then substring matches.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+WORD_RE = re.compile(r"[0-9a-z]+")
+
+# Níveis do ranking
+_EXACT_CODE, _CODE_PREFIX, _WORDS, _SUBSTRING = 0, 1, 2, 8
+_DOC_BITS = 20
+_DOC_MASK = (1 << _DOC_BITS) - 1
+
+
+def fold(text: str) -> str:
+    """Lowercase without accents ("Cefaléia" -> "cefaleia")."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _intersect(postings: List[array]) -> Set[int]:
+    postings = sorted(postings, key=len)
+    result = set(postings[0])
+    for posting in postings[1:]:
+        if not result:
+            break
+        result.intersection_update(posting)
+    return result
+
+
+class TerminologyIndex:
+    """
+    Search index over one code table.
+
+    Args:
+        entries: {code: {field: value}} in display order
+        fields: searchable text fields, most important first
+        facets: fields with exact-value filters (e.g. TUSS type)
+        normalize_code: canonical form of codes, applied to table and queries
+    """
+
+    def __init__(
+        self,
+        entries: Mapping[str, Dict[str, Any]],
+        fields: Sequence[str],
+        facets: Sequence[str] = (),
+        normalize_code: Callable[[str], str] = str.upper,
+    ):
+        self.normalize_code = normalize_code
+        self.codes: List[str] = []
+        self.entries: List[Dict[str, Any]] = []
+        self.by_code: Dict[str, int] = {}
+        self._texts: List[str] = []
+        primary_len: List[int] = []
+        self.facets: Dict[str, Dict[str, List[int]]] = {name: {} for name in facets}
+
+        # Postings: doc << 2 | posição do campo (0 = principal)
+        words: Dict[str, array] = {}
+        trigrams: Dict[str, array] = {}
+
+        for doc, (code, entry) in enumerate(entries.items()):
+            self.codes.append(code)
+            self.entries.append(entry)
+            self.by_code[normalize_code(code)] = doc
+
+            folded_fields = [fold(str(entry.get(field) or "")) for field in fields]
+            primary_len.append(len(folded_fields[0]) if folded_fields else 0)
+            seen: Set[str] = set()
+            for rank, text in enumerate(folded_fields):
+                for word in WORD_RE.findall(text):
+                    if word not in seen:
+                        seen.add(word)
+                        words.setdefault(word, array("I")).append(doc << 2 | min(rank, 3))
+
+            text = " ".join([fold(code)] + folded_fields)
+            self._texts.append(text)
+            for trigram in _trigrams(text):
+                trigrams.setdefault(trigram, array("I")).append(doc)
+
+            for name in facets:
+                self.facets[name].setdefault(str(entry.get(name)), []).append(doc)
+
+        self._tiebreak = array("Q", (
+            min(length, 0xFFF) << _DOC_BITS | doc for doc, length in enumerate(primary_len)
+        ))
+        # Postings de palavras na ordem do score (campo, texto mais curto, ordem da tabela)
+        tiebreak = self._tiebreak
+        self._words = {
+            word: array("I", sorted(postings, key=lambda p: (p & 3, tiebreak[p >> 2])))
+            for word, postings in words.items()
+        }
+        self._vocabulary = sorted(words)
+        self._trigrams = trigrams
+        ordered = sorted((normalized, doc) for normalized, doc in self.by_code.items())
+        self._sorted_codes = [normalized for normalized, _ in ordered]
+        self._sorted_docs = [doc for _, doc in ordered]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    # =========================================================================
+    # Lookups
+    # =========================================================================
+
+    def get(self, code: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(code, entry) for an exact code."""
+        doc = self.by_code.get(self.normalize_code(code))
+        return None if doc is None else (self.codes[doc], self.entries[doc])
+
+    def longest_prefix(self, code: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(code, entry) of the longest table code the given code starts with (I10.9 -> I10)."""
+        normalized = self.normalize_code(code)
+        for end in range(len(normalized), 0, -1):
+            doc = self.by_code.get(normalized[:end])
+            if doc is not None:
+                return self.codes[doc], self.entries[doc]
+        return None
+
+    def facet(self, name: str, value: str, max_results: Optional[int] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """Entries with an exact facet value, in table order."""
+        docs = self.facets[name].get(value, [])
+        return [(self.codes[doc], self.entries[doc]) for doc in docs[:max_results]]
+
+    # =========================================================================
+    # Search
+    # =========================================================================
+
+    def search(
+        self,
+        term: str,
+        max_results: int = 20,
+        facet: Optional[Tuple[str, str]] = None,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Ranked (code, entry) matches of a code or description query.
+
+        An empty term returns [] unless a facet filter is given, in which
+        case the facet's entries are listed in table order.
+        """
+        allowed = set(self.facets[facet[0]].get(facet[1], ())) if facet else None
+        folded = fold(term).strip()
+        if not folded:
+            return [] if allowed is None else self.facet(facet[0], facet[1], max_results)
+
+        # Score inteiro: (nível << 4 | qualidade) << 32 | desempate (texto mais curto, ordem da tabela)
+        scores: Dict[int, int] = {}
+        tiebreak = self._tiebreak
+
+        def offer(doc: int, level: int) -> None:
+            if allowed is not None and doc not in allowed:
+                return
+            score = level << 32 | tiebreak[doc]
+            if score < scores.get(doc, score + 1):
+                scores[doc] = score
+
+        # 1. Código exato / prefixo do código
+        code = self.normalize_code(term.strip())
+        if code:
+            start = bisect.bisect_left(self._sorted_codes, code)
+            end = bisect.bisect_left(self._sorted_codes, code + "\U0010ffff", start)
+            candidates = (
+                (min(len(self._sorted_codes[i]) - len(code), 15) << 32 | tiebreak[doc], doc)
+                for i, doc in zip(range(start, end), self._sorted_docs[start:end])
+                if allowed is None or doc in allowed
+            )
+            for key, doc in heapq.nsmallest(max_results, candidates):
+                extra = key >> 32
+                offer(doc, (_CODE_PREFIX if extra else _EXACT_CODE) << 4 | extra)
+
+        # 2. Palavras: cada palavra da consulta é prefixo de alguma palavra do texto
+        query_words = WORD_RE.findall(folded)
+        if len(query_words) == 1 and len(scores) < max_results:
+            # Postings já ordenados pelo score: basta ler os primeiros
+            for key in heapq.merge(*self._ranked_postings(query_words[0])):
+                offer(key & _DOC_MASK, (_WORDS + (key >> 33)) << 4 | (key >> 32 & 1))
+                if len(scores) >= max_results:
+                    break
+        elif query_words and len(scores) < max_results:
+            matches = sorted((self._word_matches(word) for word in query_words), key=len)
+            for doc, quality in matches[0].items():
+                rank, partial = quality >> 1, quality & 1
+                for match in matches[1:]:
+                    other = match.get(doc)
+                    if other is None:
+                        break
+                    rank, partial = max(rank, other >> 1), partial + (other & 1)
+                else:
+                    offer(doc, (_WORDS + rank) << 4 | min(partial, 15))
+
+        # 3. Substring (dentro de palavras/códigos), só para completar o resultado
+        if len(scores) < max_results and len(folded) >= 3:
+            postings = [self._trigrams.get(t) for t in _trigrams(folded)]
+            if all(postings):
+                for doc in _intersect(postings):
+                    if doc not in scores and folded in self._texts[doc]:
+                        offer(doc, _SUBSTRING << 4)
+
+        best = heapq.nsmallest(max_results, scores.values())
+        return [(self.codes[doc], self.entries[doc]) for doc in (score & _DOC_MASK for score in best)]
+
+    def _vocabulary_range(self, word: str) -> Iterator[str]:
+        """Indexed words starting with `word`."""
+        vocabulary = self._vocabulary
+        for i in range(bisect.bisect_left(vocabulary, word), len(vocabulary)):
+            if not vocabulary[i].startswith(word):
+                break
+            yield vocabulary[i]
+
+    def _ranked_postings(self, word: str) -> List[Iterator[int]]:
+        """One sorted stream of field position << 33 | partial << 32 | tiebreak per matching word."""
+        tiebreak = self._tiebreak
+
+        def stream(postings: array, partial: int) -> Iterator[int]:
+            for posting in postings:
+                yield ((posting & 3) << 1 | partial) << 32 | tiebreak[posting >> 2]
+
+        return [stream(self._words[candidate], int(candidate != word)) for candidate in self._vocabulary_range(word)]
+
+    def _word_matches(self, word: str) -> Dict[int, int]:
+        """doc -> field position << 1 | partial, for text words starting with `word`."""
+        matches: Dict[int, int] = {}
+        for candidate in self._vocabulary_range(word):
+            partial = candidate != word
+            for posting in self._words[candidate]:
+                doc, quality = posting >> 2, (posting & 3) << 1 | partial
+                if quality < matches.get(doc, 8):
+                    matches[doc] = quality
+        return matches
+
+
+class LazyTerminologyIndex:
+    """Index built on first use (thread-safe) and rebuilt after reset()."""
+
+    def __init__(self, build: Callable[[], TerminologyIndex]):
+        self._build = build
+        self._index: Optional[TerminologyIndex] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> TerminologyIndex:
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._build()
+                index = self._index
+        return index
+
+    def reset(self) -> None:
+        with self._lock:
+            self._index = None
@@ -8,25 +8,86 @@ This module provides integration with medical terminology systems:
 - SNOMED CT mappings
 """
 
+import contextvars
 import logging
 import requests
-from typing import Dict, List, Optional, Any
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Any
+
+from django.conf import settings
+
+from .cache_service import CacheService, cache_service
+from .drug_interactions import get_interaction_source
+from .terminology_store import TerminologySource, TerminologySpec
 
 logger = logging.getLogger(__name__)
 
 # RxNorm API base URL (NLM public API - no authentication required)
 RXNORM_API_BASE = "https://rxnav.nlm.nih.gov/REST"
 
+# Respostas do RxNav no CacheService (Redis: compartilhadas entre workers e restarts)
+RXNORM_CACHE_PREFIX = f"{CacheService.PREFIX_TERMINOLOGY}:rxnorm"
+
+# Detalhes de vários RxCUIs buscados em paralelo
+_rxnav_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'RXNORM_MAX_WORKERS', 8),
+    thread_name_prefix='rxnav',
+)
+
+
+def rxnav_cached(default: Callable[[], Any], key: Callable[..., Any] = None):
+    """
+    Cache a TerminologyService RxNav lookup in CacheService.
+    
+    Results are kept RXNORM_CACHE_TTL seconds (empty ones only
+    RXNORM_NEGATIVE_TTL) and served stale for RXNORM_STALE_TTL more while
+    one background refresh runs. API errors are logged, return ``default()``
+    and are never cached. ``key`` maps the call arguments to the cache key
+    (e.g. order-independent drug sets); by default the arguments as given.
+    
+    Like functools.lru_cache, the wrapper exposes ``cache_clear()``;
+    ``fetch(cls, ...)`` is the same cached lookup raising API errors, for
+    callers that must not cache a result built from a failed lookup.
+    """
+    def decorator(func):
+        prefix = f"{RXNORM_CACHE_PREFIX}:{func.__name__}"
+        
+        def cache_key(*args, **kwargs) -> str:
+            parts = key(*args, **kwargs) if key else (args, kwargs)
+            return f"{prefix}:{CacheService.generate_key(parts)}"
+        
+        def fetch(cls, *args, **kwargs):
+            return cache_service.fetch(
+                cache_key(*args, **kwargs),
+                lambda: func(cls, *args, **kwargs),
+                ttl=getattr(settings, 'RXNORM_CACHE_TTL', CacheService.TTL_VERY_LONG),
+                stale_ttl=getattr(settings, 'RXNORM_STALE_TTL', CacheService.TTL_VERY_LONG),
+                negative_ttl=getattr(settings, 'RXNORM_NEGATIVE_TTL', CacheService.TTL_LONG),
+            )
+        
+        @wraps(func)
+        def wrapper(cls, *args, **kwargs):
+            try:
+                return fetch(cls, *args, **kwargs)
+            except requests.RequestException as e:
+                logger.error(f"RxNorm API error ({func.__name__}): {str(e)}")
+            except Exception as e:
+                logger.error(f"Error in RxNorm {func.__name__}: {str(e)}")
+            return default()
+        
+        wrapper.cache_key = cache_key
+        wrapper.fetch = fetch
+        wrapper.cache_clear = lambda: cache_service.backend.clear_pattern(f"{prefix}:*")
+        return wrapper
+    return decorator
+
 
 class TerminologyService:
     """Service for medical terminology lookups and validations."""
     
-    # Cache TTL in seconds (1 hour for terminology data)
-    _cache_ttl = 3600
-    
     @classmethod
-    @lru_cache(maxsize=1000)
+    @rxnav_cached(default=list, key=lambda term, max_results=20: (term.strip().lower(), max_results))
     def search_rxnorm(cls, term: str, max_results: int = 20) -> List[Dict[str, Any]]:
         """
         Search RxNorm for medications by name.
@@ -38,44 +99,38 @@ class TerminologyService:
         Returns:
             List of matching medications with RxCUI codes
         """
-        try:
-            # Use approximate matching for better results
-            url = f"{RXNORM_API_BASE}/approximateTerm.json"
-            params = {"term": term, "maxEntries": max_results}
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            candidates = data.get("approximateGroup", {}).get("candidate", [])
-            
-            results = []
-            for candidate in candidates[:max_results]:
-                rxcui = candidate.get("rxcui")
-                if rxcui:
-                    # Get detailed info for each result
-                    details = cls.get_rxnorm_details(rxcui)
-                    if details:
-                        results.append({
-                            "rxcui": rxcui,
-                            "name": details.get("name", candidate.get("name", "")),
-                            "score": candidate.get("score", 0),
-                            "tty": details.get("tty", ""),  # Term type (SCD, SBD, etc.)
-                            "synonym": details.get("synonym", "")
-                        })
-            
-            logger.info(f"RxNorm search for '{term}' returned {len(results)} results")
-            return results
-            
-        except requests.RequestException as e:
-            logger.error(f"RxNorm API error: {str(e)}")
-            return []
-        except Exception as e:
-            logger.error(f"Error searching RxNorm: {str(e)}")
-            return []
+        # Use approximate matching for better results
+        url = f"{RXNORM_API_BASE}/approximateTerm.json"
+        params = {"term": term, "maxEntries": max_results}
+        
+        response = requests.get(url, params=params, timeout=10)
+        response.raise_for_status()
+        
+        data = response.json()
+        candidates = [c for c in data.get("approximateGroup", {}).get("candidate", [])[:max_results] if c.get("rxcui")]
+        
+        # Get detailed info for all results at once (cache + concurrent requests);
+        # a failed lookup raises, so a shortened result list is never cached
+        details = cls.get_rxnorm_details_many([c["rxcui"] for c in candidates])
+        
+        results = []
+        for candidate in candidates:
+            rxcui = candidate["rxcui"]
+            info = details.get(rxcui)
+            if info:
+                results.append({
+                    "rxcui": rxcui,
+                    "name": info.get("name") or candidate.get("name", ""),
+                    "score": candidate.get("score", 0),
+                    "tty": info.get("tty", ""),  # Term type (SCD, SBD, etc.)
+                    "synonym": info.get("synonym", "")
+                })
+        
+        logger.info(f"RxNorm search for '{term}' returned {len(results)} results")
+        return results
     
     @classmethod
-    @lru_cache(maxsize=500)
+    @rxnav_cached(default=lambda: None)
     def get_rxnorm_details(cls, rxcui: str) -> Optional[Dict[str, Any]]:
         """
         Get detailed information for an RxNorm concept.
@@ -86,32 +141,62 @@ class TerminologyService:
         Returns:
             Dictionary with medication details
         """
-        try:
-            url = f"{RXNORM_API_BASE}/rxcui/{rxcui}/properties.json"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            props = data.get("properties", {})
-            
-            return {
-                "rxcui": rxcui,
-                "name": props.get("name", ""),
-                "tty": props.get("tty", ""),
-                "synonym": props.get("synonym", ""),
-                "language": props.get("language", "ENG"),
-                "active": props.get("suppress", "N") != "Y"
+        url = f"{RXNORM_API_BASE}/rxcui/{rxcui}/properties.json"
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        
+        data = response.json()
+        props = data.get("properties", {})
+        
+        return {
+            "rxcui": rxcui,
+            "name": props.get("name", ""),
+            "tty": props.get("tty", ""),
+            "synonym": props.get("synonym", ""),
+            "language": props.get("language", "ENG"),
+            "active": props.get("suppress", "N") != "Y"
+        }
+    
+    @classmethod
+    def get_rxnorm_details_many(cls, rxcuis: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Details for several RxNorm concepts.
+        
+        Fresh cached details come from one multi-get; the others are looked
+        up concurrently (RXNORM_MAX_WORKERS), each through the cache.
+        
+        Returns:
+            {rxcui: details}
+        
+        Raises:
+            requests.RequestException: If any lookup failed (unlike
+                get_rxnorm_details, which returns None)
+        """
+        rxcuis = list(dict.fromkeys(rxcuis))
+        keys = {rxcui: cls.get_rxnorm_details.cache_key(rxcui) for rxcui in rxcuis}
+        cached = cache_service.get_many(list(keys.values()))
+        
+        results = {}
+        for rxcui, key in keys.items():
+            entry = cached.get(key)
+            if cache_service.is_entry(entry) and not cache_service.needs_refresh(entry):
+                results[rxcui] = entry["v"]
+        
+        missing = [rxcui for rxcui in rxcuis if rxcui not in results]
+        if len(missing) == 1:
+            results[missing[0]] = cls.get_rxnorm_details.fetch(cls, missing[0])
+        elif missing:
+            futures = {
+                rxcui: _rxnav_executor.submit(contextvars.copy_context().run, cls.get_rxnorm_details.fetch, cls, rxcui)
+                for rxcui in missing
             }
-            
-        except requests.RequestException as e:
-            logger.error(f"RxNorm details error for {rxcui}: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"Error getting RxNorm details: {str(e)}")
-            return None
+            for rxcui, future in futures.items():
+                results[rxcui] = future.result()
+        
+        return {rxcui: results.get(rxcui) for rxcui in rxcuis}
     
     @classmethod
-    @lru_cache(maxsize=200)
+    @rxnav_cached(default=list)
     def get_rxnorm_interactions(cls, rxcui: str) -> List[Dict[str, Any]]:
         """
         Get drug interactions for an RxNorm concept.
@@ -122,37 +207,29 @@ class TerminologyService:
         Returns:
             List of potential drug interactions
         """
-        try:
-            url = f"{RXNORM_API_BASE}/interaction/interaction.json"
-            params = {"rxcui": rxcui}
-            
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            
-            data = response.json()
-            interaction_groups = data.get("interactionTypeGroup", [])
-            
-            interactions = []
-            for group in interaction_groups:
-                source = group.get("sourceName", "")
-                for interaction_type in group.get("interactionType", []):
-                    for pair in interaction_type.get("interactionPair", []):
-                        interactions.append({
-                            "source": source,
-                            "severity": pair.get("severity", "unknown"),
-                            "description": pair.get("description", ""),
-                            "interacting_drug": pair.get("interactionConcept", [{}])[1].get("minConceptItem", {}).get("name", "") if len(pair.get("interactionConcept", [])) > 1 else ""
-                        })
-            
-            logger.info(f"Found {len(interactions)} interactions for RxCUI {rxcui}")
-            return interactions
-            
-        except requests.RequestException as e:
-            logger.error(f"RxNorm interactions error for {rxcui}: {str(e)}")
-            return []
-        except Exception as e:
-            logger.error(f"Error getting RxNorm interactions: {str(e)}")
-            return []
+        url = f"{RXNORM_API_BASE}/interaction/interaction.json"
+        params = {"rxcui": rxcui}
+        
+        response = requests.get(url, params=params, timeout=15)
+        response.raise_for_status()
+        
+        data = response.json()
+        interaction_groups = data.get("interactionTypeGroup", [])
+        
+        interactions = []
+        for group in interaction_groups:
+            source = group.get("sourceName", "")
+            for interaction_type in group.get("interactionType", []):
+                for pair in interaction_type.get("interactionPair", []):
+                    interactions.append({
+                        "source": source,
+                        "severity": pair.get("severity", "unknown"),
+                        "description": pair.get("description", ""),
+                        "interacting_drug": pair.get("interactionConcept", [{}])[1].get("minConceptItem", {}).get("name", "") if len(pair.get("interactionConcept", [])) > 1 else ""
+                    })
+        
+        logger.info(f"Found {len(interactions)} interactions for RxCUI {rxcui}")
+        return interactions
     
     @classmethod
     def check_multi_drug_interactions(cls, rxcuis: List[str]) -> List[Dict[str, Any]]:
@@ -165,42 +242,55 @@ class TerminologyService:
         Returns:
             List of interactions between the provided drugs
         """
+        # O mesmo conjunto de medicamentos, em qualquer ordem, usa a mesma entrada do cache
+        rxcuis = sorted(set(rxcuis))
         if len(rxcuis) < 2:
             return []
-            
-        try:
-            url = f"{RXNORM_API_BASE}/interaction/list.json"
-            params = {"rxcuis": "+".join(rxcuis)}
-            
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            
-            data = response.json()
-            interactions = []
-            
-            for group in data.get("fullInteractionTypeGroup", []):
-                for interaction_type in group.get("fullInteractionType", []):
-                    for pair in interaction_type.get("interactionPair", []):
-                        concepts = pair.get("interactionConcept", [])
-                        if len(concepts) >= 2:
-                            interactions.append({
-                                "drug1": concepts[0].get("minConceptItem", {}).get("name", ""),
-                                "drug1_rxcui": concepts[0].get("minConceptItem", {}).get("rxcui", ""),
-                                "drug2": concepts[1].get("minConceptItem", {}).get("name", ""),
-                                "drug2_rxcui": concepts[1].get("minConceptItem", {}).get("rxcui", ""),
-                                "severity": pair.get("severity", "unknown"),
-                                "description": pair.get("description", "")
-                            })
-            
-            return interactions
-            
-        except Exception as e:
-            logger.error(f"Error checking multi-drug interactions: {str(e)}")
-            return []
+
+        table = get_interaction_source().get()
+        if table is None:
+            return cls._fetch_multi_drug_interactions(rxcuis)
+
+        # Tabela local; o RxNav só é consultado para medicamentos fora do dataset
+        interactions, unknown = table.check(rxcuis)
+        if unknown:
+            interactions.extend(
+                interaction for interaction in cls._fetch_multi_drug_interactions(rxcuis)
+                if interaction["drug1_rxcui"] in unknown or interaction["drug2_rxcui"] in unknown
+            )
+        return interactions
+    
+    @classmethod
+    @rxnav_cached(default=list)
+    def _fetch_multi_drug_interactions(cls, rxcuis: List[str]) -> List[Dict[str, Any]]:
+        url = f"{RXNORM_API_BASE}/interaction/list.json"
+        params = {"rxcuis": "+".join(rxcuis)}
+        
+        response = requests.get(url, params=params, timeout=15)
+        response.raise_for_status()
+        
+        data = response.json()
+        interactions = []
+        
+        for group in data.get("fullInteractionTypeGroup", []):
+            for interaction_type in group.get("fullInteractionType", []):
+                for pair in interaction_type.get("interactionPair", []):
+                    concepts = pair.get("interactionConcept", [])
+                    if len(concepts) >= 2:
+                        interactions.append({
+                            "drug1": concepts[0].get("minConceptItem", {}).get("name", ""),
+                            "drug1_rxcui": concepts[0].get("minConceptItem", {}).get("rxcui", ""),
+                            "drug2": concepts[1].get("minConceptItem", {}).get("name", ""),
+                            "drug2_rxcui": concepts[1].get("minConceptItem", {}).get("rxcui", ""),
+                            "severity": pair.get("severity", "unknown"),
+                            "description": pair.get("description", "")
+                        })
+        
+        return interactions
 
 
 # ICD-10 Code Database (subset of commonly used codes)
-# Full database would be loaded from a JSON file
+# Full database: python manage.py terminology_import icd10 <arquivo> --release <versão>
 ICD10_CODES = {
     # Infectious diseases (A00-B99)
     "A09": {"description": "Outras gastroenterites e colites de origem infecciosa e não especificada", "category": "Doenças infecciosas intestinais"},
@@ -280,6 +370,16 @@ ICD10_CODES = {
 }
 
 
+def normalize_icd10(code: str) -> str:
+    """Canonical ICD-10 code (upper case, without dots)."""
+    return code.strip().upper().replace(".", "")
+
+
+ICD10_SPEC = TerminologySpec("icd10", ("description", "category"), normalize_code=normalize_icd10)
+# Release importada ativa ou o subconjunto acima (índice construído no primeiro uso)
+_ICD10_SOURCE = TerminologySource(ICD10_SPEC, ICD10_CODES)
+
+
 class ICD10Service:
     """Service for ICD-10 code validation and lookup."""
     
@@ -295,25 +395,15 @@ class ICD10Service:
         Returns:
             List of matching ICD-10 codes
         """
-        term_lower = term.lower()
-        results = []
-        
-        for code, info in ICD10_CODES.items():
-            # Search in code, description and category
-            if (term_lower in code.lower() or 
-                term_lower in info["description"].lower() or
-                term_lower in info["category"].lower()):
-                results.append({
-                    "code": code,
-                    "description": info["description"],
-                    "category": info["category"],
-                    "system": "http://hl7.org/fhir/sid/icd-10"
-                })
-                
-                if len(results) >= max_results:
-                    break
-        
-        return results
+        return [
+            {
+                "code": code,
+                "description": info["description"],
+                "category": info["category"],
+                "system": "http://hl7.org/fhir/sid/icd-10"
+            }
+            for code, info in _ICD10_SOURCE.get().search(term, max_results)
+        ]
     
     @classmethod
     def validate(cls, code: str) -> Optional[Dict[str, Any]]:
@@ -326,23 +416,20 @@ class ICD10Service:
         Returns:
             Code details if valid, None if invalid
         """
-        # Normalize code (remove dots)
-        normalized = code.upper().replace(".", "")
-        
-        # Check with and without subcodes
-        for icd_code in ICD10_CODES:
-            if normalized.startswith(icd_code.replace(".", "").upper()):
-                info = ICD10_CODES[icd_code]
-                return {
-                    "code": code,
-                    "normalized": icd_code,
-                    "description": info["description"],
-                    "category": info["category"],
-                    "valid": True,
-                    "system": "http://hl7.org/fhir/sid/icd-10"
-                }
-        
-        return None
+        # Código mais longo da tabela que prefixa o informado (I10.9 -> I10)
+        match = _ICD10_SOURCE.get().longest_prefix(code)
+        if match is None:
+            return None
+        
+        icd_code, info = match
+        return {
+            "code": code,
+            "normalized": icd_code,
+            "description": info["description"],
+            "category": info["category"],
+            "valid": True,
+            "system": "http://hl7.org/fhir/sid/icd-10"
+        }
     
     @classmethod
     def get_by_code(cls, code: str) -> Optional[Dict[str, Any]]:
@@ -370,7 +457,11 @@ ICD10_SNOMED_MAP = {
 }
 
 # SNOMED CT to ICD-10 reverse mapping
-SNOMED_ICD10_MAP = {v["snomed"]: {"icd10": k, **v} for k, v in ICD10_SNOMED_MAP.items()}
+
+ICD10_SNOMED_SPEC = TerminologySpec(
+    "icd10-snomed", ("snomed_display",), facets=("snomed",), normalize_code=normalize_icd10
+)
+_ICD10_SNOMED_SOURCE = TerminologySource(ICD10_SNOMED_SPEC, ICD10_SNOMED_MAP)
 
 
 class TerminologyMappingService:
@@ -387,35 +478,23 @@ class TerminologyMappingService:
         Returns:
             SNOMED CT mapping if found
         """
-        normalized = icd10_code.upper().replace(".", "")
-        
-        # Check exact match first
-        if normalized in ICD10_SNOMED_MAP:
-            mapping = ICD10_SNOMED_MAP[normalized]
-            return {
-                "source_system": "http://hl7.org/fhir/sid/icd-10",
-                "source_code": icd10_code,
-                "target_system": "http://snomed.info/sct",
-                "target_code": mapping["snomed"],
-                "target_display": mapping["snomed_display"],
-                "equivalence": "equivalent"
-            }
+        normalized = normalize_icd10(icd10_code)
         
-        # Check prefix matches (e.g., I21.0 -> I21)
-        for prefix_len in range(len(normalized) - 1, 2, -1):
-            prefix = normalized[:prefix_len]
-            if prefix in ICD10_SNOMED_MAP:
-                mapping = ICD10_SNOMED_MAP[prefix]
-                return {
-                    "source_system": "http://hl7.org/fhir/sid/icd-10",
-                    "source_code": icd10_code,
-                    "target_system": "http://snomed.info/sct",
-                    "target_code": mapping["snomed"],
-                    "target_display": mapping["snomed_display"],
-                    "equivalence": "wider"  # Less specific match
-                }
-        
-        return None
+        # Exact match or the longest mapped prefix (e.g., I21.0 -> I21)
+        match = _ICD10_SNOMED_SOURCE.get().longest_prefix(normalized)
+        if match is None or len(normalize_icd10(match[0])) < 3:
+            return None
+        
+        code, mapping = match
+        return {
+            "source_system": "http://hl7.org/fhir/sid/icd-10",
+            "source_code": icd10_code,
+            "target_system": "http://snomed.info/sct",
+            "target_code": mapping["snomed"],
+            "target_display": mapping["snomed_display"],
+            # Less specific match when only a prefix is mapped
+            "equivalence": "equivalent" if normalize_icd10(code) == normalized else "wider"
+        }
     
     @classmethod
     def snomed_to_icd10(cls, snomed_code: str) -> Optional[Dict[str, Any]]:
@@ -428,20 +507,21 @@ class TerminologyMappingService:
         Returns:
             ICD-10 mapping if found
         """
-        if snomed_code in SNOMED_ICD10_MAP:
-            mapping = SNOMED_ICD10_MAP[snomed_code]
-            icd10_info = ICD10_CODES.get(mapping["icd10"], {})
-            return {
-                "source_system": "http://snomed.info/sct",
-                "source_code": snomed_code,
-                "source_display": mapping["snomed_display"],
-                "target_system": "http://hl7.org/fhir/sid/icd-10",
-                "target_code": mapping["icd10"],
-                "target_display": icd10_info.get("description", ""),
-                "equivalence": "equivalent"
-            }
+        matches = _ICD10_SNOMED_SOURCE.get().facet("snomed", snomed_code, 1)
+        if not matches:
+            return None
         
-        return None
+        icd10_code, mapping = matches[0]
+        icd10 = _ICD10_SOURCE.get().get(icd10_code)
+        return {
+            "source_system": "http://snomed.info/sct",
+            "source_code": snomed_code,
+            "source_display": mapping["snomed_display"],
+            "target_system": "http://hl7.org/fhir/sid/icd-10",
+            "target_code": icd10_code,
+            "target_display": icd10[1].get("description", "") if icd10 else "",
+            "equivalence": "equivalent"
+        }
 
 
 # TUSS (Tabela Unificada de Saúde Suplementar) codes
@@ -504,6 +584,11 @@ TUSS_CODES = {
 }
 
 
+TUSS_SPEC = TerminologySpec("tuss", ("description", "category"), facets=("type",), normalize_code=str.strip)
+# Release importada ativa ou o subconjunto acima (índice construído no primeiro uso)
+_TUSS_SOURCE = TerminologySource(TUSS_SPEC, TUSS_CODES)
+
+
 class TUSSService:
     """Service for TUSS code validation and lookup."""
     
@@ -520,30 +605,11 @@ class TUSSService:
         Returns:
             List of matching TUSS codes
         """
-        term_lower = term.lower()
-        results = []
-        
-        for code, info in TUSS_CODES.items():
-            # Filter by type if specified
-            if procedure_type and info["type"] != procedure_type:
-                continue
-                
-            # Search in code, description and category
-            if (term_lower in code or 
-                term_lower in info["description"].lower() or
-                term_lower in info["category"].lower()):
-                results.append({
-                    "code": code,
-                    "description": info["description"],
-                    "type": info["type"],
-                    "category": info["category"],
-                    "system": "http://www.ans.gov.br/tuss"
-                })
-                
-                if len(results) >= max_results:
-                    break
-        
-        return results
+        facet = ("type", procedure_type) if procedure_type else None
+        return [
+            cls._result(code, info)
+            for code, info in _TUSS_SOURCE.get().search(term, max_results, facet=facet)
+        ]
     
     @classmethod
     def validate(cls, code: str) -> Optional[Dict[str, Any]]:
@@ -556,18 +622,11 @@ class TUSSService:
         Returns:
             Code details if valid, None if invalid
         """
-        if code in TUSS_CODES:
-            info = TUSS_CODES[code]
-            return {
-                "code": code,
-                "description": info["description"],
-                "type": info["type"],
-                "category": info["category"],
-                "valid": True,
-                "system": "http://www.ans.gov.br/tuss"
-            }
+        match = _TUSS_SOURCE.get().get(code)
+        if match is None:
+            return None
         
-        return None
+        return {**cls._result(*match), "valid": True}
     
     @classmethod
     def get_by_code(cls, code: str) -> Optional[Dict[str, Any]]:
@@ -586,18 +645,17 @@ class TUSSService:
         Returns:
             List of TUSS codes
         """
-        results = []
-        for code, info in TUSS_CODES.items():
-            if info["type"] == procedure_type:
-                results.append({
-                    "code": code,
-                    "description": info["description"],
-                    "type": info["type"],
-                    "category": info["category"],
-                    "system": "http://www.ans.gov.br/tuss"
-                })
-                
-                if len(results) >= max_results:
-                    break
-        
-        return results
+        return [
+            cls._result(code, info)
+            for code, info in _TUSS_SOURCE.get().facet("type", procedure_type, max_results)
+        ]
+    
+    @staticmethod
+    def _result(code: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "code": code,
+            "description": info["description"],
+            "type": info["type"],
+            "category": info["category"],
+            "system": "http://www.ans.gov.br/tuss"
+        }
@@ -0,0 +1,462 @@
+"""
+Terminology Store
+
+Full terminology releases (CID-10, TUSS, CBO, CID-10 -> SNOMED CT) imported
+from the official CSV/JSON files into one SQLite file
+(TERMINOLOGY_DB_PATH), instead of the subsets embedded as Python dicts:
+- workers open it read-only with mmap, so every gunicorn worker shares the
+  same pages through the OS page cache instead of each building its own
+  dicts and indexes
+- each import is a new release (system + version) written next to the
+  active one; activating it is a single commit, and workers notice it via
+  ``PRAGMA data_version`` on the next lookup (no restart)
+- codes are looked up through an index on the normalised code, words
+  through a per-release FTS5 table (accent-insensitive, prefix queries)
+
+TerminologySource picks the active release of a system, falling back to
+the embedded subset (TerminologyIndex) when nothing was imported. Both
+expose the same lookups (get, longest_prefix, facet, search).
+
+Import: python manage.py terminology_import <system> <file> --release <version>
+"""
+
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+from django.conf import settings
+
+from .terminology_index import WORD_RE, LazyTerminologyIndex, TerminologyIndex, fold
+
+logger = logging.getLogger(__name__)
+
+Entry = Tuple[str, Dict[str, Any]]
+
+# Desempate igual ao TerminologyIndex: texto principal mais curto, ordem do arquivo
+_SEQ_BITS = 20
+_SEQ_MASK = (1 << _SEQ_BITS) - 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    system TEXT NOT NULL,
+    version TEXT NOT NULL,
+    loaded_at TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    active INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (system, version)
+);
+CREATE TABLE IF NOT EXISTS concepts (
+    release_id INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    norm_code TEXT NOT NULL,
+    text TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (release_id, pos)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS concepts_code ON concepts (release_id, norm_code);
+CREATE TABLE IF NOT EXISTS facets (
+    release_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (release_id, name, value, seq)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass(frozen=True)
+class TerminologySpec:
+    """
+    How a code system is stored and searched.
+
+    Args:
+        system: name used by the store and the import command (e.g. "icd10")
+        fields: searchable text fields, most important first
+        facets: fields with exact-value filters
+        normalize_code: canonical form of codes
+        prepare: optional (code, entry) -> (code, entry) fix-up for imported rows
+    """
+    system: str
+    fields: Tuple[str, ...]
+    facets: Tuple[str, ...] = ()
+    normalize_code: Callable[[str], str] = str.upper
+    prepare: Optional[Callable[[str, Dict[str, Any]], Entry]] = None
+
+
+# Sistemas conhecidos (registrados pelos serviços que os usam)
+TERMINOLOGY_SPECS: Dict[str, TerminologySpec] = {}
+
+
+class SQLiteTerminologyTable:
+    """One imported release; same lookups as TerminologyIndex."""
+
+    def __init__(self, store: "TerminologyStore", spec: TerminologySpec, release_id: int, version: str, size: int):
+        self.store = store
+        self.spec = spec
+        self.release_id = release_id
+        self.version = version
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _query(self, sql: str, args: Sequence[Any]) -> List[tuple]:
+        return self.store._connection().execute(sql, args).fetchall()
+
+    def _entries(self, rows: Iterable[tuple]) -> List[Entry]:
+        return [(code, json.loads(data)) for code, data in rows]
+
+    def get(self, code: str) -> Optional[Entry]:
+        rows = self._query(
+            "SELECT code, data FROM concepts WHERE release_id = ? AND norm_code = ? LIMIT 1",
+            (self.release_id, self.spec.normalize_code(code)),
+        )
+        return self._entries(rows)[0] if rows else None
+
+    def longest_prefix(self, code: str) -> Optional[Entry]:
+        normalized = self.spec.normalize_code(code)
+        prefixes = [normalized[:end] for end in range(len(normalized), 0, -1)]
+        if not prefixes:
+            return None
+        rows = self._query(
+            f"SELECT code, data FROM concepts WHERE release_id = ? AND norm_code IN ({','.join('?' * len(prefixes))}) "
+            "ORDER BY length(norm_code) DESC LIMIT 1",
+            (self.release_id, *prefixes),
+        )
+        return self._entries(rows)[0] if rows else None
+
+    def facet(self, name: str, value: str, max_results: Optional[int] = None) -> List[Entry]:
+        rows = self._query(
+            "SELECT c.code, c.data FROM facets f JOIN concepts c ON c.release_id = f.release_id AND c.pos = f.pos "
+            "WHERE f.release_id = ? AND f.name = ? AND f.value = ? ORDER BY f.seq LIMIT ?",
+            (self.release_id, name, value, -1 if max_results is None else max_results),
+        )
+        return self._entries(rows)
+
+    def search(self, term: str, max_results: int = 20, facet: Optional[Tuple[str, str]] = None) -> List[Entry]:
+        """
+        Ranked matches, in the TerminologyIndex order: exact code, code
+        prefix, words in the primary field, words in any field, substring.
+        """
+        folded = fold(term).strip()
+        if not folded:
+            return [] if facet is None else self.facet(facet[0], facet[1], max_results)
+
+        release = self.release_id
+        facet_sql, facet_args = "", ()
+        if facet:
+            facet_sql = " AND {} IN (SELECT pos FROM facets WHERE release_id = ? AND name = ? AND value = ?)"
+            facet_args = (release, facet[0], facet[1])
+
+        # Posições em ordem de relevância (pos = desempate, ver _SEQ_BITS)
+        found: Dict[int, None] = {}
+
+        def collect(sql: str, args: Sequence[Any], column: str = "pos") -> None:
+            sql = sql.format(facet=facet_sql.format(column))
+            for (pos,) in self._query(sql, (*args, *facet_args, max_results + len(found))):
+                found.setdefault(pos, None)
+
+        code = self.spec.normalize_code(term.strip())
+        if code:
+            collect(
+                "SELECT pos FROM concepts WHERE release_id = ? AND norm_code >= ? AND norm_code < ?"
+                "{facet} ORDER BY length(norm_code), pos LIMIT ?",
+                (release, code, code + "\U0010ffff"),
+            )
+
+        words = WORD_RE.findall(folded)
+        if words:
+            whole = " AND ".join(f'"{w}"' for w in words)
+            prefix = " AND ".join(f'"{w}"*' for w in words)
+            primary = self.spec.fields[0]
+            for query in (f"{primary} : ({whole})", f"{primary} : ({prefix})", prefix):
+                if len(found) >= max_results:
+                    break
+                collect(f"SELECT rowid FROM fts_{release} WHERE fts_{release} MATCH ?{{facet}} "
+                        "ORDER BY rowid LIMIT ?", (query,), column="rowid")
+
+        if len(found) < max_results and len(folded) >= 3:
+            collect(
+                "SELECT pos FROM concepts WHERE release_id = ? AND instr(text, ?) > 0{facet} ORDER BY pos LIMIT ?",
+                (release, folded),
+            )
+
+        positions = list(found)[:max_results]
+        if not positions:
+            return []
+        rows = self._query(
+            f"SELECT pos, code, data FROM concepts WHERE release_id = ? AND pos IN ({','.join('?' * len(positions))})",
+            (release, *positions),
+        )
+        by_pos = {pos: (code, json.loads(data)) for pos, code, data in rows}
+        return [by_pos[pos] for pos in positions if pos in by_pos]
+
+
+class TerminologyStore:
+    """SQLite file with the imported releases (read-only, mmap'ed, for the workers)."""
+
+    def __init__(self, path: str, mmap_size: int = 256 * 1024 * 1024):
+        self.path = path
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+
+    # =========================================================================
+    # Leitura (workers)
+    # =========================================================================
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """Read-only connection of the current thread (None while the file does not exist)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if not self.path or not os.path.exists(self.path):
+                return None
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+            self._local.conn = conn
+            self._local.data_version = None
+        return conn
+
+    def table(self, spec: TerminologySpec) -> Optional[SQLiteTerminologyTable]:
+        """Active release of a system, or None when nothing was imported."""
+        try:
+            conn = self._connection()
+            if conn is None:
+                return None
+            # Muda quando outra conexão faz commit (import / ativação)
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._local.data_version:
+                self._local.active = self._active_releases(conn)
+                self._local.data_version = data_version
+        except sqlite3.Error as e:
+            logger.warning(f"Terminology store unavailable ({e}), using embedded tables")
+            return None
+
+        release = self._local.active.get(spec.system)
+        if release is None:
+            return None
+        release_id, version, size = release
+        return SQLiteTerminologyTable(self, spec, release_id, version, size)
+
+    def _active_releases(self, conn: sqlite3.Connection) -> Dict[str, Tuple[int, str, int]]:
+        try:
+            rows = conn.execute("SELECT system, id, version, size FROM releases WHERE active = 1").fetchall()
+        except sqlite3.OperationalError:
+            return {}  # Arquivo ainda sem schema
+        active = {system: (release_id, version, size) for system, release_id, version, size in rows}
+        if active:
+            logger.info(f"Terminology releases: {', '.join(f'{s}={v[1]}' for s, v in sorted(active.items()))}")
+        return active
+
+    # =========================================================================
+    # Escrita (import)
+    # =========================================================================
+
+    def _writer(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        # WAL: os workers continuam lendo a release ativa durante o import
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def import_release(
+        self,
+        spec: TerminologySpec,
+        version: str,
+        entries: Iterable[Entry],
+        activate: bool = True,
+        keep: int = 2,
+    ) -> int:
+        """
+        Write a release of `spec.system` and optionally activate it.
+
+        Codes repeated in the input keep the last entry. Returns the number
+        of codes written.
+        """
+        by_code: Dict[str, Entry] = {}
+        for code, entry in entries:
+            code = str(code or "").strip()
+            if not code:
+                continue
+            if spec.prepare:
+                code, entry = spec.prepare(code, entry)
+            by_code[spec.normalize_code(code)] = (code, entry)
+        if len(by_code) > _SEQ_MASK:
+            raise ValueError(f"{spec.system} release too large ({len(by_code)} codes)")
+
+        conn = self._writer()
+        try:
+            with conn:
+                if conn.execute("SELECT 1 FROM releases WHERE system = ? AND version = ?",
+                                (spec.system, version)).fetchone():
+                    raise ValueError(f"{spec.system} release {version} already imported")
+                release_id = conn.execute(
+                    "INSERT INTO releases (system, version, loaded_at, size) VALUES (?, ?, ?, ?)",
+                    (spec.system, version, datetime.now(timezone.utc).isoformat(), len(by_code)),
+                ).lastrowid
+
+                columns = ", ".join(spec.fields)
+                conn.execute(
+                    f"CREATE VIRTUAL TABLE fts_{release_id} USING fts5("
+                    f"{columns}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+                )
+                concepts, texts, facets = [], [], []
+                for seq, (normalized, (code, entry)) in enumerate(by_code.items()):
+                    values = [str(entry.get(field) or "") for field in spec.fields]
+                    pos = min(len(values[0]) if values else 0, 0xFFF) << _SEQ_BITS | seq
+                    text = " ".join(fold(v) for v in [code, *values])
+                    concepts.append((release_id, pos, code, normalized, text, json.dumps(entry, ensure_ascii=False)))
+                    texts.append((pos, *values))
+                    facets.extend((release_id, name, str(entry.get(name)), pos, seq) for name in spec.facets)
+
+                conn.executemany("INSERT INTO concepts VALUES (?, ?, ?, ?, ?, ?)", concepts)
+                conn.executemany(
+                    f"INSERT INTO fts_{release_id} (rowid, {columns}) VALUES (?{', ?' * len(spec.fields)})", texts
+                )
+                conn.executemany("INSERT INTO facets VALUES (?, ?, ?, ?, ?)", facets)
+            logger.info(f"Imported {spec.system} release {version}: {len(by_code)} codes")
+        finally:
+            conn.close()
+
+        if activate:
+            self.activate(spec.system, version, keep=keep)
+        return len(by_code)
+
+    def activate(self, system: str, version: str, keep: int = 2) -> None:
+        """Make `version` the active release and drop all but the `keep` newest others."""
+        conn = self._writer()
+        try:
+            with conn:
+                if not conn.execute("SELECT 1 FROM releases WHERE system = ? AND version = ?",
+                                    (system, version)).fetchone():
+                    raise ValueError(f"{system} release {version} not found")
+                conn.execute("UPDATE releases SET active = (version = ?) WHERE system = ?", (version, system))
+                stale = conn.execute(
+                    "SELECT id FROM releases WHERE system = ? AND active = 0 ORDER BY id DESC LIMIT -1 OFFSET ?",
+                    (system, max(keep - 1, 0)),
+                ).fetchall()
+                for (release_id,) in stale:
+                    conn.execute(f"DROP TABLE IF EXISTS fts_{release_id}")
+                    for table in ("concepts", "facets", "releases"):
+                        column = "id" if table == "releases" else "release_id"
+                        conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (release_id,))
+            logger.info(f"Activated {system} release {version}")
+        finally:
+            conn.close()
+
+    def releases(self, system: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Imported releases, newest first."""
+        if not self.path or not os.path.exists(self.path):
+            return []
+        conn = self._writer()
+        try:
+            rows = conn.execute(
+                "SELECT system, version, loaded_at, size, active FROM releases "
+                "WHERE ? IS NULL OR system = ? ORDER BY system, id DESC",
+                (system, system),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {"system": s, "version": v, "loaded_at": at, "size": size, "active": bool(active)}
+            for s, v, at, size, active in rows
+        ]
+
+
+class TerminologySource:
+    """Active imported release of a system, or the embedded subset."""
+
+    def __init__(self, spec: TerminologySpec, embedded: Mapping[str, Dict[str, Any]]):
+        self.spec = spec
+        self.embedded = LazyTerminologyIndex(
+            lambda: TerminologyIndex(embedded, spec.fields, spec.facets, spec.normalize_code)
+        )
+        TERMINOLOGY_SPECS[spec.system] = spec
+
+    def get(self) -> Union[SQLiteTerminologyTable, TerminologyIndex]:
+        table = get_terminology_store().table(self.spec)
+        return table if table is not None else self.embedded.get()
+
+
+# =============================================================================
+# Leitura dos arquivos oficiais
+# =============================================================================
+
+def read_release_file(
+    path: str,
+    spec: TerminologySpec,
+    code_column: str = "code",
+    columns: Optional[Mapping[str, str]] = None,
+    encoding: str = "utf-8",
+    delimiter: Optional[str] = None,
+) -> Iterator[Entry]:
+    """
+    (code, entry) rows of a CSV or JSON release file.
+
+    JSON may be a list of objects or a {code: object} map. `columns` maps
+    spec fields to source columns when the names differ (e.g.
+    {"description": "DESCRICAO"}).
+    """
+    columns = dict(columns or {})
+    wanted = dict.fromkeys((*spec.fields, *spec.facets))
+
+    def entry(row: Mapping[str, Any]) -> Dict[str, Any]:
+        return {name: str(row.get(columns.get(name, name)) or "").strip() for name in wanted}
+
+    if path.lower().endswith(".json"):
+        with open(path, encoding=encoding) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for code, row in data.items():
+                yield code, entry(row)
+        else:
+            for row in data:
+                yield row.get(code_column), entry(row)
+        return
+
+    with open(path, encoding=encoding, newline="") as f:
+        if delimiter is None:
+            sample = f.readline()
+            f.seek(0)
+            delimiter = max(",;\t|", key=sample.count)
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield row.get(code_column), entry(row)
+
+
+# =============================================================================
+# Store selection
+# =============================================================================
+
+_terminology_store: Optional[TerminologyStore] = None
+_terminology_store_lock = threading.Lock()
+
+
+def get_terminology_store() -> TerminologyStore:
+    """Return the terminology store (TERMINOLOGY_DB_PATH; empty disables it)."""
+    global _terminology_store
+    if _terminology_store is None:
+        with _terminology_store_lock:
+            if _terminology_store is None:
+                _terminology_store = TerminologyStore(
+                    getattr(settings, 'TERMINOLOGY_DB_PATH', ''),
+                    getattr(settings, 'TERMINOLOGY_MMAP_SIZE', 256 * 1024 * 1024),
+                )
+    return _terminology_store
+
+
+def set_terminology_store(store: Optional[TerminologyStore]) -> None:
+    """Replace the terminology store (tests)."""
+    global _terminology_store
+    with _terminology_store_lock:
+        _terminology_store = store
@@ -0,0 +1,240 @@
+"""
+Unit Tests for the materialised analytics counters
+
+Tests for the analytics store (facts, replays, versions, removal), the
+_lastUpdated build and _history catch-up sync, the FHIR write hook and the
+dashboards read from the store or from the query planner (count queries,
+projections).
+"""
+
+import json
+from datetime import date
+
+import pytest
+import requests
+from unittest.mock import patch
+
+from fhir_api.services.analytics_service import AnalyticsService
+from fhir_api.services.analytics_store import (
+    InMemoryAnalyticsStore,
+    age_band,
+    encounter_facts,
+    fact_update,
+    set_analytics_store,
+)
+from fhir_api.services.fhir_core import FHIRService
+
+
+def patient(resource_id, gender="female", birth_date="1990-01-02", version="1", updated="2024-05-01T10:00:00Z"):
+    return {
+        "resourceType": "Patient",
+        "id": resource_id,
+        "gender": gender,
+        "birthDate": birth_date,
+        "meta": {"versionId": version, "lastUpdated": updated},
+    }
+
+
+def bundle(*resources):
+    return {"resourceType": "Bundle", "entry": [{"resource": r} for r in resources]}
+
+
+@pytest.fixture
+def store():
+    store = InMemoryAnalyticsStore()
+    set_analytics_store(store)
+    yield store
+    set_analytics_store(None)
+
+
+@pytest.fixture
+def service():
+    with patch.object(AnalyticsService, "_schedule_sync"):
+        yield AnalyticsService()
+
+
+class TestAnalyticsStore:
+    """Tests for applying resource facts."""
+
+    def test_update_moves_contribution(self, store):
+        assert store.apply_many("Patient", [fact_update("Patient", patient("1"))]) == 1
+        assert store.apply_many("Patient", [fact_update("Patient", patient("1", gender="male", version="2"))]) == 1
+
+        counters = store.counters("Patient")
+        assert counters["gender"] == {"male": 1}
+        assert counters["total"] == {"": 1}
+
+    def test_replay_and_older_version_are_ignored(self, store):
+        store.apply_many("Patient", [fact_update("Patient", patient("1", gender="male", version="2"))])
+        assert store.apply_many("Patient", [fact_update("Patient", patient("1", gender="male", version="2"))]) == 0
+        assert store.apply_many("Patient", [fact_update("Patient", patient("1", version="1"))]) == 0
+        assert store.counters("Patient")["gender"] == {"male": 1}
+
+    def test_remove(self, store):
+        store.apply_many("Patient", [fact_update("Patient", patient("1")), fact_update("Patient", patient("2"))])
+        assert store.apply("Patient", "1", None)
+        assert not store.apply("Patient", "unknown", None)
+        assert store.counters("Patient")["total"] == {"": 1}
+
+    def test_encounter_facts(self):
+        facts = encounter_facts({
+            "status": "finished",
+            "class": {"code": "AMB"},
+            "type": [{"coding": [{"code": "consulta"}]}],
+            "period": {"start": "2024-05-01T08:00:00Z"},
+        })
+        assert facts == {"total:": 1, "status:finished": 1, "type:consulta": 1, "day:2024-05-01": 1, "opd:": 1}
+
+    def test_age_band(self):
+        assert age_band(date(2000, 6, 1), date(2018, 5, 31)) == "13-18"
+        assert age_band(date(2000, 6, 1), date(2019, 6, 1)) == "19-30"
+
+
+class TestAnalyticsSync:
+    """Tests for the _lastUpdated build and the _history catch-up sync."""
+
+    def test_full_then_incremental(self, store, service):
+        history = {"resourceType": "Bundle", "type": "history", "entry": [
+            {"resource": patient("3", updated="2024-05-03T10:00:00Z"), "request": {"method": "POST", "url": "Patient"}},
+            {"resource": patient("2", gender="male", updated="2024-05-02T10:00:00Z"),
+             "request": {"method": "PUT", "url": "Patient/2"}},
+        ]}
+        pages = [
+            [bundle(patient("1"), patient("2", gender="male", updated="2024-05-02T10:00:00Z"))],
+            [history],
+        ]
+        calls = []
+
+        def iter_pages(resource_type, params=None, max_pages=None):
+            calls.append((resource_type, dict(params)))
+            return iter(pages.pop(0))
+
+        with patch.object(FHIRService, "iter_pages", side_effect=iter_pages):
+            assert service.sync(["Patient"]) == {"Patient": 2}
+            assert service.sync(["Patient"]) == {"Patient": 1}
+
+        assert calls[0][0] == "Patient"
+        assert "_lastUpdated" not in calls[0][1]
+        assert calls[0][1]["_elements"] == "gender,birthDate"
+        assert calls[1] == ("Patient/_history", {"_since": "2024-05-02T10:00:00Z", "_count": 500})
+        assert store.counters("Patient")["total"] == {"": 3}
+        assert store.get_state("Patient")["cursor"] == "2024-05-03T10:00:00Z"
+        assert store.is_ready("Patient")
+
+    def test_incremental_subtracts_deletes(self, store, service):
+        store.apply_many("Patient", [fact_update("Patient", patient(str(i))) for i in range(1, 4)])
+        store.set_state("Patient", cursor="2024-05-01T10:00:00Z", synced_at="2024-05-01T10:00:00+00:00")
+        # Mais novo primeiro: 2 foi excluído e recriado, 3 foi excluído
+        history = {"resourceType": "Bundle", "type": "history", "entry": [
+            {"resource": patient("2", gender="male", version="3", updated="2024-05-04T10:00:00Z"),
+             "request": {"method": "PUT", "url": "Patient/2"}},
+            {"request": {"method": "DELETE", "url": "Patient/2/_history/2"},
+             "response": {"lastModified": "2024-05-03T10:00:00Z"}},
+            {"request": {"method": "DELETE", "url": "Patient/3"},
+             "response": {"lastModified": "2024-05-02T10:00:00Z"}},
+        ]}
+
+        with patch.object(FHIRService, "iter_pages", return_value=iter([history])):
+            assert service.sync(["Patient"]) == {"Patient": 2}
+
+        counters = store.counters("Patient")
+        assert counters["total"] == {"": 2}
+        assert counters["gender"] == {"female": 1, "male": 1}
+        assert store.get_state("Patient")["cursor"] == "2024-05-04T10:00:00Z"
+
+    def test_dashboard_reads_store(self, store, service):
+        store.apply_many("Patient", [fact_update("Patient", patient(str(i))) for i in range(1500)])
+        store.set_state("Patient", synced_at="2999-01-01T00:00:00+00:00")
+
+        with patch.object(AnalyticsService, "_fetch_all_resources") as fetch:
+            demographics = service.get_population_demographics()
+        fetch.assert_not_called()
+        assert demographics["total_patients"] == 1500
+        assert sum(demographics["age_distribution"].values()) == 1500
+
+    def test_planner_fallback_until_synced(self, store, service):
+        def count(resource_type, params):
+            if params.get("gender") == "female":
+                return 7
+            return 2 if params.get("gender:missing") else 0
+
+        with patch.object(FHIRService, "get_total_count", side_effect=count):
+            demographics = service.get_population_demographics()
+        assert demographics["gender_distribution"] == {"female": 7, "unknown": 2}
+        service._schedule_sync.assert_called()
+
+
+class TestAnalyticsQueryPlanner:
+    """Tests for the _summary=count / _elements fallback."""
+
+    def test_count_queries(self, service):
+        today = date(2024, 5, 1)
+        ages = service.planner.count_queries("Patient", "age", today)
+        assert ages["0-12"] == [({"birthdate": ["le2024-05-01", "gt2011-05-01"]}, 1)]
+        assert ages["71+"] == [({"birthdate": ["le1953-05-01"]}, 1)]
+        days = service.planner.count_queries("Encounter", "day", today)
+        assert days["2024-05-01"] == [({"date": "lt2024-05-02"}, 1), ({"date": "lt2024-05-01"}, -1)]
+
+    def test_encounter_days_count_by_start_like_the_store(self, store, service):
+        starts = ["2024-04-29T08:00:00Z", "2024-04-30T23:00:00Z", "2024-04-30T10:00:00Z", "2024-05-01T09:00:00Z"]
+        # O segundo atendimento atravessa a meia-noite: conta só no dia em que começou
+        encounters = [
+            {"status": "finished", "period": {"start": start, "end": "2024-05-01T02:00:00Z"}} for start in starts
+        ]
+
+        def count(resource_type, params):
+            # date=lt no servidor FHIR casa pelo início do período
+            return sum(1 for e in encounters if e["period"]["start"][:10] < params["date"][2:])
+
+        with patch.object(FHIRService, "get_total_count", side_effect=count), \
+                patch("fhir_api.services.analytics_service.date") as mock_date:
+            mock_date.today.return_value = date(2024, 5, 1)
+            mock_date.fromisoformat = date.fromisoformat
+            planned = service.planner.counters({"Encounter": ("day",)})
+
+        store.apply_many("Encounter", [(str(i), encounter_facts(e), 1) for i, e in enumerate(encounters)])
+        assert planned["Encounter"]["day"] == store.counters("Encounter")["day"]
+        assert planned["Encounter"]["day"] == {"2024-04-29": 1, "2024-04-30": 2, "2024-05-01": 1}
+
+    def test_kpis_in_one_round(self, store, service):
+        counted = []
+
+        def count(resource_type, params):
+            counted.append((resource_type, params))
+            return {"Patient": 1200, "Encounter": 300}[resource_type]
+
+        service_requests = [{"resourceType": "ServiceRequest", "intent": "order", "status": "active"}] * 3
+        with patch.object(FHIRService, "get_total_count", side_effect=count), \
+                patch.object(service.planner, "fetch", return_value=service_requests) as fetch:
+            kpis = service.get_kpi_summary()
+
+        assert kpis["new_patients"] == 1200
+        assert kpis["opd_patients"] == 300
+        assert kpis["todays_operations"] == 3
+        assert ("Encounter", {"class": "AMB,EMER,HH"}) in counted
+        assert fetch.call_args[1]["elements"] == "category,intent,status"
+
+
+class TestAnalyticsWriteHook:
+    """Tests for FHIRService._on_write."""
+
+    def response(self, method, url, body=None, status=201):
+        response = requests.Response()
+        response.request = requests.Request(method, url).prepare()
+        response.status_code = status
+        response._content = json.dumps(body).encode() if body is not None else b""
+        return response
+
+    def test_create_and_delete(self, store, settings):
+        base = settings.FHIR_SERVER_URL
+        FHIRService._on_write(self.response("POST", f"{base}/Patient", patient("7")))
+        assert store.counters("Patient")["total"] == {"": 1}
+
+        FHIRService._on_write(self.response("DELETE", f"{base}/Patient/7", status=200))
+        assert store.counters("Patient") == {}
+
+    def test_untracked_and_failed_writes(self, store, settings):
+        base = settings.FHIR_SERVER_URL
+        FHIRService._on_write(self.response("POST", f"{base}/Observation", {"id": "1"}))
+        FHIRService._on_write(self.response("POST", f"{base}/Patient", patient("8"), status=400))
+        assert store.counters("Patient") == {}
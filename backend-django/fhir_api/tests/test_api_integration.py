@@ -115,6 +115,13 @@ class TestBulkExportAPI:
 class TestBulkImportAPI:
     """Integration tests for bulk import API endpoints."""
     
+    @pytest.fixture(autouse=True)
+    def import_dir(self, tmp_path):
+        """Keep spool files out of the source tree; the pipeline itself is not run here."""
+        with patch("fhir_api.services.bulk_data_service.IMPORT_DIR", str(tmp_path)), \
+                patch("fhir_api.services.bulk_data_service.BulkImportService._process_import_job"):
+            yield tmp_path
+    
     @pytest.fixture
     def auth_client(self):
         """Authenticated API client."""
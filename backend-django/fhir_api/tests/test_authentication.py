@@ -0,0 +1,128 @@
+"""
+Unit Tests for Keycloak JWT Authentication
+
+Tests for the cached JWKS key store and the validated-token claims cache.
+"""
+
+import json
+import time
+
+import jwt
+import pytest
+from unittest.mock import patch, MagicMock
+from cryptography.hazmat.primitives.asymmetric import rsa
+from rest_framework.exceptions import AuthenticationFailed
+
+from fhir_api.authentication import (
+    JWKSKeyStore,
+    KeycloakAuthentication,
+    TokenClaimsCache,
+    token_claims_cache,
+)
+
+
+@pytest.fixture(scope="module")
+def rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def make_jwks(private_key, kid):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": kid, "use": "sig", "alg": "RS256"})
+    return {"keys": [jwk]}
+
+
+def make_token(private_key, kid, exp_in=300, **claims):
+    payload = {"sub": "user-1", "exp": int(time.time()) + exp_in, **claims}
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def jwks_response(jwks):
+    response = MagicMock()
+    response.json.return_value = jwks
+    response.raise_for_status.return_value = None
+    return response
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    JWKSKeyStore.reset_instance()
+    token_claims_cache.clear()
+    yield
+    JWKSKeyStore.reset_instance()
+    token_claims_cache.clear()
+
+
+class TestJWKSKeyStore:
+    """Tests for the process-wide JWKS cache."""
+
+    def test_fetches_once_for_known_kid(self, rsa_key):
+        store = JWKSKeyStore("http://kc/certs", refresh_interval=3600)
+        with patch("fhir_api.authentication.requests.get",
+                   return_value=jwks_response(make_jwks(rsa_key, "k1"))) as mock_get:
+            for _ in range(5):
+                assert store.get_signing_key("k1") is not None
+        assert mock_get.call_count == 1
+        store.stop()
+
+    def test_unknown_kid_refetch_is_rate_limited(self, rsa_key):
+        store = JWKSKeyStore("http://kc/certs", refresh_interval=3600, min_refetch_interval=60)
+        with patch("fhir_api.authentication.requests.get",
+                   return_value=jwks_response(make_jwks(rsa_key, "k1"))) as mock_get:
+            store.get_signing_key("k1")
+            for _ in range(3):
+                with pytest.raises(jwt.InvalidTokenError):
+                    store.get_signing_key("rotated")
+        assert mock_get.call_count == 1
+        store.stop()
+
+    def test_keeps_last_good_keys_when_keycloak_down(self, rsa_key):
+        import requests
+        store = JWKSKeyStore("http://kc/certs", refresh_interval=3600)
+        with patch("fhir_api.authentication.requests.get",
+                   return_value=jwks_response(make_jwks(rsa_key, "k1"))):
+            store.refresh()
+        with patch("fhir_api.authentication.requests.get",
+                   side_effect=requests.ConnectionError("down")):
+            assert store.refresh() is False
+        assert store.get_signing_key("k1") is not None
+        store.stop()
+
+
+class TestTokenClaimsCache:
+    """Tests for the validated-token claims cache."""
+
+    def test_expired_entries_are_dropped(self):
+        cache = TokenClaimsCache()
+        cache.set("token", {"sub": "x", "exp": time.time() - 1})
+        assert cache.get("token") is None
+
+    def test_lru_bound(self):
+        cache = TokenClaimsCache(max_entries=2)
+        exp = time.time() + 60
+        for token in ("a", "b", "c"):
+            cache.set(token, {"exp": exp})
+        assert cache.get("a") is None
+        assert cache.get("c") is not None
+
+
+class TestKeycloakAuthentication:
+    """Tests for KeycloakAuthentication.authenticate_credentials."""
+
+    def test_repeated_token_skips_verification(self, rsa_key):
+        token = make_token(rsa_key, "k1", realm_access={"roles": ["medico"]})
+        auth = KeycloakAuthentication()
+        with patch("fhir_api.authentication.requests.get",
+                   return_value=jwks_response(make_jwks(rsa_key, "k1"))):
+            user, _ = auth.authenticate_credentials(token)
+            assert user.sub == "user-1"
+            with patch("fhir_api.authentication.jwt.decode") as mock_decode:
+                auth.authenticate_credentials(token)
+                mock_decode.assert_not_called()
+
+    def test_unknown_kid_fails(self, rsa_key):
+        token = make_token(rsa_key, "other")
+        with patch("fhir_api.authentication.requests.get",
+                   return_value=jwks_response(make_jwks(rsa_key, "k1"))):
+            with pytest.raises(AuthenticationFailed):
+                KeycloakAuthentication().authenticate_credentials(token)
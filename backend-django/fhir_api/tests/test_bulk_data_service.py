@@ -4,7 +4,11 @@ Sprint 23: Unit Tests for Bulk Data Services
 Tests for FHIR Bulk Export/Import and SMART scopes.
 """
 
+import gzip
+import json
+
 import pytest
+import requests
 from unittest.mock import patch, MagicMock
 from datetime import datetime
 
@@ -17,6 +21,11 @@ from fhir_api.services.bulk_data_service import (
     SMARTScopeValidator,
     SMART_SCOPES
 )
+from fhir_api import views_bulk_data
+from fhir_api.services.fhir_core import FHIRService, FHIRServiceException
+from fhir_api.services.job_store import InMemoryJobStore, get_job_store, set_job_store
+from rest_framework.test import APIRequestFactory, force_authenticate
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
 
 class TestExportJob:
@@ -291,3 +300,267 @@ class TestBulkImportService:
         retrieved = BulkImportService.get_job(job.job_id)
         assert retrieved is not None
         assert retrieved.job_id == job.job_id
+
+
+def ndjson(count, resource_type="Patient", with_ids=True):
+    lines = []
+    for i in range(count):
+        resource = {"resourceType": resource_type}
+        if with_ids:
+            resource["id"] = f"{resource_type.lower()}-{i}"
+        lines.append(json.dumps(resource))
+    return "\n".join(lines) + "\n"
+
+
+def batch_response(bundle, failing_urls=()):
+    return {
+        "resourceType": "Bundle",
+        "type": "batch-response",
+        "entry": [
+            {"response": {"status": "400 Bad Request" if e["request"]["url"] in failing_urls else "201 Created"}}
+            for e in bundle["entry"]
+        ]
+    }
+
+
+class TestBulkImportPipeline:
+    """Tests for the chunked, concurrent import pipeline."""
+    
+    @pytest.fixture(autouse=True)
+    def import_dir(self, tmp_path):
+        previous = get_job_store()
+        set_job_store(InMemoryJobStore())
+        with patch("fhir_api.services.bulk_data_service.IMPORT_DIR", str(tmp_path)):
+            yield tmp_path
+        set_job_store(previous)
+    
+    @pytest.fixture
+    def fhir(self):
+        with patch("fhir_api.services.bulk_data_service.FHIRService") as mock_cls:
+            service = mock_cls.return_value
+            service.execute_bundle.side_effect = lambda bundle: batch_response(bundle)
+            yield service
+    
+    def create_job(self, files, **kwargs):
+        with patch.object(BulkImportService, '_process_import_job'):
+            job = BulkImportService.create_import_job(files, **kwargs)
+        return job
+    
+    def run(self, job):
+        BulkImportService._process_import_job(job.job_id)
+        return BulkImportService.get_job(job.job_id)
+    
+    def test_chunks_resources_into_bundles(self, fhir):
+        job = self.create_job(
+            [{"resource_type": "Patient", "content": ndjson(5)}],
+            chunk_size=2, concurrency=2
+        )
+        job = self.run(job)
+        
+        assert job.status == ExportStatus.COMPLETED
+        assert job.imported_resources == {"Patient": 5}
+        assert fhir.execute_bundle.call_count == 3
+        bundle = fhir.execute_bundle.call_args_list[0][0][0]
+        assert bundle["type"] == "batch"
+        assert bundle["entry"][0]["request"] == {"method": "PUT", "url": "Patient/patient-0"}
+        assert job.checkpoint == {"0": 5}
+        assert job.progress == 100
+    
+    def test_resources_without_id_are_posted(self, fhir):
+        job = self.create_job([{"resource_type": "Observation", "content": ndjson(1, "Observation", False)}])
+        BulkImportService._process_import_job(job.job_id)
+        
+        entry = fhir.execute_bundle.call_args[0][0]["entry"][0]
+        assert entry["request"] == {"method": "POST", "url": "Observation"}
+    
+    def test_entry_failures_and_bad_lines_are_recorded(self, fhir):
+        fhir.execute_bundle.side_effect = lambda bundle: batch_response(bundle, {"Patient/patient-1"})
+        content = ndjson(3) + "not json\n"
+        job = self.run(self.create_job([{"resource_type": "Patient", "content": content}]))
+        
+        assert job.status == ExportStatus.COMPLETED
+        assert job.total_resources == 2
+        assert job.failed_resources == 2
+        assert {e["line_number"] for e in job.errors} == {1, 3}
+    
+    def test_resume_skips_committed_lines(self, fhir, import_dir):
+        job = self.create_job(
+            [{"resource_type": "Patient", "content": ndjson(4)}],
+            chunk_size=2, concurrency=1
+        )
+        calls = []
+        
+        def crash_on_second(bundle):
+            calls.append(bundle)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+            return batch_response(bundle)
+        
+        fhir.execute_bundle.side_effect = crash_on_second
+        job = self.run(job)
+        assert job.status == ExportStatus.FAILED
+        assert (import_dir / job.job_id / "checkpoint.json").exists()
+        
+        fhir.execute_bundle.side_effect = lambda bundle: batch_response(bundle)
+        with patch.object(BulkImportService, '_process_import_job'):
+            resumed = BulkImportService.resume_job(job.job_id)
+        assert resumed.checkpoint == {"0": 2}
+        BulkImportService._process_import_job(job.job_id)
+        
+        resumed = BulkImportService.get_job(job.job_id)
+        assert resumed.status == ExportStatus.COMPLETED
+        sent = fhir.execute_bundle.call_args[0][0]["entry"]
+        assert [e["resource"]["id"] for e in sent] == ["patient-2", "patient-3"]
+    
+    def test_lost_lease_stops_without_writing(self, fhir, import_dir):
+        job = self.create_job(
+            [{"resource_type": "Patient", "content": ndjson(3)}],
+            chunk_size=1, concurrency=1
+        )
+        store = BulkImportService._store()
+        
+        def taken_over(bundle):
+            # Another worker takes the job over while the first chunk is in flight
+            if fhir.execute_bundle.call_count == 1:
+                store._jobs[f"import:{job.job_id}"]["lease_expires"] = 0.0
+                assert store.claim("import", job.job_id, "worker-2", 60)
+                store.save("import", {**store.load("import", job.job_id), "checkpoint": {"0": 2}}, "worker-2")
+            return batch_response(bundle)
+        
+        fhir.execute_bundle.side_effect = taken_over
+        BulkImportService._process_import_job(job.job_id)
+        
+        stored = store.load("import", job.job_id)
+        assert stored["status"] == "in-progress" and stored["checkpoint"] == {"0": 2}
+        with open(import_dir / job.job_id / "checkpoint.json") as f:
+            assert json.load(f)["checkpoint"] == {}
+        assert fhir.execute_bundle.call_count < 3
+        assert job.job_id not in BulkImportService._lost
+    
+    def test_worker_run_keeps_submitting_user(self, fhir):
+        job = self.create_job([{"resource_type": "Patient", "content": ndjson(1)}], user="dra.ana")
+        
+        with patch("fhir_api.services.bulk_data_service.FHIRService") as mock_cls:
+            mock_cls.return_value = fhir
+            assert BulkImportService.run_next_pending() == job.job_id
+        
+        mock_cls.assert_called_once_with("dra.ana")
+        assert BulkImportService.get_job(job.job_id).submitted_by == "dra.ana"
+    
+    def test_resume_conflicts_only_while_lease_is_held(self, fhir):
+        job = self.create_job([{"resource_type": "Patient", "content": ndjson(1)}])
+        request = APIRequestFactory().post(f"/api/v1/import/resume/{job.job_id}/")
+        force_authenticate(request, user=MagicMock(is_authenticated=True))
+        
+        BulkImportService._store().claim("import", job.job_id, "other-worker", 60)
+        assert views_bulk_data.import_resume(request, job.job_id).status_code == 409
+        
+        BulkImportService._store().release("import", job.job_id, "other-worker")
+        BulkImportService._store().claim("import", job.job_id, "other-worker", -1)
+        with patch.object(BulkImportService, '_executor') as executor:
+            assert views_bulk_data.import_resume(request, job.job_id).status_code == 202
+        executor.submit.assert_called_once()
+    
+    @pytest.mark.parametrize("error, with_ids, attempts", [
+        (FHIRServiceException("Bundle rejected: 400", status_code=400), True, 1),
+        (FHIRServiceException("Bundle rejected: 503", status_code=503), True, 3),
+        (FHIRServiceException("Bundle rejected: 503", status_code=503), False, 1),
+        (requests.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "refused"))), False, 3),
+        (requests.ConnectTimeout("connect timeout"), False, 3),
+        (requests.ReadTimeout("read timeout"), True, 1),
+    ])
+    def test_chunk_retried_only_when_safe_to_resend(self, fhir, error, with_ids, attempts):
+        if not isinstance(error, FHIRServiceException):
+            cause, error = error, FHIRServiceException(str(error))
+            error.__cause__ = cause
+        fhir.execute_bundle.side_effect = error
+        job = self.create_job([{"resource_type": "Patient", "content": ndjson(1, with_ids=with_ids)}])
+        
+        with patch("fhir_api.services.bulk_data_service.time.sleep"):
+            job = self.run(job)
+        
+        assert fhir.execute_bundle.call_count == attempts
+        assert job.failed_resources == 1
+    
+    def test_invalid_bundle_response_is_a_chunk_error(self):
+        FHIRService.reset_circuit()
+        service = FHIRService()
+        response = MagicMock(status_code=200)
+        response.json.side_effect = ValueError("Expecting value")
+        with patch.object(service.session, "post", return_value=response):
+            with pytest.raises(FHIRServiceException) as error:
+                service.execute_bundle({"resourceType": "Bundle", "type": "batch", "entry": []})
+        assert error.value.status_code == 200
+    
+    def test_rejects_unknown_bundle_type(self):
+        with pytest.raises(ValueError):
+            self.create_job([{"resource_type": "Patient", "content": "{}"}], bundle_type="history")
+
+
+class TestBulkExportWriter:
+    """Tests for the paginated, streaming export engine."""
+    
+    @pytest.fixture(autouse=True)
+    def export_dir(self, tmp_path):
+        with patch("fhir_api.services.bulk_data_service.EXPORT_DIR", str(tmp_path)):
+            yield tmp_path
+    
+    @pytest.fixture
+    def fhir(self):
+        with patch("fhir_api.services.bulk_data_service.FHIRService") as mock_cls:
+            service = mock_cls.return_value
+            service.iter_resources.side_effect = lambda resource_type, params: iter(
+                [
+                    {"resourceType": resource_type, "id": str(i)}
+                    for i in range(2500 if resource_type == "Observation" else 3)
+                ]
+            )
+            yield service
+    
+    def run_job(self, **kwargs):
+        with patch.object(BulkExportService, '_process_export_job'):
+            job = BulkExportService.create_export_job(level=ExportLevel.SYSTEM, **kwargs)
+        BulkExportService._process_export_job(job.job_id)
+        return BulkExportService.get_job(job.job_id)
+    
+    def test_exports_all_pages(self, fhir):
+        job = self.run_job(resource_types=["Patient", "Observation"])
+        
+        assert job.status == ExportStatus.COMPLETED
+        assert job.resource_counts == {"Patient": 3, "Observation": 2500}
+        assert job.total_resources == 2503
+        assert [f["type"] for f in job.output_files] == ["Patient", "Observation"]
+        with open(job.output_files[1]["file_path"], encoding="utf-8") as f:
+            assert sum(1 for _ in f) == 2500
+        params = fhir.iter_resources.call_args_list[0][0][1]
+        assert params["_count"] == str(BulkExportService.EXPORT_PAGE_SIZE)
+    
+    def test_splits_files_by_size(self, fhir):
+        line_bytes = len(json.dumps({"resourceType": "Patient", "id": "0"}) + "\n")
+        job = self.run_job(resource_types=["Patient"], max_file_bytes=line_bytes * 2)
+        
+        names = [f["url"].rsplit("/", 1)[-1] for f in job.output_files]
+        assert names == ["Patient.ndjson", "Patient.2.ndjson"]
+        assert [f["count"] for f in job.output_files] == [2, 1]
+    
+    def test_gzip_output(self, fhir):
+        job = self.run_job(resource_types=["Patient"], compress=True)
+        
+        output = job.output_files[0]
+        assert output["file_path"].endswith("Patient.ndjson.gz")
+        with gzip.open(output["file_path"], "rt", encoding="utf-8") as f:
+            assert [json.loads(line)["id"] for line in f] == ["0", "1", "2"]
+    
+    def test_failed_type_is_skipped_and_recorded(self, fhir, export_dir):
+        def iter_resources(resource_type, params):
+            yield {"resourceType": resource_type, "id": "partial"}
+            if resource_type == "Condition":
+                raise FHIRServiceException("page 2 failed")
+        
+        fhir.iter_resources.side_effect = iter_resources
+        job = self.run_job(resource_types=["Patient", "Condition"])
+        
+        assert job.status == ExportStatus.COMPLETED
+        assert [f["type"] for f in job.output_files] == ["Patient"]
+        assert job.errors[0]["type"] == "Condition"
+        assert sorted(p.name for p in (export_dir / job.job_id).iterdir()) == ["Patient.ndjson"]
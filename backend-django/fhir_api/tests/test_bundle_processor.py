@@ -0,0 +1,202 @@
+"""
+Unit Tests for Bundle transaction/batch processing
+
+Tests for urn:uuid reference planning and for the bulk
+(bulk_create/bulk_update) and concurrent paths of BundleBatchProcessor.
+"""
+
+import pytest
+from unittest.mock import patch
+from rest_framework.exceptions import ValidationError as DRFValidationError
+
+from fhir_api.bundle_processor import BundleBatchProcessor, BundleReferencePlan, BundleTransactionProcessor
+from fhir_api.models_bundle import Bundle
+from fhir_api.models_goal import Goal, GoalTarget
+from fhir_api.serializers_goal import GoalTargetSerializer
+
+
+class TargetSerializer(GoalTargetSerializer):
+    class Meta(GoalTargetSerializer.Meta):
+        fields = GoalTargetSerializer.Meta.fields + ['goal']
+
+
+class CustomCreateTargetSerializer(TargetSerializer):
+    """Serializer with its own create(): must not be bulk-created."""
+
+    def create(self, validated_data):
+        validated_data['detail_string'] = validated_data['detail_string'].upper()
+        return super().create(validated_data)
+
+
+REGISTRY = {
+    'GoalTarget': (GoalTarget, TargetSerializer),
+    'CustomTarget': (GoalTarget, CustomCreateTargetSerializer),
+}
+
+
+class RegistryProcessor(BundleTransactionProcessor):
+    def get_model(self, resource_type):
+        return REGISTRY.get(resource_type, (None, None))[0]
+
+    def get_serializer(self, resource_type):
+        return REGISTRY.get(resource_type, (None, None))[1]
+
+
+class RegistryBatchProcessor(BundleBatchProcessor):
+    entry_processor_class = RegistryProcessor
+
+
+@pytest.fixture
+def goal(transactional_db):
+    goal = Goal(identifier='GOAL-1', description={'text': 'Reduzir HbA1c'}, subject_id='p1')
+    Goal.objects.bulk_create([goal])
+    return goal
+
+
+def post(resource):
+    return {'resource': resource, 'request': {'method': 'POST', 'url': resource['resourceType']}}
+
+
+def target(goal, value, resource_type='GoalTarget'):
+    return {'resourceType': resource_type, 'goal': str(goal.id), 'detail_string': value}
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBundleBatchProcessor:
+    """Tests for BundleBatchProcessor."""
+
+    def test_bulk_safe_types(self, goal):
+        processor = RegistryBatchProcessor(Bundle(type='batch', entries=[]))
+        assert processor._is_bulk_safe('GoalTarget') is True
+        assert processor._is_bulk_safe('CustomTarget') is False
+        assert processor._is_bulk_safe('Unknown') is False
+
+    def test_models_with_m2m_are_not_bulk_safe(self, goal):
+        processor = RegistryBatchProcessor(Bundle(type='batch', entries=[]))
+        with patch.object(GoalTarget._meta, 'many_to_many', [GoalTarget._meta.get_field('goal')]):
+            assert processor._is_bulk_safe('GoalTarget') is False
+
+    def test_posts_are_bulk_created_in_one_query(self, goal):
+        entries = [post(target(goal, f't{i}')) for i in range(20)]
+        processor = RegistryBatchProcessor(Bundle(type='batch', entries=entries))
+        with patch.object(GoalTarget.objects, 'bulk_create', wraps=GoalTarget.objects.bulk_create) as bulk:
+            result = processor.process()
+        assert bulk.call_count == 1
+        assert GoalTarget.objects.count() == 20
+        assert [e['resource']['detail_string'] for e in result['entry']] == [f't{i}' for i in range(20)]
+        assert all(e['response']['status'] == '201 Created' for e in result['entry'])
+
+    def test_mixed_entries_keep_original_order(self, goal):
+        entries = [
+            post(target(goal, 'a', 'CustomTarget')),
+            post(target(goal, 'x')),
+            {'request': {'method': 'DELETE', 'url': 'Unknown/missing'}},
+            post({'resourceType': 'Unknown'}),
+            post(target(goal, 'y')),
+        ]
+        result = RegistryBatchProcessor(Bundle(type='batch', entries=entries), max_workers=4).process()
+        statuses = [e['response']['status'] for e in result['entry']]
+        assert statuses == ['201 Created', '201 Created', '400 Bad Request', '400 Bad Request', '201 Created']
+        assert result['entry'][1]['resource']['detail_string'] == 'x'
+        assert result['entry'][4]['resource']['detail_string'] == 'y'
+        assert result['entry'][0]['resource']['detail_string'] == 'A'  # Ran through serializer.save()
+
+    def test_invalid_entry_does_not_fail_group(self, goal):
+        entries = [post(target(goal, 'ok')), post({'resourceType': 'GoalTarget', 'goal': 'not-a-uuid'})]
+        result = RegistryBatchProcessor(Bundle(type='batch', entries=entries)).process()
+        assert result['entry'][0]['response']['status'] == '201 Created'
+        assert result['entry'][1]['response']['status'] == '400 Bad Request'
+
+    def test_puts_are_bulk_updated(self, goal):
+        existing = [GoalTarget.objects.create(goal=goal, detail_string=f'old{i}') for i in range(3)]
+        entries = [
+            {'resource': target(goal, f'new{i}'), 'request': {'method': 'PUT', 'url': f'GoalTarget/{t.id}'}}
+            for i, t in enumerate(existing)
+        ]
+        entries.append({'resource': target(goal, 'z'),
+                        'request': {'method': 'PUT', 'url': 'GoalTarget/00000000-0000-0000-0000-000000000000'}})
+        with patch.object(GoalTarget.objects, 'bulk_update', wraps=GoalTarget.objects.bulk_update) as bulk:
+            result = RegistryBatchProcessor(Bundle(type='batch', entries=entries)).process()
+        assert bulk.call_count == 1
+        assert [e['response']['status'] for e in result['entry']] == ['200 OK'] * 3 + ['400 Bad Request']
+        assert sorted(GoalTarget.objects.values_list('detail_string', flat=True)) == ['new0', 'new1', 'new2']
+
+    def test_sequential_mode_matches_bulk_mode(self, goal):
+        entries = [post(target(goal, f's{i}')) for i in range(5)]
+        result = RegistryBatchProcessor(Bundle(type='batch', entries=entries), max_workers=1, use_bulk=False).process()
+        assert [e['resource']['detail_string'] for e in result['entry']] == [f's{i}' for i in range(5)]
+
+
+def urn_entry(name, resource_type, **fields):
+    return {
+        'fullUrl': f'urn:uuid:{name}',
+        'resource': {'resourceType': resource_type, **fields},
+        'request': {'method': 'POST', 'url': resource_type},
+    }
+
+
+class TestBundleReferencePlan:
+    """Tests for BundleReferencePlan."""
+
+    def test_records_reference_paths(self):
+        entries = [
+            urn_entry('p', 'Patient'),
+            urn_entry('o', 'Observation', subject={'reference': 'urn:uuid:p'},
+                      performer=[{'reference': 'Practitioner/1'}, {'reference': 'urn:uuid:p'}]),
+        ]
+        plan = BundleReferencePlan(entries)
+        assert sorted(plan.references[1]) == [(('performer', 1, 'reference'), 'urn:uuid:p'),
+                                              (('subject', 'reference'), 'urn:uuid:p')]
+        assert plan.dependencies(1) == {0}
+
+    def test_forward_references_are_ordered_first(self):
+        entries = [
+            urn_entry('o', 'Observation', subject={'reference': 'urn:uuid:p'}),
+            urn_entry('e', 'Encounter'),
+            urn_entry('p', 'Patient'),
+        ]
+        assert BundleReferencePlan(entries).execution_order() == [1, 2, 0]
+
+    def test_cycle_is_rejected(self):
+        entries = [
+            urn_entry('a', 'Patient', link=[{'other': {'reference': 'urn:uuid:b'}}]),
+            urn_entry('b', 'Patient', link=[{'other': {'reference': 'urn:uuid:a'}}]),
+            urn_entry('c', 'Patient'),
+        ]
+        with pytest.raises(DRFValidationError, match='urn:uuid:a, urn:uuid:b'):
+            BundleReferencePlan(entries).execution_order()
+
+    def test_duplicate_full_url_is_rejected(self):
+        with pytest.raises(DRFValidationError, match='duplicado'):
+            BundleReferencePlan([urn_entry('a', 'Patient'), urn_entry('a', 'Patient')]).execution_order()
+
+    def test_resolve_patches_in_place(self):
+        entries = [urn_entry('o', 'Observation', subject={'reference': 'urn:uuid:p'},
+                             focus=[{'reference': 'urn:uuid:unknown'}])]
+        subject = entries[0]['resource']['subject']
+        BundleReferencePlan(entries).resolve(0, {'urn:uuid:p': 'Patient/42'})
+        assert subject == {'reference': 'Patient/42'}
+        assert entries[0]['resource']['focus'] == [{'reference': 'urn:uuid:unknown'}]
+
+
+@pytest.mark.django_db
+class TestBundleTransactionOrder:
+    """Tests for BundleTransactionProcessor processing order."""
+
+    def test_forward_reference_is_resolved(self):
+        entries = [
+            urn_entry('o', 'Observation', subject={'reference': 'urn:uuid:p'}),
+            urn_entry('p', 'Patient'),
+        ]
+        processor = BundleTransactionProcessor(Bundle(type='transaction', entries=entries))
+        seen = []
+
+        def handle_post(url, resource, entry, idx):
+            seen.append(resource.get('subject'))
+            processor.resource_registry[entry['fullUrl']] = f"{resource['resourceType']}/{idx}"
+            return {'response': {'status': '201 Created'}, 'idx': idx}
+
+        with patch.object(processor, '_handle_post', side_effect=handle_post):
+            result = processor.process()
+        assert seen == [None, {'reference': 'Patient/1'}]
+        assert [e['idx'] for e in result['entry']] == [0, 1]
@@ -0,0 +1,311 @@
+"""
+Unit Tests for the cache service backends
+
+Tests for the in-memory fallback backend (expiry, size bounds,
+prefix-indexed invalidation) and for CacheService tags, multi-key
+operations and stampede protection.
+"""
+
+import threading
+import time
+
+import pytest
+from unittest.mock import patch
+
+from fhir_api.services.cache_service import CacheService, InMemoryCache, RedisCache, SingleFlight
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch("fhir_api.services.cache_service.time.monotonic", side_effect=lambda: now[0]):
+        yield now
+
+
+class TestInMemoryCache:
+    """Tests for InMemoryCache."""
+
+    def test_set_get_delete(self):
+        cache = InMemoryCache()
+        assert cache.set("a", "1")
+        assert cache.get("a") == "1"
+        assert cache.exists("a")
+        assert cache.delete("a") is True
+        assert cache.get("a") is None
+
+    def test_entries_expire(self, clock):
+        cache = InMemoryCache()
+        cache.set("short", "1", ttl=10)
+        cache.set("long", "2", ttl=100)
+        cache.set("forever", "3")
+        clock[0] += 11
+        assert cache.get("short") is None
+        cache.set("other", "4")  # set() drains the expiry heap
+        assert "short" not in cache._cache
+        assert cache.get("long") == "2"
+        clock[0] += 1000
+        assert cache.get("long") is None
+        assert cache.get("forever") == "3"
+
+    def test_overwrite_keeps_new_expiry(self, clock):
+        cache = InMemoryCache()
+        cache.set("a", "1", ttl=10)
+        cache.set("a", "2", ttl=100)
+        clock[0] += 50
+        cache.set("b", "x")
+        assert cache.get("a") == "2"
+
+    def test_lru_eviction_by_count(self):
+        cache = InMemoryCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        assert cache.get("b") is None
+        assert cache.get("a") == "1"
+        assert cache.evictions == 1
+
+    def test_eviction_by_bytes(self):
+        cache = InMemoryCache(max_bytes=20)
+        cache.set("a", "x" * 9)
+        cache.set("b", "y" * 9)
+        cache.set("c", "z" * 9)
+        assert cache.get("a") is None
+        assert cache.get_stats()["bytes"] <= 20
+        assert cache.set("big", "x" * 100) is False
+
+    def test_clear_pattern_uses_prefix_index(self):
+        cache = InMemoryCache()
+        cache.set("fhir:search:Patient:1", "a")
+        cache.set("fhir:search:Patient:2", "b")
+        cache.set("fhir:search:PatientX:1", "c")
+        cache.set("fhir:search:Observation:1", "d")
+        assert cache.clear_pattern("fhir:search:Patient:*") == 2
+        assert cache.get("fhir:search:PatientX:1") == "c"
+        assert cache.clear_pattern("fhir:search:Pat*") == 1
+        assert cache.clear_pattern("fhir:*:Observation:?") == 1
+        assert cache.get_stats()["total_keys"] == 0
+        assert cache._prefixes == {}
+
+    def test_incr(self):
+        cache = InMemoryCache()
+        assert cache.incr("rate:x") == 1
+        assert cache.incr("rate:x") == 2
+
+
+@pytest.fixture
+def service():
+    service = CacheService()
+    previous = service.backend
+    service.backend = InMemoryCache()
+    yield service
+    service.backend = previous
+
+
+class TestCacheServiceTags:
+    """Tests for tag-based invalidation in CacheService."""
+
+    def test_invalidate_search_only_touches_type(self, service):
+        service.set_search("Patient", {"name": "a"}, [1])
+        service.set_search("Observation", {"code": "x"}, [2])
+        with patch.object(service.backend, "clear_pattern") as clear_pattern:
+            assert service.invalidate_search("Patient") == 1
+        clear_pattern.assert_not_called()
+        assert service.get_search("Patient", {"name": "a"}) is None
+        assert service.get_search("Observation", {"code": "x"}) == [2]
+        assert service.invalidate_all_searches() == 1
+
+    def test_invalidate_resource_and_patient(self, service):
+        service.set_resource("Patient", "1", {"id": "1"})
+        service.set_patient_data("1", "summary", {"a": 1})
+        service.set_patient_data("2", "summary", {"b": 2})
+        service.set_search("Patient", {"name": "a"}, [1])
+        assert service.invalidate_patient("1") == 3
+        assert service.get_patient_data("2", "summary") == {"b": 2}
+
+    def test_invalidation_batch_coalesces(self, service):
+        service.set_search("Patient", {"name": "a"}, [1])
+        with patch.object(service.backend, "invalidate_tags", wraps=service.backend.invalidate_tags) as invalidate:
+            with service.invalidation_batch():
+                with service.invalidation_batch():
+                    service.invalidate_resource("Patient", "1")
+                service.invalidate_resource("Patient", "2")
+                service.invalidate_search("Observation")
+                assert service.get_search("Patient", {"name": "a"}) == [1]
+        invalidate.assert_called_once()
+        tags, keys = invalidate.call_args.args
+        assert tags == [service.search_tag("Observation"), service.search_tag("Patient")]
+        assert keys == ["fhir:resource:Patient:1", "fhir:resource:Patient:2"]
+        assert service.get_search("Patient", {"name": "a"}) is None
+
+
+class TestCacheServiceMulti:
+    """Tests for multi-get/multi-set, encoding and the batched decorator."""
+
+    def test_encode_round_trip(self, service):
+        small = {"id": "1"}
+        large = {"id": "2", "text": "x" * 5000}
+        assert service.encode(small) == '{"id":"1"}'
+        encoded = service.encode(large)
+        assert encoded[:1] == CacheService.ENCODING_ZLIB_JSON
+        assert len(encoded) < 200
+        assert service.decode(encoded) == large
+        assert service.decode(service.encode(small)) == small
+        assert service.decode(b'{"legacy": true}') == {"legacy": True}
+
+    def test_get_and_set_resources(self, service):
+        resources = [{"resourceType": "Patient", "id": str(i), "note": "n" * (i * 600)} for i in range(4)]
+        assert service.set_resources("Patient", resources)
+        with patch.object(service.backend, "get_many", wraps=service.backend.get_many) as get_many:
+            found = service.get_resources("Patient", ["0", "3", "missing"])
+        get_many.assert_called_once()
+        assert found == {"0": resources[0], "3": resources[3]}
+        assert service.get_resource("Patient", "2") == resources[2]
+
+    def test_cached_batch_only_calls_for_misses(self, service):
+        calls = []
+
+        @service.cached(ttl=60, key_prefix="test", batch=True)
+        def load(ids, suffix=""):
+            calls.append(list(ids))
+            return {i: f"{i}{suffix}" for i in ids if i != "none"}
+
+        assert load(["a", "b"], suffix="!") == {"a": "a!", "b": "b!"}
+        assert load(["b", "c", "none"], suffix="!") == {"b": "b!", "c": "c!"}
+        assert calls == [["a", "b"], ["c", "none"]]
+
+
+class TestStampedeProtection:
+    """Tests for single-flight and stale-while-revalidate in CacheService.fetch."""
+
+    @pytest.fixture(autouse=True)
+    def sync_refresh(self, service):
+        with patch.object(CacheService._refresh_executor, "submit", side_effect=lambda fn: fn()), \
+                patch.object(CacheService, "EARLY_REFRESH_BETA", 0):
+            yield
+
+    def test_single_flight_runs_once(self):
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return "value"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        while not flight.in_flight("k"):
+            time.sleep(0.01)
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join(5)
+        assert calls == [1]
+        assert results == ["value"] * 8
+
+    def test_concurrent_misses_compute_once(self, service):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return {"kpi": 1}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(service.fetch("kpi", compute, ttl=60)))
+                   for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        assert len(calls) == 1
+        assert results == [{"kpi": 1}] * 10
+
+    def test_stale_value_served_while_refreshing(self, service):
+        values = iter(["old", "new"])
+        with patch("fhir_api.services.cache_service.time.time", return_value=1000.0):
+            assert service.fetch("beds", lambda: next(values), ttl=10, stale_ttl=60) == "old"
+        with patch("fhir_api.services.cache_service.time.time", return_value=1015.0):
+            assert service.fetch("beds", lambda: next(values), ttl=10, stale_ttl=60) == "old"
+            assert service.fetch("beds", lambda: "unused", ttl=10, stale_ttl=60) == "new"
+
+    def test_negative_ttl_and_errors(self, service):
+        def fail():
+            raise RuntimeError("down")
+
+        with patch("fhir_api.services.cache_service.time.time", return_value=1000.0):
+            assert service.fetch("rx", lambda: [], ttl=100, negative_ttl=10) == []
+            with pytest.raises(RuntimeError):
+                service.fetch("rx-error", fail, ttl=100)
+        assert service._load_entry("rx")["soft"] == 1010.0
+        assert service._load_entry("rx-error") is None
+
+    def test_waits_for_peer_worker_holding_lock(self, service):
+        stored = service.make_entry("from-peer", 60)
+        loads = iter([None, None, stored])
+        with patch.object(service.backend, "acquire_lock", return_value=None), \
+                patch.object(CacheService, "LOCK_POLL_INTERVAL", 0):
+            value = service.fetch("k", lambda: "local", load=lambda k: next(loads))
+        assert value == "from-peer"
+
+    def test_early_refresh_probability(self, service):
+        entry = service.make_entry("v", 10, compute_seconds=1.0)
+        with patch.object(CacheService, "EARLY_REFRESH_BETA", 1.0):
+            assert service.needs_refresh(entry, now=entry["soft"] - 100) is False
+            assert service.needs_refresh(entry, now=entry["soft"]) is True
+            with patch("fhir_api.services.cache_service.random.random", return_value=0.99):
+                # -log(0.01) ~ 4.6s of early refresh window for a 1s computation
+                assert service.needs_refresh(entry, now=entry["soft"] - 4) is True
+
+    def test_cached_decorator_does_not_recompute_concurrently(self, service):
+        calls = []
+
+        @service.cached(ttl=60, key_prefix="test")
+        def kpis(unit):
+            calls.append(unit)
+            time.sleep(0.05)
+            return [unit]
+
+        threads = [threading.Thread(target=kpis, args=("uti",)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        assert calls == ["uti"]
+
+
+class TestRedisCacheTags:
+    """Tests for the RedisCache tag scripts (client mocked)."""
+
+    @pytest.fixture
+    def backend(self):
+        with patch("fhir_api.services.cache_service.redis.from_url"):
+            backend = RedisCache(url="redis://test")
+        return backend
+
+    def test_set_tagged_registers_members(self, backend):
+        backend.set_tagged("k", "v", 60, ["t1", "t2"])
+        backend._set_tagged.assert_called_once_with(keys=["k", "t1", "t2"], args=["v", 60])
+
+    def test_invalidate_does_not_scan(self, backend):
+        backend._invalidate_tags.return_value = 3
+        assert backend.invalidate_tags(["t1"], ["k"]) == 3
+        backend._invalidate_tags.assert_called_once_with(keys=["t1"], args=["k"])
+        backend.client.scan_iter.assert_not_called()
+
+    def test_get_many_is_one_mget(self, backend):
+        backend.client.mget.return_value = [b"1", None]
+        assert backend.get_many(["a", "b"]) == [b"1", None]
+        backend.client.mget.assert_called_once_with(["a", "b"])
+
+    def test_set_many_uses_one_pipeline(self, backend):
+        pipe = backend.client.pipeline.return_value
+        pipe.execute.return_value = [True, True]
+        assert backend.set_many({"a": "1", "b": b"2"}, ttl=30) is True
+        backend.client.pipeline.assert_called_once_with(transaction=False)
+        assert pipe.set.call_count == 2
+        pipe.execute.assert_called_once()
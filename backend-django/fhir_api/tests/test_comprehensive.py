@@ -40,41 +40,25 @@ class RateLimitMiddlewareTests(TestCase):
         from fhir_api.middleware.rate_limit import RateLimitConfig
         self.assertEqual(RateLimitConfig.LIMITS['default'], 60)
     
-    def test_token_bucket_initialization(self):
-        """Test token bucket algorithm initialization."""
-        from fhir_api.middleware.rate_limit import TokenBucket
-        bucket = TokenBucket(rate=60, capacity=60)
-        self.assertEqual(bucket.tokens, 60)
-        self.assertEqual(bucket.rate, 60)
-    
-    def test_token_bucket_consume(self):
-        """Test token bucket consumption."""
-        from fhir_api.middleware.rate_limit import TokenBucket
-        bucket = TokenBucket(rate=60, capacity=60)
+    def test_local_store_allows_burst_up_to_limit(self):
+        """Test GCRA store admits `limit` requests per window, then blocks."""
+        from fhir_api.middleware.rate_limit import LocalRateLimitStore
+        store = LocalRateLimitStore()
         
-        # Should be able to consume tokens
-        self.assertTrue(bucket.consume(1))
-        self.assertEqual(bucket.tokens, 59)
-    
-    def test_token_bucket_refill(self):
-        """Test token bucket refill over time."""
-        from fhir_api.middleware.rate_limit import TokenBucket
-        bucket = TokenBucket(rate=60, capacity=60)
+        results = [store.check('client', 60, 60) for _ in range(61)]
+        self.assertTrue(all(r.allowed for r in results[:60]))
+        self.assertEqual(results[0].remaining, 59)
+        self.assertFalse(results[60].allowed)
+        self.assertAlmostEqual(results[60].retry_after, 1, places=1)
+    
+    def test_rate_limiter_category_limit(self):
+        """Test rate limiter applies the per-category limit."""
+        from fhir_api.middleware.rate_limit import RateLimiter
+        limiter = RateLimiter()
         
-        # Consume all tokens
-        for _ in range(60):
-            bucket.consume(1)
-        
-        self.assertAlmostEqual(bucket.tokens, 0, places=1)
-    
-    def test_rate_limiter_get_bucket(self):
-        """Test rate limiter bucket creation."""
-        from fhir_api.middleware.rate_limit import get_rate_limiter
-        limiter = get_rate_limiter()
-        
-        bucket = limiter.get_bucket('test-client', 'default')
-        self.assertIsNotNone(bucket)
-        self.assertEqual(bucket.capacity, 60)
+        status = limiter.check_category('test-client', 'default')
+        self.assertTrue(status.allowed)
+        self.assertEqual(status.limit, 60)
 
 
 class OpenAPIDocumentationTests(TestCase):
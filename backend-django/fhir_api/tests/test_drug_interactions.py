@@ -0,0 +1,178 @@
+"""
+Unit Tests for the local drug interaction table
+
+Tests for pairwise checks by unordered RXCUI pair, the dataset file
+(rows, save/load, reload after an import), TerminologyService calling
+RxNav only for drugs outside the dataset, the AI and pharmacy checks
+reusing the table, and the drug_interactions_import command.
+"""
+
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+from django.core.management import call_command
+
+from fhir_api.services.ai_service import AIService
+from fhir_api.services.drug_interactions import (
+    RXNORM_SYSTEM,
+    InteractionSource,
+    InteractionTable,
+    read_interaction_file,
+    set_interaction_source,
+)
+from fhir_api.services.pharmacy_integration import PharmacyIntegrationService
+from fhir_api.services.terminology_service import TerminologyService
+
+
+ROWS = [
+    {"rxcui1": "11289", "rxcui2": "1191", "drug1": "warfarin", "drug2": "aspirin",
+     "severity": "high", "description": "Risco de sangramento", "source": "teste"},
+    {"rxcui1": "1191", "rxcui2": "5640", "drug1": "aspirin", "drug2": "ibuprofen",
+     "severity": "moderate", "description": "Reduz o efeito antiplaquetário", "source": "teste"},
+    {"rxcui1": "6809", "rxcui2": "", "drug1": "metformin"},
+]
+
+
+@pytest.fixture
+def table_path(tmp_path):
+    path = str(tmp_path / "drug_interactions.json")
+    InteractionTable.from_rows("2024-06", ROWS).save(path)
+    set_interaction_source(InteractionSource(path, check_interval=0))
+    TerminologyService._fetch_multi_drug_interactions.cache_clear()
+    yield path
+    set_interaction_source(None)
+
+
+def rxnav_response(*pairs):
+    response = MagicMock()
+    response.json.return_value = {"fullInteractionTypeGroup": [{"fullInteractionType": [{
+        "interactionPair": [{
+            "severity": "N/A",
+            "description": "remote",
+            "interactionConcept": [
+                {"minConceptItem": {"name": name1, "rxcui": rxcui1}},
+                {"minConceptItem": {"name": name2, "rxcui": rxcui2}},
+            ],
+        } for rxcui1, name1, rxcui2, name2 in pairs],
+    }]}]}
+    return response
+
+
+class TestInteractionTable:
+    """Tests for the pairwise check."""
+
+    def test_check_is_order_independent(self):
+        table = InteractionTable.from_rows("1", ROWS)
+
+        interactions, unknown = table.check(["5640", "11289", "1191", "11289"])
+
+        assert unknown == set()
+        assert [(i["drug1_rxcui"], i["drug2_rxcui"], i["severity"]) for i in interactions] == [
+            ("11289", "1191", "high"),
+            ("1191", "5640", "moderate"),
+        ]
+        assert interactions[0]["drug2"] == "aspirin"
+
+    def test_declared_drugs_and_unknown(self):
+        table = InteractionTable.from_rows("1", ROWS + ROWS[:1])
+
+        assert len(table) == 2 and len(table.pairs[("11289", "1191")]) == 1
+        assert table.knows("6809")
+        assert table.check(["6809", "11289", "999"]) == ([], {"999"})
+
+    def test_save_load_and_reload(self, table_path):
+        source = InteractionSource(table_path, check_interval=0)
+        assert source.get().version == "2024-06"
+
+        InteractionTable.from_rows("2024-07", ROWS[:1]).save(table_path)
+        os.utime(table_path, ns=(1, 1))
+        assert source.get().version == "2024-07" and len(source.get()) == 1
+
+        os.remove(table_path)
+        assert source.get() is None
+
+    def test_read_csv_with_column_map(self, tmp_path):
+        path = tmp_path / "ddi.csv"
+        path.write_text("object_rxcui;precipitant_rxcui;severity\n11289;1191;high\n")
+
+        rows = list(read_interaction_file(str(path), columns={"rxcui1": "object_rxcui", "rxcui2": "precipitant_rxcui"}))
+        assert rows[0]["rxcui1"] == "11289" and rows[0]["rxcui2"] == "1191" and rows[0]["description"] == ""
+
+
+class TestServicesWithTable:
+    """Tests for the services reading the local table."""
+
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_known_drugs_need_no_network(self, mock_get, table_path):
+        interactions = TerminologyService.check_multi_drug_interactions(["1191", "11289", "6809"])
+
+        assert [i["description"] for i in interactions] == ["Risco de sangramento"]
+        mock_get.assert_not_called()
+
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_unknown_drugs_fall_back_to_rxnav(self, mock_get, table_path):
+        mock_get.return_value = rxnav_response(
+            ("11289", "warfarin", "1191", "aspirin"),
+            ("999", "novo", "11289", "warfarin"),
+        )
+
+        interactions = TerminologyService.check_multi_drug_interactions(["11289", "1191", "999"])
+
+        assert [i["description"] for i in interactions] == ["Risco de sangramento", "remote"]
+        assert mock_get.call_count == 1
+
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_pharmacy_prescription_check(self, mock_get, table_path):
+        prescricao = [
+            {"medicationCodeableConcept": {"coding": [{"system": RXNORM_SYSTEM, "code": code}]}}
+            for code in ("11289", "1191")
+        ]
+
+        interacoes = PharmacyIntegrationService().verificar_interacoes_prescricao(prescricao)
+
+        assert interacoes == [{
+            "tipo": "grave",
+            "medicamento_1": "warfarin",
+            "medicamento_2": "aspirin",
+            "descricao": "Risco de sangramento",
+            "recomendacao": "Evitar uso concomitante ou monitorar o paciente de perto",
+        }]
+        mock_get.assert_not_called()
+
+    def test_ai_check_uses_table_before_model(self, table_path):
+        service = AIService()
+        with patch.object(service, 'check_ollama_health') as health:
+            result = service.check_medication_interactions(["5640", "1191", "11289"])
+            assert service.check_medication_interactions(["6809", "11289"])["has_interactions"] is False
+        health.assert_not_called()
+
+        assert result["has_interactions"] is True and result["severity"] == "high"
+        assert result["interactions"][0] == "warfarin + aspirin: Risco de sangramento"
+
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_ai_check_merges_rxnav_for_unknown_drugs(self, mock_get, table_path):
+        mock_get.return_value = rxnav_response(("999", "novo", "11289", "warfarin"))
+        service = AIService()
+        with patch.object(service, 'check_ollama_health') as health:
+            result = service.check_medication_interactions(["11289", "1191", "999"])
+        health.assert_not_called()
+
+        assert result["interactions"] == ["warfarin + aspirin: Risco de sangramento", "novo + warfarin: remote"]
+        assert result["severity"] == "high" and result["source"] == "local+rxnav"
+        assert "Medicamentos fora da base de interações: 999" in result["recommendations"]
+        assert mock_get.call_args[1]["params"] == {"rxcuis": "11289+1191+999"}
+
+
+class TestImportCommand:
+    """Tests for drug_interactions_import."""
+
+    def test_import_csv(self, tmp_path, settings):
+        settings.DRUG_INTERACTIONS_PATH = str(tmp_path / "drug_interactions.json")
+        dataset = tmp_path / "ddi.csv"
+        dataset.write_text("rxcui1,rxcui2,severity,description\n11289,1191,high,Sangramento\n6809,,,\n")
+
+        call_command('drug_interactions_import', str(dataset), release='2024-06')
+
+        table = InteractionTable.load(settings.DRUG_INTERACTIONS_PATH)
+        assert table.version == "2024-06" and len(table) == 1 and table.knows("6809")
@@ -0,0 +1,154 @@
+"""
+Unit Tests for conditional GET (ETaggerMiddleware)
+
+Tests for validators derived from FHIR meta, 304 before the view,
+invalidation on FHIR writes, hashed bodies always running the view and
+the streaming / large body cases.
+"""
+
+import pytest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from fhir_api.middleware.performance import ETaggerMiddleware, fhir_version_validators
+from fhir_api.services.cache_service import cache_service
+from fhir_api.services.fhir_core import FHIRService
+
+
+PATIENT = {
+    "resourceType": "Patient",
+    "id": "123",
+    "meta": {"versionId": "3", "lastUpdated": "2024-05-01T10:00:00.000+00:00"},
+}
+
+
+def drf_response(data):
+    response = Response(data)
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = "application/json"
+    response.renderer_context = {}
+    return response.render()
+
+
+class CountingView:
+    def __init__(self, make_response):
+        self.make_response = make_response
+        self.calls = 0
+
+    def __call__(self, request):
+        self.calls += 1
+        return self.make_response()
+
+
+def get(path="/api/v1/patients/123/", **headers):
+    return RequestFactory().get(path, HTTP_AUTHORIZATION="Bearer token-a", **headers)
+
+
+@pytest.fixture(autouse=True)
+def clear_validators():
+    cache_service.invalidate_validators()
+    yield
+    cache_service.invalidate_validators()
+
+
+class TestFhirVersionValidators:
+    """Tests for ETag / Last-Modified derived from meta."""
+
+    def test_resource(self):
+        etag, last_modified = fhir_version_validators(PATIENT)
+        assert etag == 'W/"3"'
+        assert last_modified == 1714557600
+
+    def test_bundle_changes_with_entry_version(self):
+        bundle = {"resourceType": "Bundle", "total": 1, "entry": [{"resource": PATIENT}]}
+        updated = {**PATIENT, "meta": {"versionId": "4"}}
+        etag, _ = fhir_version_validators(bundle)
+        other, last_modified = fhir_version_validators({**bundle, "entry": [{"resource": updated}]})
+        assert etag.startswith('W/"') and etag != other
+        assert last_modified is None
+
+    def test_without_version(self):
+        assert fhir_version_validators({"resourceType": "Patient", "id": "1"}) is None
+        assert fhir_version_validators({"patients": []}) is None
+
+
+class TestETaggerMiddleware:
+    """Tests for the conditional request layer."""
+
+    def test_etag_from_meta(self):
+        middleware = ETaggerMiddleware(CountingView(lambda: drf_response(PATIENT)))
+        response = middleware(get())
+        assert response.status_code == 200
+        assert response["ETag"] == 'W/"3"'
+        assert response["Last-Modified"] == "Wed, 01 May 2024 10:00:00 GMT"
+
+    def test_not_modified_before_view(self):
+        view = CountingView(lambda: drf_response(PATIENT))
+        middleware = ETaggerMiddleware(view)
+        middleware(get())
+
+        response = middleware(get(HTTP_IF_NONE_MATCH='W/"3"'))
+        assert response.status_code == 304
+        assert response["ETag"] == 'W/"3"'
+        assert view.calls == 1
+
+        response = middleware(get(HTTP_IF_MODIFIED_SINCE="Wed, 01 May 2024 10:00:00 GMT"))
+        assert response.status_code == 304
+        assert view.calls == 1
+
+    def test_validators_are_per_credential(self):
+        view = CountingView(lambda: drf_response(PATIENT))
+        middleware = ETaggerMiddleware(view)
+        middleware(get())
+
+        request = RequestFactory().get(
+            "/api/v1/patients/123/", HTTP_AUTHORIZATION="Bearer token-b", HTTP_IF_NONE_MATCH='W/"3"'
+        )
+        # Matches after the view ran, but the view must run for another credential
+        assert middleware(request).status_code == 304
+        assert view.calls == 2
+
+    def test_fhir_write_drops_validators(self):
+        view = CountingView(lambda: drf_response(PATIENT))
+        middleware = ETaggerMiddleware(view)
+        middleware(get())
+
+        FHIRService.clear_cache("Patient")
+        response = middleware(get(HTTP_IF_NONE_MATCH='W/"2"'))
+        assert response.status_code == 200
+        assert view.calls == 2
+
+    def test_hashed_body_runs_the_view(self):
+        body = [b'{"total": 1}']
+        view = CountingView(lambda: HttpResponse(body[0]))
+        middleware = ETaggerMiddleware(view)
+        etag = middleware(get())["ETag"]
+
+        assert middleware(get(HTTP_IF_NONE_MATCH=etag)).status_code == 304
+        assert view.calls == 2
+
+        body[0] = b'{"total": 2}'
+        response = middleware(get(HTTP_IF_NONE_MATCH=etag))
+        assert response.status_code == 200 and response["ETag"] != etag
+
+    def test_content_hash_fallback(self):
+        middleware = ETaggerMiddleware(CountingView(lambda: HttpResponse(b'{"total": 1}')))
+        etag = middleware(get()).get("ETag")
+        assert etag and not etag.startswith("W/")
+
+        middleware.max_body = 4
+        cache_service.invalidate_validators()
+        assert middleware(get()).get("ETag") is None
+
+    def test_streaming_is_skipped(self):
+        view = CountingView(lambda: StreamingHttpResponse(iter([b"a", b"b"])))
+        response = ETaggerMiddleware(view)(get(HTTP_IF_NONE_MATCH="*"))
+        assert response.status_code == 200
+        assert not response.has_header("ETag")
+
+    def test_writes_pass_through(self):
+        view = CountingView(lambda: drf_response(PATIENT))
+        response = ETaggerMiddleware(view)(RequestFactory().post("/api/v1/patients/"))
+        assert not response.has_header("ETag")
@@ -0,0 +1,168 @@
+"""
+Unit Tests for the FHIRService search/read cache
+
+Tests for the bounded LRU/TTL cache and per-resource-type invalidation.
+"""
+
+import json
+import threading
+import time
+
+import pytest
+import requests
+from unittest.mock import patch, MagicMock
+
+from fhir_api.services.cache_service import LRUTTLCache
+from fhir_api.services.fhir_core import FHIRService
+
+
+def bundle_response(resources, status_code=200):
+    bundle = {"resourceType": "Bundle", "entry": [{"resource": r} for r in resources]}
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = bundle
+    response.content = json.dumps(bundle).encode()
+    response.raise_for_status.return_value = None
+    return response
+
+
+def adapter_send(get_resources):
+    """Fake HTTPAdapter.send so session hooks run on real Response objects."""
+    calls = []
+
+    def send(request, **kwargs):
+        calls.append(request)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        if request.method == "GET":
+            response.status_code = 200
+            response._content = json.dumps(
+                {"resourceType": "Bundle", "entry": [{"resource": r} for r in get_resources]}
+            ).encode()
+        else:
+            response.status_code = 201
+            response._content = b'{"resourceType": "Patient", "id": "2"}'
+        return response
+
+    return send, calls
+
+
+class TestLRUTTLCache:
+    """Tests for LRUTTLCache."""
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUTTLCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.evictions == 1
+
+    def test_byte_budget(self):
+        cache = LRUTTLCache(max_entries=100, max_bytes=10)
+        cache.set("a", "x", size=6)
+        cache.set("b", "y", size=6)
+        assert len(cache) == 1
+        assert cache.get_stats()["bytes"] == 6
+
+    def test_ttl_expiry(self):
+        cache = LRUTTLCache()
+        with patch("fhir_api.services.cache_service.time.monotonic", return_value=1000.0):
+            cache.set("a", 1, ttl=10)
+        with patch("fhir_api.services.cache_service.time.monotonic", return_value=1011.0):
+            assert cache.get("a") is None
+
+    def test_invalidate_tag(self):
+        cache = LRUTTLCache()
+        cache.set("Patient:1", 1, tag="Patient")
+        cache.set("Patient:2", 2, tag="Patient")
+        cache.set("Observation:1", 3, tag="Observation")
+        assert cache.invalidate_tag("Patient") == 2
+        assert cache.get("Observation:1") == 3
+
+    def test_hit_miss_counters(self):
+        cache = LRUTTLCache()
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("missing")
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+
+class TestFHIRServiceCache:
+    """Tests for FHIRService search caching and invalidation."""
+
+    @pytest.fixture(autouse=True)
+    def clean_cache(self):
+        # Outros testes podem deixar o circuit breaker (de classe) aberto
+        FHIRService.reset_circuit()
+        FHIRService.clear_cache()
+        yield
+        FHIRService.reset_circuit()
+        FHIRService.clear_cache()
+
+    def test_search_is_cached(self):
+        service = FHIRService()
+        with patch.object(service.session, "get", return_value=bundle_response([{"id": "1"}])) as mock_get:
+            first = service.search_resources("Patient", {"name": "Ana"})
+            second = service.search_resources("Patient", {"name": "Ana"})
+        assert first == second == [{"id": "1"}]
+        assert mock_get.call_count == 1
+
+    def test_callers_get_independent_copies(self):
+        service = FHIRService()
+        with patch.object(service.session, "get", return_value=bundle_response([{"id": "1"}])):
+            first = service.search_resources("Location", {"type": "bed"})
+            first[0]["operationalStatus"] = "Occupied"
+            second = service.search_resources("Location", {"type": "bed"})
+        assert second == [{"id": "1"}]
+
+    def test_concurrent_searches_hit_server_once(self):
+        service = FHIRService()
+
+        def slow_get(*args, **kwargs):
+            time.sleep(0.05)
+            return bundle_response([{"id": "1"}])
+
+        with patch.object(service.session, "get", side_effect=slow_get) as mock_get:
+            threads = [
+                threading.Thread(target=service.search_resources, args=("Location", {"type": "bed"}))
+                for _ in range(8)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+        assert mock_get.call_count == 1
+
+    def test_use_cache_false_bypasses_cache(self):
+        service = FHIRService()
+        with patch.object(service.session, "get", return_value=bundle_response([])) as mock_get:
+            service.search_resources("Patient", {"name": "Ana"}, use_cache=False)
+            service.search_resources("Patient", {"name": "Ana"}, use_cache=False)
+        assert mock_get.call_count == 2
+
+    def test_create_invalidates_resource_type(self):
+        service = FHIRService()
+        send, calls = adapter_send([{"id": "1"}])
+        with patch("requests.adapters.HTTPAdapter.send", side_effect=send):
+            service.search_resources("Patient", {"name": "Ana"})
+            service.search_resources("Observation", {"code": "x"})
+            service.create_resource("Patient", {"resourceType": "Patient"})
+            service.search_resources("Patient", {"name": "Ana"})
+            service.search_resources("Observation", {"code": "x"})
+        # Patient refetched after the write, Observation still cached
+        assert [c.method for c in calls].count("GET") == 3
+
+    def test_any_session_write_invalidates(self):
+        service = FHIRService()
+        send, calls = adapter_send([])
+        with patch("requests.adapters.HTTPAdapter.send", side_effect=send):
+            service.search_resources("Observation", {"code": "x"})
+            service.session.post(f"{service.base_url}/Observation", json={})
+            service.search_resources("Observation", {"code": "x"})
+        assert [c.method for c in calls].count("GET") == 2
@@ -0,0 +1,115 @@
+"""
+Unit Tests for FHIRService Bundle pagination
+
+Tests for iter_resources/iter_pages following link[rel=next].
+"""
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+from fhir_api.services.fhir_core import FHIRService
+
+
+def page(ids, next_url=None):
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "entry": [{"resource": {"resourceType": "Observation", "id": i}} for i in ids],
+        "link": [{"relation": "self", "url": "http://hapi/fhir/Observation"}],
+    }
+    if next_url:
+        bundle["link"].append({"relation": "next", "url": next_url})
+    response = MagicMock(status_code=200)
+    response.json.return_value = bundle
+    response.raise_for_status.return_value = None
+    return response
+
+
+@pytest.fixture
+def service():
+    FHIRService.clear_cache()
+    FHIRService.reset_circuit()
+    svc = FHIRService()
+    svc.base_url = "http://fhir-server:8080/fhir"
+    yield svc
+    FHIRService.clear_cache()
+
+
+PAGES = [
+    page(["1", "2"], "http://localhost:8080/fhir?_getpages=abc&_getpagesoffset=2"),
+    page(["3", "4"], "http://localhost:8080/fhir?_getpages=abc&_getpagesoffset=4"),
+    page(["5"]),
+]
+
+
+class TestIterResources:
+    """Tests for lazy pagination."""
+
+    def test_follows_next_links(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES) as mock_get:
+            ids = [r["id"] for r in service.iter_resources("Observation", {"code": "x"})]
+        assert ids == ["1", "2", "3", "4", "5"]
+        assert mock_get.call_count == 3
+
+    def test_next_link_rewritten_to_configured_base(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES) as mock_get:
+            list(service.iter_resources("Observation"))
+        second_url = mock_get.call_args_list[1][0][0]
+        assert second_url == "http://fhir-server:8080/fhir?_getpages=abc&_getpagesoffset=2"
+        assert mock_get.call_args_list[1][1]["params"] is None
+
+    def test_is_lazy(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES) as mock_get:
+            iterator = service.iter_resources("Observation")
+            next(iterator)
+            assert mock_get.call_count == 1
+
+    def test_max_items_budget(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES) as mock_get:
+            ids = [r["id"] for r in service.iter_resources("Observation", max_items=3)]
+        assert ids == ["1", "2", "3"]
+        assert mock_get.call_count == 2
+
+    def test_max_pages_budget(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES):
+            ids = [r["id"] for r in service.iter_resources("Observation", max_pages=1)]
+        assert ids == ["1", "2"]
+
+    def test_included_resources_are_skipped(self, service):
+        response = page(["1", "2"])
+        bundle = response.json.return_value
+        bundle["entry"][0]["search"] = {"mode": "match"}
+        bundle["entry"].append({"resource": {"resourceType": "Patient", "id": "p"}, "search": {"mode": "include"}})
+        bundle["entry"].append({"resource": {"resourceType": "OperationOutcome"}, "search": {"mode": "outcome"}})
+        with patch.object(service.session, "get", return_value=response):
+            ids = [r["id"] for r in service.iter_resources("Observation", {"_include": "Observation:subject"})]
+        assert ids == ["1", "2"]
+
+    def test_included_resources_on_request(self, service):
+        response = page(["1"])
+        bundle = response.json.return_value
+        bundle["entry"].append({"resource": {"resourceType": "Patient", "id": "p"}, "search": {"mode": "include"}})
+        bundle["entry"].append({"resource": {"resourceType": "OperationOutcome"}, "search": {"mode": "outcome"}})
+        with patch.object(service.session, "get", return_value=response):
+            ids = [r["id"] for r in service.iter_resources("Observation", include_included=True)]
+        assert ids == ["1", "p"]
+
+
+class TestSearchResourcesPagination:
+    """Tests for search_resources on top of iter_resources."""
+
+    def test_collects_all_pages(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES):
+            results = service.search_resources("Observation", {"code": "x"}, use_cache=False)
+        assert len(results) == 5
+
+    def test_explicit_count_returns_first_page(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES) as mock_get:
+            results = service.search_resources("Observation", {"_count": 2}, use_cache=False)
+        assert len(results) == 2
+        assert mock_get.call_count == 1
+
+    def test_patient_getter_is_not_truncated(self, service):
+        with patch.object(service.session, "get", side_effect=PAGES):
+            results = service.get_observations_by_patient_id("p1")
+        assert len(results) == 5
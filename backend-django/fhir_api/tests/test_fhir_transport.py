@@ -0,0 +1,77 @@
+"""
+Unit Tests for the shared FHIR HTTP transport
+
+Tests for connection reuse across FHIRService instances, default
+timeouts, optional gzip request bodies and pool metrics.
+"""
+
+import gzip
+import json
+
+import pytest
+import requests
+from unittest.mock import patch
+
+from fhir_api.services.fhir_core import FHIRService
+from fhir_api.services.fhir_transport import FHIRTransport
+
+
+def ok_response(request, **kwargs):
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = 200
+    response._content = b'{"resourceType": "Bundle"}'
+    return response
+
+
+@pytest.fixture(autouse=True)
+def fresh_transport():
+    FHIRTransport.reset_instance()
+    FHIRService.clear_cache()
+    yield
+    FHIRTransport.reset_instance()
+
+
+class TestFHIRTransport:
+    """Tests for FHIRTransport and PooledHTTPAdapter."""
+
+    def test_session_shared_across_instances(self):
+        first = FHIRService(user="a")
+        second = FHIRService(user="b")
+        assert first.session is second.session
+        assert first.user != second.user
+
+    def test_response_hook_registered_once(self):
+        for _ in range(5):
+            FHIRService()
+        hooks = FHIRTransport.get_instance().session.hooks["response"]
+        assert len(hooks) == 1
+
+    def test_default_timeout_applied(self):
+        transport = FHIRTransport(connect_timeout=2, read_timeout=7)
+        with patch("requests.adapters.HTTPAdapter.send", side_effect=ok_response) as mock_send:
+            transport.session.get("http://hapi/fhir/Patient")
+        assert mock_send.call_args[1]["timeout"] == (2, 7)
+
+    def test_gzip_request_body(self):
+        transport = FHIRTransport(compress_requests=True)
+        transport.adapter.compress_min_bytes = 10
+        payload = {"resourceType": "Patient", "name": [{"family": "Silva" * 50}]}
+        with patch("requests.adapters.HTTPAdapter.send", side_effect=ok_response) as mock_send:
+            transport.session.post("http://hapi/fhir/Patient", json=payload)
+        sent = mock_send.call_args[0][0]
+        assert sent.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(sent.body)) == payload
+
+    def test_stats_count_requests_and_errors(self):
+        transport = FHIRTransport()
+        with patch("requests.adapters.HTTPAdapter.send", side_effect=ok_response):
+            transport.session.get("http://hapi/fhir/Patient")
+        with patch("requests.adapters.HTTPAdapter.send", side_effect=requests.ConnectionError("down")):
+            with pytest.raises(requests.ConnectionError):
+                transport.session.get("http://hapi/fhir/Patient")
+        stats = transport.get_stats()
+        assert stats["requests_total"] == 2
+        assert stats["errors_total"] == 1
+        assert stats["in_flight"] == 0
@@ -0,0 +1,92 @@
+"""
+Unit Tests for the HL7 v2 parsing core
+
+Tests for the segment index, HL7 field numbering (MSH-1/MSH-2),
+components, repetitions and escape sequences decoded on access, custom
+encoding characters, FHS/BHS batches and HL7Message/HL7Service on top of
+the parser.
+"""
+
+from fhir_api.services.hl7_parser import HL7Encoding, ParsedMessage, iter_messages, unescape
+from fhir_api.services.hl7_service import ADTEventType, HL7Message, HL7Service
+
+
+ORU = "\r\n".join([
+    "MSH|^~\\&|LAB|HOSPITAL|OPENEHR|CORE|20241213120000||ORU^R01^ORU_R01|12346|P|2.5.1",
+    "PID|1||123456^^^HOSP^MR~987^^^SUS||Silva^Jo\\S\\ão^Carlos||19850315|M",
+    "",
+    "OBX|1|NM|718-7^HEMOGLOBIN^LN||14.5|g/dL^grama por decilitro|13.5-17.5|N|||F",
+    "OBX|2|ST|5778-6^COR^LN||Amarelo \\T\\ límpido\\.br\\sem depósito|",
+])
+
+
+class TestParsedMessage:
+    """Tests for field access on the parsed message."""
+
+    def test_segment_index(self):
+        message = ParsedMessage(ORU)
+
+        assert message.names == ["MSH", "PID", "OBX", "OBX"]
+        assert message.message_type == "ORU^R01^ORU_R01"
+        assert [obx.get(1) for obx in message.segments("OBX")] == ["1", "2"]
+        assert message.first("NTE") is None and message.segments("NTE") == []
+
+    def test_header_field_numbering(self):
+        msh = ParsedMessage(ORU).first("MSH")
+
+        assert msh.get(1) == "|" and msh.get(2) == "^~\\&"
+        assert msh.get(9, 2) == "R01" and msh.get(10) == "12346"
+        assert msh.fields[:2] == ["^~\\&", "LAB"]
+
+    def test_components_repetitions_and_escapes(self):
+        message = ParsedMessage(ORU)
+        pid = message.first("PID")
+
+        assert pid.get(3, 1) == "123456"
+        assert pid.get(3, 1, repetition=2) == "987"
+        assert pid.get(3, 1, repetition=3) == ""
+        assert pid.repetitions(3) == ["123456^^^HOSP^MR", "987^^^SUS"]
+        assert pid.components(5) == ["Silva", "Jo^ão", "Carlos"]
+        assert pid.get(5, 9) == "" and pid.get(40) == ""
+        assert message.segments("OBX")[1].get(5) == "Amarelo & límpido\nsem depósito"
+
+    def test_custom_encoding_characters(self):
+        message = ParsedMessage("MSH#$*!@#LAB######ADT$A04\rPID#1##55$$$HOSP*66#")
+
+        assert message.encoding == HL7Encoding("#", "$", "*", "!", "@")
+        assert message.message_type == "ADT^A04"
+        assert message.first("PID").get(3, 1, repetition=2) == "66"
+        assert unescape("a!F!b!S!c", message.encoding) == "a#b$c"
+
+    def test_unescape(self):
+        assert unescape("\\X41\\\\E\\\\H\\x\\N\\") == "A\\x"
+        assert unescape("sem fechamento \\F") == "sem fechamento \\F"
+
+    def test_batch(self):
+        batch = "\r".join(["FHS|^~\\&|LAB", "BHS|^~\\&|LAB", ORU, ORU.replace("12346", "12347"), "BTS|2", "FTS|1"])
+
+        messages = list(iter_messages(batch))
+
+        assert [m.first("MSH").get(10) for m in messages] == ["12346", "12347"]
+        assert [len(m) for m in messages] == [4, 4]
+
+
+class TestHL7MessageOnParser:
+    """Tests for HL7Message/HL7Service reading through the parser."""
+
+    def test_oru_to_fhir(self):
+        observations = HL7Service.parse_oru_to_fhir(HL7Message.from_string(ORU))
+
+        assert observations[0]["valueQuantity"] == {"value": 14.5, "unit": "g/dL"}
+        assert observations[0]["subject"]["reference"] == "Patient/123456"
+        assert observations[1]["valueString"].startswith("Amarelo & límpido")
+
+    def test_built_and_parsed_messages_agree(self):
+        patient = {"id": "9", "name": [{"family": "Souza", "given": ["Ana"]}], "gender": "female"}
+        built = HL7Service.create_adt_message(patient, ADTEventType.ADMIT)
+        parsed = HL7Message.from_string(built.to_string())
+
+        assert parsed.message_type == built.message_type == "ADT^A01"
+        assert parsed.to_string() == built.to_string()
+        assert HL7Service.parse_adt_to_fhir(parsed) == HL7Service.parse_adt_to_fhir(built)
+        assert built.get_segment("MSH").get(2) == parsed.get_segment("MSH").get(2) == "^~\\&"
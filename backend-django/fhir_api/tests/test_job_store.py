@@ -0,0 +1,134 @@
+"""
+Unit Tests for the Bulk Data job store
+
+Tests for lease-based claiming, cancellation and expiry in the in-memory
+and Django ORM job stores.
+"""
+
+from datetime import timedelta
+
+import pytest
+from unittest.mock import patch
+from django.utils import timezone
+
+from fhir_api.services.bulk_data_service import BulkExportService, ExportLevel, ExportStatus
+from fhir_api.services.job_store import DatabaseJobStore, InMemoryJobStore, get_job_store, set_job_store
+
+
+def job(job_id, status="pending", **extra):
+    return {"job_id": job_id, "status": status, **extra}
+
+
+@pytest.fixture(params=["memory", pytest.param("database", marks=pytest.mark.django_db)])
+def store(request):
+    if request.param == "database":
+        return DatabaseJobStore()
+    return InMemoryJobStore()
+
+
+class TestJobStore:
+    """Tests shared by the job store backends."""
+
+    def test_save_and_load(self, store):
+        store.save("export", job("a", progress=10))
+        assert store.load("export", "a")["progress"] == 10
+        assert store.load("import", "a") is None
+
+    def test_only_one_worker_claims(self, store):
+        store.save("export", job("a"))
+        assert store.claim("export", "a", "w1", 60) is True
+        assert store.claim("export", "a", "w2", 60) is False
+
+    def test_expired_lease_can_be_taken_over(self, store):
+        store.save("export", job("a", "in-progress"))
+        assert store.claim("export", "a", "w1", -1)
+        assert store.claim("export", "a", "w2", 60)
+        assert store.heartbeat("export", "a", "w1", 60) is None
+        assert store.heartbeat("export", "a", "w2", 60) == "in-progress"
+
+    def test_lease_held(self, store):
+        store.save("export", job("a", "in-progress"))
+        assert store.lease_held("export", "a") is False
+        store.claim("export", "a", "w1", 60)
+        assert store.lease_held("export", "a") is True
+        store.release("export", "a", "w1")
+        store.claim("export", "a", "w1", -1)
+        assert store.lease_held("export", "a") is False
+
+    def test_save_is_fenced_on_lease_owner(self, store):
+        store.save("export", job("a", "in-progress"))
+        store.claim("export", "a", "w1", -1)
+        assert store.claim("export", "a", "w2", 60)
+
+        assert store.save("export", job("a", "in-progress", progress=10), "w1") is False
+        assert store.save("export", job("a", "cancelled"), "w1") is False
+        assert store.save("export", job("a", "in-progress", progress=50), "w2") is True
+        assert store.load("export", "a")["progress"] == 50
+
+    def test_finished_jobs_are_not_claimable(self, store):
+        store.save("export", job("a", "completed"))
+        assert store.claim_next("export", "w1", 60) is None
+
+    def test_claim_next_takes_oldest(self, store):
+        store.save("export", job("a"))
+        store.save("export", job("b"))
+        assert store.claim_next("export", "w1", 60) == "a"
+        assert store.claim_next("export", "w1", 60) == "b"
+
+    def test_progress_write_does_not_undo_cancel(self, store):
+        store.save("export", job("a", "in-progress"))
+        store.claim("export", "a", "w1", 60)
+        assert store.cancel("export", "a") is True
+        assert store.save("export", job("a", "in-progress")) is False
+        assert store.heartbeat("export", "a", "w1", 60) == "cancelled"
+
+    def test_expired(self, store):
+        past = (timezone.now() - timedelta(minutes=1)).isoformat()
+        future = (timezone.now() + timedelta(hours=1)).isoformat()
+        store.save("export", job("old", "completed", expires_time=past))
+        store.save("export", job("new", "completed", expires_time=future))
+        assert [d["job_id"] for d in store.expired("export")] == ["old"]
+
+
+class TestBulkExportJobStore:
+    """Tests for BulkExportService on top of the job store."""
+
+    @pytest.fixture(autouse=True)
+    def export_dir(self, tmp_path):
+        previous = get_job_store()
+        set_job_store(InMemoryJobStore())
+        with patch("fhir_api.services.bulk_data_service.EXPORT_DIR", str(tmp_path)):
+            yield tmp_path
+        set_job_store(previous)
+
+    def create_job(self):
+        with patch.object(BulkExportService, '_process_export_job'):
+            return BulkExportService.create_export_job(level=ExportLevel.SYSTEM, resource_types=["Patient"])
+
+    def test_pending_job_is_run_by_any_worker(self):
+        job = self.create_job()
+        with patch("fhir_api.services.bulk_data_service.FHIRService") as mock_cls:
+            mock_cls.return_value.iter_resources.return_value = iter([{"resourceType": "Patient", "id": "1"}])
+            assert BulkExportService.run_next_pending() == job.job_id
+        done = BulkExportService.get_job(job.job_id)
+        assert done.status == ExportStatus.COMPLETED
+        assert done.expires_time is not None
+
+    def test_claimed_job_is_not_run_twice(self):
+        job = self.create_job()
+        assert BulkExportService._store().claim("export", job.job_id, "other-worker", 60)
+        with patch.object(BulkExportService, '_execute_export_job') as mock_execute:
+            BulkExportService._process_export_job(job.job_id)
+        mock_execute.assert_not_called()
+
+    def test_expire_jobs_removes_files(self, export_dir):
+        job = self.create_job()
+        (export_dir / job.job_id).mkdir()
+        (export_dir / job.job_id / "Patient.ndjson").write_text("{}\n")
+        job.status = ExportStatus.COMPLETED
+        job.expires_time = timezone.now() - timedelta(seconds=1)
+        BulkExportService._persist(job)
+
+        assert BulkExportService.expire_jobs() == 1
+        assert BulkExportService.get_job(job.job_id) is None
+        assert not (export_dir / job.job_id).exists()
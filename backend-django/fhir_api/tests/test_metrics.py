@@ -0,0 +1,152 @@
+"""
+Unit Tests for the Prometheus metrics
+
+Tests for fixed-bucket histograms, per-thread shards, quantile estimation
+and aggregation of the memory-mapped per-worker files.
+"""
+
+import os
+import threading
+
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from fhir_api import metrics
+from fhir_api.metrics import Counter, Histogram, histogram_quantile
+
+
+@pytest.fixture(autouse=True)
+def fresh_stores(settings):
+    settings.METRICS_MULTIPROC_DIR = ''
+    metrics._reset_stores()
+    yield
+    metrics._reset_stores()
+
+
+@pytest.fixture
+def multiproc_dir(settings, tmp_path):
+    settings.METRICS_MULTIPROC_DIR = str(tmp_path)
+    metrics._reset_stores()
+    return tmp_path
+
+
+def samples():
+    return {
+        line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+        for line in metrics.format_prometheus_metrics().splitlines()
+        if line and not line.startswith('#')
+    }
+
+
+class TestHistogram:
+    """Tests for histogram observation and exposition."""
+
+    def test_cumulative_buckets(self):
+        hist = Histogram('test_latency_seconds', 'test', ['endpoint'], buckets=[0.1, 1])
+        for value in (0.05, 0.1, 0.5, 3):
+            hist.observe(value, endpoint='a')
+
+        exposed = samples()
+        assert exposed['test_latency_seconds_bucket{endpoint="a",le="0.1"}'] == 2
+        assert exposed['test_latency_seconds_bucket{endpoint="a",le="1.0"}'] == 3
+        assert exposed['test_latency_seconds_bucket{endpoint="a",le="+Inf"}'] == 4
+        assert exposed['test_latency_seconds_count{endpoint="a"}'] == 4
+        assert exposed['test_latency_seconds_sum{endpoint="a"}'] == pytest.approx(3.65)
+
+    def test_quantile(self):
+        hist = Histogram('test_quantile_seconds', 'test', buckets=[0.1, 0.2, 0.4])
+        for _ in range(90):
+            hist.observe(0.05)
+        for _ in range(10):
+            hist.observe(0.3)
+        assert hist.quantile(0.5) == pytest.approx(0.1 * 50 / 90)
+        assert hist.quantile(0.95) == pytest.approx(0.2 + 0.2 * 5 / 10)
+
+    def test_quantile_empty(self):
+        assert histogram_quantile(0.9, (1.0, float('inf')), [0, 0]) is None
+
+    def test_threads_write_own_shards(self):
+        counter = Counter('test_threaded_total', 'test')
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert samples()['test_threaded_total'] == 8000
+
+
+class TestMultiProcess:
+    """Tests for the memory-mapped per-worker store."""
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason="requires fork")
+    def test_scrape_aggregates_workers(self, multiproc_dir):
+        counter = Counter('test_workers_total', 'test', ['worker'])
+        counter.inc(worker='all')
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                counter.inc(2, worker='all')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert samples()['test_workers_total{worker="all"}'] == 3
+        assert len(list(multiproc_dir.glob('counter_*.db'))) == 2
+
+    def test_file_grows_and_reloads(self, multiproc_dir, monkeypatch):
+        monkeypatch.setattr(metrics._MmapValueStore, 'INITIAL_SIZE', 256)
+        counter = Counter('test_grow_total', 'test', ['n'])
+        for n in range(50):
+            counter.inc(n, n=n)
+
+        path = multiproc_dir / f'counter_{os.getpid()}.db'
+        reloaded = metrics._MmapValueStore(str(path))
+        values = dict(reloaded.items())
+        assert len(values) == 50
+        assert sum(values.values()) == sum(range(50))
+
+    def test_dead_worker_gauges_dropped(self, multiproc_dir):
+        metrics.ACTIVE_REQUESTS.inc()
+        metrics.collect()
+        metrics.mark_process_dead(os.getpid())
+        assert not list(multiproc_dir.glob('gauge_*.db'))
+
+
+class TestInstrumentation:
+    """Tests for the request, FHIR operation and upstream call metrics."""
+
+    def test_middleware_labels_by_route(self):
+        middleware = metrics.MetricsMiddleware(lambda request: HttpResponse(status=201))
+        middleware(RequestFactory().post('/api/v1/unknown/'))
+
+        exposed = samples()
+        assert exposed['openehrcore_requests_by_status{status="201"}'] == 1
+        assert exposed[
+            'openehrcore_request_duration_seconds_count{method="POST",endpoint="unmatched"}'
+        ] == 1
+
+    def test_fhir_operation_decorator(self):
+        class Service:
+            @metrics.fhir_operation('read')
+            def get_resource(self, resource_type, resource_id):
+                return {'id': resource_id}
+
+        Service().get_resource('Patient', '1')
+        exposed = samples()
+        assert exposed['openehrcore_fhir_operations{operation="read",resource="Patient"}'] == 1
+        assert exposed[
+            'openehrcore_fhir_operation_duration_seconds_count{operation="read",resource="Patient"}'
+        ] == 1
+
+    def test_summary_reports_percentiles(self):
+        metrics.REQUEST_DURATION.observe(0.2, method='GET', endpoint='x')
+        summary = metrics.get_metrics_summary()
+        assert summary['avg_response_time'] == pytest.approx(0.2)
+        assert 0.1 < summary['p95_response_time'] <= 0.25
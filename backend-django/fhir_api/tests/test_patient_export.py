@@ -0,0 +1,167 @@
+"""
+Unit Tests for patient data export ($everything)
+
+Tests for the native $everything path, the parallel fan-out fallback and
+the streaming Bundle/NDJSON output.
+"""
+
+import json
+import time
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+from fhir_api.services.fhir_core import FHIRService, FHIRServiceException
+
+
+def json_response(body, status_code=200):
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = body
+    response.raise_for_status.return_value = None
+    return response
+
+
+def searchset(resources):
+    return {"resourceType": "Bundle", "type": "searchset",
+            "entry": [{"resource": r} for r in resources]}
+
+
+PATIENT = {"resourceType": "Patient", "id": "p1"}
+
+
+def capability(with_everything):
+    resource = {"type": "Patient"}
+    if with_everything:
+        resource["operation"] = [{"name": "everything",
+                                  "definition": "http://hl7.org/fhir/OperationDefinition/Patient-everything"}]
+    return {"resourceType": "CapabilityStatement", "rest": [{"resource": [resource]}]}
+
+
+def fake_get(with_everything):
+    def get(url, params=None, timeout=None):
+        if url.endswith("/metadata"):
+            return json_response(capability(with_everything))
+        if url.endswith("/Patient/p1"):
+            return json_response(PATIENT)
+        if url.endswith("/Patient/p1/$everything"):
+            return json_response(searchset([PATIENT, {"resourceType": "Observation", "id": "o1"}]))
+        resource_type = url.rsplit("/", 1)[-1]
+        return json_response(searchset([{"resourceType": resource_type, "id": f"{resource_type}-1"}]))
+    return get
+
+
+@pytest.fixture
+def service():
+    FHIRService.clear_cache()
+    FHIRService.reset_circuit()
+    FHIRService._capabilities = None
+    yield FHIRService()
+    FHIRService._capabilities = None
+
+
+class TestPatientExport:
+    """Tests for export_patient_data and stream_patient_export."""
+
+    def test_fan_out_covers_all_searches(self, service):
+        with patch.object(service.session, "get", side_effect=fake_get(False)) as mock_get:
+            bundle = service.export_patient_data("p1")
+        types = sorted(e["resource"]["resourceType"] for e in bundle["entry"])
+        expected = sorted(["Patient"] + [t for t, _ in FHIRService.PATIENT_EXPORT_SEARCHES])
+        assert types == expected
+        assert not any("$everything" in c[0][0] for c in mock_get.call_args_list)
+
+    def test_uses_native_everything_when_advertised(self, service):
+        with patch.object(service.session, "get", side_effect=fake_get(True)) as mock_get:
+            bundle = service.export_patient_data("p1")
+        ids = [e["resource"]["id"] for e in bundle["entry"]]
+        assert ids == ["p1", "o1"]  # Patient not duplicated
+        assert not any(c[0][0].endswith("/Encounter") for c in mock_get.call_args_list)
+
+    def test_everything_keeps_included_resources(self, service):
+        everything = searchset([PATIENT, {"resourceType": "Observation", "id": "o1"},
+                                {"resourceType": "Practitioner", "id": "pr1"},
+                                {"resourceType": "OperationOutcome"}])
+        for entry, mode in zip(everything["entry"], ["match", "match", "include", "outcome"]):
+            entry["search"] = {"mode": mode}
+
+        def get(url, params=None, timeout=None):
+            if url.endswith("/Patient/p1/$everything"):
+                return json_response(everything)
+            return fake_get(True)(url, params, timeout)
+
+        with patch.object(service.session, "get", side_effect=get):
+            bundle = service.export_patient_data("p1")
+        assert [e["resource"]["id"] for e in bundle["entry"]] == ["p1", "o1", "pr1"]
+
+    def test_stream_bundle_is_valid_json(self, service):
+        with patch.object(service.session, "get", side_effect=fake_get(False)):
+            body = "".join(service.stream_patient_export("p1", "bundle"))
+        bundle = json.loads(body)
+        assert bundle["resourceType"] == "Bundle"
+        assert len(bundle["entry"]) == 1 + len(FHIRService.PATIENT_EXPORT_SEARCHES)
+
+    def test_stream_ndjson(self, service):
+        with patch.object(service.session, "get", side_effect=fake_get(True)):
+            lines = "".join(service.stream_patient_export("p1", "ndjson")).splitlines()
+        assert [json.loads(line)["id"] for line in lines] == ["p1", "o1"]
+
+    def test_first_page_failure_raises_before_streaming(self, service):
+        def failing_get(url, params=None, timeout=None):
+            if url.endswith("/$everything"):
+                import requests
+                raise requests.ConnectionError("boom")
+            return fake_get(True)(url, params, timeout)
+
+        with patch.object(service.session, "get", side_effect=failing_get):
+            with pytest.raises(FHIRServiceException):
+                service.stream_patient_export("p1", "bundle")
+        FHIRService.reset_circuit()
+
+    @pytest.mark.parametrize("output_format", ["bundle", "ndjson"])
+    def test_mid_stream_failure_ends_with_operation_outcome(self, service, output_format):
+        first_page = searchset([PATIENT, {"resourceType": "Observation", "id": "o1"}])
+        first_page["link"] = [{"relation": "next", "url": f"{service.base_url}?_getpages=abc"}]
+
+        def get(url, params=None, timeout=None):
+            if "_getpages" in url:
+                import requests
+                raise requests.ConnectionError("boom")
+            if url.endswith("/Patient/p1/$everything"):
+                return json_response(first_page)
+            return fake_get(True)(url, params, timeout)
+
+        with patch.object(service.session, "get", side_effect=get):
+            body = "".join(service.stream_patient_export("p1", output_format))
+        FHIRService.reset_circuit()
+
+        if output_format == "bundle":
+            resources = [e["resource"] for e in json.loads(body)["entry"]]
+        else:
+            resources = [json.loads(line) for line in body.splitlines()]
+        assert [r.get("id") for r in resources[:2]] == ["p1", "o1"]
+        assert resources[-1]["resourceType"] == "OperationOutcome"
+        assert resources[-1]["issue"][0]["code"] == "incomplete"
+
+    def test_audit_recorded_before_first_chunk(self, service):
+        service.user = "dr.house"
+        with patch.object(service.session, "get", side_effect=fake_get(True)), \
+                patch.object(service, "create_provenance_resource") as mock_provenance:
+            chunks = service.stream_patient_export("p1", "ndjson")
+            mock_provenance.assert_not_called()
+            next(chunks)
+            chunks.close()  # Cliente abortou o download
+        mock_provenance.assert_called_once()
+        assert mock_provenance.call_args.kwargs["target_reference"] == "Patient/p1"
+
+    def test_search_failure_propagates(self, service):
+        def failing_get(url, params=None, timeout=None):
+            if url.endswith("/Condition"):
+                import requests
+                raise requests.ConnectionError("boom")
+            return fake_get(False)(url, params, timeout)
+
+        with patch.object(service.session, "get", side_effect=failing_get):
+            with pytest.raises(FHIRServiceException):
+                service.export_patient_data("p1")
+            time.sleep(0.2)  # Let in-flight workers observe the stop flag
+        FHIRService.reset_circuit()
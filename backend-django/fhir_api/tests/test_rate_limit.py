@@ -0,0 +1,133 @@
+"""
+Unit Tests for the shared rate limit engine
+
+Tests for the GCRA stores (in-process and Redis, client mocked), the
+fallback on Redis errors and the middlewares built on the engine.
+"""
+
+import pytest
+from unittest.mock import MagicMock, patch
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from fhir_api.middleware import performance, rate_limit, rate_limiter
+from fhir_api.middleware.rate_limit import (
+    LocalRateLimitStore,
+    RateLimitMiddleware,
+    RateLimiter,
+    RedisRateLimitStore,
+    set_rate_limiter,
+)
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch("fhir_api.middleware.rate_limit.time.monotonic", side_effect=lambda: now[0]):
+        yield now
+
+
+@pytest.fixture
+def limiter():
+    limiter = RateLimiter()
+    set_rate_limiter(limiter)
+    yield limiter
+    set_rate_limiter(None)
+
+
+class TestLocalRateLimitStore:
+    """Tests for the in-process GCRA store."""
+
+    def test_sliding_window_refill(self, clock):
+        store = LocalRateLimitStore()
+        assert [store.check("k", 3, 60).allowed for _ in range(4)] == [True, True, True, False]
+
+        # One request's worth of the window (20s) frees exactly one slot
+        clock[0] += 20
+        assert store.check("k", 3, 60).allowed is True
+        status = store.check("k", 3, 60)
+        assert status.allowed is False
+        assert status.retry_after == pytest.approx(20)
+
+    def test_keys_are_independent(self, clock):
+        store = LocalRateLimitStore()
+        assert store.check("a", 1, 60).allowed is True
+        assert store.check("a", 1, 60).allowed is False
+        assert store.check("b", 1, 60).allowed is True
+
+    def test_idle_keys_are_pruned(self, clock):
+        store = LocalRateLimitStore(max_keys=10)
+        for i in range(10):
+            store.check(f"ip:{i}", 60, 60)
+        clock[0] += 60
+        store.check("ip:new", 60, 60)
+        assert store.check("ip:new2", 60, 60).allowed is True
+        assert len(store._tat) == 2
+
+
+class TestRedisRateLimitStore:
+    """Tests for the Redis GCRA store and the local fallback."""
+
+    @pytest.fixture
+    def store(self):
+        with patch("fhir_api.middleware.rate_limit.redis.from_url"):
+            store = RedisRateLimitStore(url="redis://test")
+        return store
+
+    def test_check_is_one_script_call(self, store):
+        store._gcra.return_value = [1, 9, 0, 6000]
+        status = store.check("ip:1:default", 10, 60)
+        store._gcra.assert_called_once_with(keys=["ratelimit:ip:1:default"], args=[6000.0, 10, 1])
+        assert (status.allowed, status.remaining, status.reset_after) == (True, 9, 6.0)
+
+    def test_denied(self, store):
+        store._gcra.return_value = [0, 0, 1500, 60000]
+        status = store.check("k", 10, 60)
+        assert status.allowed is False
+        assert status.retry_after == 1.5
+
+    def test_redis_error_falls_back_to_local(self, store):
+        import redis
+        store._gcra.side_effect = redis.ConnectionError("down")
+        limiter = RateLimiter(store)
+        assert [limiter.check("k", 2, 60).allowed for _ in range(3)] == [True, True, False]
+
+
+class TestRateLimitMiddlewares:
+    """Tests for the middlewares sharing the engine."""
+
+    def test_429_after_category_limit(self, limiter):
+        middleware = RateLimitMiddleware(lambda request: HttpResponse("ok"))
+        factory = RequestFactory()
+        responses = [middleware(factory.get("/api/v1/export/")) for _ in range(4)]
+
+        assert [r.status_code for r in responses] == [200, 200, 200, 429]
+        assert responses[0]["X-RateLimit-Limit"] == "3"
+        assert responses[0]["X-RateLimit-Remaining"] == "2"
+        assert int(responses[3]["Retry-After"]) >= 20
+
+    def test_decorator_and_middleware_keys_are_independent(self, limiter):
+        middleware = RateLimitMiddleware(lambda request: HttpResponse("ok"))
+        view = rate_limiter.rate_limit(category="bulk", limit=1)(lambda request: HttpResponse("ok"))
+        request = RequestFactory().get("/api/v1/export/", REMOTE_ADDR="10.0.0.2")
+
+        assert [middleware(request).status_code for _ in range(3)] == [200, 200, 200]
+        assert [view(request).status_code for _ in range(2)] == [200, 429]
+
+    def test_performance_middleware_shares_engine(self, limiter, settings):
+        settings.RATE_LIMIT_REQUESTS = 2
+        middleware = performance.RateLimitMiddleware(lambda request: HttpResponse("ok"))
+        request = RequestFactory().get("/api/v1/patients/", REMOTE_ADDR="10.0.0.1")
+
+        assert [middleware(request).status_code for _ in range(3)] == [200, 200, 429]
+        limiter.fallback.clear()
+        assert middleware(request).status_code == 200
+
+    def test_redis_backend_selected_from_settings(self, settings):
+        settings.RATE_LIMIT_BACKEND = "redis"
+        set_rate_limiter(None)
+        try:
+            with patch("fhir_api.middleware.rate_limit.redis.from_url", return_value=MagicMock()):
+                assert isinstance(rate_limit.get_rate_limiter().store, RedisRateLimitStore)
+        finally:
+            set_rate_limiter(None)
@@ -0,0 +1,116 @@
+"""
+Unit Tests for upstream FHIR call tracing
+
+Tests for the per-request trace (transport calls, cache hits, threads),
+the Server-Timing header and the structured / slow-request log lines.
+"""
+
+import io
+import json
+import logging
+
+import pytest
+import requests
+from unittest.mock import patch
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from fhir_api import tracing
+from fhir_api.middleware.performance import PerformanceMiddleware
+from fhir_api.services.fhir_core import FHIRService
+from fhir_api.services.fhir_transport import FHIRTransport
+
+
+def bundle_response(request, **kwargs):
+    body = json.dumps({"resourceType": "Bundle", "entry": [{"resource": {"id": "1"}}]}).encode()
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    response.raw.read()
+    response._content = body
+    return response
+
+
+@pytest.fixture(autouse=True)
+def fresh_transport():
+    FHIRTransport.reset_instance()
+    FHIRService.clear_cache()
+    with patch("requests.adapters.HTTPAdapter.send", side_effect=bundle_response):
+        yield
+    FHIRTransport.reset_instance()
+
+
+def run(view, settings_overrides=None):
+    middleware = PerformanceMiddleware(view)
+    for name, value in (settings_overrides or {}).items():
+        setattr(middleware, name, value)
+    return middleware(RequestFactory().get("/api/v1/ipd/beds/1/"))
+
+
+class TestRequestTracing:
+    """Tests for the request trace and PerformanceMiddleware reporting."""
+
+    def test_calls_recorded_with_cache_hits(self):
+        def view(request):
+            service = FHIRService()
+            service.search_resources("Location", {"_id": "1"})
+            service.search_resources("Location", {"_id": "1"})
+            service.get_resource("Patient", "1", use_cache=False)
+            trace = tracing.current_trace()
+            calls = trace.finish()
+            assert [(c.resource, c.method, c.cache_hit) for c in calls] == [
+                ("Location", "GET", False), ("Location", "GET", True), ("Patient", "GET", False),
+            ]
+            assert calls[0].status == 200
+            assert calls[0].bytes > 0
+            assert calls[0].path == "/fhir/Location"
+            return HttpResponse("ok")
+
+        response = run(view)
+        timing = response["Server-Timing"]
+        assert 'fhir;dur=' in timing and 'desc="2 calls"' in timing
+        assert 'fhir-cache;desc="1 hits"' in timing
+        assert 'fhir-Location-GET;dur=' in timing
+        assert 'total;dur=' in timing
+
+    def test_no_trace_outside_requests(self):
+        FHIRService().get_resource("Patient", "1", use_cache=False)
+        assert tracing.current_trace() is None
+
+    def test_fan_out_threads_share_trace(self):
+        def view(request):
+            service = FHIRService()
+            list(service._fan_out_searches([("Observation", {}), ("Condition", {})]))
+            resources = sorted(c.resource for c in tracing.current_trace().calls)
+            assert resources == ["Condition", "Observation"]
+            return HttpResponse("ok")
+
+        assert 'desc="2 calls"' in run(view)["Server-Timing"]
+
+    def test_structured_and_slow_trace_logs(self, caplog):
+        def view(request):
+            service = FHIRService()
+            for i in range(3):
+                service.get_resource("Condition", str(i), use_cache=False)
+            return HttpResponse("ok")
+
+        with caplog.at_level(logging.INFO, logger="fhir_api.tracing"):
+            run(view, {"slow_ms": 0, "sample_rate": 1.0, "repeat_threshold": 3})
+
+        records = [r for r in caplog.records if r.name == "fhir_api.tracing"]
+        assert records[0].trace["fhir_calls"] == 3
+        slow = records[1]
+        assert slow.levelno == logging.WARNING
+        assert slow.trace["repeated"] == {"GET Condition": 3}
+        assert len(slow.trace["calls"]) == 3
+
+    def test_slow_trace_sampled_out(self, caplog):
+        def view(request):
+            FHIRService().get_resource("Condition", "1", use_cache=False)
+            return HttpResponse("ok")
+
+        with caplog.at_level(logging.INFO, logger="fhir_api.tracing"):
+            run(view, {"slow_ms": 0, "sample_rate": 0.0})
+        assert [r.levelno for r in caplog.records if r.name == "fhir_api.tracing"] == [logging.INFO]
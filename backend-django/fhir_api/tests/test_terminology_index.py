@@ -0,0 +1,92 @@
+"""
+Unit Tests for the terminology search index
+
+Tests for code lookups (exact, prefix, longest prefix), accent-folded word
+search with ranking, substring fallback, facets and the services built on
+the index (ICD-10, TUSS, CBO).
+"""
+
+from fhir_api.services.cbo_service import cbo_service
+from fhir_api.services.terminology_index import LazyTerminologyIndex, TerminologyIndex, fold
+from fhir_api.services.terminology_service import ICD10Service, TUSSService, normalize_icd10
+
+
+TABLE = {
+    "A01.1": {"description": "Febre paratifoide A", "category": "Infecções intestinais", "type": "x"},
+    "A01": {"description": "Febre tifoide e paratifoide", "category": "Infecções intestinais", "type": "y"},
+    "B20": {"description": "Doença pelo HIV", "category": "Febre e outras", "type": "x"},
+    "R51": {"description": "Cefaléia", "category": "Sintomas e sinais gerais", "type": "y"},
+}
+
+
+def codes(results):
+    return [code for code, _ in results]
+
+
+def make_index():
+    return TerminologyIndex(TABLE, ("description", "category"), facets=("type",), normalize_code=normalize_icd10)
+
+
+class TestTerminologyIndex:
+    """Tests for TerminologyIndex."""
+
+    def test_fold(self):
+        assert fold("Cefaléia Ação") == "cefaleia acao"
+
+    def test_exact_code_before_prefix(self):
+        assert codes(make_index().search("a01")) == ["A01", "A01.1"]
+
+    def test_longest_prefix(self):
+        index = make_index()
+        assert index.longest_prefix("A01.19")[0] == "A01.1"
+        assert index.longest_prefix("A019")[0] == "A01"
+        assert index.longest_prefix("Z99") is None
+
+    def test_words_are_accent_folded_prefixes(self):
+        index = make_index()
+        assert codes(index.search("cefaleia")) == ["R51"]
+        assert codes(index.search("CEFAL")) == ["R51"]
+        assert codes(index.search("febre para")) == ["A01.1", "A01"]
+
+    def test_primary_field_ranks_first(self):
+        # B20 only has "febre" in the category
+        assert codes(make_index().search("febre")) == ["A01.1", "A01", "B20"]
+
+    def test_substring_fallback(self):
+        assert codes(make_index().search("tifoide")) == ["A01", "A01.1"]
+
+    def test_facets(self):
+        index = make_index()
+        assert codes(index.search("febre", facet=("type", "x"))) == ["A01.1", "B20"]
+        assert codes(index.search("", facet=("type", "y"))) == ["A01", "R51"]
+        assert index.search("") == []
+
+    def test_max_results(self):
+        assert len(make_index().search("a", max_results=1)) == 1
+
+    def test_lazy_build(self):
+        built = []
+        lazy = LazyTerminologyIndex(lambda: built.append(1) or make_index())
+        assert lazy.get() is lazy.get()
+        lazy.reset()
+        lazy.get()
+        assert len(built) == 2
+
+
+class TestTerminologyServicesIndex:
+    """Tests for the services backed by the index."""
+
+    def test_icd10_accents_and_validate(self):
+        assert ICD10Service.search("cefaleia")[0]["code"] == "R51"
+        assert ICD10Service.validate("u07.1")["normalized"] == "U07.1"
+        assert ICD10Service.validate("I10.9")["normalized"] == "I10"
+
+    def test_tuss_type_filter(self):
+        results = TUSSService.search("consulta", procedure_type="consulta")
+        assert results and all(r["type"] == "consulta" for r in results)
+        assert TUSSService.get_by_type("exame", max_results=2) == TUSSService.search("", "exame", max_results=2)
+
+    def test_cbo_search_without_accents(self):
+        nomes = [o.nome for o in cbo_service.buscar_por_nome("medico", 3)]
+        assert nomes[0] == "Médico"
+        assert all(o.familia == "2251" for o in cbo_service.listar_por_familia("2251"))
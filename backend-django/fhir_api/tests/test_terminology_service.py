@@ -5,6 +5,7 @@ Tests for RxNorm, ICD-10, TUSS, and mapping functionality.
 """
 
 import pytest
+import requests
 from unittest.mock import patch, MagicMock
 from fhir_api.services.terminology_service import (
     TerminologyService,
@@ -220,3 +221,79 @@ class TestTerminologyServiceRxNorm:
         result = TerminologyService.get_rxnorm_details("1191")
         # Should not error
         assert result is not None or result is None  # Depends on implementation
+
+
+class TestRxNormCache:
+    """Tests for the shared RxNav cache (CacheService)."""
+    
+    def setup_method(self):
+        for method in (
+            TerminologyService.search_rxnorm,
+            TerminologyService.get_rxnorm_details,
+            TerminologyService._fetch_multi_drug_interactions,
+        ):
+            method.cache_clear()
+    
+    @staticmethod
+    def response(data):
+        response = MagicMock()
+        response.json.return_value = data
+        return response
+    
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_interaction_sets_are_order_independent(self, mock_get):
+        mock_get.return_value = self.response({"fullInteractionTypeGroup": []})
+        
+        assert TerminologyService.check_multi_drug_interactions(["2", "1"]) == []
+        assert TerminologyService.check_multi_drug_interactions(["1", "2", "1"]) == []
+        assert mock_get.call_count == 1
+        assert mock_get.call_args[1]["params"] == {"rxcuis": "1+2"}
+    
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_errors_are_not_cached(self, mock_get):
+        mock_get.side_effect = Exception("API Error")
+        assert TerminologyService.check_multi_drug_interactions(["1", "2"]) == []
+        
+        mock_get.side_effect = None
+        mock_get.return_value = self.response({"fullInteractionTypeGroup": [{"fullInteractionType": [{
+            "interactionPair": [{
+                "severity": "high",
+                "interactionConcept": [
+                    {"minConceptItem": {"name": "a", "rxcui": "1"}},
+                    {"minConceptItem": {"name": "b", "rxcui": "2"}},
+                ],
+            }],
+        }]}]})
+        assert TerminologyService.check_multi_drug_interactions(["1", "2"])[0]["severity"] == "high"
+    
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_details_many_uses_cache(self, mock_get):
+        mock_get.side_effect = lambda url, **kwargs: self.response(
+            {"properties": {"name": url.split("/")[-2]}}
+        )
+        TerminologyService.get_rxnorm_details("10")
+        
+        details = TerminologyService.get_rxnorm_details_many(["10", "11", "12", "11"])
+        
+        assert [d["name"] for d in details.values()] == ["10", "11", "12"]
+        assert mock_get.call_count == 3
+    
+    @patch('fhir_api.services.terminology_service.requests.get')
+    def test_search_with_failed_details_is_not_cached(self, mock_get):
+        down = {"1192"}
+        
+        def rxnav(url, **kwargs):
+            if url.endswith("approximateTerm.json"):
+                return self.response({"approximateGroup": {"candidate": [
+                    {"rxcui": "1191", "name": "Aspirin"}, {"rxcui": "1192", "name": "Aspirin 81"},
+                ]}})
+            rxcui = url.split("/")[-2]
+            if rxcui in down:
+                raise requests.ConnectionError("down")
+            return self.response({"properties": {"name": rxcui}})
+        
+        mock_get.side_effect = rxnav
+        assert TerminologyService.search_rxnorm("aspirin") == []
+        
+        down.clear()
+        assert [r["rxcui"] for r in TerminologyService.search_rxnorm("aspirin")] == ["1191", "1192"]
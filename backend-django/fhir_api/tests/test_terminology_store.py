@@ -0,0 +1,133 @@
+"""
+Unit Tests for the terminology store
+
+Tests for importing releases into the SQLite store (lookups, ranking,
+facets), versioned reloads seen without restart, pruning, the CSV/JSON
+reader and the services falling back to the embedded subsets.
+"""
+
+import json
+
+import pytest
+
+from fhir_api.services.cbo_service import CBO_SPEC, CBOService
+from fhir_api.services.terminology_service import ICD10_SPEC, ICD10Service, TerminologyMappingService
+from fhir_api.services.terminology_store import (
+    TerminologyStore,
+    read_release_file,
+    set_terminology_store,
+)
+
+
+ICD10_RELEASE = [
+    ("A00.0", {"description": "Cólera devida a Vibrio cholerae 01, biótipo cholerae", "category": "Cólera"}),
+    ("A00.1", {"description": "Cólera El Tor", "category": "Cólera"}),
+    ("B20", {"description": "Doença pelo HIV", "category": "Cólera e outras"}),
+    ("R51", {"description": "Cefaléia", "category": "Sintomas"}),
+]
+
+
+def codes(results):
+    return [code for code, _ in results]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TerminologyStore(str(tmp_path / "terminology.sqlite3"))
+    set_terminology_store(store)
+    yield store
+    set_terminology_store(None)
+
+
+class TestTerminologyStore:
+    """Tests for imported releases."""
+
+    def test_lookups(self, store):
+        assert store.import_release(ICD10_SPEC, "2024", ICD10_RELEASE) == 4
+        table = store.table(ICD10_SPEC)
+
+        assert table.version == "2024" and len(table) == 4
+        assert table.get("a000")[0] == "A00.0"
+        assert table.longest_prefix("A00.19")[0] == "A00.1"
+        assert table.longest_prefix("Z99") is None
+
+    def test_search_ranking(self, store):
+        store.import_release(ICD10_SPEC, "2024", ICD10_RELEASE)
+        table = store.table(ICD10_SPEC)
+
+        assert codes(table.search("a00")) == ["A00.1", "A00.0"]
+        assert codes(table.search("cefaleia")) == ["R51"]
+        # Primary field first, category matches last
+        assert codes(table.search("colera")) == ["A00.1", "A00.0", "B20"]
+        assert codes(table.search("chole")) == ["A00.0"]
+        assert codes(table.search("ibrio")) == ["A00.0"]
+        assert table.search("") == []
+
+    def test_facets(self, store):
+        store.import_release(CBO_SPEC, "2002", [
+            ("225125", {"nome": "Médico clínico", "descricao": ""}),
+            ("223505", {"nome": "Enfermeiro", "descricao": ""}),
+        ])
+        table = store.table(CBO_SPEC)
+
+        assert table.get("2251-25")[1]["familia"] == "2251"
+        assert codes(table.facet("familia", "2235")) == ["2235-05"]
+        assert table.search("medico", facet=("familia", "2235")) == []
+
+    def test_versioned_reload_without_restart(self, store):
+        assert store.table(ICD10_SPEC) is None
+        store.import_release(ICD10_SPEC, "2023", ICD10_RELEASE[:1])
+        assert store.table(ICD10_SPEC).version == "2023"
+
+        store.import_release(ICD10_SPEC, "2024", ICD10_RELEASE)
+        assert store.table(ICD10_SPEC).version == "2024"
+
+        store.activate("icd10", "2023")
+        assert len(store.table(ICD10_SPEC)) == 1
+
+    def test_inactive_import_and_prune(self, store):
+        for version in ("1", "2", "3"):
+            store.import_release(ICD10_SPEC, version, ICD10_RELEASE, activate=False)
+        assert store.table(ICD10_SPEC) is None
+
+        store.activate("icd10", "3", keep=2)
+        assert [r["version"] for r in store.releases("icd10")] == ["3", "2"]
+        with pytest.raises(ValueError):
+            store.activate("icd10", "1")
+        with pytest.raises(ValueError):
+            store.import_release(ICD10_SPEC, "3", ICD10_RELEASE)
+
+
+class TestReleaseFiles:
+    """Tests for reading official CSV/JSON files."""
+
+    def test_csv_with_column_map(self, tmp_path):
+        path = tmp_path / "cid10.csv"
+        path.write_text("SUBCAT;DESCRICAO\nA000;Cólera\n", encoding="latin-1")
+
+        rows = list(read_release_file(
+            str(path), ICD10_SPEC, code_column="SUBCAT", columns={"description": "DESCRICAO"}, encoding="latin-1"
+        ))
+        assert rows == [("A000", {"description": "Cólera", "category": ""})]
+
+    def test_json_map(self, tmp_path):
+        path = tmp_path / "cid10.json"
+        path.write_text(json.dumps({"I10": {"description": "Hipertensão", "category": "Doenças hipertensivas"}}))
+        assert list(read_release_file(str(path), ICD10_SPEC))[0][0] == "I10"
+
+
+class TestServicesWithStore:
+    """Tests for the services reading the active release."""
+
+    def test_embedded_fallback(self, store):
+        assert ICD10Service.validate("I10")["description"] == "Hipertensão essencial (primária)"
+        assert TerminologyMappingService.icd10_to_snomed("I10.1")["equivalence"] == "wider"
+        assert TerminologyMappingService.snomed_to_icd10("38341003")["target_code"] == "I10"
+
+    def test_imported_release(self, store):
+        store.import_release(ICD10_SPEC, "2024", ICD10_RELEASE)
+        store.import_release(CBO_SPEC, "2002", [("225125", {"nome": "Médico clínico", "descricao": ""})])
+
+        assert ICD10Service.validate("I10") is None
+        assert ICD10Service.search("cefal")[0]["code"] == "R51"
+        assert CBOService().buscar_por_codigo("2251.25").nome == "Médico clínico"
@@ -0,0 +1,147 @@
+"""
+Request tracing of upstream FHIR calls
+
+Every HAPI call made while serving a request (and FHIRService cache hits)
+is recorded on a per-request trace held in a context variable:
+resource type, method, status, bytes, duration and cache hit.
+
+PerformanceMiddleware turns the trace into:
+- a `Server-Timing` header (total FHIR time, per resource/method, cache hits)
+- one structured log line per request that called the FHIR server
+- a sampled WARNING with every call for slow requests, flagging repeated
+  calls to the same resource (N+1 patterns)
+
+Work handed to thread pools inside a request must run under
+`contextvars.copy_context()` to stay on the request's trace.
+"""
+
+import contextvars
+import logging
+import time
+from collections import Counter as CallCounter
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamCall(NamedTuple):
+    """One FHIR call; durations in seconds, bytes as read from the wire."""
+    resource: str
+    method: str
+    status: Optional[int]
+    bytes: Optional[int]
+    duration: float
+    cache_hit: bool
+    path: str
+
+
+class RequestTrace:
+    """Upstream calls of one request."""
+
+    SERVER_TIMING_ENTRIES = 8
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls: List[UpstreamCall] = []
+        self._raws: List[Any] = []
+
+    def record(self, call: UpstreamCall, raw: Any = None) -> None:
+        """
+        Record a call. `raw` (the urllib3 response) lets the byte count be
+        taken once the body has been read, at the end of the request.
+        """
+        self.calls.append(call)
+        self._raws.append(raw)
+
+    def finish(self) -> List[UpstreamCall]:
+        """Resolve byte counts of the calls whose body was read after they were recorded."""
+        for i, raw in enumerate(self._raws):
+            if raw is not None and self.calls[i].bytes is None:
+                try:
+                    self.calls[i] = self.calls[i]._replace(bytes=raw.tell())
+                except Exception:
+                    pass
+        self._raws = [None] * len(self.calls)
+        return self.calls
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def upstream(self) -> List[UpstreamCall]:
+        return [c for c in self.calls if not c.cache_hit]
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """(method resource) pairs called at least `threshold` times."""
+        counts = CallCounter(f"{c.method} {c.resource}" for c in self.upstream())
+        return {key: n for key, n in counts.most_common() if n >= threshold}
+
+    def server_timing(self) -> str:
+        upstream = self.upstream()
+        hits = len(self.calls) - len(upstream)
+        entries = [
+            f'fhir;dur={sum(c.duration for c in upstream) * 1000:.1f};desc="{len(upstream)} calls"',
+        ]
+        if hits:
+            entries.append(f'fhir-cache;desc="{hits} hits"')
+
+        by_resource: Dict[tuple, List[float]] = {}
+        for call in upstream:
+            by_resource.setdefault((call.resource, call.method), []).append(call.duration)
+        ranked = sorted(by_resource.items(), key=lambda item: -sum(item[1]))
+        for (resource, method), durations in ranked[:self.SERVER_TIMING_ENTRIES]:
+            entries.append(
+                f'fhir-{resource}-{method};dur={sum(durations) * 1000:.1f};desc="x{len(durations)}"'
+            )
+        return ', '.join(entries)
+
+    def summary(self) -> Dict[str, Any]:
+        upstream = self.upstream()
+        return {
+            "fhir_calls": len(upstream),
+            "fhir_cache_hits": len(self.calls) - len(upstream),
+            "fhir_ms": round(sum(c.duration for c in upstream) * 1000, 1),
+            "fhir_bytes": sum(c.bytes or 0 for c in upstream),
+            "fhir_errors": sum(1 for c in upstream if c.status is None or c.status >= 500),
+        }
+
+
+_current: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    'fhir_request_trace', default=None
+)
+
+
+def start_trace() -> contextvars.Token:
+    """Start a trace for the current request; pass the token to end_trace()."""
+    return _current.set(RequestTrace())
+
+
+def end_trace(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def record_upstream_call(
+    resource: str,
+    method: str,
+    status: Optional[int],
+    duration: float,
+    url: str = '',
+    size: Optional[int] = None,
+    raw: Any = None,
+) -> None:
+    """Record an HTTP call to the FHIR server on the current request's trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.record(UpstreamCall(resource, method, status, size, duration, False, urlsplit(url).path), raw)
+
+
+def record_cache_hit(resource: str, duration: float) -> None:
+    """Record a FHIRService read/search answered from cache."""
+    trace = _current.get()
+    if trace is not None:
+        trace.record(UpstreamCall(resource, 'GET', None, None, duration, True, ''))
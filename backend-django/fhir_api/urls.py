@@ -226,6 +226,7 @@ urlpatterns = [
     # Sprint 22: FHIR Bulk Data Import ($import)
     path('import/', views_bulk_data.import_bulk, name='import_bulk'),
     path('import/status/<str:job_id>/', views_bulk_data.import_status, name='import_status'),
+    path('import/resume/<str:job_id>/', views_bulk_data.import_resume, name='import_resume'),
     
     # Sprint 22: SMART on FHIR OAuth2 Scopes
     path('smart/scopes/', views_bulk_data.list_smart_scopes, name='list_smart_scopes'),
@@ -47,7 +47,8 @@ def receive_hl7_from_agent(request):
         
         logger.info(f"Received HL7 from agent {agent_id}, source {source}")
         
-        # Parse HL7 message
+        # Parse HL7 message (uma vez; o processamento reutiliza o índice de segmentos)
+        message = None
         try:
             message = HL7Message.from_string(hl7_payload)
             msg_type = message.message_type
@@ -56,7 +57,7 @@ def receive_hl7_from_agent(request):
             msg_type = "UNKNOWN"
         
         # Process based on message type
-        result = _process_hl7_message(msg_type, hl7_payload, source, agent_id)
+        result = _process_hl7_message(msg_type, message, source, agent_id)
         
         return Response({
             'status': 'received',
@@ -73,15 +74,14 @@ def receive_hl7_from_agent(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-def _process_hl7_message(msg_type: str, payload: str, source: str, agent_id: str) -> dict:
-    """Process HL7 message based on type."""
+def _process_hl7_message(msg_type: str, message: HL7Message, source: str, agent_id: str) -> dict:
+    """Process a parsed HL7 message based on type."""
     
     resources = []
     
     if msg_type.startswith('ADT'):
         # Admission/Discharge/Transfer
         try:
-            message = HL7Message.from_string(payload)
             fhir = HL7Service.parse_adt_to_fhir(message)
             resources = list(fhir.keys())
             # TODO: Save to FHIR server
@@ -92,10 +92,9 @@ def _process_hl7_message(msg_type: str, payload: str, source: str, agent_id: str
     elif msg_type.startswith('ORU'):
         # Lab Results
         try:
-            message = HL7Message.from_string(payload)
-            fhir = HL7Service.parse_oru_to_fhir(message)
+            observations = HL7Service.parse_oru_to_fhir(message)
             resources = ['observations']
-            logger.info(f"Parsed ORU to {len(fhir.get('observations', []))} observations")
+            logger.info(f"Parsed ORU to {len(observations)} observations")
         except Exception as e:
             logger.error(f"ORU processing error: {e}")
     
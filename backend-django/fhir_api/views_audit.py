@@ -4,9 +4,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 import logging
-import requests
 from django.conf import settings
 
+from .services.fhir_transport import get_fhir_session
+
 logger = logging.getLogger(__name__)
 
 @api_view(['GET'])
@@ -25,7 +26,7 @@ def get_audit_logs(request):
         # Como Provenance é read-only para o frontend, podemos fazer um proxy simples
         
         fhir_url = settings.FHIR_SERVER_URL
-        response = requests.get(
+        response = get_fhir_session().get(
             f"{fhir_url}/Provenance",
             params={"target": target, "_sort": "-_lastUpdated"},
             headers={'Accept': 'application/fhir+json'},
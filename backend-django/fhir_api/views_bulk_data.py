@@ -48,7 +48,9 @@ def export_patient(request):
             "patient_ids": ["patient-1", "patient-2"],  // Optional, defaults to all
             "resource_types": ["Patient", "Observation", "Condition"],  // Optional
             "_since": "2024-01-01T00:00:00Z",  // Optional
-            "_typeFilter": "Observation?category=vital-signs"  // Optional
+            "_typeFilter": "Observation?category=vital-signs",  // Optional
+            "compress": true,  // Optional, gzip the NDJSON files
+            "max_file_bytes": 104857600  // Optional, split files above this size
         }
     
     Returns:
@@ -78,7 +80,9 @@ def export_patient(request):
             patient_ids=patient_ids,
             since=since_dt,
             type_filter=type_filter,
-            user=request.user
+            user=request.user,
+            compress=data.get("compress"),
+            max_file_bytes=data.get("max_file_bytes")
         )
         
         response = Response({
@@ -133,7 +137,9 @@ def export_group(request, group_id):
             resource_types=resource_types,
             group_id=group_id,
             since=since_dt,
-            user=request.user
+            user=request.user,
+            compress=data.get("compress"),
+            max_file_bytes=data.get("max_file_bytes")
         )
         
         response = Response({
@@ -190,7 +196,9 @@ def export_system(request):
             level=ExportLevel.SYSTEM,
             resource_types=resource_types,
             since=since_dt,
-            user=request.user
+            user=request.user,
+            compress=data.get("compress"),
+            max_file_bytes=data.get("max_file_bytes")
         )
         
         response = Response({
@@ -240,7 +248,8 @@ def export_status(request, job_id):
                 {
                     "type": f.get("type"),
                     "url": f.get("url"),
-                    "count": f.get("count")
+                    "count": f.get("count"),
+                    "bytes": f.get("bytes")
                 }
                 for f in job.output_files
             ]
@@ -354,7 +363,7 @@ def download_export_file(request, job_id, file_name):
         
         response = FileResponse(
             open(file_path, 'rb'),
-            content_type='application/ndjson',
+            content_type='application/gzip' if file_name.endswith('.gz') else 'application/ndjson',
             as_attachment=True,
             filename=file_name
         )
@@ -386,7 +395,10 @@ def import_bulk(request):
                     "resource_type": "Patient",
                     "content": "{\\"resourceType\\":\\"Patient\\"...}\\n{\\"resourceType\\":\\"Patient\\"...}"
                 }
-            ]
+            ],
+            "chunk_size": 200,         # optional, resources per Bundle
+            "concurrency": 4,          # optional, Bundles in parallel
+            "bundle_type": "batch"     # optional, "batch" or "transaction"
         }
     
     The content should be NDJSON format (one JSON resource per line).
@@ -400,7 +412,16 @@ def import_bulk(request):
                 "error": "No files provided for import"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        job = BulkImportService.create_import_job(files, request.user)
+        try:
+            job = BulkImportService.create_import_job(
+                files,
+                request.user,
+                chunk_size=data.get("chunk_size"),
+                concurrency=data.get("concurrency"),
+                bundle_type=data.get("bundle_type")
+            )
+        except (TypeError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         response = Response({
             "status": "pending",
@@ -451,6 +472,40 @@ def import_status(request, job_id):
         return Response({"error": "Erro ao obter status"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@authentication_classes([KeycloakAuthentication])
+@permission_classes([IsAuthenticated])
+def import_resume(request, job_id):
+    """
+    Resume an interrupted import job from its last checkpoint.
+    
+    POST /api/v1/import/resume/{job_id}/
+    """
+    try:
+        # Só conflita enquanto um worker mantém o lease; um job ativo com
+        # lease expirado (worker morreu) pode ser retomado
+        job = BulkImportService.get_job(job_id)
+        active = job and job.status in (ExportStatus.PENDING, ExportStatus.IN_PROGRESS)
+        if active and BulkImportService.is_running(job_id):
+            return Response({
+                "error": f"Import job {job_id} is still running"
+            }, status=status.HTTP_409_CONFLICT)
+        
+        job = BulkImportService.resume_job(job_id, request.user)
+        if not job:
+            return Response({
+                "error": f"No checkpoint found for import job {job_id}"
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        response = Response(job.to_dict(), status=status.HTTP_202_ACCEPTED)
+        response["Content-Location"] = f"/api/v1/import/status/{job.job_id}/"
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error resuming import job: {e}")
+        return Response({"error": "Erro ao retomar importação"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 # ============================================================================
 # SMART on FHIR Scopes
 # ============================================================================
@@ -1,38 +1,52 @@
-
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from django.http import HttpResponse
-import json
+from django.http import StreamingHttpResponse
 import logging
 
 from .services.fhir_core import FHIRService, FHIRServiceException
 
 logger = logging.getLogger(__name__)
 
+EXPORT_FORMATS = {
+    # _format -> (formato interno, content-type, extensão)
+    'json': ('bundle', 'application/json', 'json'),
+    'ndjson': ('ndjson', 'application/fhir+ndjson', 'ndjson'),
+}
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def export_patient_data_view(request, patient_id):
     """
-    Exporta todos os dados do paciente em formato FHIR Bundle (JSON).
-    GET /api/v1/patients/{id}/export/
+    Exporta todos os dados do paciente em formato FHIR Bundle (JSON) ou NDJSON.
+    GET /api/v1/patients/{id}/export/?_format=json|ndjson
+
+    A resposta é transmitida em streaming à medida que os recursos chegam do
+    servidor FHIR (Patient/$everything ou buscas paralelas). Falhas na primeira
+    página ainda viram erro HTTP; depois do 200, o fluxo termina com um
+    OperationOutcome indicando o export truncado.
     """
     try:
         logger.info(f"Export requested for Patient {patient_id} by {request.user}")
         
         # Validar acesso (Se for paciente, só pode exportar o dele mesmo)
         # TODO: Implementar essa validação fina se necessário. Por enquanto, IsAuthenticated.
+
+        requested_format = request.GET.get('_format', 'json')
+        if requested_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported _format: {requested_format}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        output_format, content_type, extension = EXPORT_FORMATS[requested_format]
         
         fhir_service = FHIRService(request.user)
-        bundle = fhir_service.export_patient_data(patient_id)
+        chunks = fhir_service.stream_patient_export(patient_id, output_format)
         
         # Retornar como arquivo para download
-        response = HttpResponse(
-            json.dumps(bundle, indent=2), 
-            content_type='application/json'
-        )
-        response['Content-Disposition'] = f'attachment; filename="patient_{patient_id}_export.json"'
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="patient_{patient_id}_export.{extension}"'
         
         return response
         
@@ -30,11 +30,13 @@ def check_fhir_server():
             headers={'Accept': 'application/fhir+json'}
         )
         if response.status_code == 200:
+            from .services.fhir_transport import FHIRTransport
             return {
                 'status': 'healthy',
                 'message': 'HAPI FHIR Server conectado',
                 'version': response.json().get('fhirVersion', 'R4'),
-                'response_time_ms': response.elapsed.total_seconds() * 1000
+                'response_time_ms': response.elapsed.total_seconds() * 1000,
+                'connection_pool': FHIRTransport.get_instance().get_stats()
             }
         return {
             'status': 'unhealthy',
@@ -7,7 +7,6 @@ from .auth import KeycloakAuthentication
 from rest_framework.permissions import IsAuthenticated
 import logging
 from datetime import datetime
-import requests
 
 logger = logging.getLogger(__name__)
 
@@ -155,7 +154,7 @@ def admit_patient(request):
         
         headers = {'Content-Type': 'application/fhir+json'}
         put_url = f"{fhir.base_url}/Location/{location_id}"
-        r_put = requests.put(put_url, json=location, headers=headers)
+        r_put = fhir.session.put(put_url, json=location, headers=headers, timeout=fhir.timeout)
         if r_put.status_code not in [200, 201]:
              logger.error(f"Failed to update location: {r_put.text}")
              return Response({"error": "Failed to update location status"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -300,7 +299,7 @@ def discharge_patient(request):
         
         headers = {'Content-Type': 'application/fhir+json'}
         put_enc_url = f"{fhir.base_url}/Encounter/{encounter_id}"
-        r_enc = requests.put(put_enc_url, json=encounter, headers=headers)
+        r_enc = fhir.session.put(put_enc_url, json=encounter, headers=headers, timeout=fhir.timeout)
         
         if r_enc.status_code not in [200, 201]:
              logger.error(f"Failed to update encounter: {r_enc.text}")
@@ -317,7 +316,7 @@ def discharge_patient(request):
                  "display": "Housekeeping"
             }
             put_loc_url = f"{fhir.base_url}/Location/{location_id}"
-            requests.put(put_loc_url, json=location, headers=headers)
+            fhir.session.put(put_loc_url, json=location, headers=headers, timeout=fhir.timeout)
             
         return Response({"message": "Discharge successful. Bed marked for cleaning."}, status=status.HTTP_200_OK)
 
@@ -357,7 +356,7 @@ def finish_cleaning(request, location_id):
         }
         
         put_loc_url = f"{fhir.base_url}/Location/{location_id}"
-        r = requests.put(put_loc_url, json=location, headers=headers)
+        r = fhir.session.put(put_loc_url, json=location, headers=headers, timeout=fhir.timeout)
         
         if r.status_code not in [200, 201]:
              return Response({"error": "Failed to update location"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
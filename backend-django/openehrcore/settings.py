@@ -36,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'fhir_api.metrics.MetricsMiddleware',  # Prometheus: latência por endpoint
+    'fhir_api.middleware.performance.PerformanceMiddleware',  # Server-Timing das chamadas FHIR
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -45,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'fhir_api.middleware.rate_limit.RateLimitMiddleware',  # Sprint 22: Rate Limiting
+    'fhir_api.middleware.performance.ETaggerMiddleware',  # GET condicional (304 sem ir ao HAPI)
 ]
 
 ROOT_URLCONF = 'openehrcore.urls'
@@ -126,12 +129,52 @@ CORS_ALLOWED_ORIGINS = config(
 # FHIR Server Configuration
 FHIR_SERVER_URL = config('FHIR_SERVER_URL', default='http://localhost:8080/fhir')
 FHIR_SERVER_TIMEOUT = config('FHIR_SERVER_TIMEOUT', default=30, cast=int)
+FHIR_CACHE_MAX_ENTRIES = config('FHIR_CACHE_MAX_ENTRIES', default=2048, cast=int)
+FHIR_CACHE_MAX_BYTES = config('FHIR_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+LOCAL_CACHE_MAX_ENTRIES = config('LOCAL_CACHE_MAX_ENTRIES', default=100000, cast=int)
+LOCAL_CACHE_MAX_BYTES = config('LOCAL_CACHE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+CACHE_COMPRESSION = config('CACHE_COMPRESSION', default=True, cast=bool)
+CACHE_COMPRESS_MIN_BYTES = config('CACHE_COMPRESS_MIN_BYTES', default=512, cast=int)
+# Proteção contra stampede: janela stale-while-revalidate, lock entre workers e refresh antecipado
+CACHE_STALE_TTL = config('CACHE_STALE_TTL', default=60, cast=int)
+CACHE_LOCK_TIMEOUT = config('CACHE_LOCK_TIMEOUT', default=10, cast=int)
+CACHE_EARLY_REFRESH_BETA = config('CACHE_EARLY_REFRESH_BETA', default=1.0, cast=float)
+CACHE_REFRESH_WORKERS = config('CACHE_REFRESH_WORKERS', default=4, cast=int)
+FHIR_SEARCH_MAX_ITEMS = config('FHIR_SEARCH_MAX_ITEMS', default=10000, cast=int)
+FHIR_EXPORT_WORKERS = config('FHIR_EXPORT_WORKERS', default=6, cast=int)
+
+# Bulk $export: workers compartilhados, tamanho de página, divisão de arquivos e gzip
+BULK_EXPORT_WORKERS = config('BULK_EXPORT_WORKERS', default=4, cast=int)
+BULK_EXPORT_PAGE_SIZE = config('BULK_EXPORT_PAGE_SIZE', default=1000, cast=int)
+BULK_EXPORT_MAX_FILE_BYTES = config('BULK_EXPORT_MAX_FILE_BYTES', default=0, cast=int)
+BULK_EXPORT_GZIP = config('BULK_EXPORT_GZIP', default=False, cast=bool)
+
+# Bulk Data jobs: store durável (database | redis | memory), lease e retenção
+BULK_JOB_STORE = config('BULK_JOB_STORE', default='database')
+BULK_JOB_LEASE_SECONDS = config('BULK_JOB_LEASE_SECONDS', default=60, cast=int)
+BULK_JOB_RETENTION_HOURS = config('BULK_JOB_RETENTION_HOURS', default=24, cast=int)
+
+# Bulk $import: recursos por Bundle, Bundles em paralelo e tipo (batch/transaction)
+BULK_IMPORT_CHUNK_SIZE = config('BULK_IMPORT_CHUNK_SIZE', default=200, cast=int)
+BULK_IMPORT_CONCURRENCY = config('BULK_IMPORT_CONCURRENCY', default=4, cast=int)
+BULK_IMPORT_BUNDLE_TYPE = config('BULK_IMPORT_BUNDLE_TYPE', default='batch')
+# NDJSON recebido e checkpoints dos jobs de $import (fora do pacote Python)
+BULK_IMPORT_DIR = config('BULK_IMPORT_DIR', default=str(BASE_DIR / 'imports'))
+
+# Pool HTTP compartilhado com o HAPI FHIR (keep-alive)
+FHIR_POOL_CONNECTIONS = config('FHIR_POOL_CONNECTIONS', default=10, cast=int)
+FHIR_POOL_MAXSIZE = config('FHIR_POOL_MAXSIZE', default=50, cast=int)
+FHIR_CONNECT_TIMEOUT = config('FHIR_CONNECT_TIMEOUT', default=5, cast=int)
+FHIR_GZIP_REQUESTS = config('FHIR_GZIP_REQUESTS', default=False, cast=bool)
 
 # Keycloak Configuration
 KEYCLOAK_URL = config('KEYCLOAK_URL', default='http://localhost:8180')
 KEYCLOAK_REALM = config('KEYCLOAK_REALM', default='master')
 KEYCLOAK_CLIENT_ID = config('KEYCLOAK_CLIENT_ID', default='openehrcore')
 KEYCLOAK_CLIENT_SECRET = config('KEYCLOAK_CLIENT_SECRET', default='')
+KEYCLOAK_JWKS_REFRESH_INTERVAL = config('KEYCLOAK_JWKS_REFRESH_INTERVAL', default=300, cast=int)
+KEYCLOAK_JWKS_MIN_REFETCH_INTERVAL = config('KEYCLOAK_JWKS_MIN_REFETCH_INTERVAL', default=30, cast=int)
+KEYCLOAK_TOKEN_CACHE_SIZE = config('KEYCLOAK_TOKEN_CACHE_SIZE', default=10000, cast=int)
 
 # Logging - JSON Estruturado para Produção
 LOG_DIR = BASE_DIR / 'logs'
@@ -225,8 +268,50 @@ LOGGING = {
     },
 }
 
+# Prometheus: diretório dos arquivos mmap por worker (vazio = métricas só do processo)
+METRICS_MULTIPROC_DIR = config('METRICS_MULTIPROC_DIR', default='')
+
+# Trace das chamadas FHIR por requisição: limiar de requisição lenta (ms), amostragem
+# do trace detalhado e nº de chamadas repetidas ao mesmo recurso sinalizadas (N+1)
+REQUEST_TRACE_SLOW_MS = config('REQUEST_TRACE_SLOW_MS', default=1000, cast=int)
+REQUEST_TRACE_SAMPLE_RATE = config('REQUEST_TRACE_SAMPLE_RATE', default=1.0, cast=float)
+REQUEST_TRACE_REPEAT_THRESHOLD = config('REQUEST_TRACE_REPEAT_THRESHOLD', default=5, cast=int)
+
+# GET condicional: validade dos ETag/Last-Modified de meta.versionId guardados por URL e credencial (s)
+# e tamanho máximo de corpo sem meta.versionId que ainda recebe ETag por hash
+ETAG_VALIDATOR_TTL = config('ETAG_VALIDATOR_TTL', default=300, cast=int)
+ETAG_MAX_BODY_BYTES = config('ETAG_MAX_BODY_BYTES', default=1024 * 1024, cast=int)
+
+# Analytics: store dos contadores materializados (memory | redis), página do sync
+# (busca por _lastUpdated / _history) e idade máxima antes de um catch-up em
+# background (0 = desligado)
+ANALYTICS_STORE = config('ANALYTICS_STORE', default='memory')
+ANALYTICS_SYNC_PAGE_SIZE = config('ANALYTICS_SYNC_PAGE_SIZE', default=500, cast=int)
+ANALYTICS_SYNC_INTERVAL = config('ANALYTICS_SYNC_INTERVAL', default=300, cast=int)
+# Consultas _summary=count em paralelo do planner (enquanto o store não sincronizou)
+ANALYTICS_QUERY_WORKERS = config('ANALYTICS_QUERY_WORKERS', default=8, cast=int)
+
+# Terminologias completas (CID-10, TUSS, CBO) importadas com terminology_import:
+# arquivo SQLite compartilhado pelos workers (vazio = só os subconjuntos embutidos)
+TERMINOLOGY_DB_PATH = config('TERMINOLOGY_DB_PATH', default=str(BASE_DIR / 'terminology.sqlite3'))
+TERMINOLOGY_MMAP_SIZE = config('TERMINOLOGY_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)
+
+# RxNorm (RxNav): validade das respostas no cache compartilhado (s), de resultados
+# vazios, janela servida stale durante o refresh e buscas de detalhes em paralelo
+RXNORM_CACHE_TTL = config('RXNORM_CACHE_TTL', default=7 * 86400, cast=int)
+RXNORM_NEGATIVE_TTL = config('RXNORM_NEGATIVE_TTL', default=3600, cast=int)
+RXNORM_STALE_TTL = config('RXNORM_STALE_TTL', default=86400, cast=int)
+RXNORM_MAX_WORKERS = config('RXNORM_MAX_WORKERS', default=8, cast=int)
+
+# Interações medicamentosas locais (drug_interactions_import), por par de RxCUIs:
+# arquivo da tabela (vazio = só RxNav) e intervalo de checagem de nova versão (s)
+DRUG_INTERACTIONS_PATH = config('DRUG_INTERACTIONS_PATH', default=str(BASE_DIR / 'drug_interactions.json'))
+DRUG_INTERACTIONS_CHECK_INTERVAL = config('DRUG_INTERACTIONS_CHECK_INTERVAL', default=60, cast=int)
+
 # Rate Limiting Configuration (Sprint 22)
 RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+# Store do rate limit (memory | redis); com redis o limite vale para todos os workers
+RATE_LIMIT_BACKEND = config('RATE_LIMIT_BACKEND', default='memory')
 
 # =====================================================
 # AI Configuration (Ollama)
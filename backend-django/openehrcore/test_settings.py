@@ -18,6 +18,9 @@ CACHES = {
     }
 }
 
+# Keep bulk data jobs in process memory (no DB access needed)
+BULK_JOB_STORE = 'memory'
+
 # Simplify password hashing for speed
 PASSWORD_HASHERS = [
     'django.contrib.auth.hashers.MD5PasswordHasher',